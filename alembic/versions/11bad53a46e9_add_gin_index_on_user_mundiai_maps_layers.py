@@ -0,0 +1,38 @@
+"""add gin index on user_mundiai_maps.layers
+
+Revision ID: 11bad53a46e9
+Revises: a1b2c3d4e5f6
+Create Date: 2026-10-16 00:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "11bad53a46e9"
+down_revision: Union[str, None] = "a1b2c3d4e5f6"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Serves "which maps contain this layer" lookups written as
+    # layers @> ARRAY[layer_id]; `layer_id = ANY(layers)` can't use it.
+    # CONCURRENTLY so the maps table stays writable while it builds.
+    with op.get_context().autocommit_block():
+        op.execute(
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_user_mundiai_maps_layers_gin
+            ON user_mundiai_maps USING GIN (layers)
+            """
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute(
+            "DROP INDEX CONCURRENTLY IF EXISTS ix_user_mundiai_maps_layers_gin"
+        )
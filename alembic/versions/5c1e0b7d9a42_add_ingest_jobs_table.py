@@ -0,0 +1,85 @@
+"""add ingest_jobs table
+
+Revision ID: 5c1e0b7d9a42
+Revises: 11bad53a46e9
+Create Date: 2026-10-16 00:00:00.000000
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5c1e0b7d9a42"
+down_revision: Union[str, None] = "11bad53a46e9"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "ingest_jobs",
+        sa.Column("id", sa.String(length=12), nullable=False),
+        sa.Column("owner_uuid", sa.UUID(), nullable=False),
+        sa.Column("project_id", sa.String(length=12), nullable=False),
+        sa.Column("map_id", sa.String(length=12), nullable=False),
+        sa.Column("conversation_id", sa.Integer(), nullable=True),
+        sa.Column("filename", sa.Text(), nullable=False),
+        sa.Column("layer_name", sa.Text(), nullable=True),
+        sa.Column("add_layer_to_map", sa.Boolean(), nullable=False),
+        sa.Column("source_s3_key", sa.Text(), nullable=False),
+        sa.Column("spool_path", sa.Text(), nullable=True),
+        sa.Column("size_bytes", sa.BIGINT(), nullable=False),
+        sa.Column("sha256", sa.String(length=64), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("stage", sa.String(), nullable=True),
+        sa.Column(
+            "stage_timings",
+            postgresql.JSONB(astext_type=sa.Text()),
+            server_default=sa.text("'{}'::jsonb"),
+            nullable=False,
+        ),
+        sa.Column("attempts", sa.Integer(), server_default="0", nullable=False),
+        sa.Column("max_attempts", sa.Integer(), nullable=False),
+        sa.Column(
+            "cancel_requested",
+            sa.Boolean(),
+            server_default=sa.text("false"),
+            nullable=False,
+        ),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("layer_id", sa.String(length=12), nullable=True),
+        sa.Column("worker_id", sa.String(), nullable=True),
+        sa.Column(
+            "run_after",
+            sa.TIMESTAMP(timezone=True),
+            server_default=sa.text("CURRENT_TIMESTAMP"),
+            nullable=False,
+        ),
+        sa.Column("heartbeat_at", sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.Column(
+            "created_at",
+            sa.TIMESTAMP(timezone=True),
+            server_default=sa.text("CURRENT_TIMESTAMP"),
+            nullable=False,
+        ),
+        sa.Column("finished_at", sa.TIMESTAMP(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(["map_id"], ["user_mundiai_maps.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    # workers claim with ORDER BY created_at over queued rows only
+    op.create_index(
+        "ix_ingest_jobs_queued",
+        "ingest_jobs",
+        ["run_after", "created_at"],
+        postgresql_where=sa.text("status = 'queued'"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ingest_jobs_queued", table_name="ingest_jobs")
+    op.drop_table("ingest_jobs")
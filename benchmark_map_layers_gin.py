@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark of layer membership lookups on user_mundiai_maps.layers.
+
+Seeds a maps-shaped temp table and compares `= ANY(layers)` with `layers @>`
+before and after a GIN index, mirroring the ix_user_mundiai_maps_layers_gin
+migration. Needs the app's PostgreSQL environment; nothing is written to the
+real tables.
+
+Usage: python benchmark_map_layers_gin.py [n_maps]
+"""
+
+import asyncio
+import sys
+import time
+
+from src.structures import get_async_db_connection
+
+LOOKUPS = 50
+
+
+async def time_lookups(conn, query: str, n_maps: int) -> float:
+    start = time.perf_counter()
+    for i in range(LOOKUPS):
+        await conn.fetch(query, f"L{(i * 3989) % n_maps:011d}")
+    return 1000 * (time.perf_counter() - start) / LOOKUPS
+
+
+async def benchmark(n_maps: int):
+    async with get_async_db_connection("bench_map_layers_gin") as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """
+                CREATE TEMP TABLE bench_maps (
+                    id varchar(12) PRIMARY KEY,
+                    layers varchar(12)[]
+                ) ON COMMIT DROP
+                """
+            )
+            # every map version carries ~5 layers, neighbours share layers
+            # the way forks of one map do
+            await conn.execute(
+                f"""
+                INSERT INTO bench_maps (id, layers)
+                SELECT 'M' || lpad(g::text, 11, '0'),
+                       ARRAY(
+                           SELECT 'L' || lpad(((g + k) % {n_maps})::text, 11, '0')
+                           FROM generate_series(0, 4) k
+                       )::varchar(12)[]
+                FROM generate_series(0, {n_maps - 1}) g
+                """
+            )
+            await conn.execute("ANALYZE bench_maps")
+
+            any_query = "SELECT id FROM bench_maps WHERE $1 = ANY(layers)"
+            contains_query = (
+                "SELECT id FROM bench_maps WHERE layers @> ARRAY[$1]::varchar[]"
+            )
+
+            before_ms = await time_lookups(conn, any_query, n_maps)
+
+            await conn.execute(
+                "CREATE INDEX bench_maps_layers_gin ON bench_maps USING GIN (layers)"
+            )
+            await conn.execute("ANALYZE bench_maps")
+
+            any_after_ms = await time_lookups(conn, any_query, n_maps)
+            after_ms = await time_lookups(conn, contains_query, n_maps)
+
+    print(
+        f"{n_maps} maps, per lookup: = ANY(layers) {before_ms:.2f} ms, "
+        f"= ANY(layers) with GIN {any_after_ms:.2f} ms, "
+        f"@> with GIN {after_ms:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000))
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+专业模型MCP服务器性能基准测试
+对比向量化/隐式实现与原有逐单元Python循环实现的耗时和精度
+
+用法: python benchmark_mcp_models.py [flood flood_ensemble reservoir_curves reservoir_cascade reservoir_dp prediction_registry ...]
+"""
+
+import asyncio
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from src.mcp_servers.flood_evolution_mcp import FloodEvolutionMCPServer, SaintVenantSolver, SolverRun
+from src.mcp_servers.prediction_mcp import ModelRegistry, PredictionMCPServer
+from src.mcp_servers.reservoir_simulation_mcp import (
+    CascadeSimulationEngine,
+    InflowForecast,
+    ReservoirCharacteristics,
+    ReservoirDPScheduler,
+    ReservoirOperationMode,
+    ReservoirSimulationMCPServer,
+    ReservoirSimulationModel,
+    sample_inflow_scenarios,
+)
+
+
+def legacy_explicit_run(solver: SaintVenantSolver, h0, q0, upstream_flow,
+                        downstream_level, nt, bank_height) -> SolverRun:
+    """原有实现的参考副本: 逐单元循环的中心差分 + 前向欧拉, 结果后处理也逐单元进行"""
+    h = np.array(h0, dtype=float)
+    q = np.array(q0, dtype=float)
+    depths = np.zeros((nt, solver.nx))
+    discharges = np.zeros((nt, solver.nx))
+    dx_m, width = solver.dx_m, solver.bottom_width
+
+    volume0 = h[1:-1].sum() * dx_m * width
+    net_inflow = 0.0
+    volume_scale = volume0
+    completed = 0
+    for n in range(nt):
+        q[0] = upstream_flow[n] / width
+        h[-1] = downstream_level[n] - solver.z[-1]
+
+        dh_dt = np.zeros_like(h)
+        dq_dt = np.zeros_like(q)
+        for i in range(1, solver.nx - 1):
+            dh_dt[i] = -(q[i + 1] - q[i - 1]) / (2 * dx_m)
+            if h[i] > 0:
+                d_q2h_dx = ((q[i + 1]**2 / h[i + 1]) - (q[i - 1]**2 / h[i - 1])) / (2 * dx_m)
+                dh_dx = (h[i + 1] - h[i - 1]) / (2 * dx_m)
+                dz_dx = (solver.z[i + 1] - solver.z[i - 1]) / (2 * dx_m)
+                velocity = q[i] / h[i]
+                hydraulic_radius = h[i] / (1 + 2 * h[i] / 50)
+                sf = (solver.manning_n**2 * velocity**2) / (hydraulic_radius**(4/3))
+                dq_dt[i] = -d_q2h_dx - solver.gravity * h[i] * (dh_dx + dz_dx) - solver.gravity * h[i] * sf
+
+        h_new = h + dh_dt * solver.dt
+        q_new = q + dq_dt * solver.dt
+        if not solver.check_stability(h_new, q_new):
+            break
+
+        inflow = (q[0] + q[1]) / 2 * width * solver.dt
+        net_inflow += inflow - (q[-2] + q[-1]) / 2 * width * solver.dt
+        volume_scale += abs(inflow)
+        h, q = h_new, q_new
+        depths[n] = h
+        discharges[n] = q * width
+        completed = n + 1
+
+        for i in range(solver.nx):
+            if h[i] > 0:
+                level = h[i] + solver.z[i]
+                solver.calculate_manning_velocity(q[i] * width, level, i)
+                solver.calculate_flood_risk_level(level, bank_height)
+                solver.calculate_cross_section_properties(level, i)
+
+    volume = h[1:-1].sum() * dx_m * width
+    mass_error = abs(volume - volume0 - net_inflow) / max(volume_scale, 1e-9)
+    return SolverRun(depths, discharges, completed, np.asarray(mass_error), completed)
+
+
+def dam_break_case(solver: SaintVenantSolver):
+    """合成溃坝算例: 河道中点处上游水深10m, 下游2m, 初始静水, 上游无入流"""
+    solver.initialize_river_bed(0.001)
+    h0 = np.where(solver.x < solver.river_length / 2, 10.0, 2.0)
+    q0 = np.zeros(solver.nx)
+    return h0, q0, 2.0 + solver.z[-1]
+
+
+def benchmark_flood(hours: float = 24.0, river_length: float = 100.0, dx: float = 0.5):
+    print("=== 圣维南求解器: 合成溃坝算例 ===")
+    print(f"河道 {river_length}km, 空间步长 {dx}km, 模拟 {hours}h")
+
+    # 显式格式按重力波CFL=0.2选取时间步长 (给溃坝初始流速留出余量), 半隐式格式取600秒
+    explicit_dt = 0.2 * dx * 1000 / np.sqrt(9.81 * 10.0)
+    cases = [
+        ("原有逐单元循环 (显式)", "legacy", explicit_dt),
+        ("向量化显式", "explicit", explicit_dt),
+        ("向量化半隐式θ格式", "semi_implicit", 600.0),
+    ]
+
+    for label, scheme, dt in cases:
+        solver = SaintVenantSolver(
+            river_length=river_length, dx=dx, dt=dt,
+            scheme="explicit" if scheme == "legacy" else scheme
+        )
+        h0, q0, downstream = dam_break_case(solver)
+        nt = int(hours * 3600 / dt)
+        upstream_flow = np.zeros(nt)
+        downstream_level = np.full(nt, downstream)
+
+        started = time.perf_counter()
+        if scheme == "legacy":
+            run = legacy_explicit_run(solver, h0, q0, upstream_flow, downstream_level, nt, 8.0)
+        else:
+            run = solver.run(h0, q0, upstream_flow, downstream_level, nt)
+            solver.derived_fields(run.depths, run.discharges, 8.0)
+        elapsed = time.perf_counter() - started
+
+        print(f"\n{label}")
+        print(f"  时间步长: {dt:.1f}s, 完成 {run.completed_steps}/{nt} 步")
+        print(f"  耗时: {elapsed:.3f}s, 每步 {elapsed / max(run.completed_steps, 1) * 1000:.2f}ms")
+        if run.completed_steps < nt:
+            print(f"  格式失稳; 按每步耗时外推全程需 {elapsed / max(run.completed_steps, 1) * nt:.1f}s")
+        print(f"  质量守恒相对误差: {float(run.mass_balance_error):.2e}")
+
+
+def benchmark_flood_ensemble(members: int = 100, hours: float = 24.0):
+    print("=== 洪水集合模拟: 逐个调用 vs 堆叠批量 ===")
+    rng = np.random.default_rng(0)
+    peaks = rng.uniform(500, 4000, members)
+    hydrographs = [list(1000 + peak * np.sin(np.linspace(0, np.pi, int(hours) + 1))) for peak in peaks]
+    roughness = rng.uniform(0.025, 0.05, members)
+    server = FloodEvolutionMCPServer()
+
+    async def sequential():
+        for m in range(members):
+            await server.simulate_flood_ensemble(
+                simulation_hours=hours, upstream_hydrographs=[hydrographs[m]],
+                manning_roughness=float(roughness[m])
+            )
+
+    async def stacked():
+        return await server.simulate_flood_ensemble(
+            simulation_hours=hours, upstream_hydrographs=hydrographs,
+            manning_roughness=list(roughness)
+        )
+
+    started = time.perf_counter()
+    asyncio.run(server.simulate_flood_propagation(simulation_hours=hours))
+    single = time.perf_counter() - started
+
+    started = time.perf_counter()
+    asyncio.run(sequential())
+    sequential_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    result = asyncio.run(stacked())
+    stacked_elapsed = time.perf_counter() - started
+
+    print(f"单次模拟: {single:.3f}s")
+    print(f"{members} 个成员逐个调用: {sequential_elapsed:.3f}s")
+    print(f"{members} 个成员堆叠批量: {stacked_elapsed:.3f}s (约 {stacked_elapsed / single:.1f} 次单次模拟)")
+    print(f"最大质量守恒相对误差: {result['results']['max_mass_balance_error']:.2e}")
+
+
+def legacy_level_to_capacity(curve: dict, water_level: float) -> float:
+    """原有实现的参考副本: 每次调用排序字典键并线性扫描区间"""
+    levels = sorted(curve.keys())
+    if water_level <= levels[0]:
+        return curve[levels[0]]
+    if water_level >= levels[-1]:
+        return curve[levels[-1]]
+    for i in range(len(levels) - 1):
+        if levels[i] <= water_level <= levels[i + 1]:
+            level1, level2 = levels[i], levels[i + 1]
+            cap1, cap2 = curve[level1], curve[level2]
+            return cap1 + (cap2 - cap1) * (water_level - level1) / (level2 - level1)
+    return curve[levels[0]]
+
+
+def benchmark_reservoir_curves(lookups: int = 20000):
+    print("=== 水库特征曲线查询 ===")
+    model = ReservoirSimulationMCPServer().reservoir
+    curve_dict = model.level_capacity_curve.to_dict()
+    levels = np.random.default_rng(0).uniform(144.0, 176.0, lookups)
+    level_list = levels.tolist()
+
+    started = time.perf_counter()
+    legacy = [legacy_level_to_capacity(curve_dict, level) for level in level_list]
+    legacy_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    scalar = [model.level_to_capacity(level) for level in level_list]
+    scalar_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    vectorized = model.level_to_capacity(levels)
+    array_elapsed = time.perf_counter() - started
+
+    assert np.allclose(legacy, scalar) and np.allclose(scalar, vectorized)
+    print(f"{len(curve_dict)} 点水位-库容曲线, {lookups} 次查询")
+    print(f"  原有字典排序+线性扫描: {legacy_elapsed / lookups * 1e6:.2f}us/次")
+    print(f"  预编译曲线标量查询: {scalar_elapsed / lookups * 1e6:.2f}us/次")
+    print(f"  预编译曲线数组查询: {array_elapsed / lookups * 1e6:.3f}us/次")
+
+
+def cascade_reservoirs(n: int = 6):
+    """合成梯级: 各级水位依次降低10m"""
+    return [
+        ReservoirSimulationModel(ReservoirCharacteristics(
+            name=f"梯级{i + 1}", total_capacity=5e9 + i * 1e9, dead_capacity=1e9, flood_capacity=2e9,
+            normal_water_level=175.0 - 10 * i, dead_water_level=145.0 - 10 * i,
+            flood_limit_water_level=171.0 - 10 * i, dam_height=181.0, crest_elevation=185.0 - 10 * i,
+        ))
+        for i in range(n)
+    ]
+
+
+def benchmark_reservoir_cascade(traces: int = 1000, hours: int = 168, legacy_traces: int = 20):
+    print("=== 梯级水库多情景调度 ===")
+    reservoirs = cascade_reservoirs()
+    n = len(reservoirs)
+    local = np.abs(500 + 300 * np.random.default_rng(0).standard_normal((traces, n, hours)))
+    initial = [160.0 - 10 * i for i in range(n)]
+    times = [datetime(2025, 1, 1) + timedelta(hours=i) for i in range(hours)]
+
+    # 原有方式: 逐情景、逐水库调用逐时段调度, 上游下泄作为下游入流
+    started = time.perf_counter()
+    for k in range(legacy_traces):
+        upstream_outflow = np.zeros(hours)
+        for i, model in enumerate(reservoirs):
+            forecast = InflowForecast(times, list(local[k, i] + upstream_outflow), 0.85)
+            schedule = model.optimize_reservoir_operation(initial[i], forecast)
+            upstream_outflow = np.array([op["outflow"] for op in schedule])
+    legacy_elapsed = (time.perf_counter() - started) / legacy_traces * traces
+
+    engine = CascadeSimulationEngine(reservoirs, downstream=list(range(1, n)) + [None])
+    started = time.perf_counter()
+    engine.run(local, initial)
+    engine_elapsed = time.perf_counter() - started
+
+    print(f"{traces} 条入流过程 x {n} 级梯级 x {hours} 小时")
+    print(f"  原有逐时段循环 (按 {legacy_traces} 条外推): {legacy_elapsed:.1f}s")
+    print(f"  向量化引擎: {engine_elapsed:.3f}s")
+
+
+def benchmark_reservoir_dp(hours: int = 168, samples: int = 20):
+    print("=== 动态规划优化调度: 7天逐小时 ===")
+    model = ReservoirSimulationMCPServer().reservoir
+    inflow = 5000 * (1 + 0.2 * np.sin(2 * np.pi * np.arange(hours) / 24))
+    forecast = InflowForecast([datetime(2025, 1, 1) + timedelta(hours=i) for i in range(hours)], inflow.tolist(), 0.85)
+
+    schedule = model.optimize_reservoir_operation(165.0, forecast, None, ReservoirOperationMode.POWER_GENERATION)
+    print(f"规则调度 (发电模式): 发电量 {sum(op['power_generation'] for op in schedule):.0f} MWh, "
+          f"末水位 {schedule[-1]['new_level']:.3f}m")
+
+    for max_states in (1000, 2000):
+        result = ReservoirDPScheduler(model, max_states=max_states).solve(inflow, 165.0)
+        print(f"确定性DP ({max_states} 状态): 发电量 {result.total_power_generation_mwh:.0f} MWh, "
+              f"末水位 {result.water_levels[-1]:.3f}m, 耗时 {result.solve_seconds:.2f}s")
+
+    inflow_samples = sample_inflow_scenarios(inflow, samples, seed=0)
+    result = ReservoirDPScheduler(model, max_states=1000).solve_stochastic(inflow_samples, 165.0)
+    print(f"随机DP ({samples} 条样本, 1000 状态): 期望目标 {result.expected_objective:.0f} MWh, "
+          f"样本平均发电量 {result.total_power_generation_mwh:.0f} MWh, 耗时 {result.solve_seconds:.2f}s")
+
+
+def benchmark_prediction_registry(points: int = 720):
+    print("=== 水文预测模型注册表 ===")
+    hours = np.arange(points + 1)
+    rng = np.random.default_rng(0)
+    levels = 160 + 3 * np.sin(2 * np.pi * hours / 24) + rng.normal(0, 0.2, len(hours))
+    discharges = 5000 + 800 * np.sin(2 * np.pi * hours / 24) + rng.normal(0, 50, len(hours))
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        registry = ModelRegistry(tmp_dir)
+        server = PredictionMCPServer(registry)
+
+        async def forecast(window: slice, label: str):
+            started = time.perf_counter()
+            result = await server.predict_hydrological_variables(
+                levels[window].tolist(), discharges[window].tolist(), prediction_hours=24,
+                method="ensemble", station_id="S1"
+            )
+            assert result["status"] == "success"
+            print(f"  {label}: {time.perf_counter() - started:.3f}s")
+
+        print(f"{points} 点逐小时历史, 集成预测水位与流量")
+        asyncio.run(forecast(slice(0, points), "首次预测 (训练)"))
+        asyncio.run(forecast(slice(0, points), "相同数据 (内存命中)"))
+        asyncio.run(forecast(slice(1, points + 1), "新增1个观测 (旧模型+后台重训)"))
+        registry.wait_for_refits()
+
+        registry.memory.clear()
+        asyncio.run(forecast(slice(1, points + 1), "清空内存后 (磁盘命中)"))
+
+        stats = registry.stats()
+        print(f"  训练 {stats['fits']} 次 (后台 {stats['background_fits']} 次), "
+              f"累计训练耗时 {stats['fit_seconds_total']:.2f}s, 命中率 {stats['hit_ratio']:.2f}")
+
+
+BENCHMARKS = {
+    "flood": benchmark_flood,
+    "flood_ensemble": benchmark_flood_ensemble,
+    "reservoir_curves": benchmark_reservoir_curves,
+    "reservoir_cascade": benchmark_reservoir_cascade,
+    "reservoir_dp": benchmark_reservoir_dp,
+    "prediction_registry": benchmark_prediction_registry,
+}
+
+
+if __name__ == "__main__":
+    selected = sys.argv[1:] or list(BENCHMARKS)
+    for name in selected:
+        BENCHMARKS[name]()
+        print()
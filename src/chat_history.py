@@ -0,0 +1,96 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+from typing import Any
+
+
+class ConversationHistory:
+    """OpenAI-format messages of one conversation, held in memory by the agent loop.
+
+    It is loaded from chat_completion_messages once per interaction and then
+    appended to as the loop inserts messages. That way, building each
+    completion request doesn't re-select and re-parse the whole conversation.
+    The conversation's chat_lock only expires, it can't guarantee nobody else
+    wrote in the meantime, so sync() compares the stored row count before
+    each completion and reloads if another writer got in.
+    """
+
+    def __init__(
+        self, conversation_id: int, owner_uuid: str, messages: list[dict[str, Any]]
+    ):
+        self.conversation_id = conversation_id
+        self.owner_uuid = owner_uuid
+        self._messages = list(messages)
+        self.reloads = 0
+
+    @staticmethod
+    async def _fetch(conn, conversation_id: int, owner_uuid: str) -> list:
+        return await conn.fetch(
+            """
+            SELECT ccm.message_json
+            FROM chat_completion_messages ccm
+            JOIN conversations c ON ccm.conversation_id = c.id
+            WHERE ccm.conversation_id = $1
+            AND c.owner_uuid = $2
+            AND c.soft_deleted_at IS NULL
+            ORDER BY ccm.created_at ASC
+            """,
+            conversation_id,
+            owner_uuid,
+        )
+
+    @classmethod
+    async def load(
+        cls, conn, conversation_id: int, owner_uuid: str
+    ) -> "ConversationHistory":
+        rows = await cls._fetch(conn, conversation_id, owner_uuid)
+        return cls(
+            conversation_id,
+            owner_uuid,
+            [json.loads(r["message_json"]) for r in rows],
+        )
+
+    async def sync(self, conn) -> bool:
+        """Reload if the stored conversation no longer matches; True if it did."""
+        stored = await conn.fetchval(
+            """
+            SELECT count(*)
+            FROM chat_completion_messages ccm
+            JOIN conversations c ON ccm.conversation_id = c.id
+            WHERE ccm.conversation_id = $1
+            AND c.owner_uuid = $2
+            AND c.soft_deleted_at IS NULL
+            """,
+            self.conversation_id,
+            self.owner_uuid,
+        )
+        if stored == len(self._messages):
+            return False
+        rows = await self._fetch(conn, self.conversation_id, self.owner_uuid)
+        self._messages = [json.loads(r["message_json"]) for r in rows]
+        self.reloads += 1
+        return True
+
+    def append(self, message_json: str):
+        """Record a message exactly as it was stored, i.e. its JSON text."""
+        self._messages.append(json.loads(message_json))
+
+    def openai_messages(self) -> list[dict[str, Any]]:
+        return list(self._messages)
+
+    def __len__(self) -> int:
+        return len(self._messages)
@@ -0,0 +1,365 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+import json
+import os
+import subprocess
+import tempfile
+import time
+from typing import Optional
+
+from boto3.s3.transfer import TransferConfig
+from redis import Redis
+from redis.exceptions import LockError, RedisError
+
+from src.database.models import MapLayer
+from src.structures import get_async_db_connection
+from src.utils import get_async_s3_client, get_bucket_name
+
+one_shot_config = TransferConfig(multipart_threshold=5 * 1024**3)  # 5 GiB
+
+redis = Redis(
+    host=os.environ["REDIS_HOST"],
+    port=int(os.environ["REDIS_PORT"]),
+    decode_responses=True,
+)
+
+# how long a job's status stays around once it finishes
+COG_JOB_STATUS_TTL_SEC = 3600
+# a failed build isn't retried by viewers until this has passed
+COG_RETRY_AFTER_FAILURE_SEC = 60
+
+
+class CogBuildError(Exception):
+    pass
+
+
+async def run_cmd(cmd: list[str], timeout_seconds: int) -> str:
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout_bytes, stderr_bytes = await asyncio.wait_for(
+            proc.communicate(), timeout=timeout_seconds
+        )
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise CogBuildError(f"{cmd[0]} timed out after {timeout_seconds}s")
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(
+            returncode=proc.returncode,
+            cmd=cmd,
+            output=stdout_bytes,
+            stderr=(stderr_bytes or b"").decode("utf-8", "ignore"),
+        )
+    return (stdout_bytes or b"").decode("utf-8", "ignore")
+
+
+async def build_cog(layer: MapLayer, command_timeout: int) -> dict:
+    """Reproject a raster layer to an EPSG:3857 COG, upload it and record it.
+
+    Returns what was merged into the layer's metadata: the cog_key plus a
+    cog_build entry with per-stage timings and the output size.
+    """
+    timings_ms: dict[str, float] = {}
+    started = time.perf_counter()
+
+    def lap(stage: str, since: float) -> float:
+        now = time.perf_counter()
+        timings_ms[stage] = round((now - since) * 1000, 1)
+        return now
+
+    bucket_name = get_bucket_name()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        s3_key = str(layer.s3_key or "")
+        file_extension = os.path.splitext(s3_key)[1] if s3_key else ""
+        local_input_file = os.path.join(
+            temp_dir, f"layer_{layer.layer_id}{file_extension}"
+        )
+        local_cog_file = os.path.join(temp_dir, f"layer_{layer.layer_id}.cog.tif")
+
+        t = time.perf_counter()
+        s3 = await get_async_s3_client()
+        await s3.download_file(bucket_name, s3_key, local_input_file)
+        t = lap("download", t)
+
+        try:
+            gdalinfo_json = json.loads(
+                await run_cmd(["gdalinfo", "-json", local_input_file], 30)
+            )
+        except (subprocess.CalledProcessError, json.JSONDecodeError):
+            raise CogBuildError(
+                f"Failed to process raster info for layer {layer.layer_id}."
+            )
+        t = lap("gdalinfo", t)
+
+        input_file_for_cog = local_input_file
+        needs_color_ramp_suffix = False
+        if len(gdalinfo_json.get("bands", [])) == 1:
+            try:
+                # Try expanding to RGB first
+                local_rgb_file = os.path.join(
+                    temp_dir, f"layer_{layer.layer_id}_rgb.tif"
+                )
+                await run_cmd(
+                    [
+                        "gdal_translate",
+                        "-of",
+                        "GTiff",
+                        "-expand",
+                        "rgb",
+                        local_input_file,
+                        local_rgb_file,
+                    ],
+                    command_timeout,
+                )
+                input_file_for_cog = local_rgb_file
+            except subprocess.CalledProcessError:
+                # not paletted; keep the single band and stretch it with the
+                # existing raster_value_stats_b1 at render time
+                meta = layer.metadata_dict or {}
+                if isinstance(meta, dict) and "raster_value_stats_b1" in meta:
+                    needs_color_ramp_suffix = True
+            t = lap("expand_rgb", t)
+
+        # gdalwarp reprojects to EPSG:3857 and writes the COG in one pass
+        warp_cmd = [
+            "gdalwarp",
+            "-t_srs",
+            "EPSG:3857",
+            "-r",
+            "bilinear",
+            "-of",
+            "COG",
+            "-co",
+            "BLOCKSIZE=256",
+        ]
+        if needs_color_ramp_suffix:
+            warp_cmd += ["-ot", "Float32", "-co", "COMPRESS=LZW"]
+        else:
+            warp_cmd += ["-co", "COMPRESS=JPEG", "-co", "QUALITY=85"]
+        warp_cmd += ["-co", "OVERVIEWS=AUTO", input_file_for_cog, local_cog_file]
+        try:
+            await run_cmd(warp_cmd, command_timeout)
+        except subprocess.CalledProcessError as e:
+            raise CogBuildError(f"COG generation failed: {e.stderr[-500:]}")
+        t = lap("gdalwarp", t)
+
+        size_bytes = os.path.getsize(local_cog_file)
+        cog_key = f"cog/layer/{layer.layer_id}.cog.tif"
+        s3 = await get_async_s3_client()
+        await s3.upload_file(
+            local_cog_file, bucket_name, cog_key, Config=one_shot_config
+        )
+        lap("upload", t)
+
+    timings_ms["total"] = round((time.perf_counter() - started) * 1000, 1)
+    metadata_updates = {
+        "cog_key": cog_key,
+        "cog_build": {
+            "timings_ms": timings_ms,
+            "size_bytes": size_bytes,
+            "built_at": time.time(),
+        },
+    }
+    async with get_async_db_connection("cog_build.update_metadata") as conn:
+        # merge, so metadata written while we were building isn't lost
+        await conn.execute(
+            """
+            UPDATE map_layers
+            SET metadata = COALESCE(metadata, '{}'::jsonb) || $1::jsonb
+            WHERE layer_id = $2
+            """,
+            json.dumps(metadata_updates),
+            layer.layer_id,
+        )
+    return metadata_updates
+
+
+class CogBuildQueue:
+    """Builds COGs for raster layers in the background, once per layer.
+
+    The first viewer of a raster without a COG enqueues a build and gets its
+    status back immediately. Later viewers in the same worker share the same
+    task, and other workers see the Redis lock plus the job status (a JSON
+    string under cog_build:{layer_id}) that the building worker keeps up to
+    date. At most max_concurrent_builds run
+    at once in each worker.
+
+    The lock is only taken once a build has a slot, and is extended while the
+    build runs, so it expires lock_timeout seconds after its worker dies
+    rather than while a slow build is still going.
+    """
+
+    def __init__(
+        self, max_concurrent_builds: int, command_timeout: int, lock_timeout: int = 60
+    ):
+        self.max_concurrent_builds = max_concurrent_builds
+        self.command_timeout = command_timeout
+        self.lock_timeout = lock_timeout
+        self._jobs: dict[str, asyncio.Task] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    @staticmethod
+    def _status_key(layer_id: str) -> str:
+        return f"cog_build:{layer_id}"
+
+    @staticmethod
+    def _lock_key(layer_id: str) -> str:
+        return f"lock:cog:{layer_id}"
+
+    def status(self, layer_id: str) -> Optional[dict]:
+        raw = redis.get(self._status_key(layer_id))
+        return json.loads(raw) if raw else None
+
+    def _set_status(self, layer_id: str, **status):
+        redis.set(
+            self._status_key(layer_id),
+            json.dumps({"layer_id": layer_id, **status}),
+            ex=COG_JOB_STATUS_TTL_SEC,
+        )
+
+    def enqueue(self, layer: MapLayer) -> dict:
+        """Make sure a build is queued or running, and return its status."""
+        layer_id = layer.layer_id
+        status = self.status(layer_id)
+        if status and status["state"] == "done":
+            return status
+        if status and status["state"] in ("queued", "running"):
+            # a worker that died mid-build leaves its status but not its lock
+            if layer_id in self._jobs or redis.exists(self._lock_key(layer_id)):
+                return status
+        if (
+            status
+            and status["state"] == "failed"
+            and time.time() - status["finished_at"] < COG_RETRY_AFTER_FAILURE_SEC
+        ):
+            return status
+
+        if layer_id not in self._jobs:
+            task = asyncio.create_task(self._run(layer))
+            self._jobs[layer_id] = task
+            task.add_done_callback(lambda _: self._jobs.pop(layer_id, None))
+        return self.status(layer_id) or {"layer_id": layer_id, "state": "queued"}
+
+    async def _run(self, layer: MapLayer):
+        layer_id = layer.layer_id
+        enqueued_at = time.time()
+        status = self.status(layer_id)
+        if not (status and status["state"] == "running"):
+            self._set_status(layer_id, state="queued", enqueued_at=enqueued_at)
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrent_builds)
+
+        async with self._slots:
+            lock = redis.lock(self._lock_key(layer_id), timeout=self.lock_timeout)
+            if not lock.acquire(blocking=False):
+                # another worker is building it
+                return
+            try:
+                # it may have finished elsewhere while this one waited for a slot
+                status = self.status(layer_id)
+                if status and status["state"] == "done":
+                    return
+                started_at = time.time()
+                self._set_status(
+                    layer_id,
+                    state="running",
+                    enqueued_at=enqueued_at,
+                    started_at=started_at,
+                )
+                result = await self._build_holding_lock(layer, lock)
+                self._set_status(
+                    layer_id,
+                    state="done",
+                    enqueued_at=enqueued_at,
+                    started_at=started_at,
+                    finished_at=time.time(),
+                    cog_key=result["cog_key"],
+                    **result["cog_build"],
+                )
+            except Exception as e:
+                self._set_status(
+                    layer_id,
+                    state="failed",
+                    enqueued_at=enqueued_at,
+                    finished_at=time.time(),
+                    error=str(e),
+                )
+            finally:
+                try:
+                    lock.release()
+                except Exception:
+                    pass
+
+    async def _build_holding_lock(self, layer: MapLayer, lock) -> dict:
+        build = asyncio.create_task(build_cog(layer, self.command_timeout))
+        watchdog = asyncio.create_task(self._keep_lock(lock, build))
+        try:
+            return await build
+        except asyncio.CancelledError:
+            if watchdog.done():
+                raise CogBuildError("lost the build lock, another worker took over")
+            raise
+        finally:
+            watchdog.cancel()
+
+    async def _keep_lock(self, lock, build: asyncio.Task):
+        while True:
+            await asyncio.sleep(self.lock_timeout / 3)
+            try:
+                lock.reacquire()
+            except LockError:
+                # expired and maybe taken by another worker; two builds must not
+                # both upload to the same cog_key
+                build.cancel()
+                return
+            except RedisError:
+                # try again next time, the lock still has time left
+                continue
+
+    async def wait(self, layer_id: str, timeout: float, poll_sec: float = 0.5):
+        """Status of the build once it finishes, or its latest status on timeout."""
+        deadline = time.monotonic() + timeout
+        task = self._jobs.get(layer_id)
+        if task is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(task), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return self.status(layer_id)
+
+        while True:
+            status = self.status(layer_id)
+            if status is None or status["state"] in ("done", "failed"):
+                return status
+            if time.monotonic() >= deadline:
+                return status
+            await asyncio.sleep(poll_sec)
+
+
+cog_build_queue_singleton = CogBuildQueue(
+    max_concurrent_builds=int(os.environ.get("MUNDI_COG_BUILD_CONCURRENCY", 2)),
+    command_timeout=int(os.environ.get("MUNDI_COG_BUILD_TIMEOUT_SEC", 600)),
+)
+
+
+def cog_build_queue() -> CogBuildQueue:
+    return cog_build_queue_singleton
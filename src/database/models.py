@@ -34,7 +34,6 @@ from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from typing import TYPE_CHECKING
 from datetime import datetime
-import asyncio
 import os
 import tempfile
 import time
@@ -237,6 +236,7 @@ class MapLayer(Base):
         """
 
         from src.core.connection_wrapper import get_async_db_connection
+        from src.ogr_convert import OgrConversionError, ogr_conversion_engine
         from src.utils import get_async_s3_client, get_bucket_name
 
         @asynccontextmanager
@@ -268,28 +268,22 @@ class MapLayer(Base):
                     temp_gpkg_path = temp_gpkg.name
 
                 try:
-                    ogr_cmd = [
-                        "ogr2ogr",
-                        "-overwrite",
-                        "-if",
-                        "PostgreSQL",
-                        "-f",
-                        "GPKG",
-                        temp_gpkg_path,
-                        connection_uri,
-                        "-sql",
-                        self.postgis_query,
-                    ]
-
-                    process = await asyncio.create_subprocess_exec(
-                        *ogr_cmd,
-                        stdout=asyncio.subprocess.PIPE,
-                        stderr=asyncio.subprocess.PIPE,
-                    )
-                    stdout, stderr = await process.communicate()
-
-                    if process.returncode != 0:
-                        raise RuntimeError(f"ogr2ogr failed: {stderr.decode()}")
+                    try:
+                        await ogr_conversion_engine().convert(
+                            connection_uri,
+                            temp_gpkg_path,
+                            [
+                                "-overwrite",
+                                "-if",
+                                "PostgreSQL",
+                                "-f",
+                                "GPKG",
+                                "-sql",
+                                self.postgis_query,
+                            ],
+                        )
+                    except OgrConversionError as e:
+                        raise RuntimeError(f"ogr2ogr failed: {e}")
 
                     if never_return_local_file:
                         bucket_name = get_bucket_name()
@@ -456,3 +450,43 @@ class MundiChatCompletionMessage(Base):
     conversation = relationship(
         "Conversation", back_populates="chat_completion_messages"
     )
+
+
+class IngestJob(Base):
+    __tablename__ = "ingest_jobs"
+
+    id = Column(String(12), primary_key=True)  # 12-char unique ID, starts with J
+    owner_uuid = Column(UUID, nullable=False)
+    project_id = Column(String(12), nullable=False)
+    map_id = Column(String(12), ForeignKey("user_mundiai_maps.id"), nullable=False)
+    conversation_id = Column(Integer)  # where stage progress is pushed, if any
+    filename = Column(Text, nullable=False)
+    layer_name = Column(Text)
+    add_layer_to_map = Column(Boolean, nullable=False)
+    source_s3_key = Column(Text, nullable=False)  # durable copy of the upload
+    spool_path = Column(Text)  # local copy on the node that received it
+    size_bytes = Column(BIGINT, nullable=False)
+    sha256 = Column(String(64), nullable=False)
+    status = Column(
+        String, nullable=False
+    )  # 'queued', 'running', 'succeeded', 'failed', 'cancelled'
+    stage = Column(String)
+    stage_timings = Column(JSONB, nullable=False, server_default="{}")
+    attempts = Column(Integer, nullable=False, server_default="0")
+    max_attempts = Column(Integer, nullable=False)
+    cancel_requested = Column(Boolean, nullable=False, server_default="false")
+    error = Column(Text)
+    layer_id = Column(String(12))  # first layer, pinned so retries reuse it
+    worker_id = Column(String)
+    run_after = Column(
+        TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=func.current_timestamp(),
+    )
+    heartbeat_at = Column(TIMESTAMP(timezone=True))
+    created_at = Column(
+        TIMESTAMP(timezone=True),
+        nullable=False,
+        server_default=func.current_timestamp(),
+    )
+    finished_at = Column(TIMESTAMP(timezone=True))
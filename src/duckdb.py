@@ -14,13 +14,23 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import asyncio
+import glob
+import os
+import threading
 import time
 import duckdb
 import json
 import re
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException, status
 
 from src.fs_lru import layer_cache
+from src.structures import get_async_db_connection
+
+DUCKDB_CACHE_DIR = os.environ.get("MUNDI_DUCKDB_CACHE_DIR", "/cache_duckdb")
+
+# statements that can be used as a subquery, so the row cap can be pushed down
+WRAPPABLE_QUERY_RE = re.compile(r"^(select|with|from|values|table)\b", re.IGNORECASE)
 
 DUCKDB_RESERVED_KEYWORDS = {
     "select",
@@ -75,47 +85,374 @@ def quoted_col_for(name: str) -> str:
     return name
 
 
-async def execute_duckdb_query(
-    sql_query: str, layer_id: str, max_n_rows: int = 25, timeout: int = 10
-):
-    start_time = time.time()
-    cache = layer_cache()
-    # Acquire cached geopackage path in async context
-    async with cache.layer_filename(layer_id) as gpkg_path:
+class PooledConnection:
+    def __init__(self, con: duckdb.DuckDBPyConnection):
+        self.con = con
+
 
-        def query_func():
-            con = duckdb.connect(":memory:")
+class DuckDBEngine:
+    """Runs LLM SQL against layers converted once into DuckDB database files.
+
+    Each layer's cached GeoPackage is read with ST_Read a single time per
+    last_edited version and written to {cache_dir}/{layer_id}-{version}.duckdb.
+    Queries borrow a warm in-memory connection (extensions already loaded),
+    ATTACH the layer file read-only and expose it as a view named after the
+    layer_id. User SQL runs inside a transaction that is always rolled back,
+    and the view and attachment are dropped again after every query, so a
+    pooled connection never exposes one user's layer to the next query.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        pool_size: int = 4,
+        max_disk_bytes: int = 1024 * 1024 * 1024 * 4,
+        extensions: tuple[str, ...] = ("spatial",),
+    ):
+        self.cache_dir = cache_dir
+        self.pool_size = pool_size
+        self.max_disk_bytes = max_disk_bytes
+        self.extensions = extensions
+        self.executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="duckdb"
+        )
+        self.idle: list[PooledConnection] = []
+        self._semaphore: asyncio.Semaphore | None = None
+        self._convert_locks: dict[str, asyncio.Lock] = {}
+        self._sweep_lock = threading.Lock()
+        self.counters = {
+            "queries": 0,
+            "conversions": 0,
+            "connections_opened": 0,
+            "connections_discarded": 0,
+            "interrupted": 0,
+        }
+
+    def _new_connection(self) -> PooledConnection:
+        con = duckdb.connect(":memory:")
+        for extension in self.extensions:
             # Extensions are cached locally
-            con.install_extension("spatial")
-            con.load_extension("spatial")
+            con.install_extension(extension)
+            con.load_extension(extension)
+        self.counters["connections_opened"] += 1
+        return PooledConnection(con)
+
+    def _source_sql(self, gpkg_path: str) -> str:
+        escaped = gpkg_path.replace("'", "''")
+        return f"SELECT * FROM ST_Read('{escaped}')"
+
+    def _convert(self, gpkg_path: str, db_path: str):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{db_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        con = duckdb.connect(tmp_path)
+        try:
+            for extension in self.extensions:
+                con.install_extension(extension)
+                con.load_extension(extension)
+            con.execute(f"CREATE TABLE layer AS {self._source_sql(gpkg_path)}")
+        finally:
+            con.close()
+        # other workers either see no file or a complete one
+        os.replace(tmp_path, db_path)
+
+    def _remove_stale(self, layer_id: str, keep: str):
+        for path in glob.glob(os.path.join(self.cache_dir, f"{layer_id}-*.duckdb")):
+            if path != keep:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _sweep_disk(self):
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            entries = []
+            total = 0
+            for path in glob.glob(os.path.join(self.cache_dir, "*.duckdb")):
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_disk_bytes:
+                    break
+                # attached connections keep their open handle, unlink is safe
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+        finally:
+            self._sweep_lock.release()
+
+    async def _layer_version(self, layer_id: str) -> int:
+        async with get_async_db_connection("duckdb_layer_version") as conn:
+            last_edited = await conn.fetchval(
+                "SELECT last_edited FROM map_layers WHERE layer_id = $1",
+                layer_id,
+            )
+        return int(last_edited.timestamp() * 1000) if last_edited else 0
+
+    async def layer_db_path(self, layer_id: str) -> tuple[str, float]:
+        """Path of the converted layer database, and ms spent converting it."""
+        version = await self._layer_version(layer_id)
+        db_path = os.path.join(self.cache_dir, f"{layer_id}-{version}.duckdb")
+        if os.path.exists(db_path):
+            return db_path, 0.0
 
-            # Create table from cached parquet file
-            con.execute(f"""
-                CREATE OR REPLACE TABLE {layer_id} AS
-                SELECT * FROM ST_Read('{gpkg_path}');
-            """)
+        # only one conversion per layer version in this worker
+        lock = self._convert_locks.setdefault(db_path, asyncio.Lock())
+        async with lock:
+            if os.path.exists(db_path):
+                return db_path, 0.0
 
+            start = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            try:
+                async with layer_cache().layer_filename(layer_id) as gpkg_path:
+                    await loop.run_in_executor(
+                        self.executor, self._convert, gpkg_path, db_path
+                    )
+            finally:
+                self._convert_locks.pop(db_path, None)
+            self.counters["conversions"] += 1
+
+        await loop.run_in_executor(self.executor, self._remove_stale, layer_id, db_path)
+        await loop.run_in_executor(self.executor, self._sweep_disk)
+        return db_path, 1000 * (time.perf_counter() - start)
+
+    def _attach(self, pooled: PooledConnection, layer_id: str, db_path: str):
+        escaped = db_path.replace("'", "''")
+        pooled.con.execute(f"ATTACH '{escaped}' AS layer_{layer_id} (READ_ONLY)")
+        pooled.con.execute(
+            f"CREATE OR REPLACE VIEW {layer_id} AS SELECT * FROM layer_{layer_id}.layer"
+        )
+
+    def _detach(self, pooled: PooledConnection, layer_id: str):
+        pooled.con.execute(f"DROP VIEW IF EXISTS {layer_id}")
+        pooled.con.execute(f"DETACH DATABASE IF EXISTS layer_{layer_id}")
+
+    def _fetch_capped(self, con: duckdb.DuckDBPyConnection, sql_query: str, n: int):
+        """Run sql_query returning at most n rows, plus the full row count.
+
+        Plain queries are wrapped so the LIMIT is part of the plan and DuckDB
+        serializes each row to JSON itself; rows never exist as Python tuples
+        that then need a json.dumps/loads round trip. The total is only
+        computed with a count(*) over the same query when the cap was hit,
+        which lets DuckDB skip every column the count doesn't need.
+        """
+        statement = sql_query.strip().rstrip(";").strip()
+        if not WRAPPABLE_QUERY_RE.match(statement) or ";" in statement:
+            # PRAGMA, DESCRIBE, multiple statements... run as-is but still
+            # only pull max_n_rows out of the result
             cursor = con.execute(sql_query)
+            if cursor.description is None:
+                return [], [], 0
             headers = [col[0] for col in cursor.description]
-            rows = cursor.fetchall()[:max_n_rows]
-            result_json = json.loads(json.dumps(rows))
-
-            return {
-                "status": "success",
-                "duration_ms": 1000 * (time.time() - start_time),
-                "result": result_json,
-                "headers": headers,
-                "row_count": len(rows),
-                "query": sql_query,
-            }
+            rows = cursor.fetchmany(n)
+            return headers, json.loads(json.dumps(rows, default=str)), None
+
+        headers = [
+            col[0]
+            for col in con.execute(
+                f"SELECT * FROM ({statement}\n) _q LIMIT 0"
+            ).description
+        ]
+        # one extra row tells us whether the cap truncated anything
+        json_rows = con.execute(
+            f"SELECT to_json(_q) FROM ({statement}\n) _q LIMIT {n + 1}"
+        ).fetchall()
+        rows = [list(json.loads(r[0]).values()) for r in json_rows]
+        if len(rows) <= n:
+            return headers, rows, len(rows)
 
+        total = con.execute(f"SELECT count(*) FROM ({statement}\n) _q").fetchone()[0]
+        return headers, rows[:n], total
+
+    def _run(
+        self,
+        pooled: PooledConnection | None,
+        running: dict,
+        sql_query: str,
+        layer_id: str,
+        db_path: str,
+        max_n_rows: int,
+    ) -> tuple[PooledConnection, dict]:
+        created = pooled is None
+        if created:
+            pooled = self._new_connection()
+        try:
+            return pooled, self._query(
+                pooled, running, sql_query, layer_id, db_path, max_n_rows
+            )
+        except BaseException:
+            # run_query only knows about connections it took from the pool
+            if created:
+                pooled.con.close()
+                self.counters["connections_discarded"] += 1
+            raise
+
+    def _query(
+        self,
+        pooled: PooledConnection,
+        running: dict,
+        sql_query: str,
+        layer_id: str,
+        db_path: str,
+        max_n_rows: int,
+    ) -> dict:
+        start = time.perf_counter()
+        self._attach(pooled, layer_id, db_path)
+        attach_ms = 1000 * (time.perf_counter() - start)
+
+        try:
+            start = time.perf_counter()
+            # interrupt() only stops an executing query, so run_query may
+            # only use it while the user SQL itself is running; a timeout
+            # before that skips the query instead
+            with running["lock"]:
+                if running.get("timed_out"):
+                    return {"error": asyncio.TimeoutError()}
+                running["con"] = pooled.con
+            pooled.con.begin()
+            try:
+                headers, rows, total_rows = self._fetch_capped(
+                    pooled.con, sql_query, max_n_rows
+                )
+            except duckdb.Error as e:
+                # bad SQL is routine from the LLM, and an interrupted query is
+                # rolled back like any other; the connection is still fine
+                pooled.con.rollback()
+                return {"error": e}
+            finally:
+                with running["lock"]:
+                    running.pop("con", None)
+            pooled.con.rollback()
+            scan_ms = 1000 * (time.perf_counter() - start)
+        finally:
+            # the next borrower may be querying a different user's layer
+            self._detach(pooled, layer_id)
+
+        return {
+            "headers": headers,
+            "rows": rows,
+            "total_rows": total_rows,
+            "attach_ms": attach_ms,
+            "scan_ms": scan_ms,
+        }
+
+    async def run_query(
+        self, sql_query: str, layer_id: str, max_n_rows: int, timeout: float
+    ) -> dict:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.pool_size)
+
+        deadline = time.monotonic() + timeout
+        # a slow first conversion keeps going in the background after a
+        # timeout, so the next query against this layer finds it ready
+        db_path, convert_ms = await asyncio.wait_for(
+            asyncio.shield(asyncio.ensure_future(self.layer_db_path(layer_id))),
+            timeout=timeout,
+        )
+
+        await asyncio.wait_for(
+            self._semaphore.acquire(), timeout=max(0, deadline - time.monotonic())
+        )
+        pooled = self.idle.pop() if self.idle else None
+        running: dict = {"lock": threading.Lock()}
         loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            self.executor,
+            self._run,
+            pooled,
+            running,
+            sql_query,
+            layer_id,
+            db_path,
+            max_n_rows,
+        )
+
+        def release(done: asyncio.Future):
+            # runs when the thread finishes, even if the caller gave up waiting
+            self._semaphore.release()
+            if done.cancelled() or done.exception() is not None:
+                # the connection may have been left in any state
+                if pooled is not None:
+                    pooled.con.close()
+                    self.counters["connections_discarded"] += 1
+                return
+            self.idle.append(done.result()[0])
+
+        future.add_done_callback(release)
+        self.counters["queries"] += 1
+
         try:
-            return await asyncio.wait_for(
-                loop.run_in_executor(None, query_func), timeout=timeout
+            _, result = await asyncio.wait_for(
+                asyncio.shield(future), timeout=max(0, deadline - time.monotonic())
             )
         except asyncio.TimeoutError:
-            raise HTTPException(
-                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
-                detail=f"DuckDB query timed out after {timeout} seconds",
-            )
+            # abandoning the future alone would leave the query burning a
+            # pool thread; interrupt makes it fail fast and free the slot
+            with running["lock"]:
+                running["timed_out"] = True
+                con = running.get("con")
+                if con is not None:
+                    con.interrupt()
+                    self.counters["interrupted"] += 1
+            raise
+        if "error" in result:
+            raise result["error"]
+        return {**result, "convert_ms": convert_ms}
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "idle_connections": len(self.idle),
+            "pool_size": self.pool_size,
+        }
+
+
+engine_singleton = DuckDBEngine(
+    cache_dir=DUCKDB_CACHE_DIR,
+    pool_size=int(os.environ.get("MUNDI_DUCKDB_POOL_SIZE", 4)),
+)
+
+
+def duckdb_engine() -> DuckDBEngine:
+    return engine_singleton
+
+
+async def execute_duckdb_query(
+    sql_query: str, layer_id: str, max_n_rows: int = 25, timeout: int = 10
+):
+    start_time = time.time()
+    try:
+        result = await duckdb_engine().run_query(
+            sql_query, layer_id, max_n_rows=max_n_rows, timeout=timeout
+        )
+    except asyncio.TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=f"DuckDB query timed out after {timeout} seconds",
+        )
+
+    rows = result["rows"]
+    return {
+        "status": "success",
+        "duration_ms": 1000 * (time.time() - start_time),
+        "timings_ms": {
+            "convert": result["convert_ms"],
+            "attach": result["attach_ms"],
+            "scan": result["scan_ms"],
+        },
+        "result": rows,
+        "headers": result["headers"],
+        "row_count": len(rows),
+        # None when the statement couldn't be counted without running it twice
+        "total_row_count": result["total_rows"],
+        "query": sql_query,
+    }
@@ -14,207 +14,369 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
-import tempfile
-from collections import OrderedDict
+import fcntl
+import shutil
+import itertools
+import sqlite3
+import time
 import asyncio
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, contextmanager
+from typing import Awaitable, Callable
+from src.ogr_convert import ogr_conversion_engine
 from src.structures import get_async_db_connection
 from src.utils import get_async_s3_client, get_bucket_name
 
+DEFAULT_LAYER_CACHE_DIR = os.environ.get("MUNDI_LAYER_CACHE_DIR", "/cache")
+DEFAULT_LAYER_CACHE_MAX_BYTES = int(
+    os.environ.get("MUNDI_LAYER_CACHE_MAX_BYTES", 1024 * 1024 * 128)  # 128 MiB
+)
+
 
 class FileCache:
+    """LRU of files in one directory, shared by every worker on the node.
+
+    Entries are plain files named by key. Sizes, last access times and pin
+    counts live in a SQLite index at {cache_dir}/.index.sqlite, so LRU order
+    and the size budget are the same for every worker. Cross-worker
+    coordination goes through flock(2) on {cache_dir}/.locks/{key}: filling
+    a key holds it exclusively (so only one worker builds it), readers pin a
+    key with a shared lock, and eviction only removes a file if it can take
+    the exclusive lock without waiting. The flock, not the refcount column,
+    is what makes eviction safe, since the kernel drops it if a worker dies
+    mid-read. In-progress writes live in {cache_dir}/.tmp and are renamed
+    into place, so a key's file is either absent or complete.
+    """
+
     def __init__(self, cache_dir, max_size):
-        os.makedirs(cache_dir, exist_ok=True)
         self.cache_dir, self.max_size = cache_dir, max_size
-        self.cache = OrderedDict()  # key -> file size
-        self.locked_keys = set()
-        self.total = 0
-        for fn in os.listdir(cache_dir):
-            path = os.path.join(cache_dir, fn)
-            size = os.path.getsize(path)
-            self.cache[fn] = size
-            self.total += size
+        self.lock_dir = os.path.join(cache_dir, ".locks")
+        self.tmp_dir = os.path.join(cache_dir, ".tmp")
+        os.makedirs(self.lock_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._tmp_seq = itertools.count()
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "fills": 0,
+            "evictions": 0,
+            "bytes_hit": 0,
+            "bytes_filled": 0,
+            "bytes_evicted": 0,
+        }
+
+        self.index = sqlite3.connect(
+            os.path.join(cache_dir, ".index.sqlite"),
+            timeout=10,
+            isolation_level=None,  # autocommit, every statement is tiny
+            check_same_thread=False,
+        )
+        self.index.execute("PRAGMA journal_mode=WAL")
+        self.index.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                refcount INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._reconcile()
+
+    def _reconcile(self):
+        """Bring the index in line with the directory, e.g. after an upgrade."""
+        on_disk = {}
+        for fn in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, fn)
+            if fn.startswith(".") or not os.path.isfile(path):
+                continue
+            on_disk[fn] = os.stat(path)
+        indexed = {key for (key,) in self.index.execute("SELECT key FROM entries")}
+        self.index.executemany(
+            "DELETE FROM entries WHERE key = ?",
+            [(key,) for key in indexed - on_disk.keys()],
+        )
+        self.index.executemany(
+            "INSERT OR IGNORE INTO entries (key, size, last_access) VALUES (?, ?, ?)",
+            [
+                (key, st.st_size, st.st_mtime)
+                for key, st in on_disk.items()
+                if key not in indexed
+            ],
+        )
+        # writes interrupted by a crashed worker; live workers' writes stay
+        for fn in os.listdir(self.tmp_dir):
+            pid = fn.split("-", 1)[0]
+            if pid.isdigit() and not _pid_alive(int(pid)):
+                try:
+                    os.remove(os.path.join(self.tmp_dir, fn))
+                except OSError:
+                    pass
+
+    def _path(self, key) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    @contextmanager
+    def _flock(self, key, mode):
+        fd = os.open(os.path.join(self.lock_dir, key), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, mode)
+            yield
+        finally:
+            os.close(fd)
+
+    @property
+    def total(self) -> int:
+        return self.index.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+
+    def _size(self, key) -> int | None:
+        row = self.index.execute(
+            "SELECT size FROM entries WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
 
     def _evict(self):
-        while self.total > self.max_size:
-            for key in list(self.cache.keys()):
-                if key not in self.locked_keys:
-                    size = self.cache.pop(key)
-                    os.remove(os.path.join(self.cache_dir, key))
-                    self.total -= size
-                    break
-            else:
+        """Single pass in global LRU order; pinned keys are skipped, not rescanned."""
+        total = self.total
+        if total <= self.max_size:
+            return
+        candidates = self.index.execute(
+            "SELECT key, size FROM entries ORDER BY refcount > 0, last_access"
+        ).fetchall()
+        for key, size in candidates:
+            if total <= self.max_size:
                 break
-
-    def set(self, key, data: bytes):
-        path = os.path.join(self.cache_dir, key)
-        with open(path, "wb") as f:
-            f.write(data)
-        size = os.path.getsize(path)
-        if key in self.cache:
-            self.total -= self.cache.pop(key)
-        self.cache[key] = size
-        self.total += size
+            try:
+                with self._flock(key, fcntl.LOCK_EX | fcntl.LOCK_NB):
+                    os.remove(self._path(key))
+            except BlockingIOError:
+                # pinned by this or another worker
+                continue
+            except FileNotFoundError:
+                # already evicted by another worker
+                pass
+            else:
+                self.counters["evictions"] += 1
+                self.counters["bytes_evicted"] += size
+            self.index.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+
+    def tmp_path(self, key) -> str:
+        """Scratch path on the cache's filesystem, so set_from_path can rename."""
+        return os.path.join(self.tmp_dir, f"{os.getpid()}-{next(self._tmp_seq)}-{key}")
+
+    def set_from_path(self, key, src_path: str):
+        """Move src_path into the cache without reading it into memory."""
+        dest = self._path(key)
+        try:
+            os.replace(src_path, dest)
+        except OSError:
+            # different filesystem: copy next to the destination, then rename
+            tmp = self.tmp_path(key)
+            shutil.copyfile(src_path, tmp)
+            os.replace(tmp, dest)
+        size = os.path.getsize(dest)
+        self.index.execute(
+            """
+            INSERT INTO entries (key, size, last_access) VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE
+            SET size = excluded.size, last_access = excluded.last_access
+            """,
+            (key, size, time.time()),
+        )
+        self.counters["fills"] += 1
+        self.counters["bytes_filled"] += size
         self._evict()
 
-    def get(self, key) -> bytes:
-        if key not in self.cache:
-            raise KeyError(f"Key {key} not found in cache")
-        path = os.path.join(self.cache_dir, key)
-        self.cache.move_to_end(key)
-        with open(path, "rb") as f:
-            return f.read()
+    def _cached_size(self, key) -> int | None:
+        size = self._size(key)
+        if size is None:
+            return None
+        if not os.path.exists(self._path(key)):
+            # removed behind the index's back
+            self.index.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        return size
 
     def has(self, key) -> bool:
-        return key in self.cache
+        return self._cached_size(key) is not None
 
     def get_path(self, key) -> str:
-        if key not in self.cache:
+        cursor = self.index.execute(
+            "UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key)
+        )
+        if cursor.rowcount == 0:
             raise KeyError(f"Key {key} not found in cache")
-        self.cache.move_to_end(key)
-        return os.path.join(self.cache_dir, key)
+        return self._path(key)
+
+    async def ensure(self, key, fill: Callable[[str], Awaitable[None]]):
+        """Make sure key is cached, calling fill(tmp_path) at most once per node.
+
+        Concurrent callers in this process share one in-flight future, and
+        the exclusive file lock makes other workers wait for it too.
+        """
+        # the index is shared with other workers and can be busy, so every
+        # SQLite call from async code runs off the event loop
+        size = await asyncio.to_thread(self._cached_size, key)
+        if size is not None:
+            self.counters["hits"] += 1
+            self.counters["bytes_hit"] += size
+            return
+
+        flight = self._inflight.get(key)
+        if flight is None:
+            self.counters["misses"] += 1
+            flight = asyncio.ensure_future(self._fill(key, fill))
+            self._inflight[key] = flight
+            flight.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # one cancelled caller must not cancel the fill for everyone else
+        await asyncio.shield(flight)
+
+    async def _fill(self, key, fill: Callable[[str], Awaitable[None]]):
+        fd = os.open(os.path.join(self.lock_dir, key), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            await asyncio.to_thread(fcntl.flock, fd, fcntl.LOCK_EX)
+            if await asyncio.to_thread(self.has, key):
+                return
+
+            tmp = self.tmp_path(key)
+            try:
+                await fill(tmp)
+                await asyncio.to_thread(self.set_from_path, key, tmp)
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        finally:
+            os.close(fd)
 
-    def lock(self, key):
-        self.locked_keys.add(key)
+    @asynccontextmanager
+    async def pinned(self, key):
+        """Yield the path of a cached key, protected from eviction by any worker.
 
-    def unlock(self, key):
-        self.locked_keys.discard(key)
+        Yields None if the key isn't cached (anymore).
+        """
+        fd = os.open(os.path.join(self.lock_dir, key), os.O_RDWR | os.O_CREAT, 0o644)
+        path = None
+        try:
+            await asyncio.to_thread(fcntl.flock, fd, fcntl.LOCK_SH)
+            path = await asyncio.to_thread(self._pin, key)
+            yield path
+        finally:
+            if path is not None:
+                await asyncio.to_thread(self._unpin, key)
+            os.close(fd)
+
+    def _pin(self, key) -> str | None:
+        if not self.has(key):
+            return None
+        self.index.execute(
+            "UPDATE entries SET refcount = refcount + 1 WHERE key = ?", (key,)
+        )
+        return self.get_path(key)
+
+    def _unpin(self, key):
+        self.index.execute(
+            "UPDATE entries SET refcount = MAX(refcount - 1, 0) WHERE key = ?",
+            (key,),
+        )
+
+    def stats(self) -> dict:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        entries, total, pinned = self.index.execute(
+            """
+            SELECT count(*), COALESCE(SUM(size), 0), COALESCE(SUM(refcount > 0), 0)
+            FROM entries
+            """
+        ).fetchone()
+        return {
+            **self.counters,
+            "hit_ratio": (self.counters["hits"] / lookups) if lookups else None,
+            "entries": entries,
+            "total_bytes": total,
+            "max_bytes": self.max_size,
+            "pinned": pinned,
+        }
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
 
 
 class LayerCache:
-    def __init__(self):
-        self.file_cache = FileCache(
-            cache_dir="/cache", max_size=1024 * 1024 * 128
-        )  # 128 MiB
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_LAYER_CACHE_DIR,
+        max_size: int = DEFAULT_LAYER_CACHE_MAX_BYTES,
+    ):
+        self.file_cache = FileCache(cache_dir=cache_dir, max_size=max_size)
 
     @asynccontextmanager
     async def layer_filename(self, layer_id: str):
         cache_key = f"{layer_id}.gpkg"
 
-        await self.bytes_for_layer(layer_id, "GeoPackage")
-
-        self.file_cache.lock(cache_key)
-        try:
-            yield self.file_cache.get_path(cache_key)
-        finally:
-            self.file_cache.unlock(cache_key)
-
-    async def bytes_for_layer(self, layer_id: str, format: str = "GeoPackage") -> bytes:
-        cache_key = f"{layer_id}.gpkg"
-
-        try:
-            return self.file_cache.get(cache_key)
-        except (KeyError, FileNotFoundError):
-            # not cached yet or missing file, proceed to fetch
-            pass
-
+        # the file can be evicted by another worker between ensure and pin
+        for _ in range(3):
+            await self.file_cache.ensure(
+                cache_key, lambda dest: self._fill_layer(layer_id, dest)
+            )
+            async with self.file_cache.pinned(cache_key) as path:
+                if path is None:
+                    continue
+                yield path
+                return
+        raise KeyError(f"Layer {layer_id} was evicted before it could be used")
+
+    async def _fill_layer(self, layer_id: str, dest_path: str):
         async with get_async_db_connection() as conn:
             layer = await conn.fetchrow(
                 """
-                SELECT layer_id, name, type, metadata, bounds, geometry_type,
-                    created_on, last_edited, feature_count, s3_key, remote_url
+                SELECT layer_id, type, s3_key, remote_url
                 FROM map_layers
                 WHERE layer_id = $1
                 """,
                 layer_id,
             )
 
-            if not layer:
-                raise KeyError(f"Layer {layer_id} not found")
-
-            if layer["type"] == "postgis":
-                raise KeyError(
-                    f"PostGIS layer {layer_id} cannot be pulled as individual vector file"
-                )
+        if not layer:
+            raise KeyError(f"Layer {layer_id} not found")
 
-            # Check if the layer is associated with any maps via the layers array
-            # Order by created_on DESC to get the most recently created map first
-            await conn.fetch(
-                """
-                SELECT id, title, description, owner_uuid
-                FROM user_mundiai_maps
-                WHERE $1 = ANY(layers) AND soft_deleted_at IS NULL
-                ORDER BY created_on DESC
-                """,
-                layer_id,
+        if layer["type"] == "postgis":
+            raise KeyError(
+                f"PostGIS layer {layer_id} cannot be pulled as individual vector file"
             )
 
-            # Handle remote sources
-            if layer["remote_url"]:
-                # Remote URL: use vsicurl with ogr2ogr
-                ogr_source = f"/vsicurl/{layer['remote_url']}"
-
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    cached_output_gpkg = os.path.join(temp_dir, f"{layer_id}.gpkg")
-
-                    if format != "GeoPackage":
-                        raise TypeError("only GeoPackage supported in bytes_for_layer")
-
-                    # Use ogr2ogr to convert remote source to GPKG
-                    ogr_cmd = [
-                        "ogr2ogr",
-                        "-f",
-                        "GPKG",
-                        cached_output_gpkg,
-                        ogr_source,
-                    ]
-                    process = await asyncio.create_subprocess_exec(*ogr_cmd)
-                    await process.wait()
-                    if process.returncode != 0:
-                        raise Exception(
-                            f"ogr2ogr command failed with exit code {process.returncode}"
-                        )
-
-                    with open(cached_output_gpkg, "rb") as f:
-                        data = f.read()
-                    self.file_cache.set(cache_key, data)
+        if layer["remote_url"]:
+            # Remote URL: use vsicurl with ogr2ogr
+            await self._ogr2ogr_gpkg(f"/vsicurl/{layer['remote_url']}", dest_path)
+            return
 
+        # S3 storage: download next to the cache so it can be renamed in place
+        s3_key = layer["s3_key"]
+        file_extension = os.path.splitext(s3_key)[1]
+        local_input_file = f"{dest_path}_input{file_extension}"
+
+        s3 = await get_async_s3_client()
+        try:
+            await s3.download_file(get_bucket_name(), s3_key, local_input_file)
+            if file_extension.lower() == ".gpkg":
+                os.replace(local_input_file, dest_path)
             else:
-                # S3 storage: original approach
-                bucket_name = get_bucket_name()
-
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    s3_key = layer["s3_key"]
-                    file_extension = os.path.splitext(s3_key)[1]
-
-                    local_input_file = os.path.join(
-                        temp_dir, f"{layer_id}_input{file_extension}"
-                    )
-
-                    s3 = await get_async_s3_client()
-                    await s3.download_file(bucket_name, s3_key, local_input_file)
-
-                    cached_output_gpkg = os.path.join(temp_dir, f"{layer_id}.gpkg")
-
-                    if format != "GeoPackage":
-                        raise TypeError("only GeoPackage supported in bytes_for_layer")
-
-                    if file_extension.lower() == ".gpkg":
-                        with (
-                            open(local_input_file, "rb") as src,
-                            open(cached_output_gpkg, "wb") as dst,
-                        ):
-                            dst.write(src.read())
-                    else:
-                        ogr_cmd = [
-                            "ogr2ogr",
-                            "-f",
-                            "GPKG",
-                            cached_output_gpkg,
-                            local_input_file,
-                        ]
-                        process = await asyncio.create_subprocess_exec(*ogr_cmd)
-                        await process.wait()
-                        if process.returncode != 0:
-                            raise Exception(
-                                f"ogr2ogr command failed with exit code {process.returncode}"
-                            )
-
-                    with open(cached_output_gpkg, "rb") as f:
-                        data = f.read()
-                    self.file_cache.set(cache_key, data)
-
-        return self.file_cache.get(cache_key)
+                await self._ogr2ogr_gpkg(local_input_file, dest_path)
+        finally:
+            if os.path.exists(local_input_file):
+                os.remove(local_input_file)
+
+    async def _ogr2ogr_gpkg(self, ogr_source: str, dest_path: str):
+        await ogr_conversion_engine().convert(ogr_source, dest_path, ["-f", "GPKG"])
 
 
 cache_singleton = LayerCache()
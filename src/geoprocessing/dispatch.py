@@ -15,6 +15,7 @@
 
 import os
 import json
+from functools import lru_cache
 
 
 class UnsupportedAlgorithmError(Exception):
@@ -25,6 +26,8 @@ class InvalidInputFormatError(Exception):
     pass
 
 
+@lru_cache(maxsize=1)
 def get_tools():
+    """Geoprocessing tool definitions, parsed once. Callers must not mutate them."""
     with open(os.path.join(os.path.dirname(__file__), "tools.json"), "r") as f:
         return json.load(f)
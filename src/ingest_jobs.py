@@ -0,0 +1,677 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import socket
+import tempfile
+import time
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+
+from src.routes.websocket import CHAT_CH, EphemeralNotificationPayload
+from src.structures import get_async_db_connection
+from src.utils import (
+    ensure_private_dir,
+    generate_id,
+    get_async_s3_client,
+    get_bucket_name,
+)
+
+logger = logging.getLogger(__name__)
+
+# in pipeline order; "receive" happens in the request, the rest in a worker
+INGEST_STAGES = ("receive", "convert", "upload", "analyze", "tiles", "register")
+
+STAGE_ACTIONS = {
+    "receive": "Receiving",
+    "convert": "Converting",
+    "upload": "Storing",
+    "analyze": "Analyzing",
+    "tiles": "Building tiles for",
+    "register": "Adding",
+}
+
+# stages that are throttled even when no MUNDI_INGEST_<STAGE>_CONCURRENCY is set;
+# tippecanoe is multi-threaded, so a few at once already saturate the node
+DEFAULT_STAGE_CONCURRENCY = {
+    "tiles": max(1, (os.cpu_count() or 1) // 2),
+}
+
+_stage_semaphores: dict[str, Optional[asyncio.Semaphore]] = {}
+
+
+def stage_concurrency(stage: str) -> Optional[int]:
+    configured = os.environ.get(f"MUNDI_INGEST_{stage.upper()}_CONCURRENCY")
+    if configured:
+        return int(configured)
+    return DEFAULT_STAGE_CONCURRENCY.get(stage)
+
+
+def _stage_semaphore(stage: str) -> Optional[asyncio.Semaphore]:
+    if stage not in _stage_semaphores:
+        limit = stage_concurrency(stage)
+        _stage_semaphores[stage] = asyncio.Semaphore(limit) if limit else None
+    return _stage_semaphores[stage]
+
+
+class IngestJobCancelled(Exception):
+    pass
+
+
+class IngestJobLost(Exception):
+    """The job was handed to another attempt, e.g. after missing heartbeats."""
+
+
+def is_retryable(e: BaseException) -> bool:
+    # a 4xx means the upload itself is bad, running it again won't help
+    return not (isinstance(e, HTTPException) and e.status_code < 500)
+
+
+class IngestJobContext:
+    """Progress of the ingest job running in the current task."""
+
+    def __init__(self, job: dict):
+        self.job = job
+        self.stage: Optional[str] = None
+        self.stage_started = time.monotonic()
+        timings = job.get("stage_timings") or {}
+        self.timings: dict[str, float] = (
+            json.loads(timings) if isinstance(timings, str) else dict(timings)
+        )
+
+    def _close_stage(self):
+        if self.stage is not None:
+            elapsed = time.monotonic() - self.stage_started
+            self.timings[self.stage] = round(
+                self.timings.get(self.stage, 0.0) + elapsed, 3
+            )
+
+    async def enter_stage(self, stage: str):
+        if stage == self.stage:
+            return
+        self._close_stage()
+        self.stage = stage
+        self.stage_started = time.monotonic()
+
+        async with get_async_db_connection() as conn:
+            row = await conn.fetchrow(
+                """
+                UPDATE ingest_jobs
+                SET stage = $2, stage_timings = $3::jsonb,
+                    heartbeat_at = CURRENT_TIMESTAMP
+                WHERE id = $1 AND attempts = $4 AND status = 'running'
+                RETURNING cancel_requested
+                """,
+                self.job["id"],
+                stage,
+                json.dumps(self.timings),
+                self.job["attempts"],
+            )
+            if row is None:
+                raise IngestJobLost(f"ingest job {self.job['id']} was requeued")
+            if row["cancel_requested"]:
+                raise IngestJobCancelled(f"ingest job {self.job['id']} was cancelled")
+            await notify_ingest_progress(conn, self.job, stage, "active")
+
+    def finish(self) -> dict:
+        self._close_stage()
+        self.stage = None
+        return self.timings
+
+
+current_ingest_job: contextvars.ContextVar[Optional[IngestJobContext]] = (
+    contextvars.ContextVar("current_ingest_job", default=None)
+)
+
+
+async def mark_ingest_stage(stage: str):
+    """Record that the ingest job running in this task has reached stage.
+
+    Outside an ingest job this does nothing. Inside one it updates the job row,
+    pushes progress to the job's conversation, and raises IngestJobCancelled if
+    cancellation was requested.
+    """
+    ctx = current_ingest_job.get()
+    if ctx is not None:
+        await ctx.enter_stage(stage)
+
+
+@asynccontextmanager
+async def ingest_stage(stage: str):
+    """Like mark_ingest_stage, but also holds one of the stage's concurrency slots.
+
+    The limit applies to every caller on this node, background job or not.
+    """
+    await mark_ingest_stage(stage)
+    semaphore = _stage_semaphore(stage)
+    if semaphore is None:
+        yield
+        return
+    async with semaphore:
+        yield
+
+
+async def notify_ingest_progress(conn, job: dict, stage: Optional[str], status: str):
+    """Push job progress to the conversation websocket, on every node."""
+    if job.get("conversation_id") is None:
+        return
+    now = datetime.now(timezone.utc)
+    action = STAGE_ACTIONS.get(stage, "Processing")
+    payload = EphemeralNotificationPayload(
+        conversation_id=job["conversation_id"],
+        ephemeral=True,
+        action_id=job["id"],
+        # pinned when the job is queued, but only exists once it has succeeded
+        layer_id=job.get("layer_id") if job.get("status") == "succeeded" else None,
+        action=f"{action} {job['filename']}",
+        timestamp=now,
+        completed_at=None if status == "active" else now,
+        status=status,
+        bounds=None,
+        updates={
+            "ingest_job_id": job["id"],
+            "stage": stage,
+            "stage_index": INGEST_STAGES.index(stage)
+            if stage in INGEST_STAGES
+            else None,
+            "stage_count": len(INGEST_STAGES),
+            "attempt": job.get("attempts"),
+        },
+    )
+    # same channel as chat messages, so subscribers on any worker receive it
+    await conn.execute("SELECT pg_notify($1, $2)", CHAT_CH, payload.model_dump_json())
+
+
+class IngestJobQueue:
+    """Durable queue of layer uploads, processed by a pool of local workers.
+
+    Jobs live in the ingest_jobs table; any node may claim a queued job with
+    FOR UPDATE SKIP LOCKED. Running jobs heartbeat, and a job whose worker
+    stopped heartbeating for stale_after_sec is put back on the queue. Failed
+    jobs are retried with exponential backoff up to max_attempts, unless the
+    failure was the upload's fault (a 4xx). Cancellation is a flag on the row,
+    which the owning worker picks up on its next heartbeat or stage change.
+
+    Every write a worker makes to a running job is fenced on the attempt it
+    claimed, so a worker that was presumed dead and requeued stops at its next
+    stage instead of finishing the job a second time. The layer_id is pinned
+    when the job is queued and passed to every attempt, which makes
+    registering the layer idempotent.
+
+    The uploaded file is kept both in spool_dir on the receiving node and in
+    S3, so a job can be processed by a different node or after a restart.
+    Each node removes its own spool files once their job is finished,
+    whichever node ran it. A spool file is processed as it is, so spool_dir
+    is only used while it is private to this user.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        max_attempts: int,
+        spool_dir: str,
+        poll_interval_sec: float = 2.0,
+        heartbeat_interval_sec: float = 10.0,
+        stale_after_sec: float = 120.0,
+        retry_backoff_sec: float = 15.0,
+    ):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.spool_dir = spool_dir
+        self.poll_interval_sec = poll_interval_sec
+        self.heartbeat_interval_sec = heartbeat_interval_sec
+        self.stale_after_sec = stale_after_sec
+        self.retry_backoff_sec = retry_backoff_sec
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: list[asyncio.Task] = []
+        self._running: dict[str, asyncio.Task] = {}
+        self._attempts: dict[str, int] = {}
+        self._lost: set[str] = set()
+        self._wake: Optional[asyncio.Event] = None
+        self._closing = False
+        self.counters = {
+            "enqueued": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "retried": 0,
+            "cancelled": 0,
+            "lost": 0,
+            "spool_swept": 0,
+        }
+
+    def _spool_dir_ok(self) -> bool:
+        if ensure_private_dir(self.spool_dir):
+            return True
+        logger.error(
+            f"Ingest spool directory {self.spool_dir} is not owned by this user "
+            "or is open to others, not using it"
+        )
+        return False
+
+    def _is_spooled_here(self, path: Optional[str]) -> bool:
+        return bool(path) and os.path.dirname(path) == os.path.normpath(self.spool_dir)
+
+    def spool_path(self, job_id: str, file_ext: str) -> str:
+        if not self._spool_dir_ok():
+            raise RuntimeError(f"ingest spool directory {self.spool_dir} is unsafe")
+        return os.path.join(self.spool_dir, f"{job_id}{file_ext}")
+
+    def start(self):
+        if self._tasks:
+            return
+        self._closing = False
+        self._wake = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._worker_loop()) for _ in range(self.workers)
+        ]
+        self._tasks.append(asyncio.create_task(self._heartbeat_loop()))
+
+    async def close(self):
+        self._closing = True
+        running = list(self._running.values())
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(
+        self,
+        conn,
+        *,
+        job_id: str,
+        owner_uuid: str,
+        project_id: str,
+        map_id: str,
+        conversation_id: Optional[int],
+        filename: str,
+        layer_name: Optional[str],
+        add_layer_to_map: bool,
+        source_s3_key: str,
+        spool_path: Optional[str],
+        size_bytes: int,
+        sha256: str,
+        receive_seconds: float,
+    ) -> dict:
+        row = await conn.fetchrow(
+            """
+            INSERT INTO ingest_jobs
+            (id, owner_uuid, project_id, map_id, conversation_id, filename,
+             layer_name, add_layer_to_map, source_s3_key, spool_path, size_bytes,
+             sha256, status, stage, stage_timings, max_attempts, layer_id)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12,
+                    'queued', 'receive', $13::jsonb, $14, $15)
+            RETURNING *
+            """,
+            job_id,
+            owner_uuid,
+            project_id,
+            map_id,
+            conversation_id,
+            filename,
+            layer_name,
+            add_layer_to_map,
+            source_s3_key,
+            spool_path,
+            size_bytes,
+            sha256,
+            json.dumps({"receive": round(receive_seconds, 3)}),
+            self.max_attempts,
+            generate_id(prefix="L"),
+        )
+        self.counters["enqueued"] += 1
+        if self._wake is not None:
+            self._wake.set()
+        return dict(row)
+
+    async def cancel(self, conn, job_id: str) -> Optional[dict]:
+        row = await conn.fetchrow(
+            """
+            UPDATE ingest_jobs
+            SET cancel_requested = true,
+                status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+                finished_at = CASE WHEN status = 'queued'
+                    THEN CURRENT_TIMESTAMP ELSE finished_at END
+            WHERE id = $1
+            RETURNING *
+            """,
+            job_id,
+        )
+        if row is None:
+            return None
+        job = dict(row)
+
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        elif job["status"] == "cancelled" and job["worker_id"] is None:
+            # never started, nobody else will clean up after it
+            await self._discard_source(job)
+            await notify_ingest_progress(conn, job, job["stage"], "completed")
+        return job
+
+    async def _claim(self) -> Optional[dict]:
+        async with get_async_db_connection() as conn:
+            row = await conn.fetchrow(
+                """
+                UPDATE ingest_jobs
+                SET status = 'running', attempts = attempts + 1, worker_id = $1,
+                    heartbeat_at = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM ingest_jobs
+                    WHERE status = 'queued' AND run_after <= CURRENT_TIMESTAMP
+                    ORDER BY created_at
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING *
+                """,
+                self.worker_id,
+            )
+        return dict(row) if row else None
+
+    async def _worker_loop(self):
+        while True:
+            try:
+                job = await self._claim()
+            except Exception:
+                logger.exception("Failed to claim ingest job")
+                job = None
+
+            if job is None:
+                self._wake.clear()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wake.wait(), self.poll_interval_sec)
+                continue
+
+            task = asyncio.create_task(self._run(job))
+            self._running[job["id"]] = task
+            self._attempts[job["id"]] = job["attempts"]
+            try:
+                await asyncio.wait({task})
+            finally:
+                self._running.pop(job["id"], None)
+                self._attempts.pop(job["id"], None)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval_sec)
+            try:
+                async with get_async_db_connection() as conn:
+                    await self._heartbeat(conn)
+                    await self._sweep_spool(conn)
+            except Exception:
+                logger.exception("Ingest job heartbeat failed")
+
+    async def _heartbeat(self, conn):
+        if self._attempts:
+            rows = await conn.fetch(
+                """
+                UPDATE ingest_jobs SET heartbeat_at = CURRENT_TIMESTAMP
+                FROM unnest($1::text[], $2::int[]) AS mine(id, attempts)
+                WHERE ingest_jobs.id = mine.id
+                  AND ingest_jobs.attempts = mine.attempts
+                  AND ingest_jobs.status = 'running'
+                RETURNING ingest_jobs.id, ingest_jobs.cancel_requested
+                """,
+                list(self._attempts),
+                list(self._attempts.values()),
+            )
+            alive = {row["id"] for row in rows}
+            for job_id, task in list(self._running.items()):
+                if job_id not in alive:
+                    # requeued while we were still at it, e.g. blocked past
+                    # stale_after_sec; the attempt now running elsewhere owns it
+                    self._lost.add(job_id)
+                    task.cancel()
+            for row in rows:
+                task = self._running.get(row["id"])
+                if row["cancel_requested"] and task is not None:
+                    task.cancel()
+
+        # jobs whose worker died go back on the queue, or fail if that was
+        # their last attempt
+        await conn.execute(
+            """
+            UPDATE ingest_jobs
+            SET status = CASE WHEN attempts >= max_attempts
+                    THEN 'failed' ELSE 'queued' END,
+                finished_at = CASE WHEN attempts >= max_attempts
+                    THEN CURRENT_TIMESTAMP END,
+                error = 'worker stopped responding',
+                worker_id = NULL
+            WHERE status = 'running'
+              AND heartbeat_at < CURRENT_TIMESTAMP - make_interval(secs => $1)
+            """,
+            float(self.stale_after_sec),
+        )
+
+    async def _sweep_spool(self, conn):
+        """Removes spool files on this node whose job has finished.
+
+        _discard_source can only remove the spool file when the job ran on the
+        node that received it, so each node also clears out its own spool_dir.
+        """
+        if not os.path.isdir(self.spool_dir) or not self._spool_dir_ok():
+            return
+        try:
+            names = os.listdir(self.spool_dir)
+        except FileNotFoundError:
+            return
+        spooled = {os.path.splitext(name)[0]: name for name in names}
+        if not spooled:
+            return
+        rows = await conn.fetch(
+            "SELECT id, status FROM ingest_jobs WHERE id = ANY($1::text[])",
+            list(spooled),
+        )
+        statuses = {row["id"]: row["status"] for row in rows}
+        for job_id, name in spooled.items():
+            status = statuses.get(job_id)
+            if status in ("queued", "running"):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            with suppress(FileNotFoundError):
+                # no row yet may just mean the upload is still being received
+                if status is None and (
+                    time.time() - os.path.getmtime(path) < self.stale_after_sec
+                ):
+                    continue
+                os.remove(path)
+                self.counters["spool_swept"] += 1
+
+    async def _run(self, job: dict):
+        ctx = IngestJobContext(job)
+        token = current_ingest_job.set(ctx)
+        try:
+            result = await self._process(job)
+        except asyncio.CancelledError:
+            if self._closing:
+                # shutting down, not the user's doing: hand it to another worker
+                await self._release(job)
+                raise
+            if job["id"] in self._lost:
+                self._lost.discard(job["id"])
+                self.counters["lost"] += 1
+                logger.warning(f"Ingest job {job['id']} was requeued, stopping")
+                return
+            await self._finish(ctx, "cancelled")
+        except IngestJobCancelled:
+            await self._finish(ctx, "cancelled")
+        except IngestJobLost:
+            self.counters["lost"] += 1
+            logger.warning(f"Ingest job {job['id']} was requeued, stopping")
+        except Exception as e:
+            logger.exception(f"Ingest job {job['id']} failed")
+            error = e.detail if isinstance(e, HTTPException) else str(e)
+            if is_retryable(e) and job["attempts"] < job["max_attempts"]:
+                await self._retry(ctx, error)
+            else:
+                await self._finish(ctx, "failed", error=error)
+        else:
+            await self._finish(ctx, "succeeded", layer_id=result.id)
+        finally:
+            current_ingest_job.reset(token)
+
+    async def _process(self, job: dict):
+        # imported here, as postgres_routes uses this module to report its stages
+        from src.routes.postgres_routes import internal_upload_layer
+
+        async with self._source_file(job) as path:
+            with open(path, "rb") as f:
+                return await internal_upload_layer(
+                    map_id=job["map_id"],
+                    file=UploadFile(f, filename=job["filename"]),
+                    layer_name=job["layer_name"],
+                    add_layer_to_map=job["add_layer_to_map"],
+                    user_id=str(job["owner_uuid"]),
+                    project_id=job["project_id"],
+                    layer_id=job["layer_id"],
+                )
+
+    @asynccontextmanager
+    async def _source_file(self, job: dict):
+        spool_path = job["spool_path"]
+        if (
+            self._is_spooled_here(spool_path)
+            and self._spool_dir_ok()
+            and os.path.exists(spool_path)
+            and os.path.getsize(spool_path) == job["size_bytes"]
+        ):
+            yield spool_path
+            return
+
+        # received on another node, or the spool didn't survive a restart
+        suffix = os.path.splitext(job["filename"])[1]
+        with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+            s3 = await get_async_s3_client()
+            await s3.download_file(get_bucket_name(), job["source_s3_key"], tmp.name)
+            yield tmp.name
+
+    async def _discard_source(self, job: dict):
+        if self._is_spooled_here(job["spool_path"]):
+            with suppress(FileNotFoundError):
+                os.remove(job["spool_path"])
+        try:
+            s3 = await get_async_s3_client()
+            await s3.delete_object(Bucket=get_bucket_name(), Key=job["source_s3_key"])
+        except Exception:
+            logger.exception(f"Failed to delete {job['source_s3_key']}")
+
+    async def _release(self, job: dict):
+        async with get_async_db_connection() as conn:
+            await conn.execute(
+                """
+                UPDATE ingest_jobs
+                SET status = 'queued', attempts = attempts - 1, worker_id = NULL
+                WHERE id = $1 AND attempts = $2 AND status = 'running'
+                """,
+                job["id"],
+                job["attempts"],
+            )
+
+    async def _retry(self, ctx: IngestJobContext, error: str):
+        job = ctx.job
+        delay = self.retry_backoff_sec * 2 ** (job["attempts"] - 1)
+        async with get_async_db_connection() as conn:
+            await conn.execute(
+                """
+                UPDATE ingest_jobs
+                SET status = 'queued', error = $2, stage_timings = $3::jsonb,
+                    run_after = CURRENT_TIMESTAMP + make_interval(secs => $4),
+                    worker_id = NULL
+                WHERE id = $1 AND attempts = $5 AND status = 'running'
+                """,
+                job["id"],
+                error,
+                json.dumps(ctx.finish()),
+                float(delay),
+                job["attempts"],
+            )
+        self.counters["retried"] += 1
+
+    async def _finish(
+        self,
+        ctx: IngestJobContext,
+        status: str,
+        error: Optional[str] = None,
+        layer_id: Optional[str] = None,
+    ):
+        job = ctx.job
+        stage = ctx.stage
+        async with get_async_db_connection() as conn:
+            row = await conn.fetchrow(
+                """
+                UPDATE ingest_jobs
+                SET status = $2, error = $3, layer_id = COALESCE($4, layer_id),
+                    stage_timings = $5::jsonb, finished_at = CURRENT_TIMESTAMP,
+                    worker_id = NULL
+                WHERE id = $1 AND attempts = $6 AND status = 'running'
+                RETURNING *
+                """,
+                job["id"],
+                status,
+                error,
+                layer_id,
+                json.dumps(ctx.finish()),
+                job["attempts"],
+            )
+            if row is None:
+                # requeued meanwhile; leave the job and its source to that attempt
+                self.counters["lost"] += 1
+                logger.warning(f"Ingest job {job['id']} was requeued, not finishing")
+                return
+            await notify_ingest_progress(
+                conn,
+                dict(row),
+                stage,
+                "error" if status == "failed" else "completed",
+            )
+        self.counters[status] += 1
+        await self._discard_source(job)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "running": len(self._running),
+            "workers": self.workers,
+            "stage_concurrency": {
+                stage: stage_concurrency(stage) for stage in INGEST_STAGES
+            },
+        }
+
+
+ingest_job_queue_singleton = IngestJobQueue(
+    workers=int(os.environ.get("MUNDI_INGEST_WORKERS", 2)),
+    max_attempts=int(os.environ.get("MUNDI_INGEST_MAX_ATTEMPTS", 3)),
+    # spooled uploads are processed as they are, so not somewhere like /tmp
+    spool_dir=os.environ.get(
+        "MUNDI_INGEST_SPOOL_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "mundi", "ingest"),
+    ),
+)
+
+
+def ingest_job_queue() -> IngestJobQueue:
+    return ingest_job_queue_singleton
@@ -0,0 +1,290 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+import base64
+import itertools
+import json
+import os
+import signal
+import time
+from collections import deque
+from contextlib import suppress
+from typing import Any, Optional, Sequence
+
+RENDER_WORKER_COMMAND = ("xvfb-run", "-a", "node", "src/renderer/worker.js")
+
+# a response line carries a whole base64 PNG
+WORKER_STREAM_LIMIT = 64 * 1024 * 1024
+
+
+class RendererError(Exception):
+    def __init__(self, message: str, messages: Optional[list[dict]] = None):
+        super().__init__(message)
+        self.messages = messages or []
+
+
+class RenderResult:
+    def __init__(self, png: bytes, zoom: float, center: list[float], messages):
+        self.png = png
+        self.zoom = zoom
+        self.center = center
+        self.messages = messages
+
+
+class RendererWorker:
+    """One long-lived worker.js process, which keeps its own Xvfb display.
+
+    The worker runs in its own session, so that it can be stopped as a process
+    group: killing xvfb-run alone would leave node and Xvfb running.
+    """
+
+    def __init__(self, process: asyncio.subprocess.Process):
+        self.process = process
+        self.jobs = 0
+        self.rss = 0
+
+    @classmethod
+    async def start(cls, command: Sequence[str], timeout: float) -> "RendererWorker":
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=WORKER_STREAM_LIMIT,
+            start_new_session=True,
+        )
+        worker = cls(process)
+        try:
+            hello = await asyncio.wait_for(worker._read(), timeout)
+        except BaseException:
+            await worker.close()
+            raise
+        if not hello.get("ready"):
+            await worker.close()
+            raise RendererError(f"renderer worker failed to start: {hello}")
+        worker.rss = hello.get("rss", 0)
+        return worker
+
+    async def _read(self) -> dict:
+        line = await self.process.stdout.readline()
+        if not line:
+            raise RendererError(
+                f"renderer worker exited with code {await self.process.wait()}"
+            )
+        return json.loads(line)
+
+    async def run(self, job: dict) -> dict:
+        self.process.stdin.write(json.dumps(job).encode() + b"\n")
+        await self.process.stdin.drain()
+        response = await self._read()
+        self.jobs += 1
+        self.rss = response.get("rss", self.rss)
+        if response.get("id") != job["id"]:
+            raise RendererError(f"renderer worker answered job {response.get('id')}")
+        return response
+
+    @property
+    def alive(self) -> bool:
+        return self.process.returncode is None
+
+    def _signal_group(self, sig: int):
+        with suppress(ProcessLookupError, PermissionError):
+            os.killpg(self.process.pid, sig)
+
+    async def close(self, kill: bool = False):
+        if kill:
+            # it may be wedged mid-render, don't wait for it to read EOF; after
+            # a crash its children may still be around, so signal them anyway
+            self._signal_group(signal.SIGKILL)
+            await self.process.wait()
+            return
+        if self.alive:
+            try:
+                self.process.stdin.close()
+                await asyncio.wait_for(self.process.wait(), 5)
+            except (asyncio.TimeoutError, ConnectionError):
+                self._signal_group(signal.SIGTERM)
+                try:
+                    await asyncio.wait_for(self.process.wait(), 5)
+                except asyncio.TimeoutError:
+                    pass
+        self._signal_group(signal.SIGKILL)
+        await self.process.wait()
+
+
+class MapRendererPool:
+    """Bounded pool of warm MapLibre renderer processes.
+
+    Workers are started on first use and handle one job at a time. A worker
+    is replaced after max_jobs renders, once its RSS grows past max_rss_bytes,
+    or after any timeout or crash, so a leak or a wedged GL context can't
+    outlive a few renders. Jobs waiting for a free worker are counted as the
+    queue depth.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        max_jobs: int,
+        max_rss_bytes: int,
+        timeout: float,
+        command: Sequence[str] = RENDER_WORKER_COMMAND,
+        latency_window: int = 256,
+    ):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.max_rss_bytes = max_rss_bytes
+        self.timeout = timeout
+        self.command = tuple(command)
+        self._idle: list[RendererWorker] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._ids = itertools.count()
+        self.queued = 0
+        self.in_flight = 0
+        self._latencies_ms: deque[float] = deque(maxlen=latency_window)
+        self.counters = {
+            "rendered": 0,
+            "failed": 0,
+            "timed_out": 0,
+            "workers_started": 0,
+            "workers_recycled": 0,
+        }
+
+    def _needs_recycle(self, worker: RendererWorker) -> bool:
+        return (
+            not worker.alive
+            or worker.jobs >= self.max_jobs
+            or worker.rss >= self.max_rss_bytes
+        )
+
+    async def _checkout(self) -> RendererWorker:
+        if self._idle:
+            return self._idle.pop()
+        worker = await RendererWorker.start(self.command, self.timeout)
+        self.counters["workers_started"] += 1
+        return worker
+
+    async def _checkin(self, worker: RendererWorker, healthy: bool):
+        if healthy and not self._needs_recycle(worker):
+            self._idle.append(worker)
+            return
+        self.counters["workers_recycled"] += 1
+        await worker.close(kill=not healthy)
+
+    async def render(
+        self,
+        style: str,
+        width: int,
+        height: int,
+        bounds: Optional[str] = None,
+        center: Optional[list[float]] = None,
+        zoom: Optional[float] = None,
+        ratio: float = 1,
+    ) -> RenderResult:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+
+        job: dict[str, Any] = {
+            "id": next(self._ids),
+            "style": style,
+            "width": width,
+            "height": height,
+            "ratio": ratio,
+        }
+        if center is not None:
+            job["center"] = center
+            job["zoom"] = zoom or 0
+        else:
+            job["bounds"] = bounds
+
+        self.queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+
+        self.in_flight += 1
+        started = time.perf_counter()
+        worker = None
+        healthy = False
+        try:
+            worker = await self._checkout()
+            try:
+                response = await asyncio.wait_for(worker.run(job), self.timeout)
+            except asyncio.TimeoutError:
+                self.counters["timed_out"] += 1
+                raise RendererError(f"render timed out after {self.timeout}s")
+            # the worker answered, even if it couldn't render this style
+            healthy = True
+            if not response.get("ok"):
+                raise RendererError(
+                    response.get("error") or "render failed",
+                    response.get("messages"),
+                )
+            self.counters["rendered"] += 1
+            return RenderResult(
+                png=base64.b64decode(response["png"]),
+                zoom=response["zoom"],
+                center=response["center"],
+                messages=response.get("messages", []),
+            )
+        except BaseException:
+            self.counters["failed"] += 1
+            raise
+        finally:
+            self._latencies_ms.append((time.perf_counter() - started) * 1000)
+            if worker is not None:
+                await self._checkin(worker, healthy)
+            self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies_ms)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 1)
+
+        return {
+            **self.counters,
+            "queue_depth": self.queued,
+            "in_flight": self.in_flight,
+            "idle_workers": len(self._idle),
+            "size": self.size,
+            "latency_ms_p50": percentile(0.5),
+            "latency_ms_p95": percentile(0.95),
+            "latency_ms_max": round(latencies[-1], 1) if latencies else None,
+        }
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        await asyncio.gather(*(worker.close() for worker in idle))
+
+
+map_renderer_pool_singleton = MapRendererPool(
+    size=int(os.environ.get("MUNDI_RENDERER_WORKERS", 2)),
+    max_jobs=int(os.environ.get("MUNDI_RENDERER_MAX_JOBS", 200)),
+    max_rss_bytes=int(
+        os.environ.get("MUNDI_RENDERER_MAX_RSS_BYTES", 1024 * 1024 * 1024)
+    ),
+    timeout=float(os.environ.get("MUNDI_RENDERER_TIMEOUT_SEC", 60)),
+)
+
+
+def map_renderer_pool() -> MapRendererPool:
+    return map_renderer_pool_singleton
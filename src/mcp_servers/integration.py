@@ -4,11 +4,11 @@ MCP服务器集成模块
 """
 
 import os
-from typing import Dict, Any, List, Optional
+from typing import Annotated, Dict, Any, List, Optional, Union
 from datetime import datetime, timedelta
 import numpy as np
 from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 
 # 导入所有MCP服务器
 from .flood_evolution_mcp import FloodEvolutionMCPServer
@@ -29,6 +29,24 @@ class FloodSimulationRequest(BaseModel):
     initial_water_level: float = 5.0
     bank_height: float = 8.0
 
+class FloodEnsembleRequest(BaseModel):
+    """洪水演进集合模拟请求, 列表参数为逐成员取值, 标量参数为全体成员共用"""
+    river_length: float = 100.0
+    simulation_hours: float = 24.0
+    upstream_hydrographs: Optional[List[List[float]]] = None
+    hydrograph_interval_hours: float = 1.0
+    upstream_flow_rate: float = 1000.0
+    downstream_water_level: float = 10.0
+    manning_roughness: Union[float, List[float]] = 0.035
+    breach_peak_flows: Optional[List[float]] = None
+    breach_time_hours: Union[float, List[float]] = 6.0
+    breach_duration_hours: Union[float, List[float]] = 4.0
+    bed_slope: float = 0.001
+    initial_water_level: float = 5.0
+    bank_height: float = 8.0
+    depth_thresholds: Optional[List[float]] = None
+    percentiles: Optional[List[float]] = None
+
 class ReservoirSimulationRequest(BaseModel):
     """水库调度模拟请求"""
     current_water_level: float
@@ -37,6 +55,61 @@ class ReservoirSimulationRequest(BaseModel):
     operation_mode: str = "normal"
     target_water_level: Optional[float] = None
 
+class CurvePoints(BaseModel):
+    """特征曲线数据点"""
+    levels: List[float]
+    values: List[float]
+
+class ReservoirSpec(BaseModel):
+    """梯级中的一座水库, 特征曲线只能引用已配置的水库编号或直接给出数据"""
+    model_config = ConfigDict(extra="forbid")
+
+    name: str
+    total_capacity: float
+    dead_capacity: float
+    flood_capacity: float
+    normal_water_level: float
+    dead_water_level: float
+    flood_limit_water_level: float
+    dam_height: float
+    crest_elevation: float
+    survey_id: Optional[str] = None
+    curves: Optional[Dict[str, CurvePoints]] = None
+    downstream: Optional[int] = None
+    lag_hours: int = Field(0, ge=0, le=ReservoirSimulationMCPServer.MAX_SCENARIO_HOURS)
+
+class ReservoirScenarioRequest(BaseModel):
+    """多水库多情景调度模拟请求, 规模上限见ReservoirSimulationMCPServer"""
+    inflow_traces: List[Any] = Field(max_length=ReservoirSimulationMCPServer.MAX_SCENARIO_TRACES)
+    initial_water_levels: Union[float, List[float]]
+    operation_modes: Union[str, List[str]] = "normal"
+    target_water_level: Optional[float] = None
+    reservoirs: Optional[List[ReservoirSpec]] = Field(
+        None, max_length=ReservoirSimulationMCPServer.MAX_CASCADE_RESERVOIRS
+    )
+    include_series: bool = False
+
+class ReservoirOptimizationRequest(BaseModel):
+    """动态规划优化调度请求, 规模上限见ReservoirSimulationMCPServer"""
+    current_water_level: float
+    forecast_hours: int = Field(168, ge=1, le=ReservoirSimulationMCPServer.MAX_DP_HOURS)
+    average_inflow: float = 5000.0
+    inflow_forecast: Optional[List[float]] = Field(
+        None, min_length=1, max_length=ReservoirSimulationMCPServer.MAX_DP_HOURS
+    )
+    objective: str = "power"
+    target_final_level: Optional[float] = None
+    stochastic: bool = False
+    n_samples: int = Field(20, ge=1, le=ReservoirSimulationMCPServer.MAX_DP_SAMPLES)
+    inflow_uncertainty: float = 0.2
+    inflow_samples: Optional[
+        List[Annotated[List[float], Field(max_length=ReservoirSimulationMCPServer.MAX_DP_HOURS)]]
+    ] = Field(
+        None, min_length=1, max_length=ReservoirSimulationMCPServer.MAX_DP_SAMPLES
+    )
+    max_states: Optional[int] = Field(None, ge=2, le=ReservoirSimulationMCPServer.MAX_DP_STATES)
+    seed: Optional[int] = None
+
 class AnomalyDetectionRequest(BaseModel):
     """异常检测请求"""
     water_level_data: List[float]
@@ -68,6 +141,7 @@ class PredictionRequest(BaseModel):
     method: str = "ensemble"
     seasonal_period: int = 24
     confidence_level: float = 0.95
+    station_id: Optional[str] = None
 
 class HydropowerMCPServer:
     """水电专业模型MCP服务器集成"""
@@ -100,6 +174,16 @@ class HydropowerMCPServer:
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"洪水演进模拟失败: {str(e)}")
 
+    async def simulate_flood_ensemble(self, request: FloodEnsembleRequest) -> Dict[str, Any]:
+        """
+        洪水演进集合模拟
+        多组入流过程、糙率和溃口参数堆叠计算, 输出逐断面超越概率和百分位水深
+        """
+        try:
+            return await self.flood_server.simulate_flood_ensemble(**request.model_dump())
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"洪水集合模拟失败: {str(e)}")
+
     async def simulate_reservoir_operation(self, request: ReservoirSimulationRequest) -> Dict[str, Any]:
         """
         水库调度模拟
@@ -117,6 +201,26 @@ class HydropowerMCPServer:
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"水库调度模拟失败: {str(e)}")
 
+    async def simulate_reservoir_scenarios(self, request: ReservoirScenarioRequest) -> Dict[str, Any]:
+        """
+        多水库多情景调度模拟
+        梯级水库与多条入流过程、多种运行模式按数组同时推进
+        """
+        try:
+            return await self.reservoir_server.simulate_operation_scenarios(**request.model_dump())
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"多情景调度模拟失败: {str(e)}")
+
+    async def optimize_reservoir_operation_dp(self, request: ReservoirOptimizationRequest) -> Dict[str, Any]:
+        """
+        动态规划优化调度
+        库容离散的确定性/随机动态规划, 最大化发电量或控制防洪风险
+        """
+        try:
+            return await self.reservoir_server.optimize_operation_dp(**request.model_dump())
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"动态规划优化调度失败: {str(e)}")
+
     async def detect_hydrological_anomalies(self, request: AnomalyDetectionRequest) -> Dict[str, Any]:
         """
         水文异常检测
@@ -170,7 +274,8 @@ class HydropowerMCPServer:
                 prediction_hours=request.prediction_hours,
                 method=request.method,
                 seasonal_period=request.seasonal_period,
-                confidence_level=request.confidence_level
+                confidence_level=request.confidence_level,
+                station_id=request.station_id
             )
             return result
         except Exception as e:
@@ -187,7 +292,11 @@ class HydropowerMCPServer:
                 "reservoir_simulation": {"status": "active", "version": "1.0.0"},
                 "anomaly_detection": {"status": "active", "version": "1.0.0"},
                 "risk_assessment": {"status": "active", "version": "1.0.0"},
-                "prediction": {"status": "active", "version": "1.0.0"}
+                "prediction": {
+                    "status": "active",
+                    "version": "1.0.0",
+                    "model_registry": self.prediction_server.registry.stats()
+                }
             },
             "capabilities": {
                 "flood_modeling": "基于圣维南方程组的洪水演进模拟",
@@ -344,11 +453,26 @@ def create_mcp_routes():
         """洪水演进模拟"""
         return await hydropower_mcp_server.simulate_flood_evolution(request)
 
+    @router.post("/flood/ensemble")
+    async def simulate_flood_ensemble(request: FloodEnsembleRequest):
+        """洪水演进集合模拟"""
+        return await hydropower_mcp_server.simulate_flood_ensemble(request)
+
     @router.post("/reservoir/simulate")
     async def simulate_reservoir(request: ReservoirSimulationRequest):
         """水库调度模拟"""
         return await hydropower_mcp_server.simulate_reservoir_operation(request)
 
+    @router.post("/reservoir/scenarios")
+    async def simulate_reservoir_scenarios(request: ReservoirScenarioRequest):
+        """多水库多情景调度模拟"""
+        return await hydropower_mcp_server.simulate_reservoir_scenarios(request)
+
+    @router.post("/reservoir/optimize")
+    async def optimize_reservoir(request: ReservoirOptimizationRequest):
+        """动态规划优化调度"""
+        return await hydropower_mcp_server.optimize_reservoir_operation_dp(request)
+
     @router.post("/anomaly/detect")
     async def detect_anomalies(request: AnomalyDetectionRequest):
         """异常检测"""
@@ -4,11 +4,19 @@
 """
 
 import asyncio
+import hashlib
+import os
+import re
+import stat
+import threading
 import numpy as np
-from typing import Dict, List, Optional, Any, Tuple
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Any, Tuple
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from enum import Enum
+from time import perf_counter
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -29,6 +37,276 @@ try:
 except ImportError:
     SCIPY_AVAILABLE = False
 
+try:
+    import joblib
+    JOBLIB_AVAILABLE = True
+except ImportError:
+    JOBLIB_AVAILABLE = False
+
+# joblib.load会执行文件中的反序列化代码, 缓存目录不能放在/tmp这类公共可写位置
+DEFAULT_MODEL_REGISTRY_DIR = os.environ.get(
+    "MUNDI_PREDICTION_MODEL_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "mundi", "prediction-models"),
+)
+
+RegistryKey = Tuple[str, str, str]
+
+
+def ensure_private_dir(path: str) -> bool:
+    """
+    创建仅当前用户可访问 (0700) 的目录, 并校验已有目录
+
+    目录为符号链接、属于其他用户或对组/其他用户开放时返回False
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.geteuid() and not st.st_mode & 0o077
+
+
+def data_fingerprint(data: np.ndarray) -> str:
+    """历史数据指纹 (长度与内容的哈希)"""
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    h = hashlib.sha256(str(len(data)).encode("utf-8"))
+    h.update(data.tobytes())
+    return h.hexdigest()[:16]
+
+
+def feature_config_hash(config: Dict[str, Any]) -> str:
+    """特征与模型配置的哈希, 配置变化时注册表键随之变化"""
+    return hashlib.sha256(repr(sorted(config.items())).encode("utf-8")).hexdigest()[:16]
+
+
+def new_observation_count(previous: np.ndarray, data: np.ndarray, max_new: int) -> Optional[int]:
+    """
+    判断data是否为previous追加新观测后的序列
+
+    同时支持不断增长的序列与固定长度的滚动窗口: 若previous去掉前shift个点后
+    恰为data的开头, 且data在其后新增了1~max_new个点, 返回新增点数, 否则返回None
+    """
+    for shift in range(0, min(max_new, len(previous) - 1) + 1):
+        overlap = len(previous) - shift
+        added = len(data) - overlap
+        if added < 1 or added > max_new:
+            continue
+        if np.array_equal(previous[shift:], data[:overlap]):
+            return added
+    return None
+
+
+@dataclass
+class RegistryEntry:
+    """注册表条目"""
+    fingerprint: str
+    observations: np.ndarray
+    artifact: Any
+    fit_seconds: float
+    fitted_at: datetime
+
+
+class ModelRegistry:
+    """
+    已训练预测模型注册表
+
+    以 (站点, 变量, 特征配置哈希) 为键保存训练结果, 内存中保留LRU, 有站点编号的
+    条目同时用joblib持久化到本地目录, 供重启后或其他工作进程复用。数据指纹不变时
+    直接命中; 只是追加了少量新观测时先返回旧模型, 同时在后台线程中重新训练;
+    其余情况同步训练。
+    """
+
+    def __init__(self, cache_dir: Optional[str], max_memory_entries: int = 64,
+                 max_new_observations: int = 24, max_workers: int = 1):
+        self.cache_dir = cache_dir
+        self.max_memory_entries = max_memory_entries
+        self.max_new_observations = max_new_observations
+        self.memory: OrderedDict[RegistryKey, RegistryEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="model-refit")
+        self._refits: Dict[RegistryKey, Future] = {}
+        self._unsafe_dir_reported = False
+        self.last_fit_seconds: Optional[float] = None
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "stale_hits": 0,
+            "misses": 0,
+            "fits": 0,
+            "background_fits": 0,
+            "fit_failures": 0,
+            "fit_seconds_total": 0.0,
+        }
+
+    @staticmethod
+    def key(station_id: str, variable: str, feature_config: Dict[str, Any]) -> RegistryKey:
+        # 站点编号和变量名用作目录名, 去掉路径分隔符等字符
+        return (
+            re.sub(r"[^A-Za-z0-9_.-]", "_", station_id) or "_",
+            re.sub(r"[^A-Za-z0-9_.-]", "_", variable) or "_",
+            feature_config_hash(feature_config),
+        )
+
+    def _path(self, key: RegistryKey) -> str:
+        return os.path.join(self.cache_dir, *key[:-1], f"{key[-1]}.joblib")
+
+    def _remember(self, key: RegistryKey, entry: RegistryEntry):
+        with self._lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_memory_entries:
+                self.memory.popitem(last=False)
+
+    def _disk_available(self) -> bool:
+        """磁盘缓存可用, 且缓存目录只有当前用户可写 (否则他人可放入恶意文件)"""
+        if not self.cache_dir or not JOBLIB_AVAILABLE:
+            return False
+        try:
+            if ensure_private_dir(self.cache_dir):
+                return True
+        except OSError as e:
+            print(f"模型注册表目录不可用 {self.cache_dir}: {e}")
+            return False
+        if not self._unsafe_dir_reported:
+            self._unsafe_dir_reported = True
+            print(f"模型注册表目录 {self.cache_dir} 不属于当前用户或权限过宽, 不读写磁盘缓存")
+        return False
+
+    def _read_disk(self, key: RegistryKey) -> Optional[RegistryEntry]:
+        if not self._disk_available():
+            return None
+        try:
+            return joblib.load(self._path(key))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            # 版本不兼容或文件损坏时视为未命中, 重新训练后覆盖
+            print(f"模型注册表读取失败 {key}: {e}")
+            return None
+
+    def _write_disk(self, key: RegistryKey, entry: RegistryEntry):
+        if not self._disk_available():
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        joblib.dump(entry, tmp_path)
+        # 其他进程要么读到旧文件, 要么读到完整的新文件
+        os.replace(tmp_path, path)
+
+    def _lookup(self, key: RegistryKey, persist: bool) -> Tuple[Optional[RegistryEntry], Optional[str]]:
+        with self._lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                return entry, "memory"
+        if persist:
+            entry = self._read_disk(key)
+            if entry is not None:
+                self._remember(key, entry)
+                return entry, "disk"
+        return None, None
+
+    def _fit(self, key: RegistryKey, data: np.ndarray, fit_fn: Callable[[np.ndarray], Any],
+             persist: bool) -> RegistryEntry:
+        start = perf_counter()
+        try:
+            artifact = fit_fn(data)
+        except Exception:
+            self.counters["fit_failures"] += 1
+            raise
+        fit_seconds = perf_counter() - start
+
+        entry = RegistryEntry(
+            fingerprint=data_fingerprint(data),
+            observations=np.array(data, dtype=np.float64),
+            artifact=artifact,
+            fit_seconds=fit_seconds,
+            fitted_at=datetime.now(),
+        )
+        self.counters["fits"] += 1
+        self.counters["fit_seconds_total"] += fit_seconds
+        self.last_fit_seconds = fit_seconds
+        self._remember(key, entry)
+        if persist:
+            self._write_disk(key, entry)
+        return entry
+
+    def _refit_in_background(self, key: RegistryKey, data: np.ndarray,
+                             fit_fn: Callable[[np.ndarray], Any], persist: bool):
+        with self._lock:
+            running = self._refits.get(key)
+            if running is not None and not running.done():
+                return
+            data = np.array(data, dtype=np.float64)
+
+            def _run():
+                try:
+                    self._fit(key, data, fit_fn, persist)
+                    self.counters["background_fits"] += 1
+                except Exception as e:
+                    print(f"模型后台重训失败 {key}: {e}")
+                finally:
+                    with self._lock:
+                        if self._refits.get(key) is future:
+                            del self._refits[key]
+
+            future = self._executor.submit(_run)
+            self._refits[key] = future
+
+    def get_or_fit(self, key: RegistryKey, data: np.ndarray,
+                   fit_fn: Callable[[np.ndarray], Any], persist: bool = True) -> Any:
+        """
+        返回key对应的训练结果, 必要时调用fit_fn(data)训练
+
+        Args:
+            key: 注册表键, 见ModelRegistry.key
+            data: 训练用历史数据
+            fit_fn: 训练函数, 返回需要缓存的模型对象 (须可被joblib序列化)
+            persist: 是否持久化到磁盘
+
+        Returns:
+            训练结果 (可能是基于稍旧数据训练的模型, 新模型正在后台训练)
+        """
+        data = np.asarray(data, dtype=np.float64)
+        entry, tier = self._lookup(key, persist)
+
+        if entry is not None and entry.fingerprint == data_fingerprint(data):
+            self.counters["memory_hits" if tier == "memory" else "disk_hits"] += 1
+            return entry.artifact
+
+        if entry is not None and new_observation_count(
+            entry.observations, data, self.max_new_observations
+        ) is not None:
+            self.counters["stale_hits"] += 1
+            self._refit_in_background(key, data, fit_fn, persist)
+            return entry.artifact
+
+        self.counters["misses"] += 1
+        return self._fit(key, data, fit_fn, persist).artifact
+
+    def wait_for_refits(self, timeout: Optional[float] = None):
+        """等待所有后台重训完成"""
+        with self._lock:
+            futures = list(self._refits.values())
+        wait(futures, timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["stale_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_ratio": (hits / lookups) if lookups else None,
+            "last_fit_seconds": self.last_fit_seconds,
+            "memory_entries": len(self.memory),
+            "refits_pending": len(self._refits),
+            "cache_dir": self.cache_dir if JOBLIB_AVAILABLE else None,
+        }
+
+
+model_registry_singleton = ModelRegistry(cache_dir=DEFAULT_MODEL_REGISTRY_DIR)
+
+
+def model_registry() -> ModelRegistry:
+    return model_registry_singleton
+
 class PredictionMethod(Enum):
     """预测方法"""
     TIME_SERIES = "time_series"  # 时间序列方法
@@ -207,16 +485,26 @@ class TimeSeriesPredictor:
 class MachineLearningPredictor:
     """机器学习预测器"""
 
-    def __init__(self):
+    # 影响训练结果的特征与模型配置, 修改后注册表中的旧模型自动失效
+    FEATURE_CONFIG = {
+        "kind": "ml",
+        "lag_orders": (1, 2, 3, 6, 12, 24),
+        "rolling_windows": (3, 6, 12, 24),
+        "n_estimators": 100,
+        "test_size": 0.2,
+    }
+
+    def __init__(self, registry: Optional[ModelRegistry] = None):
         self.models = {}
         self.scalers = {}
         self.feature_importance = {}
+        self.registry = registry if registry is not None else model_registry()
 
     def prepare_features(self, data: np.ndarray, include_lag_features: bool = True,
                         lag_orders: List[int] = None) -> np.ndarray:
         """准备特征矩阵"""
         if lag_orders is None:
-            lag_orders = [1, 2, 3, 6, 12, 24]
+            lag_orders = list(self.FEATURE_CONFIG["lag_orders"])
 
         features = []
 
@@ -247,7 +535,7 @@ class MachineLearningPredictor:
 
         # 统计特征
         rolling_stats = []
-        for window in [3, 6, 12, 24]:
+        for window in self.FEATURE_CONFIG["rolling_windows"]:
             if window <= len(data):
                 rolling_mean = np.convolve(data, np.ones(window)/window, mode='same')
                 rolling_std = np.array([np.std(data[max(0, i-window+1):i+1]) for i in range(len(data))])
@@ -307,25 +595,43 @@ class MachineLearningPredictor:
 
         return training_results
 
-    def predict_with_ml(self, historical_data: np.ndarray, forecast_steps: int,
-                       confidence_level: float = 0.95) -> PredictionResult:
-        """使用机器学习方法预测"""
-        if len(historical_data) < 48:
-            raise ValueError("机器学习预测需要至少48个历史数据点")
-
-        # 准备特征
+    def fit_best_model(self, historical_data: np.ndarray) -> Dict[str, Any]:
+        """训练所有候选模型, 返回验证集R2最高的模型及其标准化器"""
         features = self.prepare_features(historical_data)
-
-        # 训练模型
-        training_results = self.train_models(features, historical_data)
+        training_results = self.train_models(features, historical_data,
+                                             test_size=self.FEATURE_CONFIG["test_size"])
 
         if "error" in training_results:
             raise ValueError(training_results["error"])
 
-        # 选择最佳模型
         best_model_name = max(training_results.keys(),
                             key=lambda x: training_results[x]["performance"]["r2"])
-        best_model_info = training_results[best_model_name]
+        return {"model_name": best_model_name, **training_results[best_model_name]}
+
+    def predict_with_ml(self, historical_data: np.ndarray, forecast_steps: int,
+                       confidence_level: float = 0.95, station_id: Optional[str] = None,
+                       variable: str = "value") -> PredictionResult:
+        """
+        使用机器学习方法预测
+
+        给定station_id时训练结果按 (站点, 变量) 在模型注册表中持久化复用;
+        未给定时仅在内存中按数据指纹复用。
+        """
+        if len(historical_data) < 48:
+            raise ValueError("机器学习预测需要至少48个历史数据点")
+
+        # 准备特征
+        features = self.prepare_features(historical_data)
+
+        # 从注册表取模型, 未命中时训练
+        if station_id is not None:
+            key = self.registry.key(station_id, variable, self.FEATURE_CONFIG)
+        else:
+            key = self.registry.key("_anonymous", data_fingerprint(historical_data), self.FEATURE_CONFIG)
+        best_model_info = self.registry.get_or_fit(
+            key, historical_data, self.fit_best_model, persist=station_id is not None
+        )
+        best_model_name = best_model_info["model_name"]
 
         # 准备预测特征
         last_features = features[-1:].copy()
@@ -366,13 +672,26 @@ class MachineLearningPredictor:
 class EnsemblePredictor:
     """集成预测器"""
 
-    def __init__(self):
+    WEIGHTS_CONFIG = {"kind": "ensemble_weights", "max_cv_size": 24, "season": 24}
+
+    def __init__(self, registry: Optional[ModelRegistry] = None):
         self.time_series_predictor = TimeSeriesPredictor()
-        self.ml_predictor = MachineLearningPredictor()
+        self.ml_predictor = MachineLearningPredictor(registry)
         self.weights = {"time_series": 0.4, "machine_learning": 0.6}  # 默认权重
 
-    def calculate_ensemble_weights(self, historical_data: np.ndarray) -> Dict[str, float]:
-        """计算集成权重"""
+    def calculate_ensemble_weights(self, historical_data: np.ndarray,
+                                   station_id: Optional[str] = None,
+                                   variable: str = "value") -> Dict[str, float]:
+        """计算集成权重 (交叉验证结果同样经模型注册表复用)"""
+        registry = self.ml_predictor.registry
+        if station_id is not None:
+            key = registry.key(station_id, variable, self.WEIGHTS_CONFIG)
+        else:
+            key = registry.key("_anonymous", data_fingerprint(historical_data), self.WEIGHTS_CONFIG)
+        return registry.get_or_fit(key, historical_data, self._fit_ensemble_weights,
+                                   persist=station_id is not None)
+
+    def _fit_ensemble_weights(self, historical_data: np.ndarray) -> Dict[str, float]:
         try:
             # 简单的交叉验证方法
             cv_size = min(24, len(historical_data) // 4)
@@ -469,10 +788,11 @@ class EnsemblePredictor:
             return {"mae": np.inf, "rmse": np.inf, "r2": 0.0}
 
     def predict_with_ensemble(self, historical_data: np.ndarray, forecast_steps: int,
-                            confidence_level: float = 0.95) -> PredictionResult:
+                            confidence_level: float = 0.95, station_id: Optional[str] = None,
+                            variable: str = "value") -> PredictionResult:
         """使用集成方法预测"""
         # 计算动态权重
-        weights = self.calculate_ensemble_weights(historical_data)
+        weights = self.calculate_ensemble_weights(historical_data, station_id, variable)
 
         # 时间序列预测
         try:
@@ -493,7 +813,8 @@ class EnsemblePredictor:
 
         # 机器学习预测
         try:
-            ml_result = self.ml_predictor.predict_with_ml(historical_data, forecast_steps, confidence_level)
+            ml_result = self.ml_predictor.predict_with_ml(historical_data, forecast_steps, confidence_level,
+                                                          station_id, variable)
             ml_predictions = ml_result.predicted_values
             ml_lower, ml_upper = ml_result.confidence_intervals
         except Exception as e:
@@ -544,10 +865,11 @@ class EnsemblePredictor:
 class PredictionMCPServer:
     """预测模型MCP服务器"""
 
-    def __init__(self):
+    def __init__(self, registry: Optional[ModelRegistry] = None):
+        self.registry = registry if registry is not None else model_registry()
         self.time_series_predictor = TimeSeriesPredictor()
-        self.ml_predictor = MachineLearningPredictor()
-        self.ensemble_predictor = EnsemblePredictor()
+        self.ml_predictor = MachineLearningPredictor(self.registry)
+        self.ensemble_predictor = EnsemblePredictor(self.registry)
 
     async def predict_hydrological_variables(
         self,
@@ -557,7 +879,8 @@ class PredictionMCPServer:
         prediction_hours: int = 24,
         method: str = "ensemble",
         seasonal_period: int = 24,
-        confidence_level: float = 0.95
+        confidence_level: float = 0.95,
+        station_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         水文变量预测 - MCP工具接口
@@ -570,6 +893,7 @@ class PredictionMCPServer:
             method: 预测方法 (time_series/machine_learning/ensemble)
             seasonal_period: 季节周期 (小时)
             confidence_level: 置信水平
+            station_id: 站点编号 (可选, 给定时训练好的模型按站点持久化复用)
 
         Returns:
             水文变量预测结果
@@ -615,12 +939,14 @@ class PredictionMCPServer:
             # 执行预测
             water_level_result = self._predict_variable(
                 water_level_array, prediction_hours, prediction_method,
-                seasonal_period, confidence_level, "水位"
+                seasonal_period, confidence_level, "水位",
+                station_id, "water_level"
             )
 
             discharge_result = self._predict_variable(
                 discharge_array, prediction_hours, prediction_method,
-                seasonal_period, confidence_level, "流量"
+                seasonal_period, confidence_level, "流量",
+                station_id, "discharge"
             )
 
             # 温度预测 (如果提供数据)
@@ -629,7 +955,8 @@ class PredictionMCPServer:
                 temperature_array = np.array(historical_temperatures)
                 temperature_result = self._predict_variable(
                     temperature_array, prediction_hours, prediction_method,
-                    seasonal_period, confidence_level, "水温"
+                    seasonal_period, confidence_level, "水温",
+                    station_id, "temperature"
                 )
 
             # 计算预测准确性评估
@@ -649,7 +976,9 @@ class PredictionMCPServer:
                     "prediction_hours": prediction_hours,
                     "seasonal_period": seasonal_period,
                     "confidence_level": confidence_level,
-                    "historical_data_points": len(historical_water_levels)
+                    "historical_data_points": len(historical_water_levels),
+                    "station_id": station_id,
+                    "model_registry": self.registry.stats()
                 },
                 "water_level_prediction": {
                     "predicted_values": water_level_result.predicted_values.tolist(),
@@ -690,7 +1019,8 @@ class PredictionMCPServer:
 
     def _predict_variable(self, historical_data: np.ndarray, forecast_steps: int,
                          method: PredictionMethod, seasonal_period: int, confidence_level: float,
-                         variable_name: str) -> PredictionResult:
+                         variable_name: str, station_id: Optional[str] = None,
+                         variable: str = "value") -> PredictionResult:
         """预测单个变量"""
         if method == PredictionMethod.TIME_SERIES:
             return self.time_series_predictor.predict_with_seasonality(
@@ -698,10 +1028,12 @@ class PredictionMCPServer:
             )
 
         elif method == PredictionMethod.MACHINE_LEARNING:
-            return self.ml_predictor.predict_with_ml(historical_data, forecast_steps, confidence_level)
+            return self.ml_predictor.predict_with_ml(historical_data, forecast_steps, confidence_level,
+                                                     station_id, variable)
 
         elif method == PredictionMethod.ENSEMBLE:
-            return self.ensemble_predictor.predict_with_ensemble(historical_data, forecast_steps, confidence_level)
+            return self.ensemble_predictor.predict_with_ensemble(historical_data, forecast_steps, confidence_level,
+                                                                 station_id, variable)
 
         else:
             # 默认使用时间序列方法
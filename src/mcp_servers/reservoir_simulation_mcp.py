@@ -4,11 +4,16 @@
 """
 
 import asyncio
+import bisect
+import csv
+import json
+import os
 import numpy as np
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, List, Optional, Any, Tuple, Union
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from enum import Enum
+from time import perf_counter
 
 class ReservoirOperationMode(Enum):
     """水库运行模式"""
@@ -56,21 +61,151 @@ class ReservoirConstraints:
     max_water_level_change: float  # 最大水位日变幅 (m)
     min_power_generation_flow: float  # 最小发电流量 (m³/s)
 
+class CharacteristicCurve:
+    """水库特征曲线 (水位-库容、水位-泄流能力、水位-效率等)
+
+    构造时一次性整理为按x升序排列的NumPy数组, 数组查询用np.interp (内部为二分
+    查找) 线性插值, 超出范围时取端点值。逐时段调度中的标量查询用bisect在预存的
+    列表上二分, 避免每次调用NumPy的固定开销。标量输入返回float。
+    """
+
+    def __init__(self, x, y, name: str = ""):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if x.ndim != 1 or x.shape != y.shape or x.size < 2:
+            raise ValueError(f"特征曲线 {name} 至少需要两个点, 且x与y长度一致")
+        if not (np.all(np.isfinite(x)) and np.all(np.isfinite(y))):
+            raise ValueError(f"特征曲线 {name} 含有非有限数值")
+
+        order = np.argsort(x, kind="stable")
+        x, y = x[order], y[order]
+        if np.any(np.diff(x) <= 0):
+            raise ValueError(f"特征曲线 {name} 的x存在重复值")
+
+        self.name = name
+        self.x = x
+        self.y = y
+        # 反查 (如库容转水位) 要求y单调不减
+        self.invertible = bool(np.all(np.diff(y) >= 0))
+        self._x_list = x.tolist()
+        self._y_list = y.tolist()
+
+    @classmethod
+    def from_dict(cls, points: Dict[float, float], name: str = "") -> "CharacteristicCurve":
+        return cls(list(points.keys()), list(points.values()), name)
+
+    @staticmethod
+    def _interp_scalar(value: float, xs: List[float], ys: List[float]) -> float:
+        if value <= xs[0]:
+            return ys[0]
+        if value >= xs[-1]:
+            return ys[-1]
+        i = bisect.bisect_right(xs, value)
+        x0, x1 = xs[i - 1], xs[i]
+        if x1 == x0:
+            return ys[i]
+        return ys[i - 1] + (ys[i] - ys[i - 1]) * (value - x0) / (x1 - x0)
+
+    def __call__(self, value: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        if isinstance(value, (int, float)):
+            return self._interp_scalar(value, self._x_list, self._y_list)
+        result = np.interp(value, self.x, self.y)
+        return float(result) if np.ndim(result) == 0 else result
+
+    def inverse(self, value: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        if not self.invertible:
+            raise ValueError(f"特征曲线 {self.name} 不单调, 不能反查")
+        if isinstance(value, (int, float)):
+            return self._interp_scalar(value, self._y_list, self._x_list)
+        result = np.interp(value, self.y, self.x)
+        return float(result) if np.ndim(result) == 0 else result
+
+    def to_dict(self) -> Dict[float, float]:
+        return dict(zip(self.x.tolist(), self.y.tolist()))
+
+
+# 实测特征曲线CSV的列名: 第一列水位, 其余各列缺省时使用简化曲线
+SURVEY_LEVEL_COLUMN = "water_level"  # 水位 (m)
+SURVEY_CURVE_COLUMNS = {
+    "capacity": "level_capacity_curve",  # 库容 (m³)
+    "outflow_capacity": "outflow_capacity_curve",  # 泄流能力 (m³/s)
+    "power_efficiency": "power_efficiency_curve",  # 发电效率
+}
+
+
+def load_survey_curves(path: str) -> Dict[str, CharacteristicCurve]:
+    """从实测特征曲线表 (CSV) 读取曲线
+
+    表头须包含water_level列, 以及capacity/outflow_capacity/power_efficiency中的
+    一列或多列。某一列为空的行只对该曲线忽略, 便于合并测点不同的实测表。
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        columns = [c.strip() for c in (reader.fieldnames or [])]
+        if SURVEY_LEVEL_COLUMN not in columns:
+            raise ValueError(f"{path} 缺少 {SURVEY_LEVEL_COLUMN} 列")
+        present = [c for c in SURVEY_CURVE_COLUMNS if c in columns]
+        if not present:
+            raise ValueError(f"{path} 未包含任何特征曲线列: {', '.join(SURVEY_CURVE_COLUMNS)}")
+
+        points: Dict[str, Tuple[List[float], List[float]]] = {c: ([], []) for c in present}
+        for row in reader:
+            row = {(k or "").strip(): (v or "").strip() for k, v in row.items()}
+            if not row.get(SURVEY_LEVEL_COLUMN):
+                continue
+            level = float(row[SURVEY_LEVEL_COLUMN])
+            for column in present:
+                if row.get(column):
+                    points[column][0].append(level)
+                    points[column][1].append(float(row[column]))
+
+    return {
+        SURVEY_CURVE_COLUMNS[column]: CharacteristicCurve(levels, values, name=f"{os.path.basename(path)}:{column}")
+        for column, (levels, values) in points.items()
+    }
+
+
+def curves_from_points(points: Dict[str, Dict[str, List[float]]]) -> Dict[str, CharacteristicCurve]:
+    """由请求中直接给出的曲线数据创建曲线
+
+    键为capacity/outflow_capacity/power_efficiency, 值为 {"levels": [...], "values": [...]}。
+    """
+    unknown = set(points) - set(SURVEY_CURVE_COLUMNS)
+    if unknown:
+        raise ValueError(f"未知的特征曲线: {', '.join(sorted(unknown))}")
+    return {
+        SURVEY_CURVE_COLUMNS[column]: CharacteristicCurve(curve["levels"], curve["values"], name=column)
+        for column, curve in points.items()
+    }
+
+
 class ReservoirSimulationModel:
     """水库模拟模型"""
 
-    def __init__(self, characteristics: ReservoirCharacteristics):
+    def __init__(self, characteristics: ReservoirCharacteristics,
+                 curves: Optional[Dict[str, CharacteristicCurve]] = None):
         self.characteristics = characteristics
         self.constraints = self._initialize_constraints()
+        curves = curves or {}
 
-        # 水位-库容关系曲线 (简化)
-        self.level_capacity_curve = self._generate_level_capacity_curve()
+        # 水位-库容关系曲线, 无实测数据时使用简化曲线
+        self.level_capacity_curve = curves.get("level_capacity_curve") or CharacteristicCurve.from_dict(
+            self._generate_level_capacity_curve(), "level_capacity")
+        if not self.level_capacity_curve.invertible:
+            raise ValueError("水位-库容曲线必须随水位单调不减")
 
         # 泄流能力曲线
-        self.outflow_capacity_curve = self._generate_outflow_capacity_curve()
+        self.outflow_capacity_curve = curves.get("outflow_capacity_curve") or CharacteristicCurve.from_dict(
+            self._generate_outflow_capacity_curve(), "outflow_capacity")
 
         # 发电效率曲线
-        self.power_efficiency_curve = self._generate_power_efficiency_curve()
+        self.power_efficiency_curve = curves.get("power_efficiency_curve") or CharacteristicCurve.from_dict(
+            self._generate_power_efficiency_curve(), "power_efficiency")
+
+    @classmethod
+    def from_survey_csv(cls, characteristics: ReservoirCharacteristics, path: str) -> "ReservoirSimulationModel":
+        """使用实测特征曲线表创建模型"""
+        return cls(characteristics, load_survey_curves(path))
 
     def _initialize_constraints(self) -> ReservoirConstraints:
         """初始化运行约束"""
@@ -131,42 +266,13 @@ class ReservoirSimulationModel:
 
         return dict(zip(levels, efficiencies))
 
-    def level_to_capacity(self, water_level: float) -> float:
-        """水位转库容"""
-        levels = sorted(self.level_capacity_curve.keys())
-
-        if water_level <= levels[0]:
-            return self.level_capacity_curve[levels[0]]
-        if water_level >= levels[-1]:
-            return self.level_capacity_curve[levels[-1]]
-
-        # 线性插值
-        for i in range(len(levels) - 1):
-            if levels[i] <= water_level <= levels[i + 1]:
-                level1, level2 = levels[i], levels[i + 1]
-                cap1, cap2 = self.level_capacity_curve[level1], self.level_capacity_curve[level2]
-                return cap1 + (cap2 - cap1) * (water_level - level1) / (level2 - level1)
-
-        return self.level_capacity_curve[levels[0]]
-
-    def capacity_to_level(self, capacity: float) -> float:
-        """库容转水位"""
-        levels = sorted(self.level_capacity_curve.keys())
-        capacities = [self.level_capacity_curve[level] for level in levels]
+    def level_to_capacity(self, water_level: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """水位转库容, 支持数组输入"""
+        return self.level_capacity_curve(water_level)
 
-        if capacity <= capacities[0]:
-            return levels[0]
-        if capacity >= capacities[-1]:
-            return levels[-1]
-
-        # 线性插值
-        for i in range(len(capacities) - 1):
-            if capacities[i] <= capacity <= capacities[i + 1]:
-                cap1, cap2 = capacities[i], capacities[i + 1]
-                level1, level2 = levels[i], levels[i + 1]
-                return level1 + (level2 - level1) * (capacity - cap1) / (cap2 - cap1)
-
-        return levels[0]
+    def capacity_to_level(self, capacity: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+        """库容转水位, 支持数组输入"""
+        return self.level_capacity_curve.inverse(capacity)
 
     def calculate_water_balance(self, current_level: float, inflow: float, outflow: float, dt: float) -> float:
         """计算水量平衡"""
@@ -260,22 +366,9 @@ class ReservoirSimulationModel:
 
         return operation_schedule
 
-    def _get_power_efficiency(self, water_level: float) -> float:
+    def _get_power_efficiency(self, water_level: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
         """获取发电效率"""
-        levels = sorted(self.power_efficiency_curve.keys())
-
-        if water_level <= levels[0]:
-            return self.power_efficiency_curve[levels[0]]
-        if water_level >= levels[-1]:
-            return self.power_efficiency_curve[levels[-1]]
-
-        for i in range(len(levels) - 1):
-            if levels[i] <= water_level <= levels[i + 1]:
-                level1, level2 = levels[i], levels[i + 1]
-                eff1, eff2 = self.power_efficiency_curve[level1], self.power_efficiency_curve[level2]
-                return eff1 + (eff2 - eff1) * (water_level - level1) / (level2 - level1)
-
-        return 0.8
+        return self.power_efficiency_curve(water_level)
 
     def assess_reservoir_state(self, current_level: float, inflow_rate: float) -> Dict[str, Any]:
         """评估水库状态"""
@@ -315,22 +408,9 @@ class ReservoirSimulationModel:
             "power_generation_potential": self._calculate_power_potential(current_level)
         }
 
-    def _get_outflow_capacity(self, water_level: float) -> float:
+    def _get_outflow_capacity(self, water_level: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
         """获取泄流能力"""
-        levels = sorted(self.outflow_capacity_curve.keys())
-
-        if water_level <= levels[0]:
-            return self.outflow_capacity_curve[levels[0]]
-        if water_level >= levels[-1]:
-            return self.outflow_capacity_curve[levels[-1]]
-
-        for i in range(len(levels) - 1):
-            if levels[i] <= water_level <= levels[i + 1]:
-                level1, level2 = levels[i], levels[i + 1]
-                out1, out2 = self.outflow_capacity_curve[level1], self.outflow_capacity_curve[level2]
-                return out1 + (out2 - out1) * (water_level - level1) / (level2 - level1)
-
-        return 0.0
+        return self.outflow_capacity_curve(water_level)
 
     def _calculate_power_potential(self, water_level: float) -> float:
         """计算发电潜力"""
@@ -345,14 +425,581 @@ class ReservoirSimulationModel:
         power_potential = 9.81 * max_flow * head * efficiency / 1000  # MW
         return power_potential
 
+class StackedCurves:
+    """多座水库的同类特征曲线, 对形状为 [..., 水库] 的数组逐水库插值
+
+    各曲线平移到互不重叠的区间后拼接成一条单调曲线, 输入先截断到各自曲线
+    范围再平移, 这样一次np.interp即可完成所有水库的查询, 结果与逐条曲线
+    查询一致 (超出范围取端点值)。
+    """
+
+    def __init__(self, curves: List[CharacteristicCurve], inverse: bool = False):
+        if inverse and not all(c.invertible for c in curves):
+            raise ValueError("存在不单调的特征曲线, 不能反查")
+        xs = [c.y if inverse else c.x for c in curves]
+        ys = [c.x if inverse else c.y for c in curves]
+
+        self.x_min = np.array([x[0] for x in xs])
+        self.x_max = np.array([x[-1] for x in xs])
+        # 相邻曲线之间留出1个单位的间隔
+        span = float(np.max(self.x_max - self.x_min)) + 1.0
+        self.offsets = np.arange(len(curves)) * span - self.x_min
+        self.flat_x = np.concatenate([x + offset for x, offset in zip(xs, self.offsets)])
+        self.flat_y = np.concatenate(ys)
+
+    def __call__(self, values: np.ndarray, index=slice(None)) -> np.ndarray:
+        """values的最后一维对应index选出的水库"""
+        shifted = np.clip(values, self.x_min[index], self.x_max[index]) + self.offsets[index]
+        return np.interp(shifted, self.flat_x, self.flat_y)
+
+
+@dataclass
+class CascadeRun:
+    """多水库多情景调度结果, 各数组形状为 [情景, 水库, 小时]"""
+    reservoir_names: List[str]
+    water_levels: np.ndarray  # 时段末水位 (m)
+    inflows: np.ndarray  # 入库流量, 含上游水库下泄 (m³/s)
+    outflows: np.ndarray  # 下泄流量 (m³/s)
+    power_generation: np.ndarray  # 发电功率 (MW), 时段为1小时时即为MWh
+    efficiencies: np.ndarray  # 发电效率
+    target_levels: np.ndarray  # 目标水位 (m), 形状 [情景, 水库]
+
+    def summary(self) -> Dict[str, np.ndarray]:
+        """按 [情景, 水库] 汇总的统计量"""
+        return {
+            "final_water_level": self.water_levels[..., -1],
+            "max_water_level": self.water_levels.max(axis=-1),
+            "min_water_level": self.water_levels.min(axis=-1),
+            "avg_outflow": self.outflows.mean(axis=-1),
+            "max_outflow": self.outflows.max(axis=-1),
+            "total_power_generation_mwh": self.power_generation.sum(axis=-1),
+        }
+
+
+OPERATION_MODE_CODES = {mode: code for code, mode in enumerate(ReservoirOperationMode)}
+
+
+class CascadeSimulationEngine:
+    """多水库、多情景的向量化调度模拟
+
+    每个小时对全部情景和水库同时推进, 调度规则与约束截断同
+    ReservoirSimulationModel.optimize_reservoir_operation。水库按上游到下游
+    的顺序给出, downstream[i]为第i座水库下泄汇入的水库序号 (None为出口),
+    lag_hours[i]为两库之间的传播时间 (小时)。无传播时间的梯级在同一小时内
+    按上下游层次依次计算, 其余水库同层一起计算。
+    """
+
+    def __init__(self, reservoirs: List[ReservoirSimulationModel],
+                 downstream: Optional[List[Optional[int]]] = None,
+                 lag_hours: Optional[List[int]] = None,
+                 dt: float = 3600.0):
+        n = len(reservoirs)
+        if n == 0:
+            raise ValueError("至少需要一座水库")
+        downstream = list(downstream) if downstream is not None else [None] * n
+        lag_hours = list(lag_hours) if lag_hours is not None else [0] * n
+        if len(downstream) != n or len(lag_hours) != n:
+            raise ValueError("downstream和lag_hours的长度必须与水库数一致")
+        for i, d in enumerate(downstream):
+            if d is not None and not (i < d < n):
+                raise ValueError(f"第{i}座水库的下游序号 {d} 无效, 水库须按上游到下游排列")
+        if any(lag < 0 for lag in lag_hours):
+            raise ValueError("传播时间不能为负")
+
+        self.reservoirs = reservoirs
+        self.downstream = downstream
+        self.lag_hours = [int(lag) for lag in lag_hours]
+        self.dt = dt
+
+        self.level_to_capacity = StackedCurves([r.level_capacity_curve for r in reservoirs])
+        self.capacity_to_level = StackedCurves([r.level_capacity_curve for r in reservoirs], inverse=True)
+        self.power_efficiency = StackedCurves([r.power_efficiency_curve for r in reservoirs])
+
+        def param(get):
+            return np.array([get(r) for r in reservoirs], dtype=float)
+
+        self.dead_water_level = param(lambda r: r.characteristics.dead_water_level)
+        self.normal_water_level = param(lambda r: r.characteristics.normal_water_level)
+        self.flood_limit_water_level = param(lambda r: r.characteristics.flood_limit_water_level)
+        self.min_outflow = param(lambda r: r.constraints.min_outflow)
+        self.max_outflow = param(lambda r: r.constraints.max_outflow)
+        self.min_water_level = param(lambda r: r.constraints.min_water_level)
+        self.max_water_level = param(lambda r: r.constraints.max_water_level)
+        self.min_power_generation_flow = param(lambda r: r.constraints.min_power_generation_flow)
+        self.max_water_level_capacity = self.level_to_capacity(self.max_water_level)
+
+        # 无传播时间的梯级按上下游层次分组, 同组水库互不依赖
+        depth = [0] * n
+        for i, d in enumerate(downstream):
+            if d is not None and self.lag_hours[i] == 0:
+                depth[d] = max(depth[d], depth[i] + 1)
+        self.groups = [np.flatnonzero(np.array(depth) == k) for k in range(max(depth) + 1)]
+
+    def run(self, local_inflows: np.ndarray, initial_levels: np.ndarray,
+            modes: Union[str, np.ndarray] = "normal",
+            target_levels: Optional[np.ndarray] = None) -> CascadeRun:
+        """推进全部情景
+
+        Args:
+            local_inflows: 各水库区间入流 (m³/s), 形状 [情景, 水库, 小时]
+            initial_levels: 初始水位, 可广播到 [情景, 水库]
+            modes: 运行模式名称, 可广播到 [情景, 水库]
+            target_levels: 目标水位, 可广播到 [情景, 水库], NaN或缺省为正常蓄水位
+        """
+        local_inflows = np.asarray(local_inflows, dtype=float)
+        if local_inflows.ndim != 3 or local_inflows.shape[1] != len(self.reservoirs):
+            raise ValueError(f"入流数组形状须为 [情景, {len(self.reservoirs)}, 小时], 实际为 {local_inflows.shape}")
+        n_scenarios, n_reservoirs, n_hours = local_inflows.shape
+        batch = (n_scenarios, n_reservoirs)
+
+        level = np.broadcast_to(np.asarray(initial_levels, dtype=float), batch).copy()
+        mode_codes = np.vectorize(
+            lambda m: OPERATION_MODE_CODES[ReservoirOperationMode(m)], otypes=[int]
+        )(np.broadcast_to(np.asarray(modes), batch))
+        if target_levels is None:
+            target = np.broadcast_to(self.normal_water_level, batch).copy()
+        else:
+            target = np.broadcast_to(np.asarray(target_levels, dtype=float), batch).copy()
+            target = np.where(np.isnan(target), self.normal_water_level, target)
+
+        # 各模式的目标水位与调度规则在整个时段内不变
+        flood_control = mode_codes == OPERATION_MODE_CODES[ReservoirOperationMode.FLOOD_CONTROL]
+        power = mode_codes == OPERATION_MODE_CODES[ReservoirOperationMode.POWER_GENERATION]
+        water_supply = mode_codes == OPERATION_MODE_CODES[ReservoirOperationMode.WATER_SUPPLY]
+        target = np.where(flood_control, self.flood_limit_water_level, target)
+        target = np.where(power, self.normal_water_level * 0.95, target)
+
+        # 上游下泄按传播时间累加到下游水库的入流中; 首次到达之前按上游区间入流稳态下泄估计
+        inflows = local_inflows.copy()
+        for i, d in enumerate(self.downstream):
+            if d is not None and self.lag_hours[i] > 0:
+                inflows[:, d, :self.lag_hours[i]] += local_inflows[:, i, :1]
+
+        water_levels = np.empty((n_scenarios, n_reservoirs, n_hours))
+        outflows = np.empty_like(water_levels)
+        power_generation = np.empty_like(water_levels)
+        efficiencies = np.empty_like(water_levels)
+
+        # 只有一组时用切片索引, 避免每步复制数组
+        groups = [slice(None)] if len(self.groups) == 1 else self.groups
+        group_links = [
+            [(i, self.downstream[i], self.lag_hours[i]) for i in np.arange(n_reservoirs)[g]
+             if self.downstream[i] is not None]
+            for g in groups
+        ]
+        for t in range(n_hours):
+            for g, links in zip(groups, group_links):
+                inflow = inflows[:, g, t]
+                lvl = level[:, g]
+
+                outflow = np.select(
+                    [flood_control[:, g], power[:, g], water_supply[:, g]],
+                    [
+                        np.maximum(inflow * 0.8, self.min_outflow[g]),
+                        np.maximum(inflow, self.min_power_generation_flow[g]),
+                        np.maximum(inflow, self.min_outflow[g]),
+                    ],
+                    default=inflow - (lvl - target[:, g]) * 100,
+                )
+                outflow = np.clip(outflow, self.min_outflow[g], self.max_outflow[g])
+
+                capacity = self.level_to_capacity(lvl, g) + (inflow - outflow) * self.dt
+                new_level = self.capacity_to_level(capacity, g)
+
+                # 超过最高运行水位: 水位截断, 超出的水量加大下泄
+                over = new_level > self.max_water_level[g]
+                excess = np.maximum(capacity - self.max_water_level_capacity[g], 0.0)
+                outflow = np.where(over, outflow + excess / self.dt, outflow)
+                new_level = np.where(over, self.max_water_level[g], new_level)
+
+                # 低于最低运行水位: 水位截断, 减少下泄
+                under = new_level < self.min_water_level[g]
+                new_level = np.where(under, self.min_water_level[g], new_level)
+                outflow = np.where(under, np.maximum(self.min_outflow[g], outflow * 0.8), outflow)
+
+                # 按时段初水位计算发电
+                generating = outflow >= self.min_power_generation_flow[g]
+                efficiency = np.where(generating, self.power_efficiency(lvl, g), 0.0)
+                head = lvl - self.dead_water_level[g]
+                power_generation[:, g, t] = 9.81 * outflow * head * efficiency / 1000
+                efficiencies[:, g, t] = efficiency
+                outflows[:, g, t] = outflow
+                water_levels[:, g, t] = new_level
+                level[:, g] = new_level
+
+                # 下泄汇入下游水库, 无传播时间的在本小时内由下一层使用
+                for i, d, lag in links:
+                    if t + lag < n_hours:
+                        inflows[:, d, t + lag] += outflows[:, i, t]
+
+        return CascadeRun(
+            reservoir_names=[r.characteristics.name for r in self.reservoirs],
+            water_levels=water_levels,
+            inflows=inflows,
+            outflows=outflows,
+            power_generation=power_generation,
+            efficiencies=efficiencies,
+            target_levels=target,
+        )
+
+@dataclass
+class DPScheduleResult:
+    """动态规划调度结果"""
+    objective_value: float  # 目标函数值: 发电量 (MWh) 扣除各项惩罚
+    total_power_generation_mwh: float
+    penalty: float  # 约束违反、防洪和末水位惩罚之和
+    solve_seconds: float
+    releases: np.ndarray  # 逐时段下泄流量 (m³/s), 形状 [小时] 或 [样本, 小时]
+    water_levels: np.ndarray  # 时段初末水位 (m), 形状 [小时+1] 或 [样本, 小时+1]
+    power_generation: np.ndarray  # 逐时段发电功率 (MW)
+    storage_step: float  # 最终库容网格间距 (m³)
+    expected_objective: Optional[float] = None  # 随机动态规划的期望目标值
+
+
+@dataclass
+class _DPGrid:
+    """动态规划的库容网格及与入流无关的预计算数组, 二维数组形状为 [状态, 候选末状态]"""
+    storages: np.ndarray  # 库容 (m³)
+    levels: np.ndarray  # 对应水位 (m)
+    origin: int  # 初始库容所在的状态序号
+    step: float  # 网格间距 (m³)
+    next_states: np.ndarray  # 候选末状态序号
+    storage_change: np.ndarray  # 库容变化折算的下泄流量 (m³/s)
+    static_penalty: np.ndarray  # 水位变幅与防洪罚函数
+    energy_per_flow: np.ndarray  # 单位下泄的时段发电量, 形状 [状态, 1]
+    terminal_value: np.ndarray  # 末水位罚函数
+    bands: List[slice]  # 逐时段候选末状态所在的列
+
+
+class ReservoirDPScheduler:
+    """基于库容离散的动态规划水库优化调度
+
+    状态为时段初库容, 决策为时段末库容, 下泄流量由水量平衡得到。库容网格以
+    初始库容为原点等间距离散, 间距对应release_step (m³/s) 的一小时水量, 范围
+    取运行水位区间内在下泄约束下可达的库容; 状态过多时自动放宽间距。每个时段
+    只需考虑下泄落在 [min_outflow, max_outflow] 内的一段相邻末状态, Bellman
+    递推对 [状态, 候选末状态] 带状数组整体计算。
+
+    约束与发电计算同ReservoirSimulationModel:
+    - 下泄流量限制在ReservoirConstraints的 [min_outflow, max_outflow] 内, 网格边界
+      处无法满足时按罚函数处理
+    - 水位变幅按max_water_level_change (日变幅) 均摊到每小时, 超出部分按罚函数处理
+    - 下泄不小于min_power_generation_flow时发电, 按时段初水位的水头和发电效率曲线计算
+    目标为最大化发电量; 给定flood_penalty时对超过防洪限制水位的部分加罚,
+    末水位低于target_final_level时加罚, 避免为发电放空水库。
+
+    随机版本对每个时段的入流样本取期望 (时段初已知本时段入流的决策方式),
+    入流样本可以直接给出, 也可以由预报加随机扰动生成。
+    """
+
+    # 罚函数系数, 远大于单位水位/流量对应的发电量, 使约束优先满足
+    RELEASE_VIOLATION_PENALTY = 1e3  # MWh / (m³/s)
+    LEVEL_RATE_VIOLATION_PENALTY = 1e6  # MWh / m
+    TERMINAL_PENALTY = 1e6  # MWh / m
+    # objective="flood_control" 时超过防洪限制水位的罚函数系数
+    FLOOD_CONTROL_PENALTY = 1e5  # MWh / m
+    # 细网格在粗网格轨迹上下各留出的粗网格间距数
+    REFINE_MARGIN_STEPS = 4
+
+    def __init__(self, model: ReservoirSimulationModel, release_step: float = 10.0,
+                 max_states: int = 2000, dt: float = 3600.0):
+        if release_step <= 0 or max_states < 2:
+            raise ValueError("release_step须为正数, max_states至少为2")
+        self.model = model
+        self.constraints = model.constraints
+        self.release_step = release_step
+        self.max_states = max_states
+        self.dt = dt
+        self.max_hourly_level_change = self.constraints.max_water_level_change / 24 * dt / 3600
+
+    def _build_grid(self, initial_level: float, inflows: np.ndarray,
+                    window: Optional[Tuple[float, float]] = None):
+        """以初始库容为原点建立库容网格, inflows形状为 [..., 小时], window为库容范围限制"""
+        if not (self.constraints.min_water_level <= initial_level <= self.constraints.max_water_level):
+            raise ValueError(
+                f"初始水位 {initial_level}m 不在运行水位范围 "
+                f"[{self.constraints.min_water_level}, {self.constraints.max_water_level}]m 内"
+            )
+        storage0 = self.model.level_to_capacity(initial_level)
+        storage_min = self.model.level_to_capacity(self.constraints.min_water_level)
+        storage_max = self.model.level_to_capacity(self.constraints.max_water_level)
+
+        # 在下泄约束下逐时段可能达到的最低、最高库容
+        lowest = storage0 + np.min(np.cumsum(np.minimum(inflows - self.constraints.max_outflow, 0), axis=-1)) * self.dt
+        highest = storage0 + np.max(np.cumsum(np.maximum(inflows - self.constraints.min_outflow, 0), axis=-1)) * self.dt
+        lowest, highest = max(lowest, storage_min), min(highest, storage_max)
+        if window is not None:
+            lowest, highest = max(lowest, window[0]), min(highest, window[1])
+
+        step = max(self.release_step * self.dt, (highest - lowest) / (self.max_states - 1))
+        below = int(np.floor((storage0 - lowest) / step))
+        above = int(np.floor((highest - storage0) / step))
+        storages = storage0 + step * np.arange(-below, above + 1)
+        levels = np.asarray(self.model.capacity_to_level(storages))
+        return storages, levels, below, step
+
+    def _band(self, inflows, step: float, n_states: int) -> Tuple[int, int]:
+        """下泄落在 [min_outflow, max_outflow] 内的末状态偏移量范围 [lo, hi]"""
+        inflows = np.atleast_1d(inflows)
+        lo = int(np.floor(np.min(inflows - self.constraints.max_outflow) * self.dt / step))
+        hi = int(np.ceil(np.max(inflows - self.constraints.min_outflow) * self.dt / step))
+        return max(lo, -(n_states - 1)), min(hi, n_states - 1)
+
+    def _prepare(self, initial_level, inflows, target_final_level, flood_penalty, window=None) -> "_DPGrid":
+        """建立网格, 并预先计算与入流无关的 [状态, 候选末状态] 数组"""
+        storages, levels, origin, step = self._build_grid(initial_level, inflows, window)
+        n_states = storages.size
+        bands = [self._band(inflows[..., t], step, n_states) for t in range(inflows.shape[-1])]
+        lo = min(b[0] for b in bands)
+        hi = max(b[1] for b in bands)
+
+        rows = np.arange(n_states)[:, None]
+        nxt = np.clip(rows + np.arange(lo, hi + 1)[None, :], 0, n_states - 1)
+
+        # 与入流无关的罚函数: 水位变幅和防洪限制水位
+        level_change = np.abs(levels[nxt] - levels[rows])
+        static = self.LEVEL_RATE_VIOLATION_PENALTY * np.maximum(level_change - self.max_hourly_level_change, 0.0)
+        if flood_penalty:
+            flood_excess = np.maximum(levels - self.model.characteristics.flood_limit_water_level, 0.0)
+            static = static + flood_penalty * flood_excess[nxt]
+
+        # 单位下泄的时段发电量 (MWh per m³/s), 按时段初水位
+        energy_per_flow = 9.81 * (levels - self.model.characteristics.dead_water_level) * \
+            np.asarray(self.model._get_power_efficiency(levels)) / 1000 * self.dt / 3600
+
+        if target_final_level is None:
+            target_final_level = initial_level
+
+        return _DPGrid(
+            storages=storages,
+            levels=levels,
+            origin=origin,
+            step=step,
+            next_states=nxt,
+            storage_change=(storages[rows] - storages[nxt]) / self.dt,
+            static_penalty=static,
+            energy_per_flow=energy_per_flow[:, None],
+            terminal_value=-self.TERMINAL_PENALTY * np.maximum(target_final_level - levels, 0.0),
+            bands=[slice(b[0] - lo, b[1] - lo + 1) for b in bands],
+        )
+
+    def _stage_reward(self, inflow, storage_change, static, energy_per_flow):
+        """时段收益 (MWh), inflow须能与storage_change广播
+
+        递推的主要耗时在这里, 尽量原地计算以减少大数组的临时分配。
+        """
+        release = inflow + storage_change
+        reward = release * energy_per_flow
+        reward *= release >= self.constraints.min_power_generation_flow
+
+        violation = np.clip(release, self.constraints.min_outflow, self.constraints.max_outflow)
+        violation -= release
+        np.abs(violation, out=violation)
+        violation *= self.RELEASE_VIOLATION_PENALTY
+        reward -= violation
+        reward -= static
+        return reward
+
+    def _refine_window(self, grid: "_DPGrid", states: np.ndarray) -> Optional[Tuple[float, float]]:
+        """粗网格轨迹周围的库容范围; 细化不能明显减小网格间距时返回None"""
+        margin = self.REFINE_MARGIN_STEPS * grid.step
+        low = grid.storages[states].min() - margin
+        high = grid.storages[states].max() + margin
+        if max(self.release_step * self.dt, (high - low) / (self.max_states - 1)) > grid.step / 2:
+            return None
+        return low, high
+
+    def solve(self, inflows: List[float], initial_level: float,
+              target_final_level: Optional[float] = None,
+              flood_penalty: float = 0.0) -> DPScheduleResult:
+        """确定性动态规划, inflows为逐时段入库流量 (m³/s)
+
+        先在可达库容范围上求解, 再在粗网格最优轨迹附近用细网格求解一次。
+        """
+        started = perf_counter()
+        inflows = np.asarray(inflows, dtype=float)
+        grid = self._prepare(initial_level, inflows, target_final_level, flood_penalty)
+        states, objective = self._solve_deterministic(grid, inflows)
+        window = self._refine_window(grid, states)
+        if window is not None:
+            grid = self._prepare(initial_level, inflows, target_final_level, flood_penalty, window)
+            states, objective = self._solve_deterministic(grid, inflows)
+
+        releases = inflows + (grid.storages[states[:-1]] - grid.storages[states[1:]]) / self.dt
+        power = self._power(releases, grid.levels[states[:-1]])
+        energy = float(power.sum() * self.dt / 3600)
+        return DPScheduleResult(
+            objective_value=objective,
+            total_power_generation_mwh=energy,
+            penalty=energy - objective,
+            solve_seconds=perf_counter() - started,
+            releases=releases,
+            water_levels=grid.levels[states],
+            power_generation=power,
+            storage_step=grid.step,
+        )
+
+    def _solve_deterministic(self, grid: "_DPGrid", inflows: np.ndarray) -> Tuple[np.ndarray, float]:
+        n_hours = inflows.size
+        n_states = grid.storages.size
+        value = grid.terminal_value
+        policy = np.empty((n_hours, n_states), dtype=np.int64)
+        rows = np.arange(n_states)
+        for t in range(n_hours - 1, -1, -1):
+            band = grid.bands[t]
+            q = self._stage_reward(
+                inflows[t], grid.storage_change[:, band], grid.static_penalty[:, band], grid.energy_per_flow
+            )
+            q += value[grid.next_states[:, band]]
+            best = np.argmax(q, axis=1)
+            policy[t] = grid.next_states[rows, band.start + best]
+            value = q[rows, best]
+
+        # 正向回溯最优轨迹
+        states = np.empty(n_hours + 1, dtype=np.int64)
+        states[0] = grid.origin
+        for t in range(n_hours):
+            states[t + 1] = policy[t, states[t]]
+        return states, float(value[grid.origin])
+
+    def solve_stochastic(self, inflow_samples: np.ndarray, initial_level: float,
+                         target_final_level: Optional[float] = None,
+                         flood_penalty: float = 0.0) -> DPScheduleResult:
+        """基于入流样本的随机动态规划
+
+        inflow_samples形状为 [样本, 小时]。递推时对每个时段的入流样本取期望,
+        求得的策略随后在每条样本上正向模拟, 返回逐样本的下泄和水位轨迹。
+        细化方式同solve, 细网格范围覆盖全部样本轨迹。
+        """
+        started = perf_counter()
+        samples = np.asarray(inflow_samples, dtype=float)
+        if samples.ndim != 2:
+            raise ValueError("入流样本形状须为 [样本, 小时]")
+        grid = self._prepare(initial_level, samples, target_final_level, flood_penalty)
+        states, objective, expected = self._solve_stochastic(grid, samples)
+        window = self._refine_window(grid, states)
+        if window is not None:
+            grid = self._prepare(initial_level, samples, target_final_level, flood_penalty, window)
+            states, objective, expected = self._solve_stochastic(grid, samples)
+
+        releases = samples + (grid.storages[states[:, :-1]] - grid.storages[states[:, 1:]]) / self.dt
+        power = self._power(releases, grid.levels[states[:, :-1]])
+        energy = power.sum(axis=-1) * self.dt / 3600
+        return DPScheduleResult(
+            objective_value=float(objective.mean()),
+            total_power_generation_mwh=float(energy.mean()),
+            penalty=float((energy - objective).mean()),
+            solve_seconds=perf_counter() - started,
+            releases=releases,
+            water_levels=grid.levels[states],
+            power_generation=power,
+            storage_step=grid.step,
+            expected_objective=expected,
+        )
+
+    def _solve_stochastic(self, grid: "_DPGrid", samples: np.ndarray):
+        n_samples, n_hours = samples.shape
+        values = [None] * (n_hours + 1)
+        values[n_hours] = grid.terminal_value
+        for t in range(n_hours - 1, -1, -1):
+            band = grid.bands[t]
+            q = self._stage_reward(
+                samples[:, t, None, None], grid.storage_change[:, band], grid.static_penalty[:, band],
+                grid.energy_per_flow
+            )
+            q += values[t + 1][grid.next_states[:, band]]
+            values[t] = q.max(axis=-1).mean(axis=0)
+
+        # 按策略在每条样本上正向模拟: 已知本时段入流后选择使 收益+后续期望值 最大的末库容
+        states = np.empty((n_samples, n_hours + 1), dtype=np.int64)
+        states[:, 0] = grid.origin
+        objective = np.zeros(n_samples)
+        sample_rows = np.arange(n_samples)
+        for t in range(n_hours):
+            band = grid.bands[t]
+            current = states[:, t]
+            reward = self._stage_reward(
+                samples[:, t, None], grid.storage_change[current, band], grid.static_penalty[current, band],
+                grid.energy_per_flow[current]
+            )
+            following = grid.next_states[current, band]
+            best = np.argmax(reward + values[t + 1][following], axis=1)
+            objective += reward[sample_rows, best]
+            states[:, t + 1] = following[sample_rows, best]
+        objective += grid.terminal_value[states[:, -1]]
+        return states, objective, float(values[0][grid.origin])
+
+    def _power(self, releases: np.ndarray, levels: np.ndarray) -> np.ndarray:
+        """按时段初水位计算发电功率 (MW), 与optimize_reservoir_operation一致"""
+        releases = np.clip(releases, 0.0, None)
+        heads = levels - self.model.characteristics.dead_water_level
+        efficiency = self.model._get_power_efficiency(levels)
+        return np.where(
+            releases >= self.constraints.min_power_generation_flow,
+            9.81 * releases * heads * efficiency / 1000,
+            0.0,
+        )
+
+
+def sample_inflow_scenarios(forecast: List[float], n_samples: int, uncertainty: float = 0.2,
+                            autocorrelation: float = 0.9, seed: Optional[int] = None) -> np.ndarray:
+    """由入流预报生成样本: 乘以对数正态误差, 误差按AR(1)过程随时间相关"""
+    forecast = np.asarray(forecast, dtype=float)
+    rng = np.random.default_rng(seed)
+    noise = rng.standard_normal((n_samples, forecast.size))
+    errors = np.empty_like(noise)
+    errors[:, 0] = noise[:, 0]
+    scale = np.sqrt(1 - autocorrelation**2)
+    for t in range(1, forecast.size):
+        errors[:, t] = autocorrelation * errors[:, t - 1] + scale * noise[:, t]
+    sigma = np.log1p(uncertainty)
+    return forecast * np.exp(sigma * errors - sigma**2 / 2)
+
+
 class ReservoirSimulationMCPServer:
     """水库模拟模型MCP服务器"""
 
-    def __init__(self):
-        # 创建示例水库
-        self.reservoir = self._create_example_reservoir()
-
-    def _create_example_reservoir(self) -> ReservoirSimulationModel:
+    # 多情景调度的规模上限: 计算量与内存随 [模式, 过程, 水库, 小时] 的元素数增长,
+    # 逐时段列式数组 (include_series) 序列化后体积更大, 单独限制
+    MAX_SCENARIO_TRACES = 1000
+    MAX_CASCADE_RESERVOIRS = 20
+    MAX_SCENARIO_HOURS = 24 * 366
+    MAX_SCENARIO_CELLS = 2_000_000
+    MAX_SERIES_CELLS = 100_000
+
+    # 动态规划调度的规模上限: 随机动态规划的Bellman数组为 [样本, 状态, 带宽],
+    # 样本数与状态数的乘积不超过默认值 (20个样本×1000个状态)
+    MAX_DP_HOURS = 24 * 31
+    MAX_DP_STATES = 2000
+    MAX_DP_SAMPLES = 100
+    MAX_STOCHASTIC_DP_SAMPLE_STATES = 20 * 1000
+
+    def __init__(self, survey_csv: Optional[str] = None, surveys: Optional[Dict[str, str]] = None):
+        # 创建示例水库, 给定实测特征曲线表时使用实测曲线
+        self.reservoir = self._create_example_reservoir(
+            survey_csv or os.environ.get("MUNDI_RESERVOIR_SURVEY_CSV")
+        )
+        # 由部署方配置的 水库编号 -> 实测特征曲线表路径; 请求只能按编号引用,
+        # 不能直接给出服务器上的路径
+        if surveys is None:
+            surveys = json.loads(os.environ.get("MUNDI_RESERVOIR_SURVEYS") or "{}")
+        self.surveys = dict(surveys)
+        self._survey_curves: Dict[str, Dict[str, CharacteristicCurve]] = {}
+
+    def _curves_for(self, survey_id: Optional[str], points: Optional[Dict[str, Any]]) -> Dict[str, CharacteristicCurve]:
+        """按配置的水库编号和/或请求中的曲线数据取得特征曲线, 后者优先"""
+        curves: Dict[str, CharacteristicCurve] = {}
+        if survey_id is not None:
+            if survey_id not in self.surveys:
+                raise ValueError(f"未配置的水库编号: {survey_id}")
+            if survey_id not in self._survey_curves:
+                self._survey_curves[survey_id] = load_survey_curves(self.surveys[survey_id])
+            curves.update(self._survey_curves[survey_id])
+        if points:
+            curves.update(curves_from_points(points))
+        return curves
+
+    def _create_example_reservoir(self, survey_csv: Optional[str] = None) -> ReservoirSimulationModel:
         """创建示例水库"""
         characteristics = ReservoirCharacteristics(
             name="三峡水库",
@@ -366,6 +1013,8 @@ class ReservoirSimulationMCPServer:
             crest_elevation=185.0  # 185m
         )
 
+        if survey_csv:
+            return ReservoirSimulationModel.from_survey_csv(characteristics, survey_csv)
         return ReservoirSimulationModel(characteristics)
 
     async def simulate_reservoir_operation(
@@ -674,4 +1323,261 @@ class ReservoirSimulationMCPServer:
                 "status": "error",
                 "message": f"泄洪计算失败: {str(e)}",
                 "recommendations": ["请检查输入参数是否合理", "确认水库特征参数设置正确"]
-            }
\ No newline at end of file
+            }
+
+    async def simulate_operation_scenarios(
+        self,
+        inflow_traces: List[Any],
+        initial_water_levels: Union[float, List[float]],
+        operation_modes: Union[str, List[str]] = "normal",
+        target_water_level: Optional[float] = None,
+        reservoirs: Optional[List[Dict[str, Any]]] = None,
+        include_series: bool = False
+    ) -> Dict[str, Any]:
+        """
+        多水库多情景调度模拟 - MCP工具接口
+
+        每种运行模式与每条入流过程组合成一个情景, 全部情景和水库按数组同时推进。
+
+        Args:
+            inflow_traces: 入流过程 (m³/s, 逐小时)。单库时形状为 [过程, 小时],
+                梯级时为 [过程, 水库, 小时], 下游水库给出区间入流
+            initial_water_levels: 初始水位 (m), 标量或逐水库列表
+            operation_modes: 运行模式或模式列表, 每种模式与全部入流过程组合
+            target_water_level: 目标水位 (m), 缺省为各水库正常蓄水位
+            reservoirs: 梯级水库定义, 按上游到下游排列。每项为ReservoirCharacteristics
+                的字段, 另可给出survey_id (已配置的水库编号, 使用其实测特征曲线表)、
+                curves (曲线数据, 见curves_from_points)、downstream (下游水库序号)
+                和lag_hours (传播时间); 缺省为示例水库单库
+            include_series: 是否返回 [模式, 过程, 水库, 小时] 的逐时段列式数组
+
+        Returns:
+            按模式汇总的调度统计
+        """
+
+        try:
+            if reservoirs and len(reservoirs) > self.MAX_CASCADE_RESERVOIRS:
+                raise ValueError(f"水库数 {len(reservoirs)} 超过上限 {self.MAX_CASCADE_RESERVOIRS}")
+            if reservoirs:
+                models, downstream, lags = [], [], []
+                for spec in reservoirs:
+                    spec = dict(spec)
+                    curves = self._curves_for(spec.pop("survey_id", None), spec.pop("curves", None))
+                    downstream.append(spec.pop("downstream", None))
+                    lags.append(int(spec.pop("lag_hours", 0) or 0))
+                    characteristics = ReservoirCharacteristics(**spec)
+                    models.append(ReservoirSimulationModel(characteristics, curves))
+            else:
+                models, downstream, lags = [self.reservoir], [None], [0]
+
+            modes = [operation_modes] if isinstance(operation_modes, str) else list(operation_modes)
+            for mode in modes:
+                ReservoirOperationMode(mode)
+            if len(set(modes)) != len(modes):
+                raise ValueError("运行模式不能重复")
+
+            if len(inflow_traces) > self.MAX_SCENARIO_TRACES:
+                raise ValueError(f"入流过程数 {len(inflow_traces)} 超过上限 {self.MAX_SCENARIO_TRACES}")
+            traces = np.asarray(inflow_traces, dtype=float)
+            if traces.ndim == 2 and len(models) == 1:
+                traces = traces[:, None, :]
+            if traces.ndim != 3 or traces.shape[1] != len(models):
+                raise ValueError(f"入流过程形状 {traces.shape} 与水库数 {len(models)} 不匹配")
+            n_traces, n_reservoirs, n_hours = traces.shape
+            if n_hours > self.MAX_SCENARIO_HOURS:
+                raise ValueError(f"调度时长 {n_hours} 小时超过上限 {self.MAX_SCENARIO_HOURS}")
+            n_cells = len(modes) * n_traces * n_reservoirs * n_hours
+            if n_cells > self.MAX_SCENARIO_CELLS:
+                raise ValueError(
+                    f"情景规模 (模式×过程×水库×小时 = {n_cells}) 超过上限 {self.MAX_SCENARIO_CELLS}"
+                )
+            if include_series and n_cells > self.MAX_SERIES_CELLS:
+                raise ValueError(
+                    f"逐时段数组规模 {n_cells} 超过上限 {self.MAX_SERIES_CELLS}, 请减少情景或不返回series"
+                )
+
+            engine = CascadeSimulationEngine(models, downstream, lags)
+            # 情景顺序为 [模式, 过程]
+            local_inflows = np.tile(traces, (len(modes), 1, 1))
+            scenario_modes = np.repeat(np.array(modes), n_traces)[:, None]
+
+            started = perf_counter()
+            run = await asyncio.to_thread(
+                engine.run, local_inflows, initial_water_levels, scenario_modes,
+                np.nan if target_water_level is None else target_water_level
+            )
+            elapsed = perf_counter() - started
+
+            shape = (len(modes), n_traces, n_reservoirs)
+            summary = {name: values.reshape(shape) for name, values in run.summary().items()}
+            flood_limit = engine.flood_limit_water_level
+
+            statistics_by_mode = {}
+            for m, mode in enumerate(modes):
+                statistics_by_mode[mode] = {
+                    "mean_final_water_level": summary["final_water_level"][m].mean(axis=0).tolist(),
+                    "p95_max_water_level": np.percentile(summary["max_water_level"][m], 95, axis=0).tolist(),
+                    "flood_limit_exceedance_probability": (
+                        summary["max_water_level"][m] >= flood_limit
+                    ).mean(axis=0).tolist(),
+                    "mean_max_outflow": summary["max_outflow"][m].mean(axis=0).tolist(),
+                    "mean_total_power_generation_mwh": summary["total_power_generation_mwh"][m].mean(axis=0).tolist(),
+                }
+
+            result = {
+                "status": "success",
+                "reservoir_names": run.reservoir_names,
+                "operation_modes": modes,
+                "n_traces": n_traces,
+                "hours": n_hours,
+                "compute_seconds": elapsed,
+                "statistics_by_mode": statistics_by_mode,
+                # 列式汇总, 形状 [模式, 过程, 水库]
+                "scenario_summary": {name: values.tolist() for name, values in summary.items()},
+            }
+            if include_series:
+                series_shape = shape + (n_hours,)
+                result["series"] = {
+                    "water_levels": run.water_levels.reshape(series_shape).tolist(),
+                    "inflows": run.inflows.reshape(series_shape).tolist(),
+                    "outflows": run.outflows.reshape(series_shape).tolist(),
+                    "power_generation": run.power_generation.reshape(series_shape).tolist(),
+                }
+            return result
+
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"多情景调度模拟失败: {str(e)}",
+                "recommendations": ["检查入流过程的形状与水库数是否一致", "确认运行模式和水库参数设置正确"]
+            }
+
+    async def optimize_operation_dp(
+        self,
+        current_water_level: float,
+        forecast_hours: int = 168,
+        average_inflow: float = 5000.0,  # m³/s
+        inflow_forecast: Optional[List[float]] = None,  # 逐小时入流预报 (m³/s), 给出时忽略average_inflow
+        objective: str = "power",
+        target_final_level: Optional[float] = None,
+        stochastic: bool = False,
+        n_samples: int = 20,
+        inflow_uncertainty: float = 0.2,
+        inflow_samples: Optional[List[List[float]]] = None,
+        max_states: Optional[int] = None,
+        seed: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """
+        动态规划优化调度 - MCP工具接口
+
+        Args:
+            current_water_level: 当前水位 (m)
+            forecast_hours: 调度时长 (小时), 未给出inflow_forecast时使用
+            average_inflow: 平均入库流量 (m³/s), 按日变化生成入流预报
+            inflow_forecast: 逐小时入流预报 (m³/s)
+            objective: power (发电量最大) 或 flood_control (先控制不超过防洪限制水位, 再使发电量最大)
+            target_final_level: 末水位下限 (m), 默认为当前水位
+            stochastic: 是否使用随机动态规划
+            n_samples: 随机动态规划的入流样本数
+            inflow_uncertainty: 入流样本的相对误差
+            inflow_samples: 直接给出的入流样本 [样本, 小时], 给出时忽略n_samples
+            max_states: 库容离散状态数上限, 默认确定性2000、随机1000
+            seed: 入流样本的随机种子
+
+        Returns:
+            最优调度结果, 包含目标函数值、求解耗时和下泄轨迹
+        """
+
+        try:
+            if objective not in ("power", "flood_control"):
+                return {"status": "error", "message": f"无效的优化目标: {objective}"}
+
+            n_hours = len(inflow_forecast) if inflow_forecast is not None else forecast_hours
+            if n_hours > self.MAX_DP_HOURS:
+                raise ValueError(f"调度时长 {n_hours} 小时超过上限 {self.MAX_DP_HOURS}")
+            states = max_states or (1000 if stochastic else 2000)
+            if states > self.MAX_DP_STATES:
+                raise ValueError(f"状态数 {states} 超过上限 {self.MAX_DP_STATES}")
+            if stochastic:
+                if inflow_samples is not None:
+                    n_samples = len(inflow_samples)
+                    if any(len(sample) > self.MAX_DP_HOURS for sample in inflow_samples):
+                        raise ValueError(f"入流样本时长超过上限 {self.MAX_DP_HOURS} 小时")
+                if n_samples > self.MAX_DP_SAMPLES:
+                    raise ValueError(f"入流样本数 {n_samples} 超过上限 {self.MAX_DP_SAMPLES}")
+                if n_samples * states > self.MAX_STOCHASTIC_DP_SAMPLE_STATES:
+                    raise ValueError(
+                        f"样本数×状态数 ({n_samples}×{states}) 超过上限 {self.MAX_STOCHASTIC_DP_SAMPLE_STATES}, "
+                        "请减少样本数或max_states"
+                    )
+
+            if inflow_forecast is None:
+                hours = np.arange(forecast_hours)
+                inflow_forecast = average_inflow * (1 + 0.2 * np.sin(2 * np.pi * hours / 24))
+            inflow_forecast = np.asarray(inflow_forecast, dtype=float)
+
+            scheduler = ReservoirDPScheduler(self.reservoir, max_states=states)
+            flood_penalty = scheduler.FLOOD_CONTROL_PENALTY if objective == "flood_control" else 0.0
+
+            if stochastic:
+                samples = (
+                    np.asarray(inflow_samples, dtype=float) if inflow_samples is not None
+                    else sample_inflow_scenarios(inflow_forecast, n_samples, inflow_uncertainty, seed=seed)
+                )
+                result = await asyncio.to_thread(
+                    scheduler.solve_stochastic, samples, current_water_level, target_final_level, flood_penalty
+                )
+            else:
+                result = await asyncio.to_thread(
+                    scheduler.solve, inflow_forecast, current_water_level, target_final_level, flood_penalty
+                )
+
+            # 与规则调度在相同预报下比较
+            forecast = InflowForecast(
+                time_series=[datetime.now() + timedelta(hours=i) for i in range(inflow_forecast.size)],
+                inflow_rates=inflow_forecast.tolist(),
+                confidence_level=0.85
+            )
+            rule_mode = ReservoirOperationMode.FLOOD_CONTROL if objective == "flood_control" \
+                else ReservoirOperationMode.POWER_GENERATION
+            rule_schedule = self.reservoir.optimize_reservoir_operation(
+                current_water_level, forecast, None, rule_mode
+            )
+
+            response = {
+                "status": "success",
+                "method": "stochastic_dynamic_programming" if stochastic else "dynamic_programming",
+                "objective": objective,
+                "objective_value": result.objective_value,
+                "total_power_generation_mwh": result.total_power_generation_mwh,
+                "penalty": result.penalty,
+                "solve_seconds": result.solve_seconds,
+                "storage_step_m3": result.storage_step,
+                "rule_based_comparison": {
+                    "mode": rule_mode.value,
+                    "total_power_generation_mwh": float(sum(op["power_generation"] for op in rule_schedule)),
+                    "final_water_level": rule_schedule[-1]["new_level"] if rule_schedule else current_water_level,
+                    "max_water_level": max((op["new_level"] for op in rule_schedule), default=current_water_level),
+                },
+            }
+            if stochastic:
+                response["expected_objective"] = result.expected_objective
+                response["n_samples"] = int(result.releases.shape[0])
+                response["release_percentiles"] = {
+                    f"p{p}": np.percentile(result.releases, p, axis=0).tolist() for p in (10, 50, 90)
+                }
+                response["water_level_percentiles"] = {
+                    f"p{p}": np.percentile(result.water_levels, p, axis=0).tolist() for p in (10, 50, 90)
+                }
+            else:
+                response["releases"] = result.releases.tolist()
+                response["water_levels"] = result.water_levels.tolist()
+                response["power_generation"] = result.power_generation.tolist()
+            return response
+
+        except Exception as e:
+            return {
+                "status": "error",
+                "message": f"动态规划优化调度失败: {str(e)}",
+                "recommendations": ["确认当前水位位于运行水位范围内", "减少调度时长或离散状态数"]
+            }
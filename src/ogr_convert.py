@@ -0,0 +1,243 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# how often the progress callback looks for a cancellation request
+CANCEL_POLL_SEC = 0.1
+
+
+class OgrConversionError(Exception):
+    pass
+
+
+class OgrConversionCancelled(OgrConversionError):
+    pass
+
+
+def split_source_args(args: list[str]) -> tuple[list[str], list[str], list[str]]:
+    """Split ogr2ogr arguments into (-if drivers, -oo open options, the rest).
+
+    gdal.VectorTranslate only takes the translation options; opening the
+    source is the caller's job, as it is in ogr2ogr itself.
+    """
+    drivers, open_options, rest = [], [], []
+    i = 0
+    while i < len(args):
+        if args[i] == "-if" and i + 1 < len(args):
+            drivers.append(args[i + 1])
+            i += 2
+        elif args[i] == "-oo" and i + 1 < len(args):
+            open_options.append(args[i + 1])
+            i += 2
+        else:
+            rest.append(args[i])
+            i += 1
+    return drivers, open_options, rest
+
+
+def _translate(
+    src: str,
+    dest: str,
+    args: list[str],
+    layers: list[str] | None,
+    cancel_path: str,
+    submitted_at: float,
+) -> dict:
+    """Runs in a pool process: the in-process equivalent of `ogr2ogr args dest src layers`."""
+    started = time.time()
+    from osgeo import gdal
+
+    gdal.UseExceptions()
+    drivers, open_options, rest = split_source_args(args)
+
+    last_poll = [0.0]
+
+    def progress(complete, message, user_data):
+        now = time.monotonic()
+        if now - last_poll[0] >= CANCEL_POLL_SEC:
+            last_poll[0] = now
+            if os.path.exists(cancel_path):
+                return 0
+        return 1
+
+    t0 = time.perf_counter()
+    try:
+        src_ds = gdal.OpenEx(
+            src,
+            gdal.OF_VECTOR,
+            allowed_drivers=drivers,
+            open_options=open_options,
+        )
+        t1 = time.perf_counter()
+        # GDAL picks its Arrow stream fast path on its own when the options allow
+        out_ds = gdal.VectorTranslate(
+            dest,
+            src_ds,
+            options=gdal.VectorTranslateOptions(
+                options=rest, layers=layers, callback=progress
+            ),
+        )
+        if out_ds is None:
+            raise RuntimeError(gdal.GetLastErrorMsg() or "VectorTranslate failed")
+        # closing flushes the output
+        del out_ds, src_ds
+        t2 = time.perf_counter()
+    except RuntimeError as e:
+        if os.path.exists(cancel_path):
+            raise OgrConversionCancelled(f"conversion of {src} was cancelled")
+        raise OgrConversionError(str(e))
+
+    return {
+        "queue_ms": 1000 * max(0.0, started - submitted_at),
+        "open_ms": 1000 * (t1 - t0),
+        "translate_ms": 1000 * (t2 - t1),
+    }
+
+
+class OgrConversionEngine:
+    """Runs ogr2ogr-style conversions with gdal.VectorTranslate in a process pool.
+
+    Pool processes stay alive, so each conversion skips the 100-300 ms of
+    GDAL start-up a fresh ogr2ogr pays. GDAL runs outside the event loop's
+    process, and a cancelled or timed out conversion is stopped at the next
+    progress callback instead of running to completion.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        self._executor: ProcessPoolExecutor | None = None
+        self.counters = {
+            "conversions": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "pool_restarts": 0,
+        }
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # fork()ing a process that runs an event loop and threads is unsafe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def _discard_pool(self, executor: ProcessPoolExecutor):
+        # a worker died (segfault, OOM kill): the executor refuses all further
+        # work, so drop it and let the next conversion start a fresh one
+        if self._executor is executor:
+            self._executor = None
+            self.counters["pool_restarts"] += 1
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def convert(
+        self,
+        src: str,
+        dest: str,
+        args: list[str],
+        layers: list[str] | None = None,
+        timeout: float | None = None,
+    ) -> dict:
+        """Convert src into dest; args are ogr2ogr options (-f, -t_srs, -if, -oo...).
+
+        Returns per-stage timings in ms. Raises OgrConversionError on failure
+        and OgrConversionCancelled if the caller was cancelled or timed out.
+        """
+        cancel_path = os.path.join(
+            tempfile.gettempdir(), f"ogr-convert-cancel-{uuid.uuid4().hex}"
+        )
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        executor = self._pool()
+        try:
+            future = loop.run_in_executor(
+                executor,
+                _translate,
+                src,
+                dest,
+                list(args),
+                layers,
+                cancel_path,
+                time.time(),
+            )
+        except BrokenProcessPool as e:
+            self._discard_pool(executor)
+            self.counters["failed"] += 1
+            raise OgrConversionError(f"GDAL worker pool is broken: {e}")
+        future.add_done_callback(lambda _: _remove_quietly(cancel_path))
+
+        try:
+            timings = await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except BrokenProcessPool as e:
+            self._discard_pool(executor)
+            self.counters["failed"] += 1
+            raise OgrConversionError(f"GDAL worker died converting {src}: {e}")
+        except (asyncio.CancelledError, asyncio.TimeoutError) as e:
+            # ask the worker to stop at its next progress callback
+            open(cancel_path, "w").close()
+            self.counters["cancelled"] += 1
+            if isinstance(e, asyncio.TimeoutError):
+                raise OgrConversionCancelled(
+                    f"conversion of {src} timed out after {timeout} seconds"
+                )
+            raise
+        except OgrConversionError:
+            self.counters["failed"] += 1
+            raise
+
+        self.counters["conversions"] += 1
+        timings["total_ms"] = 1000 * (time.perf_counter() - start)
+        logger.info(
+            "converted %s to %s: queue %.0f ms, open %.0f ms, translate %.0f ms, total %.0f ms",
+            src,
+            dest,
+            timings["queue_ms"],
+            timings["open_ms"],
+            timings["translate_ms"],
+            timings["total_ms"],
+        )
+        return timings
+
+    def stats(self) -> dict:
+        return {**self.counters, "max_workers": self.max_workers}
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+engine_singleton = OgrConversionEngine(
+    max_workers=int(
+        os.environ.get("MUNDI_OGR_CONVERT_WORKERS", min(4, os.cpu_count() or 1))
+    )
+)
+
+
+def ogr_conversion_engine() -> OgrConversionEngine:
+    return engine_singleton
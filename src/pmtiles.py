@@ -0,0 +1,398 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+import gzip
+import struct
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from botocore.exceptions import ClientError
+
+from src.utils import get_async_s3_client, get_bucket_name
+
+# PMTiles v3 keeps the header and root directory in the first 16 KiB
+PMTILES_PREFIX_BYTES = 16384
+PMTILES_HEADER_BYTES = 127
+_HEADER_STRUCT = struct.Struct("<7sB11Q6B4iB2i")
+
+COMPRESSION_NONE = 1
+COMPRESSION_GZIP = 2
+
+TILE_MEDIA_TYPES = {
+    1: "application/vnd.mapbox-vector-tile",
+    2: "image/png",
+    3: "image/jpeg",
+    4: "image/webp",
+    5: "image/avif",
+}
+
+# root -> leaf -> leaf -> leaf is the deepest the spec allows
+MAX_DIRECTORY_DEPTH = 4
+
+
+class PMTilesError(Exception):
+    pass
+
+
+class PMTilesHeader(NamedTuple):
+    root_dir_offset: int
+    root_dir_length: int
+    json_metadata_offset: int
+    json_metadata_length: int
+    leaf_dirs_offset: int
+    leaf_dirs_length: int
+    tile_data_offset: int
+    tile_data_length: int
+    addressed_tiles_count: int
+    tile_entries_count: int
+    tile_contents_count: int
+    clustered: bool
+    internal_compression: int
+    tile_compression: int
+    tile_type: int
+    min_zoom: int
+    max_zoom: int
+    min_lon_e7: int
+    min_lat_e7: int
+    max_lon_e7: int
+    max_lat_e7: int
+    center_zoom: int
+    center_lon_e7: int
+    center_lat_e7: int
+
+
+class DirectoryEntry(NamedTuple):
+    tile_id: int
+    offset: int
+    length: int
+    run_length: int
+
+
+class PMTilesArchive(NamedTuple):
+    """What we know about one object in S3, as of fetched_at."""
+
+    key: str
+    etag: str
+    size: int
+    header: PMTilesHeader
+    fetched_at: float
+
+
+class TileLocation(NamedTuple):
+    archive: PMTilesArchive
+    tile_id: int
+    offset: int
+    length: int
+
+
+def parse_header(buf: bytes) -> PMTilesHeader:
+    if len(buf) < PMTILES_HEADER_BYTES:
+        raise PMTilesError("PMTiles header is truncated")
+    magic, version, *fields = _HEADER_STRUCT.unpack_from(buf)
+    if magic != b"PMTiles":
+        raise PMTilesError("not a PMTiles archive")
+    if version != 3:
+        raise PMTilesError(f"unsupported PMTiles version {version}")
+    header = PMTilesHeader(*fields)
+    return header._replace(clustered=bool(header.clustered))
+
+
+def decompress(data: bytes, compression: int) -> bytes:
+    if compression == COMPRESSION_NONE:
+        return data
+    if compression == COMPRESSION_GZIP:
+        return gzip.decompress(data)
+    raise PMTilesError(f"unsupported PMTiles compression {compression}")
+
+
+def _read_varint(buf: bytes, pos: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        if pos >= len(buf):
+            raise PMTilesError("PMTiles directory is truncated")
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def deserialize_directory(buf: bytes) -> list[DirectoryEntry]:
+    """Decode an already decompressed directory into its entries."""
+    n, pos = _read_varint(buf, 0)
+
+    tile_ids = []
+    last_id = 0
+    for _ in range(n):
+        delta, pos = _read_varint(buf, pos)
+        last_id += delta
+        tile_ids.append(last_id)
+
+    run_lengths = []
+    for _ in range(n):
+        value, pos = _read_varint(buf, pos)
+        run_lengths.append(value)
+
+    lengths = []
+    for _ in range(n):
+        value, pos = _read_varint(buf, pos)
+        lengths.append(value)
+
+    entries: list[DirectoryEntry] = []
+    for i in range(n):
+        value, pos = _read_varint(buf, pos)
+        # 0 means "right after the previous entry", otherwise offset + 1
+        if value == 0 and i > 0:
+            offset = entries[i - 1].offset + entries[i - 1].length
+        else:
+            offset = value - 1
+        entries.append(DirectoryEntry(tile_ids[i], offset, lengths[i], run_lengths[i]))
+    return entries
+
+
+def zxy_to_tile_id(z: int, x: int, y: int) -> int:
+    """Position of a tile along the per-zoom Hilbert curves PMTiles orders by."""
+    if z > 31:
+        raise PMTilesError(f"zoom {z} is too deep for PMTiles")
+    n = 1 << z
+    if x < 0 or y < 0 or x >= n or y >= n:
+        raise PMTilesError(f"tile {z}/{x}/{y} is outside the zoom level")
+
+    # tiles on every shallower zoom come first
+    acc = ((1 << (2 * z)) - 1) // 3
+    d = 0
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x = s - 1 - x
+                y = s - 1 - y
+            x, y = y, x
+        s >>= 1
+    return acc + d
+
+
+def find_entry(entries: list[DirectoryEntry], tile_id: int) -> Optional[DirectoryEntry]:
+    lo, hi = 0, len(entries) - 1
+    while lo <= hi:
+        mid = (lo + hi) >> 1
+        diff = tile_id - entries[mid].tile_id
+        if diff > 0:
+            lo = mid + 1
+        elif diff < 0:
+            hi = mid - 1
+        else:
+            return entries[mid]
+
+    # hi is now the entry just before tile_id, which is either a leaf
+    # directory covering it or a run of identical tiles
+    if hi >= 0:
+        entry = entries[hi]
+        if entry.run_length == 0 or tile_id - entry.tile_id < entry.run_length:
+            return entry
+    return None
+
+
+class PMTilesReader:
+    """Resolves z/x/y to byte ranges of PMTiles archives stored in S3.
+
+    Each archive's header is cached per key and revalidated after
+    header_ttl_sec. Parsed root and leaf directories sit in an LRU bounded by
+    the size of their encoded bytes, keyed by the object's ETag, so a
+    regenerated archive never resolves against stale directories. Once warm,
+    a tile costs one ranged GET for its bytes.
+    """
+
+    def __init__(self, max_directory_bytes: int, header_ttl_sec: float):
+        self.max_directory_bytes = max_directory_bytes
+        self.header_ttl_sec = header_ttl_sec
+        self._archives: dict[str, PMTilesArchive] = {}
+        self._loading: dict[str, asyncio.Future] = {}
+        # (key, etag, offset) -> (entries, encoded size)
+        self._directories: OrderedDict[
+            tuple[str, str, int], tuple[list[DirectoryEntry], int]
+        ] = OrderedDict()
+        self.directory_bytes = 0
+        self.counters = {
+            "header_hits": 0,
+            "header_fetches": 0,
+            "directory_hits": 0,
+            "directory_fetches": 0,
+            "stale_archives": 0,
+        }
+
+    async def _get_range(
+        self, key: str, start: int, length: int, if_match: Optional[str] = None
+    ) -> tuple[bytes, str, int]:
+        s3 = await get_async_s3_client()
+        kwargs = {"IfMatch": if_match} if if_match else {}
+        response = await s3.get_object(
+            Bucket=get_bucket_name(),
+            Key=key,
+            Range=f"bytes={start}-{start + length - 1}",
+            **kwargs,
+        )
+        body = await response["Body"].read()
+        # Content-Range is "bytes start-end/size"
+        size = int(response["ContentRange"].rsplit("/", 1)[1])
+        return body, response["ETag"], size
+
+    def _remember_directory(
+        self, cache_key: tuple[str, str, int], entries: list[DirectoryEntry], size: int
+    ):
+        if cache_key in self._directories:
+            return
+        self._directories[cache_key] = (entries, size)
+        self.directory_bytes += size
+        while self.directory_bytes > self.max_directory_bytes and self._directories:
+            _, (_, evicted_size) = self._directories.popitem(last=False)
+            self.directory_bytes -= evicted_size
+
+    async def _load_archive(self, key: str) -> PMTilesArchive:
+        self.counters["header_fetches"] += 1
+        prefix, etag, size = await self._get_range(key, 0, PMTILES_PREFIX_BYTES)
+        header = parse_header(prefix)
+        archive = PMTilesArchive(key, etag, size, header, time.monotonic())
+
+        root_end = header.root_dir_offset + header.root_dir_length
+        if root_end <= len(prefix):
+            # the root came along with the header, so it costs nothing extra
+            raw = prefix[header.root_dir_offset : root_end]
+            entries = deserialize_directory(
+                decompress(raw, header.internal_compression)
+            )
+            self._remember_directory(
+                (key, etag, header.root_dir_offset), entries, len(raw)
+            )
+
+        previous = self._archives.get(key)
+        if previous is not None and previous.etag != etag:
+            self.counters["stale_archives"] += 1
+            self.invalidate(key)
+        self._archives[key] = archive
+        return archive
+
+    async def archive(self, key: str) -> PMTilesArchive:
+        cached = self._archives.get(key)
+        if (
+            cached is not None
+            and time.monotonic() - cached.fetched_at < self.header_ttl_sec
+        ):
+            self.counters["header_hits"] += 1
+            return cached
+
+        # single-flight, a map load asks for many tiles of one archive at once
+        future = self._loading.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._load_archive(key))
+            self._loading[key] = future
+            future.add_done_callback(lambda _: self._loading.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def _directory(
+        self, archive: PMTilesArchive, offset: int, length: int
+    ) -> list[DirectoryEntry]:
+        cache_key = (archive.key, archive.etag, offset)
+        cached = self._directories.get(cache_key)
+        if cached is not None:
+            self._directories.move_to_end(cache_key)
+            self.counters["directory_hits"] += 1
+            return cached[0]
+
+        self.counters["directory_fetches"] += 1
+        raw, _, _ = await self._get_range(
+            archive.key, offset, length, if_match=archive.etag
+        )
+        entries = deserialize_directory(
+            decompress(raw, archive.header.internal_compression)
+        )
+        self._remember_directory(cache_key, entries, len(raw))
+        return entries
+
+    async def _locate(
+        self, archive: PMTilesArchive, z: int, x: int, y: int
+    ) -> Optional[TileLocation]:
+        header = archive.header
+        if z < header.min_zoom or z > header.max_zoom:
+            return None
+        tile_id = zxy_to_tile_id(z, x, y)
+
+        dir_offset, dir_length = header.root_dir_offset, header.root_dir_length
+        for _ in range(MAX_DIRECTORY_DEPTH):
+            entries = await self._directory(archive, dir_offset, dir_length)
+            entry = find_entry(entries, tile_id)
+            if entry is None:
+                return None
+            if entry.run_length > 0:
+                return TileLocation(
+                    archive,
+                    tile_id,
+                    header.tile_data_offset + entry.offset,
+                    entry.length,
+                )
+            dir_offset = header.leaf_dirs_offset + entry.offset
+            dir_length = entry.length
+        raise PMTilesError("PMTiles directories are nested too deeply")
+
+    async def locate_tile(
+        self, key: str, z: int, x: int, y: int
+    ) -> Optional[TileLocation]:
+        """Byte range of a tile, or None when the archive doesn't have it."""
+        archive = await self.archive(key)
+        try:
+            return await self._locate(archive, z, x, y)
+        except ClientError as e:
+            if not is_precondition_failed(e):
+                raise
+        # the object was replaced under us, start over with its new header
+        self.invalidate(key)
+        return await self._locate(await self.archive(key), z, x, y)
+
+    def invalidate(self, key: str):
+        self._archives.pop(key, None)
+        for cache_key in [k for k in self._directories if k[0] == key]:
+            _, size = self._directories.pop(cache_key)
+            self.directory_bytes -= size
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "archives": len(self._archives),
+            "directories": len(self._directories),
+            "directory_bytes": self.directory_bytes,
+            "max_directory_bytes": self.max_directory_bytes,
+        }
+
+
+def is_precondition_failed(e: ClientError) -> bool:
+    return e.response.get("Error", {}).get("Code") in ("PreconditionFailed", "412")
+
+
+pmtiles_reader_singleton = PMTilesReader(
+    max_directory_bytes=1024 * 1024 * 64,  # 64 MiB
+    header_ttl_sec=60,
+)
+
+
+def pmtiles_reader() -> PMTilesReader:
+    return pmtiles_reader_singleton
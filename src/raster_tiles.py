@@ -0,0 +1,191 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from PIL import Image
+from rio_tiler.colormap import cmap
+from rio_tiler.io import Reader
+
+from src.utils import get_async_s3_client, get_bucket_name
+
+# presigned COG URLs only change query params, so don't let GDAL list the "directory"
+os.environ.setdefault("GDAL_DISABLE_READDIR_ON_OPEN", "EMPTY_DIR")
+
+PRESIGNED_URL_TTL_SEC = 3600
+# reopen readers well before their presigned URL stops working
+PRESIGNED_URL_REFRESH_SEC = PRESIGNED_URL_TTL_SEC - 600
+
+RescaleRange = Optional[Tuple[float, float]]
+
+# single band rasters with raster_value_stats_b1 are stretched onto this ramp
+RESCALED_COLORMAP = "spectral_r"
+
+
+class RasterTileQueueFull(Exception):
+    pass
+
+
+@lru_cache(maxsize=1)
+def transparent_png_tile() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGBA", (256, 256), (0, 0, 0, 0)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class RasterTileEngine:
+    """Renders raster XYZ tiles on a thread pool instead of the event loop.
+
+    Each pool thread keeps its own LRU of open rio-tiler readers keyed by
+    cog_key, so GDAL's parsed header and overview state survive between tiles
+    (GDAL datasets must not be shared across threads). Work beyond max_pending
+    outstanding tiles is rejected with RasterTileQueueFull rather than queued
+    without bound.
+    """
+
+    def __init__(
+        self, max_workers: int, max_pending: int, readers_per_thread: int = 16
+    ):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.readers_per_thread = readers_per_thread
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="raster-tile"
+        )
+        self.pending = 0
+        self._local = threading.local()
+        # cog_key -> (presigned url, generated at)
+        self._urls: dict[str, tuple[str, float]] = {}
+        self.counters = {
+            "rendered": 0,
+            "rejected": 0,
+            "failed": 0,
+            "reader_opens": 0,
+            "reader_hits": 0,
+        }
+
+    async def _asset_url(self, cog_key: str) -> str:
+        cached = self._urls.get(cog_key)
+        if cached and time.monotonic() - cached[1] < PRESIGNED_URL_REFRESH_SEC:
+            return cached[0]
+
+        s3 = await get_async_s3_client(signature_version="s3v4")
+        url = await s3.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": get_bucket_name(), "Key": cog_key},
+            ExpiresIn=PRESIGNED_URL_TTL_SEC,
+        )
+        self._urls[cog_key] = (url, time.monotonic())
+        return url
+
+    def _reader_for(self, cog_key: str, url: str) -> Reader:
+        readers: OrderedDict[str, Reader] | None = getattr(self._local, "readers", None)
+        if readers is None:
+            readers = self._local.readers = OrderedDict()
+
+        reader = readers.get(cog_key)
+        if reader is not None and reader.input == url:
+            readers.move_to_end(cog_key)
+            self.counters["reader_hits"] += 1
+            return reader
+        if reader is not None:
+            # presigned URL was refreshed, the old one is about to expire
+            self._close_reader(cog_key)
+
+        reader = Reader(url)
+        self.counters["reader_opens"] += 1
+        readers[cog_key] = reader
+        while len(readers) > self.readers_per_thread:
+            _, evicted = readers.popitem(last=False)
+            evicted.close()
+        return reader
+
+    def _close_reader(self, cog_key: str):
+        readers = getattr(self._local, "readers", None)
+        if readers is None:
+            return
+        reader = readers.pop(cog_key, None)
+        if reader is not None:
+            reader.close()
+
+    def _render(
+        self, cog_key: str, url: str, x: int, y: int, z: int, rescale: RescaleRange
+    ) -> bytes:
+        reader = self._reader_for(cog_key, url)
+        try:
+            img = reader.tile(x, y, z)
+        except Exception:
+            # don't keep a reader around that might be in a bad state
+            self._close_reader(cog_key)
+            raise
+
+        if rescale is not None:
+            img.rescale(in_range=(rescale,), out_range=((0, 255),))
+            return img.render(img_format="PNG", colormap=cmap.get(RESCALED_COLORMAP))
+        # png has alpha support; expect newer rio-tiler which returns bytes
+        return img.render(img_format="PNG")
+
+    async def render_tile(
+        self, cog_key: str, x: int, y: int, z: int, rescale: RescaleRange = None
+    ) -> bytes:
+        if self.pending >= self.max_pending:
+            self.counters["rejected"] += 1
+            raise RasterTileQueueFull(
+                f"{self.pending} raster tiles already pending, max {self.max_pending}"
+            )
+
+        self.pending += 1
+        try:
+            url = await self._asset_url(cog_key)
+            loop = asyncio.get_running_loop()
+            content = await loop.run_in_executor(
+                self.executor, self._render, cog_key, url, x, y, z, rescale
+            )
+            self.counters["rendered"] += 1
+            return content
+        except Exception:
+            self.counters["failed"] += 1
+            raise
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "max_workers": self.max_workers,
+        }
+
+
+_raster_workers = int(
+    os.environ.get("MUNDI_RASTER_TILE_WORKERS", min(8, (os.cpu_count() or 1) + 2))
+)
+raster_engine_singleton = RasterTileEngine(
+    max_workers=_raster_workers,
+    max_pending=_raster_workers * 8,
+)
+
+
+def raster_tile_engine() -> RasterTileEngine:
+    return raster_engine_singleton
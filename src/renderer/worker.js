@@ -0,0 +1,137 @@
+#!/usr/bin/env node
+/*
+ * Copyright (C) 2025 Bunting Labs, Inc.
+ *
+ * This program is free software: you can redistribute it and/or modify
+ * it under the terms of the GNU Affero General Public License as published by
+ * the Free Software Foundation, either version 3 of the License, or
+ * (at your option) any later version.
+ *
+ * This program is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ * GNU Affero General Public License for more details.
+ *
+ * You should have received a copy of the GNU Affero General Public License
+ * along with this program.  If not, see <http://www.gnu.org/licenses/>.
+ */
+
+/*
+ * Long-lived renderer for src/map_renderer.py. Reads one JSON job per line on
+ * stdin and answers each with one JSON line on stdout, so the X display, the
+ * Node runtime and the MapLibre instance stay warm between renders. stdout is
+ * reserved for responses; MapLibre's own messages are returned with the job.
+ */
+const readline = require('readline');
+const sharp = require('sharp');
+const maplibregl = require('@maplibre/maplibre-gl-native');
+const geoViewport = require('@mapbox/geo-viewport');
+
+// one map per pixel ratio, reloaded with each job's style
+const maps = new Map();
+let jobMessages = [];
+
+maplibregl.on('message', (msg) => {
+  jobMessages.push({
+    class: (msg && msg.class) || 'Unknown',
+    severity: (msg && msg.severity) || 'INFO',
+    text: (msg && msg.text) || String(msg),
+  });
+});
+
+function mapForRatio(ratio) {
+  let map = maps.get(ratio);
+  if (!map) {
+    map = new maplibregl.Map({ ratio });
+    maps.set(ratio, map);
+  }
+  return map;
+}
+
+function viewportFor(payload) {
+  if (payload.center) {
+    return {
+      center: Array.isArray(payload.center) ? payload.center : [0, 0],
+      zoom: payload.zoom || 0,
+    };
+  }
+  const boundsArr = typeof payload.bounds === 'string'
+    ? payload.bounds.split(',').map(Number)
+    : payload.bounds;
+  const viewport = geoViewport.viewport(
+    boundsArr,
+    [payload.width, payload.height],
+    undefined,
+    undefined,
+    512,
+    true
+  );
+  return { center: viewport.center, zoom: viewport.zoom };
+}
+
+function renderMap(map, options) {
+  return new Promise((resolve, reject) => {
+    map.render(options, (err, buffer) => (err ? reject(err) : resolve(buffer)));
+  });
+}
+
+async function handle(payload) {
+  const style = typeof payload.style === 'string' ? JSON.parse(payload.style) : payload.style;
+  const width = parseInt(payload.width, 10);
+  const height = parseInt(payload.height, 10);
+  const ratio = parseFloat(payload.ratio) || 1;
+  const { center, zoom } = viewportFor({ ...payload, width, height });
+
+  const map = mapForRatio(ratio);
+  map.load(style);
+  const buffer = await renderMap(map, {
+    width,
+    height,
+    center,
+    zoom,
+    bearing: payload.bearing || 0,
+    pitch: payload.pitch || 0,
+  });
+
+  const png = await sharp(buffer, {
+    raw: { width: width * ratio, height: height * ratio, channels: 4 },
+  }).png().toBuffer();
+
+  return { png: png.toString('base64'), zoom, center };
+}
+
+function respond(obj) {
+  process.stdout.write(JSON.stringify(obj) + '\n');
+}
+
+// jobs are handled strictly one at a time, the pool never pipelines them
+let queue = Promise.resolve();
+
+readline.createInterface({ input: process.stdin }).on('line', (line) => {
+  if (!line.trim()) {
+    return;
+  }
+  queue = queue.then(async () => {
+    let payload;
+    jobMessages = [];
+    try {
+      payload = JSON.parse(line);
+      const result = await handle(payload);
+      respond({ id: payload.id, ok: true, ...result, messages: jobMessages, rss: process.memoryUsage().rss });
+    } catch (err) {
+      respond({
+        id: payload && payload.id,
+        ok: false,
+        error: (err && err.message) || String(err),
+        messages: jobMessages,
+        rss: process.memoryUsage().rss,
+      });
+    }
+  });
+});
+
+process.stdin.on('end', () => {
+  queue.then(() => process.exit(0));
+});
+
+respond({ ready: true, rss: process.memoryUsage().rss });
@@ -13,14 +13,167 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
+import base64
+import json
+from typing import Any
+
 from fastapi import APIRouter, HTTPException, status, Depends
 from src.dependencies.dag import get_layer
+from src.dependencies.db_pool import get_pooled_connection
 from src.database.models import MapLayer
 from src.dependencies.session import verify_session_required, UserContext
+from src.fs_lru import layer_cache
+from src.structures import get_async_db_connection
 
 attribute_table_router = APIRouter()
 
 
+def encode_cursor(last_id: Any) -> str:
+    """Opaque keyset cursor; JSON keeps integer and text ids distinct."""
+    return base64.urlsafe_b64encode(json.dumps(last_id).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Any:
+    try:
+        last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor",
+        )
+    if not isinstance(last_id, (int, str)) or isinstance(last_id, bool):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor",
+        )
+    return last_id
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def gpkg_attribute_page(
+    gpkg_path: str, offset: int, limit: int, after: int | None
+) -> dict:
+    """Read one page of attributes straight from the cached GeoPackage.
+
+    Paging is done in SQLite on the fid primary key, so only the requested
+    rows are decoded and geometries are never read. With a keyset cursor the
+    cost of a page is independent of how deep it is.
+    """
+    from osgeo import ogr, gdal
+
+    gdal.UseExceptions()
+
+    data_source = ogr.Open(gpkg_path)
+    if not data_source:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Could not open cached GeoPackage",
+        )
+
+    ogr_layer = data_source.GetLayer(0)
+    if not ogr_layer:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="No layers found in cached GeoPackage",
+        )
+
+    # gpkg_ogr_contents keeps this up to date, so no scan
+    feature_count = ogr_layer.GetFeatureCount()
+
+    layer_def = ogr_layer.GetLayerDefn()
+    field_names = [
+        layer_def.GetFieldDefn(i).GetName() for i in range(layer_def.GetFieldCount())
+    ]
+
+    fid_column = ogr_layer.GetFIDColumn() or "rowid"
+    columns = ", ".join(quote_ident(c) for c in [fid_column, *field_names])
+    sql = f"SELECT {columns} FROM {quote_ident(ogr_layer.GetName())}"
+    if after is not None:
+        sql += f" WHERE {quote_ident(fid_column)} > {int(after)}"
+    # one extra row tells us whether there is a next page
+    sql += f" ORDER BY {quote_ident(fid_column)} LIMIT {limit + 1} OFFSET {offset}"
+
+    result = data_source.ExecuteSQL(sql)
+    try:
+        rows = []
+        for feature in result:
+            rows.append(
+                (
+                    feature.GetFID(),
+                    {name: feature.GetField(name) for name in field_names},
+                )
+            )
+    finally:
+        data_source.ReleaseResultSet(result)
+
+    return {
+        "rows": rows,
+        "field_names": field_names,
+        "total_count": feature_count if feature_count >= 0 else None,
+    }
+
+
+async def postgis_attribute_page(
+    layer: MapLayer, offset: int, limit: int, after: Any | None
+) -> dict:
+    """Push paging into the PostGIS source query instead of exporting it."""
+    if not layer.postgis_attribute_column_list:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"PostGIS layer {layer.name} has no attribute columns, you must re-create the layer.",
+        )
+    field_names = list(layer.postgis_attribute_column_list)
+
+    async with get_async_db_connection("attribute_table") as conn:
+        connection_uri = await conn.fetchval(
+            """
+            SELECT connection_uri
+            FROM project_postgres_connections
+            WHERE id = $1 AND soft_deleted_at IS NULL
+            """,
+            layer.postgis_connection_id,
+        )
+    if not connection_uri:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="PostGIS connection not found",
+        )
+
+    columns = ", ".join(f"t.{quote_ident(name)}" for name in field_names)
+    args: list[Any] = [limit + 1, offset]
+    where = ""
+    if after is not None:
+        args.append(after)
+        where = "WHERE t.id > $3"
+
+    async with get_pooled_connection(connection_uri) as postgis_conn:
+        records = await postgis_conn.fetch(
+            f"""
+            SELECT t.id, {columns}
+            FROM ({layer.postgis_query}) t
+            {where}
+            ORDER BY t.id
+            LIMIT $1 OFFSET $2
+            """,
+            *args,
+        )
+        total_count = layer.feature_count
+        if total_count is None:
+            total_count = await postgis_conn.fetchval(
+                f"SELECT count(*) FROM ({layer.postgis_query}) t"
+            )
+
+    rows = [
+        (record["id"], {name: record[name] for name in field_names})
+        for record in records
+    ]
+    return {"rows": rows, "field_names": field_names, "total_count": total_count}
+
+
 @attribute_table_router.get(
     "/layer/{layer_id}/attributes",
     operation_id="get_layer_attributes",
@@ -28,9 +181,15 @@ attribute_table_router = APIRouter()
 async def get_layer_attributes(
     offset: int = 0,
     limit: int = 100,
+    cursor: str | None = None,
     layer: MapLayer = Depends(get_layer),
     session: UserContext = Depends(verify_session_required),
 ):
+    """Page through a layer's attributes.
+
+    Pages can be addressed by offset, or by passing the next_cursor of the
+    previous page as cursor, which stays cheap no matter how deep the page is.
+    """
     if offset < 0:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -43,68 +202,33 @@ async def get_layer_attributes(
             detail="Limit must be between 1 and 100",
         )
 
-    async with await layer.get_ogr_source() as ogr_source:
-        from osgeo import ogr, gdal
-
-        gdal.UseExceptions()
-
-        data_source = ogr.Open(ogr_source)
-        if not data_source:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Could not open data source for layer {layer.layer_id}",
-            )
+    after = decode_cursor(cursor) if cursor is not None else None
 
-        ogr_layer = data_source.GetLayer(0)
-        if not ogr_layer:
+    if layer.type == "postgis":
+        page = await postgis_attribute_page(layer, offset, limit, after)
+    else:
+        if after is not None and not isinstance(after, int):
             raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"No layers found in data source for layer {layer.layer_id}",
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid cursor",
             )
-
-        feature_count = ogr_layer.GetFeatureCount()
-
-        layer_def = ogr_layer.GetLayerDefn()
-        field_names = []
-        for i in range(layer_def.GetFieldCount()):
-            field_def = layer_def.GetFieldDefn(i)
-            field_names.append(field_def.GetName())
-
-        ogr_layer.ResetReading()
-        for _ in range(offset):
-            feature = ogr_layer.GetNextFeature()
-            if not feature:
-                break
-
-        features_data = []
-        features_read = 0
-
-        while features_read < limit:
-            feature = ogr_layer.GetNextFeature()
-            if not feature:
-                break
-
-            attributes = {}
-            for field_name in field_names:
-                field_value = feature.GetField(field_name)
-                attributes[field_name] = field_value
-
-            features_data.append(
-                {"id": str(feature.GetFID()), "attributes": attributes}
+        async with layer_cache().layer_filename(layer.layer_id) as gpkg_path:
+            page = await asyncio.to_thread(
+                gpkg_attribute_page, gpkg_path, offset, limit, after
             )
 
-            features_read += 1
-
-        has_more = False
-        if features_read == limit:
-            next_feature = ogr_layer.GetNextFeature()
-            has_more = next_feature is not None
-
-        return {
-            "data": features_data,
-            "offset": offset,
-            "limit": limit,
-            "has_more": has_more,
-            "total_count": feature_count if feature_count >= 0 else None,
-            "field_names": field_names,
-        }
+    rows = page["rows"]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    return {
+        "data": [
+            {"id": str(row_id), "attributes": attributes} for row_id, attributes in rows
+        ],
+        "offset": offset,
+        "limit": limit,
+        "has_more": has_more,
+        "next_cursor": encode_cursor(rows[-1][0]) if has_more else None,
+        "total_count": page["total_count"],
+        "field_names": page["field_names"],
+    }
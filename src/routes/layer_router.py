@@ -13,7 +13,6 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import os
 import json
 import asyncpg
 import gzip
@@ -23,8 +22,14 @@ from fastapi import (
     status,
     Request,
     Depends,
+    Query,
+)
+from fastapi.responses import (
+    JSONResponse,
+    StreamingResponse,
+    Response,
+    RedirectResponse,
 )
-from fastapi.responses import StreamingResponse, Response, RedirectResponse
 from src.dependencies.db_pool import get_pooled_connection
 from src.dependencies.dag import get_layer
 from pydantic import BaseModel, Field
@@ -36,28 +41,43 @@ from src.dependencies.session import (
 )
 import logging
 import re
-from redis import Redis
-import tempfile
 import asyncio
-import io
-from PIL import Image
-from rio_tiler.io import Reader
-from rio_tiler.colormap import cmap
+from contextlib import AsyncExitStack
 
 from src.utils import (
     get_bucket_name,
     get_async_s3_client,
 )
-import subprocess
 from src.structures import get_async_db_connection, async_conn
 from src.postgis_tiles import fetch_mvt_tile
+from rio_tiler.errors import TileOutsideBounds
+from src.tile_cache import (
+    mvt_tile_cache,
+    mvt_tile_key,
+    postgis_query_hash,
+    raster_tile_cache,
+    raster_tile_key,
+    tile_etag,
+    etag_matches,
+)
+from botocore.exceptions import ClientError
+from src.cog_builder import cog_build_queue
+from src.pmtiles import (
+    COMPRESSION_GZIP,
+    TILE_MEDIA_TYPES,
+    is_precondition_failed,
+    pmtiles_reader,
+)
+from src.raster_tiles import (
+    raster_tile_engine,
+    RasterTileQueueFull,
+    RESCALED_COLORMAP,
+    transparent_png_tile,
+)
 from src.dependencies.layer_describer import LayerDescriber, get_layer_describer
 from opentelemetry import trace
 from src.dependencies.base_map import get_base_map_provider
 from src.utils import generate_id
-from boto3.s3.transfer import TransferConfig
-
-one_shot_config = TransferConfig(multipart_threshold=5 * 1024**3)  # 5 GiB
 
 # Global semaphore to limit concurrent social image renderings
 # This prevents OOM issues when many maps load simultaneously
@@ -66,16 +86,25 @@ SOCIAL_RENDER_SEMAPHORE = asyncio.Semaphore(2)  # Max 2 concurrent renders
 logger = logging.getLogger(__name__)
 tracer = trace.get_tracer(__name__)
 
-redis = Redis(
-    host=os.environ["REDIS_HOST"],
-    port=int(os.environ["REDIS_PORT"]),
-    decode_responses=True,
-)
-
 
 layer_router = APIRouter()
 
 
+# how long a .cog.tif request waits on a running build before answering 202
+COG_REQUEST_WAIT_SEC = 20
+
+
+def cog_build_pending_response(job: dict | None) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={
+            "detail": "COG generation in progress. Please refresh in a moment. This will take 2-3 minutes.",
+            "job": job,
+        },
+        headers={"Retry-After": "5", "Cache-Control": "no-store"},
+    )
+
+
 @layer_router.get(
     "/layer/{layer_id}.cog.tif",
     operation_id="view_layer_as_cog_tif",
@@ -94,288 +123,102 @@ async def get_layer_cog_tif(
     if layer.remote_url and layer.remote_url.endswith(".tif"):
         return RedirectResponse(url=layer.remote_url, status_code=302)
 
-    async with get_async_db_connection() as conn:
-        bucket_name = get_bucket_name()
-
-        # Check if metadata has cog_key
-        cog_key = layer.metadata_dict.get("cog_key")
+    bucket_name = get_bucket_name()
+    cog_key = layer.metadata_dict.get("cog_key")
+
+    if not cog_key:
+        queue = cog_build_queue()
+        job = queue.enqueue(layer)
+        if job["state"] in ("queued", "running"):
+            # later viewers wait on the build already underway, without a thread
+            job = await queue.wait(layer.layer_id, timeout=COG_REQUEST_WAIT_SEC)
+        if job and job["state"] == "done":
+            cog_key = job["cog_key"]
+        elif job and job["state"] == "failed":
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=job.get("error") or "COG generation failed",
+            )
+        else:
+            return cog_build_pending_response(job)
 
-        # Set up MinIO/S3 client
-        s3_client = await get_async_s3_client()
+    # Set up MinIO/S3 client
+    s3_client = await get_async_s3_client()
 
-        if not cog_key:
-            lock_key = f"lock:cog:{layer.layer_id}"
-            lock = redis.lock(lock_key, timeout=600, blocking_timeout=30)
-            acquired = lock.acquire(blocking=True)
-            if not acquired:
-                raise HTTPException(
-                    status_code=423,
-                    detail="COG generation in progress. Please refresh in a moment. This will take 2-3 minutes.",
-                )
-            try:
-                row = await conn.fetchrow(
-                    "SELECT metadata FROM map_layers WHERE layer_id = $1",
-                    layer.layer_id,
-                )
-                if (
-                    row
-                    and isinstance(row["metadata"], dict)
-                    and row["metadata"].get("cog_key")
-                ):
-                    cog_key = row["metadata"]["cog_key"]
-                else:
-                    with tempfile.TemporaryDirectory() as temp_dir:
-                        # Download the raster file
-                        s3_key: str = str(layer.s3_key or "")
-                        file_extension = os.path.splitext(s3_key)[1] if s3_key else ""
-                        local_input_file = os.path.join(
-                            temp_dir, f"layer_{layer.layer_id}{file_extension}"
-                        )
-
-                        # Download from S3 using async client
-                        s3 = await get_async_s3_client()
-                        await s3.download_file(bucket_name, s3_key, local_input_file)
-                        # Create COG file path
-                        local_cog_file = os.path.join(
-                            temp_dir, f"layer_{layer.layer_id}.cog.tif"
-                        )
-
-                        # Helper to run commands asynchronously with timeout
-                        async def run_cmd(
-                            cmd: list[str], timeout_seconds: int = 30
-                        ) -> str:
-                            proc = await asyncio.create_subprocess_exec(
-                                *cmd,
-                                stdout=asyncio.subprocess.PIPE,
-                                stderr=asyncio.subprocess.PIPE,
-                            )
-                            try:
-                                stdout_bytes, stderr_bytes = await asyncio.wait_for(
-                                    proc.communicate(), timeout=timeout_seconds
-                                )
-                            except asyncio.TimeoutError:
-                                try:
-                                    proc.kill()
-                                except Exception:
-                                    pass
-                                raise HTTPException(
-                                    status_code=status.HTTP_504_GATEWAY_TIMEOUT,
-                                    detail=f"Command timed out after {timeout_seconds}s: {' '.join(cmd)}",
-                                )
-                            if (proc.returncode or 0) != 0:
-                                stderr_text = (stderr_bytes or b"").decode(
-                                    "utf-8", "ignore"
-                                )
-                                raise subprocess.CalledProcessError(
-                                    returncode=int(proc.returncode or 1),
-                                    cmd=cmd,
-                                    output=stdout_bytes,
-                                    stderr=stderr_text,
-                                )
-                            return (stdout_bytes or b"").decode("utf-8", "ignore")
-
-                        gdalinfo_cmd = ["gdalinfo", "-json", local_input_file]
-                        try:
-                            gdalinfo_out = await run_cmd(
-                                gdalinfo_cmd, timeout_seconds=30
-                            )
-                            gdalinfo_json = json.loads(gdalinfo_out)
-                        except (subprocess.CalledProcessError, json.JSONDecodeError):
-                            raise HTTPException(
-                                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                                detail=f"Failed to process raster info for layer {layer.layer_id}.",
-                            )
-
-                        # Default input for downstream steps
-                        input_file_for_cog = local_input_file
-
-                        # Get band count from the original gdalinfo output
-                        num_bands = len(gdalinfo_json.get("bands", []))
-                        needs_color_ramp_suffix = False
-
-                        if num_bands == 1:
-                            try:
-                                # Try expanding to RGB first
-                                local_rgb_file = os.path.join(
-                                    temp_dir, f"layer_{layer.layer_id}_rgb.tif"
-                                )
-                                rgb_cmd = [
-                                    "gdal_translate",
-                                    "-of",
-                                    "GTiff",
-                                    "-expand",
-                                    "rgb",
-                                    local_input_file,
-                                    local_rgb_file,
-                                ]
-                                await run_cmd(rgb_cmd)
-                                input_file_for_cog = local_rgb_file
-                            except subprocess.CalledProcessError:
-                                # Use the existing raster_value_stats_b1 from metadata
-                                meta = layer.metadata_dict or {}
-                                if (
-                                    isinstance(meta, dict)
-                                    and "raster_value_stats_b1" in meta
-                                ):
-                                    needs_color_ramp_suffix = True
-                                # Keep input_file_for_cog as the original single-band file
-
-                        # Combine reprojection and COG creation in a single gdalwarp call
-                        # gdalwarp will reproject to EPSG:3857 and write COG directly
-                        warp_cmd_base = [
-                            "gdalwarp",
-                            "-t_srs",
-                            "EPSG:3857",
-                            "-r",
-                            "bilinear",
-                            "-of",
-                            "COG",
-                            "-co",
-                            "BLOCKSIZE=256",
-                        ]
-                        if needs_color_ramp_suffix:
-                            warp_cmd_base.extend(["-ot", "Float32"])
-                            warp_compress = ["-co", "COMPRESS=LZW"]
-                        else:
-                            warp_compress = [
-                                "-co",
-                                "COMPRESS=JPEG",
-                                "-co",
-                                "QUALITY=85",
-                            ]
-
-                        warp_cmd = (
-                            warp_cmd_base
-                            + warp_compress
-                            + [
-                                "-co",
-                                "OVERVIEWS=AUTO",
-                                input_file_for_cog,
-                                local_cog_file,
-                            ]
-                        )
-
-                        try:
-                            await run_cmd(warp_cmd)
-                        except subprocess.CalledProcessError:
-                            raise HTTPException(
-                                status_code=500,
-                                detail="COG generation failed",
-                            )
-
-                        # Upload the COG file to S3
-                        cog_key = f"cog/layer/{layer.layer_id}.cog.tif"
-                        s3 = await get_async_s3_client()
-                        await s3.upload_file(
-                            local_cog_file, bucket_name, cog_key, Config=one_shot_config
-                        )
-
-                        # Update the layer metadata with the COG key
-                        metadata = layer.metadata_dict or {}
-                        if not isinstance(metadata, dict):
-                            metadata = {}
-                        metadata["cog_key"] = cog_key
-
-                        # Update the database
-                        await conn.execute(
-                            """
-                            UPDATE map_layers
-                            SET metadata = $1
-                            WHERE layer_id = $2
-                            """,
-                            json.dumps(metadata),
-                            layer.layer_id,
-                        )
-            finally:
-                try:
-                    lock.release()
-                except Exception:
-                    pass
+    # Get the file size first to handle range requests
+    s3_head = await s3_client.head_object(Bucket=bucket_name, Key=cog_key)
+    file_size = s3_head["ContentLength"]
 
-        # Ensure cog_key is available if it was just generated
-        if not cog_key:
-            _meta = layer.metadata_dict or {}
-            cog_key = _meta.get("cog_key") if isinstance(_meta, dict) else None
-            if not cog_key:
-                # This case should ideally not be reached if generation logic is sound
-                raise HTTPException(
-                    status_code=500, detail="COG key missing after generation attempt."
-                )
+    # Check for Range header to support byte serving
+    range_header = request.headers.get("range", None) if request else None
+    start_byte = 0
+    end_byte = file_size - 1
 
-        # Get the file size first to handle range requests
-        s3_head = await s3_client.head_object(Bucket=bucket_name, Key=cog_key)
-        file_size = s3_head["ContentLength"]
+    # Parse the Range header if present
+    if range_header:
+        range_match = re.search(r"bytes=(\d+)-(\d*)", range_header)
+        if range_match:
+            start_byte = int(range_match.group(1))
+            end_group = range_match.group(2)
+            if end_group:
+                end_byte = min(int(end_group), file_size - 1)
+            else:
+                end_byte = file_size - 1
 
-        # Check for Range header to support byte serving
-        range_header = request.headers.get("range", None) if request else None
-        start_byte = 0
-        end_byte = file_size - 1
+        # Calculate content length for the range
+        content_length = end_byte - start_byte + 1
 
-        # Parse the Range header if present
-        if range_header:
-            range_match = re.search(r"bytes=(\d+)-(\d*)", range_header)
-            if range_match:
-                start_byte = int(range_match.group(1))
-                end_group = range_match.group(2)
-                if end_group:
-                    end_byte = min(int(end_group), file_size - 1)
-                else:
-                    end_byte = file_size - 1
+        # Get the specified range from S3
+        s3_response = await s3_client.get_object(
+            Bucket=bucket_name,
+            Key=cog_key,
+            Range=f"bytes={start_byte}-{end_byte}",
+        )
 
-            # Calculate content length for the range
-            content_length = end_byte - start_byte + 1
+        # Set response status and headers for partial content
+        status_code = 206  # Partial Content
+        headers = {
+            "Content-Range": f"bytes {start_byte}-{end_byte}/{file_size}",
+            "Accept-Ranges": "bytes",
+            "Content-Length": str(content_length),
+            "Content-Type": "image/tiff",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, OPTIONS",
+            "Access-Control-Allow-Headers": "Range, Content-Type",
+        }
+    else:
+        # Get the entire file
+        s3_response = await s3_client.get_object(Bucket=bucket_name, Key=cog_key)
+        status_code = 200
+        headers = {
+            "Content-Length": str(file_size),
+            "Content-Type": "image/tiff",
+            "Accept-Ranges": "bytes",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "GET, OPTIONS",
+            "Access-Control-Allow-Headers": "Range, Content-Type",
+        }
 
-            # Get the specified range from S3
-            s3_response = await s3_client.get_object(
-                Bucket=bucket_name,
-                Key=cog_key,
-                Range=f"bytes={start_byte}-{end_byte}",
-            )
+    # Create an async generator to stream the file
+    async def stream_s3_file():
+        # Get the body of the S3 object (this is a stream)
+        body = s3_response["Body"]
 
-            # Set response status and headers for partial content
-            status_code = 206  # Partial Content
-            headers = {
-                "Content-Range": f"bytes {start_byte}-{end_byte}/{file_size}",
-                "Accept-Ranges": "bytes",
-                "Content-Length": str(content_length),
-                "Content-Type": "image/tiff",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, OPTIONS",
-                "Access-Control-Allow-Headers": "Range, Content-Type",
-            }
-        else:
-            # Get the entire file
-            s3_response = await s3_client.get_object(Bucket=bucket_name, Key=cog_key)
-            status_code = 200
-            headers = {
-                "Content-Length": str(file_size),
-                "Content-Type": "image/tiff",
-                "Accept-Ranges": "bytes",
-                "Access-Control-Allow-Origin": "*",
-                "Access-Control-Allow-Methods": "GET, OPTIONS",
-                "Access-Control-Allow-Headers": "Range, Content-Type",
-            }
-
-        # Create an async generator to stream the file
-        async def stream_s3_file():
-            # Get the body of the S3 object (this is a stream)
-            body = s3_response["Body"]
-
-            # Stream the content in chunks
-            chunk_size = 8192  # 8KB chunks
-            while True:
-                chunk = await body.read(chunk_size)
-                if not chunk:
-                    break
-                yield chunk
+        # Stream the content in chunks
+        chunk_size = 8192  # 8KB chunks
+        while True:
+            chunk = await body.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
 
-            # Close the body
-            body.close()
+        # Close the body
+        body.close()
 
-        # Return a streaming response with the appropriate status and headers
-        return StreamingResponse(
-            stream_s3_file(), status_code=status_code, headers=headers
-        )
+    # Return a streaming response with the appropriate status and headers
+    return StreamingResponse(
+        stream_s3_file(), status_code=status_code, headers=headers
+    )
 
 
 @layer_router.get(
@@ -409,10 +252,14 @@ async def get_layer_pmtiles(
             detail="Vector tiles are still generating. Please refresh in a moment. This will take 2-3 minutes.",
         )
 
-    # Get the file size first to handle range requests using async S3
-    s3 = await get_async_s3_client()
-    s3_head = await s3.head_object(Bucket=bucket_name, Key=pmtiles_key)
-    file_size = s3_head["ContentLength"]
+    # size and ETag come from the cached archive header instead of a HEAD
+    archive = await pmtiles_reader().archive(pmtiles_key)
+    file_size = archive.size
+    cache_headers = pmtiles_cache_headers(archive.etag)
+    if etag_matches(request.headers.get("if-none-match"), cache_headers["ETag"]):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers
+        )
 
     # Check for Range header to support byte serving
     range_header = request.headers.get("range", None) if request else None
@@ -430,31 +277,26 @@ async def get_layer_pmtiles(
             else:
                 end_byte = file_size - 1
 
-        # Calculate content length for the range
-        content_length = end_byte - start_byte + 1
-
-    # Create streaming function that handles S3 connection properly
-    async def stream_s3_file():
-        s3 = await get_async_s3_client()
-        if range_header:
-            # Get range from S3
-            s3_response = await s3.get_object(
-                Bucket=bucket_name,
-                Key=pmtiles_key,
-                Range=f"bytes={start_byte}-{end_byte}",
-            )
-        else:
-            # Get entire file from S3
-            s3_response = await s3.get_object(Bucket=bucket_name, Key=pmtiles_key)
+    # Calculate content length for the range
+    content_length = end_byte - start_byte + 1
 
-        # Read all content and yield in chunks
-        body = s3_response["Body"]
-        chunk_size = 8192
-        while True:
-            chunk = await body.read(chunk_size)
-            if not chunk:
-                break
-            yield chunk
+    s3 = await get_async_s3_client()
+    try:
+        # IfMatch so a regenerated archive can't be spliced into this one
+        s3_response = await s3.get_object(
+            Bucket=bucket_name,
+            Key=pmtiles_key,
+            Range=f"bytes={start_byte}-{end_byte}",
+            IfMatch=archive.etag,
+        )
+    except ClientError as e:
+        if not is_precondition_failed(e):
+            raise
+        pmtiles_reader().invalidate(pmtiles_key)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="PMTiles archive changed, please retry",
+        )
 
     # Set headers based on range request
     if range_header:
@@ -464,6 +306,7 @@ async def get_layer_pmtiles(
             "Accept-Ranges": "bytes",
             "Content-Length": str(content_length),
             "Content-Type": "application/octet-stream",
+            **cache_headers,
         }
     else:
         status_code = 200
@@ -471,10 +314,129 @@ async def get_layer_pmtiles(
             "Accept-Ranges": "bytes",
             "Content-Length": str(file_size),
             "Content-Type": "application/octet-stream",
+            **cache_headers,
         }
 
     # Return a streaming response with the appropriate status and headers
-    return StreamingResponse(stream_s3_file(), status_code=status_code, headers=headers)
+    return StreamingResponse(
+        stream_s3_body(s3_response["Body"]), status_code=status_code, headers=headers
+    )
+
+
+# large enough that a whole tile or directory is usually a single read
+PMTILES_STREAM_CHUNK_BYTES = 1024 * 1024
+
+
+async def stream_s3_body(body):
+    try:
+        while True:
+            chunk = await body.read(PMTILES_STREAM_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        body.close()
+
+
+def pmtiles_cache_headers(object_etag: str, tile_id: int | None = None) -> dict:
+    """ETag and Cache-Control for bytes of a PMTiles object with object_etag."""
+    etag = object_etag.strip('"')
+    if tile_id is not None:
+        etag = f"{etag}-{tile_id}"
+    return {
+        "ETag": f'"{etag}"',
+        # archives are rewritten in place, so revalidate rather than trust forever
+        "Cache-Control": "public, max-age=300, stale-while-revalidate=3600",
+    }
+
+
+@layer_router.get(
+    "/layer/{layer_id}/{z}/{x}/{y}.pbf",
+    operation_id="get_layer_pmtiles_tile",
+)
+async def get_layer_pmtiles_tile(
+    z: int,
+    x: int,
+    y: int,
+    request: Request,
+    layer: MapLayer = Depends(get_layer),
+):
+    if layer.type != "vector":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Layer is not a vector type. Tiles are served from its PMTiles.",
+        )
+    if z < 0 or z > 31 or x < 0 or y < 0 or x >= (1 << z) or y >= (1 << z):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid tile coordinates"
+        )
+
+    pmtiles_key = layer.metadata_dict.get("pmtiles_key")
+    if not pmtiles_key:
+        raise HTTPException(
+            status_code=status.HTTP_423_LOCKED,
+            detail="Vector tiles are still generating. Please refresh in a moment. This will take 2-3 minutes.",
+        )
+
+    reader = pmtiles_reader()
+    location = await reader.locate_tile(pmtiles_key, z, x, y)
+    if location is None:
+        # MapLibre treats 204 as an empty tile
+        archive = await reader.archive(pmtiles_key)
+        return Response(
+            status_code=status.HTTP_204_NO_CONTENT,
+            headers={
+                "Access-Control-Allow-Origin": "*",
+                **pmtiles_cache_headers(archive.etag),
+            },
+        )
+
+    archive = location.archive
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Vary": "Accept-Encoding",
+        **pmtiles_cache_headers(archive.etag, location.tile_id),
+    }
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    s3 = await get_async_s3_client()
+    try:
+        s3_response = await s3.get_object(
+            Bucket=get_bucket_name(),
+            Key=pmtiles_key,
+            Range=f"bytes={location.offset}-{location.offset + location.length - 1}",
+            IfMatch=archive.etag,
+        )
+    except ClientError as e:
+        if not is_precondition_failed(e):
+            raise
+        # regenerated since we resolved the tile; the next request re-reads it
+        reader.invalidate(pmtiles_key)
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="PMTiles archive changed, please retry",
+        )
+
+    media_type = TILE_MEDIA_TYPES.get(
+        archive.header.tile_type, "application/octet-stream"
+    )
+    compression = archive.header.tile_compression
+    accepts_gzip = "gzip" in request.headers.get("accept-encoding", "").lower()
+    if compression == COMPRESSION_GZIP and not accepts_gzip:
+        body = s3_response["Body"]
+        try:
+            content = gzip.decompress(await body.read())
+        finally:
+            body.close()
+        return Response(content=content, media_type=media_type, headers=headers)
+
+    if compression == COMPRESSION_GZIP:
+        headers["Content-Encoding"] = "gzip"
+    headers["Content-Length"] = str(location.length)
+    return StreamingResponse(
+        stream_s3_body(s3_response["Body"]), media_type=media_type, headers=headers
+    )
 
 
 @layer_router.get(
@@ -595,51 +557,59 @@ async def get_raster_xyz_tile(
     # prefer COG key from metadata when present; fall back to original s3_key
     metadata = layer.metadata_dict or {}
     s3_key = metadata.get("cog_key") or layer.s3_key
+    if not metadata.get("cog_key") and layer.s3_key:
+        job = cog_build_queue().enqueue(layer)
+        if job["state"] == "done":
+            s3_key = job["cog_key"]
+        # otherwise keep rendering from the original while the COG builds;
+        # a placeholder would be treated as a real tile and never refetched
+
+    rescale = None
+    colormap = None
+    if "raster_value_stats_b1" in metadata:
+        rescale = (
+            metadata["raster_value_stats_b1"]["min"],
+            metadata["raster_value_stats_b1"]["max"],
+        )
+        colormap = RESCALED_COLORMAP
 
-    bucket = get_bucket_name()
-    s3 = await get_async_s3_client(signature_version="s3v4")
-    asset_url = await s3.generate_presigned_url(
-        "get_object",
-        Params={"Bucket": bucket, "Key": s3_key},
-        ExpiresIn=180,  # 3 minutes
-    )
-
-    try:
-        with Reader(asset_url) as src:
-            img = src.tile(x, y, z)
+    headers = {
+        "Cache-Control": "public, max-age=3600",
+        "Access-Control-Allow-Origin": "*",
+    }
 
-            if "raster_value_stats_b1" in metadata:
-                min_val = metadata["raster_value_stats_b1"]["min"]
-                max_val = metadata["raster_value_stats_b1"]["max"]
+    cache = raster_tile_cache()
+    cache_key = raster_tile_key(layer.layer_id, s3_key, z, x, y, colormap, rescale)
+    content = await cache.get(cache_key)
 
-                img.rescale(in_range=((min_val, max_val),), out_range=((0, 255),))
+    if content is None:
+        try:
+            content = await raster_tile_engine().render_tile(s3_key, x, y, z, rescale)
+            await cache.set(cache_key, content)
+        except RasterTileQueueFull:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many raster tiles are being rendered, retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        except TileOutsideBounds:
+            # no coverage here and there never will be, so remember that
+            content = transparent_png_tile()
+            await cache.set(cache_key, content)
+        except Exception:
+            # Return a fully transparent 256x256 PNG, but don't cache what
+            # might be a transient S3 or GDAL failure
+            return Response(
+                content=transparent_png_tile(),
+                media_type="image/png",
+                headers={**headers, "Cache-Control": "no-store"},
+            )
 
-                cm = cmap.get("spectral_r")
-                content = img.render(img_format="PNG", colormap=cm)
-            else:
-                # png has alpha support; expect newer rio-tiler which returns bytes
-                content = img.render(img_format="PNG")
+    headers["ETag"] = tile_etag(content)
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
 
-        return Response(
-            content=content,
-            media_type="image/png",
-            headers={
-                "Cache-Control": "public, max-age=3600",
-                "Access-Control-Allow-Origin": "*",
-            },
-        )
-    except Exception:
-        # Return a fully transparent 256x256 PNG
-        buf = io.BytesIO()
-        Image.new("RGBA", (256, 256), (0, 0, 0, 0)).save(buf, format="PNG")
-        return Response(
-            content=buf.getvalue(),
-            media_type="image/png",
-            headers={
-                "Cache-Control": "public, max-age=3600",
-                "Access-Control-Allow-Origin": "*",
-            },
-        )
+    return Response(content=content, media_type="image/png", headers=headers)
 
 
 @layer_router.get(
@@ -658,6 +628,17 @@ async def get_layer_mvt_tile(
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid tile coordinates"
         )
+    cache = mvt_tile_cache()
+    query_hash = postgis_query_hash(
+        layer.postgis_query, layer.postgis_attribute_column_list
+    )
+    cache_key = mvt_tile_key(layer.layer_id, query_hash, z, x, y)
+
+    # tiles are cached pre-gzipped; empty tiles are cached as b""
+    cached_tile = await cache.get(cache_key)
+    if cached_tile is not None:
+        return mvt_tile_response(cached_tile, request)
+
     async with get_async_db_connection("mvt") as conn:
         # Get PostGIS connection details (authorization handled by get_layer)
         connection_details = await conn.fetchrow(
@@ -717,96 +698,273 @@ async def get_layer_mvt_tile(
         if mvt_data is None:
             mvt_data = b""
 
-        # Check if client accepts gzip encoding and if there's data to compress
-        accept_encoding = request.headers.get("accept-encoding", "").lower()
-        should_compress = "gzip" in accept_encoding and len(mvt_data) > 0
+        gzipped_tile = gzip.compress(mvt_data, compresslevel=6) if mvt_data else b""
+        await cache.set(cache_key, gzipped_tile)
 
-        if should_compress:
-            # Compress MVT data with gzip for better performance
-            compressed_data = gzip.compress(mvt_data, compresslevel=6)
-            return Response(
-                content=compressed_data,
-                media_type="application/vnd.mapbox-vector-tile",
-                headers={
-                    "Access-Control-Allow-Origin": "*",
-                    "Cache-Control": "public, max-age=3600",
-                    "Content-Encoding": "gzip",
-                    "Vary": "Accept-Encoding",
-                },
-            )
-        else:
-            # Return uncompressed data
-            return Response(
-                content=mvt_data,
-                media_type="application/vnd.mapbox-vector-tile",
-                headers={
-                    "Access-Control-Allow-Origin": "*",
-                    "Cache-Control": "public, max-age=3600",
-                    "Vary": "Accept-Encoding",
-                },
-            )
+        return mvt_tile_response(gzipped_tile, request)
 
     except asyncpg.exceptions.InternalServerError as e:
         # Re-raise any other internal server errors that aren't handled by the fallback
         raise e
 
 
+def mvt_tile_response(gzipped_tile: bytes, request: Request) -> Response:
+    headers = {
+        "Access-Control-Allow-Origin": "*",
+        "Cache-Control": "public, max-age=3600",
+        "Vary": "Accept-Encoding",
+    }
+    # Check if client accepts gzip encoding and if there's data to compress
+    accept_encoding = request.headers.get("accept-encoding", "").lower()
+    if not gzipped_tile:
+        content = b""
+    elif "gzip" in accept_encoding:
+        content = gzipped_tile
+        headers["Content-Encoding"] = "gzip"
+    else:
+        content = gzip.decompress(gzipped_tile)
+
+    return Response(
+        content=content,
+        media_type="application/vnd.mapbox-vector-tile",
+        headers=headers,
+    )
+
+
 @layer_router.get(
-    "/layer/{layer_id}.geojson",
-    operation_id="view_layer_as_geojson",
+    "/tiles/cache/stats",
+    operation_id="get_tile_cache_stats",
 )
-async def get_layer_geojson(
-    layer: MapLayer = Depends(get_layer),
+async def get_tile_cache_stats(
+    session: UserContext = Depends(verify_session_required),
 ):
-    # Check if layer is a vector type
+    return {
+        "mvt": mvt_tile_cache().stats(),
+        "raster": raster_tile_cache().stats(),
+        "raster_engine": raster_tile_engine().stats(),
+        "pmtiles": pmtiles_reader().stats(),
+    }
+
+
+# ogr2ogr writes into a 64 KiB pipe buffer, so this bounds memory per export
+GEOJSON_STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def parse_bbox_param(bbox: str | None) -> list[str] | None:
+    if bbox is None:
+        return None
+    try:
+        xmin, ymin, xmax, ymax = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="bbox must be four comma-separated numbers: xmin,ymin,xmax,ymax",
+        )
+    if xmin > xmax or ymin > ymax:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="bbox must be ordered xmin,ymin,xmax,ymax",
+        )
+    return [str(xmin), str(ymin), str(xmax), str(ymax)]
+
+
+def parse_fields_param(fields: str | None) -> list[str] | None:
+    if fields is None:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    if not names:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="fields must name at least one attribute",
+        )
+    return names
+
+
+def ogr_field_names(ogr_source: str) -> list[str]:
+    from osgeo import gdal, ogr
+
+    gdal.UseExceptions()
+    data_source = ogr.Open(ogr_source)
+    layer_def = data_source.GetLayer(0).GetLayerDefn()
+    return [
+        layer_def.GetFieldDefn(i).GetName() for i in range(layer_def.GetFieldCount())
+    ]
+
+
+async def stream_layer_as_geojson(
+    layer: MapLayer,
+    driver: str,
+    media_type: str,
+    filename: str,
+    bbox: str | None,
+    fields: str | None,
+) -> StreamingResponse:
+    """Pipe ogr2ogr's /vsistdout/ output straight into a StreamingResponse.
+
+    The first chunk is read before the response starts so a conversion that
+    fails immediately still surfaces as an HTTP error instead of an empty 200.
+    """
     if layer.type != "vector":
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Layer is not a vector type. GeoJSON format is only available for vector data.",
         )
 
-    # Get unified OGR source (works for S3 and remote URLs)
-    async with await layer.get_ogr_source() as ogr_source:
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Convert to GeoJSON using ogr2ogr with unified source
-            local_geojson_file = os.path.join(
-                temp_dir, f"layer_{layer.layer_id}.geojson"
-            )
-            ogr_cmd = [
-                "ogr2ogr",
-                "-f",
-                "GeoJSON",
-                "-t_srs",
-                "EPSG:4326",  # Ensure coordinates are in WGS84
-                "-lco",
-                "COORDINATE_PRECISION=6",  # ~1m precision at equator
-                "-skipfailures",  # Skip features with NULL geometries or other issues
-                local_geojson_file,
-                ogr_source,
-            ]
-
-            process = await asyncio.create_subprocess_exec(*ogr_cmd)
+    spat = parse_bbox_param(bbox)
+    select = parse_fields_param(fields)
+
+    ogr_cmd = [
+        "ogr2ogr",
+        "-f",
+        driver,
+        "-t_srs",
+        "EPSG:4326",  # Ensure coordinates are in WGS84
+        "-lco",
+        "COORDINATE_PRECISION=6",  # ~1m precision at equator
+        "-skipfailures",  # Skip features with NULL geometries or other issues
+    ]
+    if spat is not None:
+        # bbox is given in WGS84 regardless of the source projection
+        ogr_cmd += ["-spat", *spat, "-spat_srs", "EPSG:4326"]
+    if select is not None:
+        ogr_cmd += ["-select", ",".join(select)]
+
+    # the OGR source (possibly a downloaded temp file) has to outlive this
+    # handler, so the stream owns it and closes it when the body is done
+    stack = AsyncExitStack()
+    try:
+        ogr_source = await stack.enter_async_context(await layer.get_ogr_source())
+        if select is not None:
+            # unknown names would otherwise only fail inside ogr2ogr, as a 500
+            known = await asyncio.to_thread(ogr_field_names, ogr_source)
+            unknown = [name for name in select if name not in known]
+            if unknown:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Unknown fields: {', '.join(unknown)}",
+                )
+        process = await asyncio.create_subprocess_exec(
+            *ogr_cmd,
+            "/vsistdout/",
+            ogr_source,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except BaseException:
+        await stack.aclose()
+        raise
+
+    async def kill_process():
+        if process.returncode is None:
+            process.kill()
             await process.wait()
-            if process.returncode != 0:
+
+    stack.push_async_callback(kill_process)
+
+    # -skipfailures can be chatty, keep draining stderr so the pipe never fills
+    stderr_tail = bytearray()
+
+    async def drain_stderr():
+        while chunk := await process.stderr.read(GEOJSON_STREAM_CHUNK_BYTES):
+            stderr_tail.extend(chunk)
+            del stderr_tail[:-4096]
+
+    stderr_task = asyncio.create_task(drain_stderr())
+    stack.callback(stderr_task.cancel)
+
+    try:
+        first_chunk = await process.stdout.read(GEOJSON_STREAM_CHUNK_BYTES)
+        if not first_chunk:
+            returncode = await process.wait()
+            await stderr_task
+            if returncode != 0:
+                logger.error(
+                    "ogr2ogr GeoJSON export of %s failed: %s",
+                    layer.layer_id,
+                    stderr_tail.decode(errors="replace"),
+                )
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     detail="Failed to convert layer to GeoJSON format",
                 )
+    except BaseException:
+        await stack.aclose()
+        raise
+
+    async def stream_ogr_output():
+        try:
+            chunk = first_chunk
+            while chunk:
+                yield chunk
+                chunk = await process.stdout.read(GEOJSON_STREAM_CHUNK_BYTES)
+            returncode = await process.wait()
+            if returncode != 0:
+                # headers are long gone, the client sees a truncated body
+                logger.error(
+                    "ogr2ogr GeoJSON export of %s failed mid-stream: %s",
+                    layer.layer_id,
+                    stderr_tail.decode(errors="replace"),
+                )
+        finally:
+            # also runs when the client disconnects, killing ogr2ogr early
+            await stack.aclose()
+
+    return StreamingResponse(
+        stream_ogr_output(),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Access-Control-Allow-Origin": "*",
+            "Cache-Control": "public, max-age=86400",  # Cache for 24 hours
+        },
+    )
 
-            # Read the GeoJSON file and return it
-            with open(local_geojson_file, "r") as f:
-                geojson_content = f.read()
 
-        # Return the GeoJSON with appropriate headers and cache control
-        return Response(
-            content=geojson_content,
-            media_type="application/geo+json",
-            headers={
-                "Content-Disposition": f'attachment; filename="{layer.name}.geojson"',
-                "Access-Control-Allow-Origin": "*",
-                "Cache-Control": "public, max-age=86400",  # Cache for 24 hours
-            },
-        )
+@layer_router.get(
+    "/layer/{layer_id}.geojson",
+    operation_id="view_layer_as_geojson",
+)
+async def get_layer_geojson(
+    layer: MapLayer = Depends(get_layer),
+    bbox: str | None = Query(
+        None, description="Only features intersecting xmin,ymin,xmax,ymax (EPSG:4326)"
+    ),
+    fields: str | None = Query(
+        None, description="Comma-separated attribute names to include"
+    ),
+):
+    return await stream_layer_as_geojson(
+        layer,
+        driver="GeoJSON",
+        media_type="application/geo+json",
+        filename=f"{layer.name}.geojson",
+        bbox=bbox,
+        fields=fields,
+    )
+
+
+@layer_router.get(
+    "/layer/{layer_id}.geojsonl",
+    operation_id="view_layer_as_geojsonseq",
+)
+async def get_layer_geojsonseq(
+    layer: MapLayer = Depends(get_layer),
+    bbox: str | None = Query(
+        None, description="Only features intersecting xmin,ymin,xmax,ymax (EPSG:4326)"
+    ),
+    fields: str | None = Query(
+        None, description="Comma-separated attribute names to include"
+    ),
+):
+    """Newline-delimited GeoJSON, one Feature per line, for incremental clients."""
+    return await stream_layer_as_geojson(
+        layer,
+        driver="GeoJSONSeq",
+        media_type="application/x-ndjson",
+        filename=f"{layer.name}.geojsonl",
+        bbox=bbox,
+        fields=fields,
+    )
 
 
 async def describe_layer_internal(
@@ -837,7 +995,7 @@ async def describe_layer_internal(
             """
             SELECT id, title, description, owner_uuid
             FROM user_mundiai_maps
-            WHERE $1 = ANY(layers) AND soft_deleted_at IS NULL
+            WHERE layers @> ARRAY[$1]::varchar[] AND soft_deleted_at IS NULL
             ORDER BY created_on DESC
             """,
             layer_id,
@@ -1058,6 +1216,17 @@ async def update_layer(
             layer.layer_id,
         )
 
+    if layer.type == "postgis":
+        # drop tiles rendered from any other version of this layer's query
+        await mvt_tile_cache().invalidate(
+            (layer.layer_id,),
+            keep=[
+                postgis_query_hash(
+                    layer.postgis_query, layer.postgis_attribute_column_list
+                )
+            ],
+        )
+
     return LayerUpdateResponse(
         layer_id=layer.layer_id,
         name=update_data.name,
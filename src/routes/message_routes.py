@@ -27,6 +27,8 @@ from opentelemetry import trace
 import io
 import csv
 import asyncio
+import copy
+import functools
 import traceback
 from src.dependencies.dag import get_map
 from fastapi import UploadFile
@@ -74,6 +76,9 @@ from src.geoprocessing.dispatch import (
 )
 from src.dependencies.conversation import get_or_create_conversation
 from src.duckdb import execute_duckdb_query
+from src.chat_history import ConversationHistory
+from src.tile_cache import mvt_tile_cache, postgis_query_hash
+from src.tool_scheduler import tool_call_scheduler
 from src.utils import get_async_s3_client, get_bucket_name
 from src.dependencies.postgis import get_postgis_provider
 from src.dependencies.layer_describer import LayerDescriber, get_layer_describer
@@ -281,68 +286,64 @@ async def get_map_tree(
     # TODO: if you add a message to a previous map, it interrupts the chain.
     # adding a message should be considered creating a new node in the DAG...
     async with get_async_db_connection("describe_map_tree") as conn:
-        # Collect all map IDs in the parent chain
-        map_ids: list[str] = []
-        current_map_id: str | None = leaf_map_id
-
-        while current_map_id:
-            map_ids.insert(0, current_map_id)
-
-            # Get parent map ID
-            parent_result = await conn.fetchrow(
-                """
-                SELECT parent_map_id
+        # Walk the whole parent chain and diff each map against its parent in
+        # one round trip, however long the history is. path guards against
+        # loops in the DAG; a row whose parent is already on its path is one.
+        db_maps = await conn.fetch(
+            """
+            WITH RECURSIVE lineage AS (
+                SELECT id, parent_map_id, fork_reason, created_on, layers,
+                       0 AS depth, ARRAY[id]::varchar[] AS path
                 FROM user_mundiai_maps
                 WHERE id = $1 AND soft_deleted_at IS NULL
-                """,
-                current_map_id,
+                UNION ALL
+                SELECT m.id, m.parent_map_id, m.fork_reason, m.created_on, m.layers,
+                       l.depth + 1, l.path || m.id
+                FROM user_mundiai_maps m
+                JOIN lineage l ON m.id = l.parent_map_id
+                WHERE m.soft_deleted_at IS NULL AND NOT m.id = ANY(l.path)
+            ),
+            chain AS (
+                SELECT id, fork_reason, created_on, depth,
+                       COALESCE(parent_map_id = ANY(path), false) AS is_loop,
+                       COALESCE(layers, '{}') AS layers,
+                       LAG(COALESCE(layers, '{}')) OVER (ORDER BY depth DESC)
+                           AS prev_layers
+                FROM lineage
             )
-            if not parent_result:
-                break
-
-            if parent_result["parent_map_id"] in map_ids:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail="Encountered loop in DAG inside describe_map_tree",
-                )
-
-            current_map_id = parent_result["parent_map_id"]
-
-        # Fetch all map data including layers
-        db_maps = await conn.fetch(
-            """
-            SELECT id, fork_reason, created_on, layers
-            FROM user_mundiai_maps
-            WHERE id = ANY($1) AND soft_deleted_at IS NULL
-            ORDER BY array_position($1, id)
+            SELECT c.id, c.fork_reason, c.created_on, c.is_loop,
+                   c.prev_layers IS NOT NULL AS has_previous,
+                   (
+                       SELECT COALESCE(json_agg(json_build_object(
+                           'layer_id', ml.layer_id, 'name', ml.name, 'type', ml.type,
+                           'geometry_type', ml.geometry_type,
+                           'feature_count', ml.feature_count
+                       ) ORDER BY ml.layer_id), '[]')
+                       FROM map_layers ml
+                       WHERE ml.layer_id = ANY(c.layers)
+                         AND NOT ml.layer_id = ANY(c.prev_layers)
+                   ) AS added_layers,
+                   (
+                       SELECT COALESCE(json_agg(json_build_object(
+                           'layer_id', ml.layer_id, 'name', ml.name, 'type', ml.type,
+                           'geometry_type', ml.geometry_type,
+                           'feature_count', ml.feature_count
+                       ) ORDER BY ml.layer_id), '[]')
+                       FROM map_layers ml
+                       WHERE ml.layer_id = ANY(c.prev_layers)
+                         AND NOT ml.layer_id = ANY(c.layers)
+                   ) AS removed_layers
+            FROM chain c
+            ORDER BY c.depth DESC
             """,
-            map_ids,
+            leaf_map_id,
         )
-        db_maps: List[MundiMap] = [MundiMap(**dict(map)) for map in db_maps]
-
-        # Fetch all unique layer IDs from all maps in the chain
-        all_layer_ids = set()
-        for db_map in db_maps:
-            if db_map.layers:
-                all_layer_ids.update(db_map.layers)
-
-        # Fetch all layer data
-        layers_by_id = {}
-        if all_layer_ids:
-            db_layers = await conn.fetch(
-                """
-                SELECT layer_id, owner_uuid, name, s3_key, type,
-                       postgis_connection_id, postgis_query, metadata, bounds, geometry_type,
-                       feature_count, size_bytes, source_map_id, created_on, last_edited
-                FROM map_layers
-                WHERE layer_id = ANY($1)
-                """,
-                list(all_layer_ids),
+
+        if any(row["is_loop"] for row in db_maps):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Encountered loop in DAG inside describe_map_tree",
             )
-            for layer_row in db_layers:
-                layer_dict = dict(layer_row)
-                layer_dict["metadata_json"] = layer_dict.pop("metadata")
-                layers_by_id[layer_dict["layer_id"]] = MapLayer(**layer_dict)
 
         # Fetch all messages from the conversation if conversation_id is provided
         db_messages = []
@@ -391,44 +392,204 @@ async def get_map_tree(
 
     # Create MapNode objects with layer diffs
     nodes: List[MapNode] = []
-    for i, map in enumerate(db_maps):
-        # Calculate diff from previous map
+    for db_map in db_maps:
         diff_from_previous = None
-        if i > 0:
-            prev_map = db_maps[i - 1]
-            prev_layers = set(prev_map.layers or [])
-            current_layers = set(map.layers or [])
-
-            added_layer_ids = current_layers - prev_layers
-            removed_layer_ids = prev_layers - current_layers
-
-            added_layers = [
-                LayerInfo.from_map_layer(layers_by_id[layer_id])
-                for layer_id in added_layer_ids
-                if layer_id in layers_by_id
-            ]
-            removed_layers = [
-                LayerInfo.from_map_layer(layers_by_id[layer_id])
-                for layer_id in removed_layer_ids
-                if layer_id in layers_by_id
-            ]
-
+        if db_map["has_previous"]:
             diff_from_previous = LayerDiff(
-                added_layers=added_layers, removed_layers=removed_layers
+                added_layers=[
+                    LayerInfo(**layer) for layer in json.loads(db_map["added_layers"])
+                ],
+                removed_layers=[
+                    LayerInfo(**layer)
+                    for layer in json.loads(db_map["removed_layers"])
+                ],
             )
 
-        node = MapNode(
-            map_id=map.id,
-            messages=messages_by_map[map.id],
-            fork_reason=map.fork_reason,
-            created_on=map.created_on.isoformat(),
-            diff_from_previous=diff_from_previous,
+        nodes.append(
+            MapNode(
+                map_id=db_map["id"],
+                messages=messages_by_map[db_map["id"]],
+                fork_reason=db_map["fork_reason"],
+                created_on=db_map["created_on"].isoformat(),
+                diff_from_previous=diff_from_previous,
+            )
         )
-        nodes.append(node)
 
     return MapTreeResponse(project_id=project_id, tree=nodes)
 
 
+# tools defined here rather than in tools.json or as pydantic tools; built once
+CORE_TOOL_DEFINITIONS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "new_layer_from_postgis",
+            "description": "Creates a new layer, given a PostGIS connection and query, and adds it to the map so the user can see it. Layer will automatically pull data from PostGIS. Modify style using the set_layer_style tool.",
+            "strict": True,
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "postgis_connection_id": {
+                        "type": "string",
+                        "description": "Unique PostGIS connection ID used as source",
+                    },
+                    "query": {
+                        "type": "string",
+                        "description": "SQL query to execute against PostGIS database for this layer, should list fetched columns for attributes that might be used for symbology (+ shape geometry). This query MUST alias the geometry column as 'geom' AND have a unique numeric id aliased as 'id'. Include newlines+spaces at ~55 column wrap",
+                    },
+                    "layer_name": {
+                        "type": "string",
+                        "description": "Sets a human-readable name for this layer. This name will appear in the layer list/legend for the user.",
+                    },
+                },
+                "required": [
+                    "postgis_connection_id",
+                    "query",
+                    "layer_name",
+                ],
+                "additionalProperties": False,
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "add_layer_to_map",
+            "description": "Shows a newly created or existing unattached layer on the user's current map and layer list. Use this after a geoprocessing step that creates a layer, or if the user asks to see an existing layer that isn't currently on their map.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "layer_id": {
+                        "type": "string",
+                        "description": "The ID of the layer to add to the map. Choose from available unattached layers.",
+                    },
+                    "new_name": {
+                        "type": "string",
+                        "description": "Sets a new human-readable name for this layer. This name will appear in the layer list/legend for the user.",
+                    },
+                },
+                "required": ["layer_id", "new_name"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "set_layer_style",
+            "description": "Creates a new style for a layer with MapLibre JSON layers and immediately applies it as the active style",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "layer_id": {
+                        "type": "string",
+                        "description": "The ID of the layer to create and apply a style for",
+                    },
+                    "maplibre_json_layers_str": {
+                        "type": "string",
+                        "description": 'JSON string of MapLibre layer objects. Example: [{"id": "LZJ5RmuZr6qN-line", "type": "line", "source": "LZJ5RmuZr6qN", "paint": {"line-color": "#1E90FF"}}]',
+                    },
+                },
+                "required": ["layer_id", "maplibre_json_layers_str"],
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "query_duckdb_sql",
+            "description": "Execute a SQL query against vector layer data using DuckDB. Use query_postgis_database for layers created from PostGIS connections instead.",
+            "strict": True,
+            "parameters": {
+                "type": "object",
+                "required": ["layer_ids", "sql_query", "head_n_rows"],
+                "properties": {
+                    "layer_ids": {
+                        "type": "array",
+                        "description": "Load these vector layer IDs as tables",
+                        "items": {"type": "string"},
+                    },
+                    "sql_query": {
+                        "type": "string",
+                        "description": "DuckDB-flavored SELECT ... SQL query. Include newlines+spaces at ~55 column wrap for readability e.g. SELECT name_en,county\n    FROM LCH6Na2SBvJr\n    ORDER BY id",
+                    },
+                    "head_n_rows": {
+                        "type": "number",
+                        "description": "Truncate result to n rows (increase gingerly, MUST specify returned columns), n=20 is good",
+                    },
+                },
+                "additionalProperties": False,
+            },
+        },
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "query_postgis_database",
+            "description": "Execute SQL queries on connected PostgreSQL/PostGIS databases. Use for data analysis, spatial queries, and exploring database tables. The query MUST include a LIMIT clause with a value less than 1000.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "postgis_connection_id": {
+                        "type": "string",
+                        "description": "User's PostGIS connection ID to query against",
+                    },
+                    "sql_query": {
+                        "type": "string",
+                        "description": "SQL query to execute. Use newlines+spaces at ~55 column wrap. Examples: 'SELECT COUNT(*) FROM table_name', 'SELECT * FROM spatial_table LIMIT 10', 'SELECT column_name FROM information_schema.columns WHERE table_name = \"my_table\"'. Use standard SQL syntax.",
+                    },
+                },
+                "required": ["postgis_connection_id", "sql_query"],
+                "additionalProperties": False,
+            },
+        },
+    },
+]
+
+
+async def fetch_unattached_layer_enum(conn, user_id: str) -> dict[str, str]:
+    """The user's most recent layers that aren't on any of their maps."""
+    with tracer.start_as_current_span("kue.fetch_unattached_layers"):
+        unattached_layers = await conn.fetch(
+            """
+            SELECT ml.layer_id, ml.created_on, ml.last_edited, ml.type, ml.name
+            FROM map_layers ml
+            WHERE ml.owner_uuid = $1
+            AND NOT EXISTS (
+                SELECT 1 FROM user_mundiai_maps m
+                WHERE m.layers @> ARRAY[ml.layer_id] AND m.owner_uuid = $2
+            )
+            ORDER BY ml.created_on DESC
+            LIMIT 10
+            """,
+            user_id,
+            user_id,
+        )
+
+    layer_enum = {}
+    for layer in unattached_layers:
+        layer_name = layer.get("name") or f"Unnamed Layer ({layer['layer_id'][:8]})"
+        layer_enum[layer["layer_id"]] = (
+            f"{layer_name} (type: {layer.get('type', 'unknown')}, created: {layer['created_on']})"
+        )
+    return layer_enum
+
+
+def build_tools_payload(static_tools: list[dict], layer_enum: dict) -> list[dict]:
+    """Tool definitions for one completion, with unattached layers as the enum."""
+    if not layer_enum:
+        return static_tools
+    payload = []
+    for tool in static_tools:
+        if tool["function"]["name"] == "add_layer_to_map":
+            # the static definitions are shared by every interaction
+            tool = copy.deepcopy(tool)
+            tool["function"]["parameters"]["properties"]["layer_id"]["enum"] = list(
+                layer_enum.keys()
+            )
+        payload.append(tool)
+    return payload
+
+
 class RecoverableToolCallError(Exception):
     def __init__(self, message: str, tool_call_id: str):
         self.message = message
@@ -436,6 +597,15 @@ class RecoverableToolCallError(Exception):
         super().__init__(message)
 
 
+# tools that never change a map, so they may run alongside its mutations
+READ_ONLY_TOOL_NAMES = {
+    "query_duckdb_sql",
+    "query_postgis_database",
+    "zoom_to_bounds",
+    "summarize_situation",
+}
+
+
 def is_layer_id(s: str) -> bool:
     return isinstance(s, str) and s[0] == "L" and len(s) == 12
 
@@ -706,6 +876,7 @@ async def process_chat_interaction_task(
                 message.model_dump() if isinstance(message, BaseModel) else message
             )
 
+            message_json = json.dumps(message_dict)
             await conn.execute(
                 """
                 INSERT INTO chat_completion_messages
@@ -714,9 +885,31 @@ async def process_chat_interaction_task(
                 """,
                 map_id,
                 user_id,
-                json.dumps(message_dict),
+                message_json,
                 conversation.id,
             )
+            history.append(message_json)
+
+        # Load the conversation once, the loop below keeps it up to date
+        with tracer.start_as_current_span("kue.fetch_messages"):
+            history = await ConversationHistory.load(conn, conversation.id, user_id)
+
+        geoprocessing_tools = get_tools()
+        geoprocessing_function_names = {
+            tool["function"]["name"] for tool in geoprocessing_tools
+        }
+        static_tools = [
+            *CORE_TOOL_DEFINITIONS,
+            *(
+                tool_from_pyd(fn, arg_model)
+                for fn, arg_model, _mundi_model in pydantic_tool_calls.values()
+            ),
+            *geoprocessing_tools,
+        ]
+
+        # only tools that can create or attach layers change the unattached set
+        layers_may_have_changed = True
+        layer_enum = {}
 
         with tracer.start_as_current_span("app.process_chat_interaction") as span:
             for i in range(25):
@@ -725,192 +918,23 @@ async def process_chat_interaction_task(
                     redis.delete(f"messages:{map_id}:cancelled")
                     break
 
-                # Refresh messages to include any new system messages we just added
-                with tracer.start_as_current_span("kue.fetch_messages"):
-                    updated_messages_response = await get_all_conversation_messages(
-                        conversation.id, session
+                # keep other /send requests out while the loop is still running
+                redis.expire(f"chat_lock:{conversation.id}", 30)
+                # the lock can still lapse during a long tool call
+                if await history.sync(conn):
+                    logger.warning(
+                        "conversation %s changed behind the agent loop, reloaded",
+                        conversation.id,
                     )
+                openai_messages = history.openai_messages()
 
-                openai_messages = [
-                    msg.message_json for msg in updated_messages_response
-                ]
-
-                with tracer.start_as_current_span("kue.fetch_unattached_layers"):
-                    unattached_layers = await conn.fetch(
-                        """
-                        SELECT ml.layer_id, ml.created_on, ml.last_edited, ml.type, ml.name
-                        FROM map_layers ml
-                        WHERE ml.owner_uuid = $1
-                        AND NOT EXISTS (
-                            SELECT 1 FROM user_mundiai_maps m
-                            WHERE ml.layer_id = ANY(m.layers) AND m.owner_uuid = $2
-                        )
-                        ORDER BY ml.created_on DESC
-                        LIMIT 10
-                        """,
-                        user_id,
-                        user_id,
-                    )
-
-                layer_enum = {}
-                for layer in unattached_layers:
-                    layer_name = (
-                        layer.get("name") or f"Unnamed Layer ({layer['layer_id'][:8]})"
-                    )
-                    layer_enum[layer["layer_id"]] = (
-                        f"{layer_name} (type: {layer.get('type', 'unknown')}, created: {layer['created_on']})"
-                    )
+                if layers_may_have_changed:
+                    layer_enum = await fetch_unattached_layer_enum(conn, user_id)
+                    layers_may_have_changed = False
 
                 client = get_openai_client(request)
 
-                tools_payload = [
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "new_layer_from_postgis",
-                            "description": "Creates a new layer, given a PostGIS connection and query, and adds it to the map so the user can see it. Layer will automatically pull data from PostGIS. Modify style using the set_layer_style tool.",
-                            "strict": True,
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "postgis_connection_id": {
-                                        "type": "string",
-                                        "description": "Unique PostGIS connection ID used as source",
-                                    },
-                                    "query": {
-                                        "type": "string",
-                                        "description": "SQL query to execute against PostGIS database for this layer, should list fetched columns for attributes that might be used for symbology (+ shape geometry). This query MUST alias the geometry column as 'geom' AND have a unique numeric id aliased as 'id'. Include newlines+spaces at ~55 column wrap",
-                                    },
-                                    "layer_name": {
-                                        "type": "string",
-                                        "description": "Sets a human-readable name for this layer. This name will appear in the layer list/legend for the user.",
-                                    },
-                                },
-                                "required": [
-                                    "postgis_connection_id",
-                                    "query",
-                                    "layer_name",
-                                ],
-                                "additionalProperties": False,
-                            },
-                        },
-                    },
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "add_layer_to_map",
-                            "description": "Shows a newly created or existing unattached layer on the user's current map and layer list. Use this after a geoprocessing step that creates a layer, or if the user asks to see an existing layer that isn't currently on their map.",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "layer_id": {
-                                        "type": "string",
-                                        "description": "The ID of the layer to add to the map. Choose from available unattached layers.",
-                                        "enum": list(layer_enum.keys())
-                                        if layer_enum
-                                        else ["NO_UNATTACHED_LAYERS"],
-                                    },
-                                    "new_name": {
-                                        "type": "string",
-                                        "description": "Sets a new human-readable name for this layer. This name will appear in the layer list/legend for the user.",
-                                    },
-                                },
-                                "required": ["layer_id", "new_name"],
-                            },
-                        },
-                    },
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "set_layer_style",
-                            "description": "Creates a new style for a layer with MapLibre JSON layers and immediately applies it as the active style",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "layer_id": {
-                                        "type": "string",
-                                        "description": "The ID of the layer to create and apply a style for",
-                                    },
-                                    "maplibre_json_layers_str": {
-                                        "type": "string",
-                                        "description": 'JSON string of MapLibre layer objects. Example: [{"id": "LZJ5RmuZr6qN-line", "type": "line", "source": "LZJ5RmuZr6qN", "paint": {"line-color": "#1E90FF"}}]',
-                                    },
-                                },
-                                "required": ["layer_id", "maplibre_json_layers_str"],
-                            },
-                        },
-                    },
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "query_duckdb_sql",
-                            "description": "Execute a SQL query against vector layer data using DuckDB. Use query_postgis_database for layers created from PostGIS connections instead.",
-                            "strict": True,
-                            "parameters": {
-                                "type": "object",
-                                "required": ["layer_ids", "sql_query", "head_n_rows"],
-                                "properties": {
-                                    "layer_ids": {
-                                        "type": "array",
-                                        "description": "Load these vector layer IDs as tables",
-                                        "items": {"type": "string"},
-                                    },
-                                    "sql_query": {
-                                        "type": "string",
-                                        "description": "DuckDB-flavored SELECT ... SQL query. Include newlines+spaces at ~55 column wrap for readability e.g. SELECT name_en,county\n    FROM LCH6Na2SBvJr\n    ORDER BY id",
-                                    },
-                                    "head_n_rows": {
-                                        "type": "number",
-                                        "description": "Truncate result to n rows (increase gingerly, MUST specify returned columns), n=20 is good",
-                                    },
-                                },
-                                "additionalProperties": False,
-                            },
-                        },
-                    },
-                    {
-                        "type": "function",
-                        "function": {
-                            "name": "query_postgis_database",
-                            "description": "Execute SQL queries on connected PostgreSQL/PostGIS databases. Use for data analysis, spatial queries, and exploring database tables. The query MUST include a LIMIT clause with a value less than 1000.",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "postgis_connection_id": {
-                                        "type": "string",
-                                        "description": "User's PostGIS connection ID to query against",
-                                    },
-                                    "sql_query": {
-                                        "type": "string",
-                                        "description": "SQL query to execute. Use newlines+spaces at ~55 column wrap. Examples: 'SELECT COUNT(*) FROM table_name', 'SELECT * FROM spatial_table LIMIT 10', 'SELECT column_name FROM information_schema.columns WHERE table_name = \"my_table\"'. Use standard SQL syntax.",
-                                    },
-                                },
-                                "required": ["postgis_connection_id", "sql_query"],
-                                "additionalProperties": False,
-                            },
-                        },
-                    },
-                ]
-
-                # add pydantic-defined tools to the payload
-                for name, (fn, arg_model, _mundi_model) in pydantic_tool_calls.items():
-                    tools_payload.append(tool_from_pyd(fn, arg_model))
-
-                all_tools = get_tools()
-                tools_payload.extend(all_tools)
-                geoprocessing_function_names = [
-                    tool["function"]["name"] for tool in all_tools
-                ]
-
-                if not layer_enum:
-                    add_layer_tool = next(
-                        tool
-                        for tool in tools_payload
-                        if tool["function"]["name"] == "add_layer_to_map"
-                    )
-                    add_layer_tool["function"]["parameters"]["properties"][
-                        "layer_id"
-                    ].pop("enum", None)
+                tools_payload = build_tools_payload(static_tools, layer_enum)
 
                 # Replace the thinking ephemeral updates with context manager
                 async with kue_ephemeral_action(conversation.id, "Anway is thinking..."):
@@ -991,10 +1015,9 @@ async def process_chat_interaction_task(
                     assert row is not None
                     current_project_id: str = row["project_id"]
 
-                # Process each tool call returned by the assistant
-
-                for tool_call in assistant_message.tool_calls:
-                    tool_call: ChatCompletionMessageToolCall = tool_call
+                async def execute_tool_call(
+                    tool_call: ChatCompletionMessageToolCall, conn
+                ) -> dict:
                     function_name = tool_call.function.name
                     tool_args = json.loads(tool_call.function.arguments)
                     tool_result = {}
@@ -1009,14 +1032,7 @@ async def process_chat_interaction_task(
                                 "status": "error",
                                 "error": f"Invalid arguments for {function_name}: {e}",
                             }
-                            await add_chat_completion_message(
-                                ChatCompletionToolMessageParam(
-                                    role="tool",
-                                    tool_call_id=tool_call.id,
-                                    content=json.dumps(tool_result),
-                                ),
-                            )
-                            continue
+                            return tool_result
 
                         try:
                             mundi_args = MundiModel(
@@ -1035,20 +1051,13 @@ async def process_chat_interaction_task(
                                 "error": "Tool execution failed. Please try again or adjust the inputs.",
                             }
 
-                        await add_chat_completion_message(
-                            ChatCompletionToolMessageParam(
-                                role="tool",
-                                tool_call_id=tool_call.id,
-                                content=json.dumps(tool_result),
-                            ),
-                        )
-                        continue
+                        return tool_result
 
                     span.add_event(
                         "kue.tool_call_started",
                         {"tool_name": function_name},
                     )
-                    with tracer.start_as_current_span(f"kue.{function_name}") as span:
+                    with tracer.start_as_current_span(f"kue.{function_name}"):
                         if function_name == "new_layer_from_postgis":
                             postgis_connection_id = tool_args.get(
                                 "postgis_connection_id"
@@ -1304,6 +1313,14 @@ async def process_chat_interaction_task(
                                                 map_id,
                                                 attribute_names,
                                             )
+                                            await mvt_tile_cache().invalidate(
+                                                (layer_id,),
+                                                keep=[
+                                                    postgis_query_hash(
+                                                        query, attribute_names
+                                                    )
+                                                ],
+                                            )
 
                                             # Create default style in separate table if we have geometry type
                                             if maplibre_layers:
@@ -1358,13 +1375,7 @@ async def process_chat_interaction_task(
                                                 "error": f"Query validation failed: {str(e)}",
                                             }
 
-                            await add_chat_completion_message(
-                                ChatCompletionToolMessageParam(
-                                    role="tool",
-                                    tool_call_id=tool_call.id,
-                                    content=json.dumps(tool_result),
-                                )
-                            )
+                            return tool_result
                         elif function_name == "add_layer_to_map":
                             layer_id_to_add = tool_args.get("layer_id")
                             new_name = tool_args.get("new_name")
@@ -1415,13 +1426,7 @@ async def process_chat_interaction_task(
                                         "name": new_name,
                                     }
 
-                                await add_chat_completion_message(
-                                    ChatCompletionToolMessageParam(
-                                        role="tool",
-                                        tool_call_id=tool_call.id,
-                                        content=json.dumps(tool_result),
-                                    )
-                                )
+                                return tool_result
                         elif function_name == "query_duckdb_sql":
                             layer_id = tool_args.get("layer_ids", [None])[
                                 0
@@ -1443,14 +1448,7 @@ async def process_chat_interaction_task(
                                     "status": "error",
                                     "error": f"Layer ID '{layer_id}' not found or you do not have permission to access it.",
                                 }
-                                await add_chat_completion_message(
-                                    ChatCompletionToolMessageParam(
-                                        role="tool",
-                                        tool_call_id=tool_call.id,
-                                        content=json.dumps(tool_result),
-                                    )
-                                )
-                                continue
+                                return tool_result
 
                             try:
                                 # Execute the query using the async function
@@ -1485,6 +1483,9 @@ async def process_chat_interaction_task(
                                         "status": "success",
                                         "result": result_text,
                                         "row_count": result["row_count"],
+                                        "total_row_count": result[
+                                            "total_row_count"
+                                        ],
                                         "query": sql_query,
                                     }
                             except HTTPException as e:
@@ -1498,13 +1499,7 @@ async def process_chat_interaction_task(
                                     "error": f"Error executing SQL query: {str(e)}",
                                 }
 
-                            await add_chat_completion_message(
-                                ChatCompletionToolMessageParam(
-                                    role="tool",
-                                    tool_call_id=tool_call.id,
-                                    content=json.dumps(tool_result),
-                                )
-                            )
+                            return tool_result
                         elif function_name == "set_layer_style":
                             layer_id = tool_args.get("layer_id")
                             maplibre_json_layers_str = tool_args.get(
@@ -1569,13 +1564,7 @@ async def process_chat_interaction_task(
                                         "layer_id": layer_id,
                                     }
 
-                            await add_chat_completion_message(
-                                ChatCompletionToolMessageParam(
-                                    role="tool",
-                                    tool_call_id=tool_call.id,
-                                    content=json.dumps(tool_result),
-                                ),
-                            )
+                            return tool_result
                         elif function_name == "query_postgis_database":
                             postgis_connection_id = tool_args.get(
                                 "postgis_connection_id"
@@ -1620,28 +1609,14 @@ async def process_chat_interaction_task(
                                                     "status": "error",
                                                     "error": f"LIMIT value {limit_value} exceeds maximum allowed limit of 1000",
                                                 }
-                                                await add_chat_completion_message(
-                                                    ChatCompletionToolMessageParam(
-                                                        role="tool",
-                                                        tool_call_id=tool_call.id,
-                                                        content=json.dumps(tool_result),
-                                                    ),
-                                                )
-                                                continue
+                                                return tool_result
                                         else:
                                             # No LIMIT found, require explicit LIMIT
                                             tool_result = {
                                                 "status": "error",
                                                 "error": "Query must include a LIMIT clause with a value less than 1000",
                                             }
-                                            await add_chat_completion_message(
-                                                ChatCompletionToolMessageParam(
-                                                    role="tool",
-                                                    tool_call_id=tool_call.id,
-                                                    content=json.dumps(tool_result),
-                                                ),
-                                            )
-                                            continue
+                                            return tool_result
 
                                         async with kue_ephemeral_action(
                                             conversation.id,
@@ -1730,13 +1705,7 @@ async def process_chat_interaction_task(
                                             "query": limited_query,
                                         }
 
-                            await add_chat_completion_message(
-                                ChatCompletionToolMessageParam(
-                                    role="tool",
-                                    tool_call_id=tool_call.id,
-                                    content=json.dumps(tool_result),
-                                ),
-                            )
+                            return tool_result
 
                         elif function_name in geoprocessing_function_names:
                             tool_result = await run_geoprocessing_tool(
@@ -1746,16 +1715,66 @@ async def process_chat_interaction_task(
                                 map_id,
                                 conversation.id,
                             )
-                            await add_chat_completion_message(
-                                ChatCompletionToolMessageParam(
-                                    role="tool",
-                                    tool_call_id=tool_call.id,
-                                    content=json.dumps(tool_result),
-                                ),
-                            )
+                            return tool_result
                         else:
                             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST)
 
+                async def run_tool_call(tool_call: ChatCompletionMessageToolCall):
+                    # asyncpg connections can't be shared between concurrent calls
+                    async with get_async_db_connection(
+                        f"kue.tool.{tool_call.function.name}"
+                    ) as tool_conn:
+                        return await execute_tool_call(tool_call, tool_conn)
+
+                def tool_call_failed(e: BaseException) -> dict:
+                    if isinstance(e, asyncio.TimeoutError):
+                        return {
+                            "status": "error",
+                            "error": "Tool call timed out. Try a smaller or simpler request.",
+                        }
+                    span.record_exception(e)
+                    return {
+                        "status": "error",
+                        "error": "Tool execution failed. Please try again or adjust the inputs.",
+                    }
+
+                if any(
+                    tool_call.function.name not in READ_ONLY_TOOL_NAMES
+                    for tool_call in assistant_message.tool_calls
+                ):
+                    layers_may_have_changed = True
+
+                # Independent tool calls run concurrently; ones that change the map
+                # are serialized on it, and results are stored in the original order
+                tool_tasks = tool_call_scheduler().schedule(
+                    conversation.id,
+                    [
+                        (
+                            functools.partial(run_tool_call, tool_call),
+                            None
+                            if tool_call.function.name in READ_ONLY_TOOL_NAMES
+                            else map_id,
+                        )
+                        for tool_call in assistant_message.tool_calls
+                    ],
+                    on_error=tool_call_failed,
+                )
+                try:
+                    for tool_call, tool_task in zip(
+                        assistant_message.tool_calls, tool_tasks
+                    ):
+                        tool_result = await tool_task
+                        await add_chat_completion_message(
+                            ChatCompletionToolMessageParam(
+                                role="tool",
+                                tool_call_id=tool_call.id,
+                                content=json.dumps(tool_result),
+                            ),
+                        )
+                finally:
+                    for tool_task in tool_tasks:
+                        tool_task.cancel()
+
             # Async connections auto-commit, no need for explicit commit
 
         # Label the conversation if it still has the default "title pending"
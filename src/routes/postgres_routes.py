@@ -20,6 +20,7 @@ import secrets
 import json
 import csv
 import datetime
+import time
 from io import StringIO, BytesIO
 from pathlib import Path
 from urllib.parse import urlparse
@@ -46,6 +47,15 @@ from typing import List, Optional, Literal
 import logging
 from pyproj import Transformer
 from osgeo import osr
+from src.map_renderer import RendererError, map_renderer_pool
+from src.ogr_convert import OgrConversionError, ogr_conversion_engine
+from src.ingest_jobs import ingest_job_queue, ingest_stage, mark_ingest_stage
+from src.upload_ingest import (
+    UploadSizeLimitRoute,
+    UploadTooLarge,
+    format_matches_extension,
+    upload_ingestor,
+)
 from fastapi import File, UploadFile, Form
 from redis import Redis
 import tempfile
@@ -375,8 +385,8 @@ def validate_remote_url(url: str, source_type: str) -> str:
     return url
 
 
-# Create router
-router = APIRouter()
+# Create router; uploads are size-limited while the body is being received
+router = APIRouter(route_class=UploadSizeLimitRoute)
 
 # Create separate router for basemap endpoints
 basemap_router = APIRouter()
@@ -472,6 +482,40 @@ class LayersListResponse(BaseModel):
     layers: List[LayerResponse]
 
 
+class IngestJobResponse(BaseModel):
+    job_id: str = Field(description="Unique identifier for the ingest job")
+    dag_child_map_id: str = Field(
+        description="The ID of the map the layer is being added to"
+    )
+    status: str = Field(
+        description="queued, running, succeeded, failed or cancelled"
+    )
+    stage: Optional[str] = Field(
+        default=None,
+        description="Current stage: receive, convert, upload, analyze, tiles or register",
+    )
+    attempts: int = Field(description="Number of times a worker has started the job")
+    layer_id: Optional[str] = Field(
+        default=None, description="ID of the new layer, once the job has succeeded"
+    )
+    error: Optional[str] = Field(
+        default=None, description="Error of the last failed attempt"
+    )
+
+
+def ingest_job_response(job: dict) -> IngestJobResponse:
+    return IngestJobResponse(
+        job_id=job["id"],
+        dag_child_map_id=job["map_id"],
+        status=job["status"],
+        stage=job["stage"],
+        attempts=job["attempts"],
+        # pinned when the job is queued, but only exists once it has succeeded
+        layer_id=job["layer_id"] if job["status"] == "succeeded" else None,
+        error=job["error"],
+    )
+
+
 class LayerUploadResponse(DAGEditOperationResponse):
     id: str = Field(description="Unique identifier for the newly uploaded layer")
     name: str = Field(description="Display name of the layer as it appears in the map")
@@ -1327,6 +1371,174 @@ async def upload_layer(
     )
 
 
+@router.post(
+    "/{original_map_id}/layers/ingest",
+    response_model=IngestJobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
+    operation_id="ingest_layer_to_map",
+    summary="Upload file as layer in the background",
+)
+async def ingest_layer(
+    original_map_id: str,
+    forked_map: MundiMap = Depends(forked_map_by_user),
+    file: UploadFile = File(...),
+    layer_name: str = Form(None),
+    add_layer_to_map: bool = Form(True),
+    conversation_id: Optional[int] = Form(None),
+    session: UserContext = Depends(verify_session_required),
+):
+    """Like uploading a layer, but returns as soon as the file has been received.
+
+    Conversion, tiling and indexing run on a background worker. Poll
+    `/api/maps/ingest/jobs/{job_id}` for the result, or pass a conversation_id to
+    receive stage-by-stage progress over that conversation's websocket.
+    """
+    filename = validate_upload_filename(file.filename)
+    file_ext = os.path.splitext(filename)[1].lower()
+    user_id = session.get_user_id()
+
+    async with get_async_db_connection() as conn:
+        if conversation_id is not None and not await conn.fetchval(
+            """
+            SELECT 1 FROM conversations
+            WHERE id = $1 AND owner_uuid = $2 AND soft_deleted_at IS NULL
+            """,
+            conversation_id,
+            user_id,
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Conversation not found",
+            )
+
+    queue = ingest_job_queue()
+    job_id = generate_id(prefix="J")
+    source_s3_key = f"ingest/{user_id}/{job_id}{file_ext}"
+    spool_path = queue.spool_path(job_id, file_ext)
+    s3_client = await get_async_s3_client()
+    bucket_name = get_bucket_name()
+
+    started = time.monotonic()
+    try:
+        with open(spool_path, "wb") as spool:
+            upload = await upload_ingestor().ingest(
+                file,
+                spool,
+                s3_client=s3_client,
+                bucket=bucket_name,
+                s3_key=source_s3_key,
+            )
+        if not format_matches_extension(upload.sniffed_format, file_ext):
+            await s3_client.delete_object(Bucket=bucket_name, Key=source_s3_key)
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"File contents do not match the {file_ext} extension",
+            )
+    except BaseException as e:
+        os.remove(spool_path)
+        if isinstance(e, UploadTooLarge):
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=str(e),
+            )
+        raise
+
+    async with get_async_db_connection() as conn:
+        job = await queue.enqueue(
+            conn,
+            job_id=job_id,
+            owner_uuid=user_id,
+            project_id=forked_map.project_id,
+            map_id=forked_map.id,
+            conversation_id=conversation_id,
+            filename=filename,
+            layer_name=layer_name,
+            add_layer_to_map=add_layer_to_map,
+            source_s3_key=source_s3_key,
+            spool_path=spool_path,
+            size_bytes=upload.size_bytes,
+            sha256=upload.sha256,
+            receive_seconds=time.monotonic() - started,
+        )
+    return ingest_job_response(job)
+
+
+@router.get(
+    "/ingest/jobs/{job_id}",
+    response_model=IngestJobResponse,
+    operation_id="get_ingest_job",
+)
+async def get_ingest_job(
+    job_id: str,
+    session: UserContext = Depends(verify_session_required),
+):
+    async with get_async_db_connection() as conn:
+        job = await conn.fetchrow(
+            "SELECT * FROM ingest_jobs WHERE id = $1 AND owner_uuid = $2",
+            job_id,
+            session.get_user_id(),
+        )
+    if job is None:
+        raise HTTPException(status_code=404, detail="Ingest job not found")
+    return ingest_job_response(dict(job))
+
+
+@router.delete(
+    "/ingest/jobs/{job_id}",
+    response_model=IngestJobResponse,
+    operation_id="cancel_ingest_job",
+)
+async def cancel_ingest_job(
+    job_id: str,
+    session: UserContext = Depends(verify_session_required),
+):
+    """Cancels a queued or running ingest job. Finished jobs are left as they are."""
+    async with get_async_db_connection() as conn:
+        job = await conn.fetchrow(
+            "SELECT status FROM ingest_jobs WHERE id = $1 AND owner_uuid = $2",
+            job_id,
+            session.get_user_id(),
+        )
+        if job is None:
+            raise HTTPException(status_code=404, detail="Ingest job not found")
+        if job["status"] not in ("queued", "running"):
+            raise HTTPException(
+                status_code=409, detail=f"Ingest job already {job['status']}"
+            )
+        cancelled = await ingest_job_queue().cancel(conn, job_id)
+    return ingest_job_response(cancelled)
+
+
+def validate_upload_filename(filename: str | None) -> str:
+    """Returns the sanitized filename of an upload, or raises a 400."""
+    # 安全补丁：清理文件名 - 防止路径遍历攻击
+    if not filename or len(filename) > 200:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="无效的文件名"
+        )
+
+    # 只取文件名，移除路径
+    filename = os.path.basename(filename)
+
+    # 验证文件名中的字符 - 只允许字母数字、下划线、点和连字符
+    if not re.match(r'^[\w\-\.]+$', filename):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="文件名包含非法字符"
+        )
+
+    # 安全补丁：验证扩展名
+    file_ext = os.path.splitext(filename)[1].lower()
+    allowed_extensions = {'.geojson', '.json', '.kml', '.kmz', '.shp', '.tif', '.tiff', '.jpg', '.jpeg', '.png', '.csv'}
+    if file_ext not in allowed_extensions:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"不允许的文件类型: {file_ext}"
+        )
+    return filename
+
+
 async def internal_upload_layer(
     map_id: str,
     file: UploadFile,
@@ -1334,44 +1546,37 @@ async def internal_upload_layer(
     add_layer_to_map: bool,
     user_id: str,
     project_id: str,
+    layer_id: Optional[str] = None,
 ) -> InternalLayerUploadResponse:
-    """Internal function to upload a layer without auth checks."""
+    """Internal function to upload a layer without auth checks.
+
+    Passing layer_id makes the upload safe to run again: if a previous run already
+    registered that layer it is returned as is, and a run that gets as far as
+    registering adds all of its layers and the map update in one transaction.
+    """
 
     # Connect to database
     async with get_async_db_connection() as conn:
-        bucket_name = get_bucket_name()
-
-        # Generate a unique filename for the uploaded file
-        filename = file.filename
-
-        # 安全补丁：清理文件名 - 防止路径遍历攻击
-        if not filename or len(filename) > 200:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="无效的文件名"
+        if layer_id is not None:
+            existing = await conn.fetchrow(
+                "SELECT name, type FROM map_layers WHERE layer_id = $1", layer_id
             )
+            if existing is not None:
+                return InternalLayerUploadResponse(
+                    id=layer_id,
+                    name=existing["name"],
+                    type=existing["type"],
+                    url=layer_url(layer_id, existing["type"]),
+                )
 
-        # 只取文件名，移除路径
-        filename = os.path.basename(filename)
+        bucket_name = get_bucket_name()
 
-        # 验证文件名中的字符 - 只允许字母数字、下划线、点和连字符
-        if not re.match(r'^[\w\-\.]+$', filename):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="文件名包含非法字符"
-            )
+        # Generate a unique filename for the uploaded file
+        filename = validate_upload_filename(file.filename)
 
         file_basename, file_ext = os.path.splitext(filename)
         file_ext = file_ext.lower()
 
-        # 安全补丁：验证扩展名
-        allowed_extensions = {'.geojson', '.json', '.kml', '.kmz', '.shp', '.tif', '.tiff', '.jpg', '.jpeg', '.png', '.csv'}
-        if file_ext not in allowed_extensions:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"不允许的文件类型: {file_ext}"
-            )
-
         # If layer_name is not provided, use the filename without extension
         if not layer_name:
             layer_name = file_basename
@@ -1391,8 +1596,8 @@ async def internal_upload_layer(
         metadata_dict = {"original_filename": filename}
         bounds = None
 
-        # Generate a unique layer ID
-        layer_id = generate_id(prefix="L")
+        # Generate a unique layer ID, unless the caller pinned one
+        layer_id = layer_id or generate_id(prefix="L")
 
         # Generate S3 key using user UUID, project ID and layer ID
         s3_key = f"uploads/{user_id}/{project_id}/{layer_id}{file_ext}"
@@ -1406,23 +1611,48 @@ async def internal_upload_layer(
         filename = file.filename
         file_ext = os.path.splitext(filename)[1].lower()
 
+        # Formats stored as uploaded go to S3 while they are still being received;
+        # the rest are converted locally first and uploaded afterwards
+        stream_to_s3 = file_ext not in {".csv", ".kmz", ".zip"} and (
+            layer_type != "point_cloud"
+        )
+
         auxiliary_temp_file_path = None
         with tempfile.NamedTemporaryFile(suffix=file_ext) as temp_file:
-            # Read file content
-            content = await file.read()
+            await mark_ingest_stage("receive")
+            try:
+                upload = await upload_ingestor().ingest(
+                    file,
+                    temp_file,
+                    s3_client=s3_client,
+                    bucket=bucket_name,
+                    s3_key=s3_key if stream_to_s3 else None,
+                )
+            except UploadTooLarge as e:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=str(e),
+                )
+            if not format_matches_extension(upload.sniffed_format, file_ext):
+                if upload.s3_key:
+                    await s3_client.delete_object(Bucket=bucket_name, Key=s3_key)
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"File contents do not match the {file_ext} extension",
+                )
             # Track file size in bytes
-            file_size_bytes = len(content)
-            # Write to temp file
-            temp_file.write(content)
-            temp_file.flush()
+            file_size_bytes = upload.size_bytes
+            metadata_dict["sha256"] = upload.sha256
             temp_file_path = temp_file.name
+            if file_ext in [".csv", ".kmz", ".zip"] or layer_type == "point_cloud":
+                await mark_ingest_stage("convert")
             # convert csvs to flatgeobufs
             if file_ext == ".csv":
                 auxiliary_temp_file_path = temp_file_path + ".fgb"
 
                 # Detect column names for X/Y in a case-insensitive way from the header
-                # Decode a small portion; use utf-8-sig to strip BOM if present
-                sample_text = content.decode("utf-8-sig", errors="replace")
+                # Decode the leading bytes; use utf-8-sig to strip BOM if present
+                sample_text = upload.head.decode("utf-8-sig", errors="replace")
                 reader = csv.reader(StringIO(sample_text))
 
                 normalized = {h.strip().lower(): h for h in next(reader, [])}
@@ -1567,13 +1797,16 @@ async def internal_upload_layer(
                 # ensure later cleanup matches previous behavior
                 temp_dir = pc.temp_dir
 
-            # Upload file to S3/MinIO
-            await s3_client.upload_file(
-                temp_file_path, bucket_name, s3_key, Config=one_shot_config
-            )
+            # Upload file to S3/MinIO, unless it was streamed there already
+            if upload.s3_key is None:
+                await mark_ingest_stage("upload")
+                await s3_client.upload_file(
+                    temp_file_path, bucket_name, s3_key, Config=one_shot_config
+                )
 
-            # Unify: always handle as a list of layers and return the first
-            created_layer_ids: list[str] = []
+            # Unify: always handle as a list of layers and return the first;
+            # rows are collected here and written together once all are processed
+            registrations: list[dict] = []
             first_layer_url: str | None = None
             first_layer_name: str | None = None
 
@@ -1609,29 +1842,74 @@ async def internal_upload_layer(
                         **lr.metadata.model_dump(exclude_none=True),
                     }
 
+                    style_json = None
+                    if lr.geometry_type and lr.geometry_type != "unknown":
+                        style_json = generate_maplibre_layers_for_layer_id(
+                            this_layer_id, lr.geometry_type
+                        )
+
+                    registrations.append(
+                        {
+                            "layer_id": this_layer_id,
+                            "name": display_name,
+                            "metadata": per_md,
+                            "bounds": lr.bounds,
+                            "geometry_type": lr.geometry_type,
+                            "feature_count": lr.feature_count,
+                            "style_json": style_json,
+                        }
+                    )
+                    if first_layer_url is None:
+                        first_layer_url = layer_url(this_layer_id, layer_type)
+                        first_layer_name = display_name
+            else:
+                # raster/point cloud as single item
+                if layer_type == "raster":
+                    async with ingest_stage("analyze"):
+                        bounds = await asyncio.to_thread(
+                            preprocess_raster, temp_file_path, metadata_dict
+                        )
+                registrations.append(
+                    {
+                        "layer_id": layer_id,
+                        "name": layer_name,
+                        "metadata": metadata_dict,
+                        "bounds": bounds,
+                        "geometry_type": None,
+                        "feature_count": None,
+                        "style_json": None,
+                    }
+                )
+                first_layer_name = layer_name
+                first_layer_url = layer_url(layer_id, layer_type)
+
+            await mark_ingest_stage("register")
+            created_layer_ids = [r["layer_id"] for r in registrations]
+
+            # a retried ingest job either finds all of its layers or none of them;
+            # a concurrent duplicate run fails here on the layer_id primary key
+            async with conn.transaction():
+                for r in registrations:
                     await conn.execute(
                         """
                         INSERT INTO map_layers
                         (layer_id, owner_uuid, name, type, metadata, bounds, geometry_type, feature_count, s3_key, size_bytes, source_map_id)
                         VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
                         """,
-                        this_layer_id,
+                        r["layer_id"],
                         user_id,
-                        display_name,
+                        r["name"],
                         layer_type,
-                        json.dumps(per_md),
-                        lr.bounds,
-                        lr.geometry_type,
-                        lr.feature_count,
+                        json.dumps(r["metadata"]),
+                        r["bounds"],
+                        r["geometry_type"],
+                        r["feature_count"],
                         s3_key,
                         file_size_bytes,
                         map_id,
                     )
 
-                    if lr.geometry_type and lr.geometry_type != "unknown":
-                        ml_layers = generate_maplibre_layers_for_layer_id(
-                            this_layer_id, lr.geometry_type
-                        )
+                    if r["style_json"] is not None:
                         style_id = generate_id(prefix="S")
                         await conn.execute(
                             """
@@ -1640,8 +1918,8 @@ async def internal_upload_layer(
                             VALUES ($1, $2, $3, $4)
                             """,
                             style_id,
-                            this_layer_id,
-                            json.dumps(ml_layers),
+                            r["layer_id"],
+                            json.dumps(r["style_json"]),
                             user_id,
                         )
                         await conn.execute(
@@ -1650,66 +1928,33 @@ async def internal_upload_layer(
                             VALUES ($1, $2, $3)
                             """,
                             map_id,
-                            this_layer_id,
+                            r["layer_id"],
                             style_id,
                         )
 
-                    created_layer_ids.append(this_layer_id)
-                    if first_layer_url is None:
-                        first_layer_url = f"/api/layer/{this_layer_id}.pmtiles"
-                        first_layer_name = display_name
-            else:
-                # raster/point cloud as single item
-                if layer_type == "raster":
-                    bounds = preprocess_raster(temp_file_path, metadata_dict)
-                await conn.execute(
-                    """
-                    INSERT INTO map_layers
-                    (layer_id, owner_uuid, name, type, metadata, bounds, geometry_type, feature_count, s3_key, size_bytes, source_map_id)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
-                    """,
-                    layer_id,
-                    user_id,
-                    layer_name,
-                    layer_type,
-                    json.dumps(metadata_dict),
-                    bounds,
-                    None,
-                    None,
-                    s3_key,
-                    file_size_bytes,
-                    map_id,
-                )
-                created_layer_ids.append(layer_id)
-                first_layer_name = layer_name
-                first_layer_url = (
-                    f"/api/layer/{layer_id}.laz"
-                    if layer_type == "point_cloud"
-                    else f"/api/layer/{layer_id}.cog.tif"
-                )
-
-        # Update map layers if requested
-        if add_layer_to_map and created_layer_ids:
-            map_data = await conn.fetchrow(
-                """
-                SELECT layers FROM user_mundiai_maps
-                WHERE id = $1
-                """,
-                map_id,
-            )
-            current_layers = (
-                map_data["layers"] if map_data and map_data["layers"] else []
-            )
-            await conn.execute(
-                """
-                UPDATE user_mundiai_maps
-                SET layers = $1,
-                    last_edited = CURRENT_TIMESTAMP
-                WHERE id = $2
-                """,
-                current_layers + created_layer_ids,
-                map_id,
-            )
+                # Update map layers if requested
+                if add_layer_to_map and created_layer_ids:
+                    map_data = await conn.fetchrow(
+                        """
+                        SELECT layers FROM user_mundiai_maps
+                        WHERE id = $1
+                        FOR UPDATE
+                        """,
+                        map_id,
+                    )
+                    current_layers = (
+                        map_data["layers"] if map_data and map_data["layers"] else []
+                    )
+                    await conn.execute(
+                        """
+                        UPDATE user_mundiai_maps
+                        SET layers = $1,
+                            last_edited = CURRENT_TIMESTAMP
+                        WHERE id = $2
+                        """,
+                        current_layers + created_layer_ids,
+                        map_id,
+                    )
 
         # Cleanup temp_dir if it exists
         if temp_dir:
@@ -1721,19 +1966,18 @@ async def internal_upload_layer(
             id=created_layer_ids[0],
             name=first_layer_name or (layer_name or file_basename),
             type=layer_type,
-            url=first_layer_url
-            or (
-                f"/api/layer/{created_layer_ids[0]}.pmtiles"
-                if layer_type == "vector"
-                else (
-                    f"/api/layer/{created_layer_ids[0]}.laz"
-                    if layer_type == "point_cloud"
-                    else f"/api/layer/{created_layer_ids[0]}.cog.tif"
-                )
-            ),
+            url=first_layer_url or layer_url(created_layer_ids[0], layer_type),
         )
 
 
+def layer_url(layer_id: str, layer_type: str) -> str:
+    if layer_type == "vector":
+        return f"/api/layer/{layer_id}.pmtiles"
+    if layer_type == "point_cloud":
+        return f"/api/layer/{layer_id}.laz"
+    return f"/api/layer/{layer_id}.cog.tif"
+
+
 CLOUD_NATIVE_EXTS = {".pmtiles", ".tif"}
 RASTER_EXTS = {".tif", ".jpg", ".jpeg", ".png", ".dem"}
 VECTOR_EXTS = {".pmtiles", ".geojson", ".fgb", ".gpkg", ".shp", ".csv"}
@@ -2206,9 +2450,8 @@ async def generate_pmtiles_from_ogr_source(
         # Reproject to EPSG:4326 and convert to FlatGeobuf
         reprojected_file = os.path.join(temp_dir, "reprojected.fgb")
 
-        # Build ogr2ogr command with source-specific options
-        ogr_cmd = [
-            "ogr2ogr",
+        # Build ogr2ogr options with source-specific options
+        ogr_args = [
             "-f",
             "FlatGeobuf",
             "-t_srs",
@@ -2220,7 +2463,7 @@ async def generate_pmtiles_from_ogr_source(
 
         # Add CSV-specific options for lat/long column detection
         if ogr_source.startswith("CSV:"):
-            ogr_cmd.extend(
+            ogr_args.extend(
                 [
                     "-oo",
                     "X_POSSIBLE_NAMES=long,longitude,lng,x",
@@ -2231,20 +2474,16 @@ async def generate_pmtiles_from_ogr_source(
                 ]
             )
 
-        ogr_cmd.extend([reprojected_file, ogr_source])
-        # If a specific dataset layer is requested (e.g., GeoPackage sublayer),
-        # pass it as an additional source argument to ogr2ogr to select that layer.
-        if dataset_layer is not None:
-            ogr_cmd.append(dataset_layer)
-
-        process = await asyncio.create_subprocess_exec(
-            *ogr_cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-        stdout, stderr = await process.communicate()
-
-        if process.returncode != 0:
+        try:
+            # If a specific dataset layer is requested (e.g., GeoPackage sublayer),
+            # only that layer is converted.
+            await ogr_conversion_engine().convert(
+                ogr_source,
+                reprojected_file,
+                ogr_args,
+                layers=[dataset_layer] if dataset_layer is not None else None,
+            )
+        except OgrConversionError:
             raise Exception(
                 "Failed to reproject geospatial data. Please check that the source contains valid geometry."
             )
@@ -2274,23 +2513,12 @@ async def generate_pmtiles_from_ogr_source(
                 "Can't guess maxzoom (-zg) without at least two distinct feature locations"
                 in err_text
             ):
-                pmtiles_ogr_cmd = [
-                    "ogr2ogr",
-                    "-f",
-                    "PMTiles",
-                    local_output_file,
-                    reprojected_file,
-                ]
-                process2 = await asyncio.create_subprocess_exec(
-                    *pmtiles_ogr_cmd,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
-                )
-                stdout2, stderr2 = await process2.communicate()
-                if process2.returncode != 0:
-                    raise Exception(
-                        f"ogr2ogr PMTiles fallback failed: {(stderr2 or b'').decode('utf-8', errors='ignore')}"
+                try:
+                    await ogr_conversion_engine().convert(
+                        reprojected_file, local_output_file, ["-f", "PMTiles"]
                     )
+                except OgrConversionError as e:
+                    raise Exception(f"ogr2ogr PMTiles fallback failed: {e}")
             else:
                 raise Exception(
                     f"tippecanoe command failed with exit code {process.returncode}: {err_text}"
@@ -2361,9 +2589,10 @@ async def process_vector_layer_common(
         dict with processed layer data ready for database insertion
     """
     # Extract bounds and metadata from the source
-    layer_info = await get_layer_bounds_and_metadata(
-        ogr_source, "vector", dataset_layer=dataset_layer
-    )
+    async with ingest_stage("analyze"):
+        layer_info = await get_layer_bounds_and_metadata(
+            ogr_source, "vector", dataset_layer=dataset_layer
+        )
 
     bounds = layer_info.bounds
     geometry_type = layer_info.geometry_type
@@ -2377,19 +2606,21 @@ async def process_vector_layer_common(
     # Generate PMTiles for vector layers with features
     pmtiles_key: Optional[str] = None
     if feature_count and feature_count > 0:
-        try:
-            pmtiles_key = await generate_pmtiles_from_ogr_source(
-                layer_id,
-                ogr_source,
-                feature_count,
-                user_id,
-                project_id,
-                dataset_layer=dataset_layer,
-            )
-            metadata_updates.pmtiles_key = pmtiles_key
-        except Exception as e:
-            print(f"PMTiles generation failed for {ogr_source}: {e}")
-            # Continue without PMTiles - not critical
+        # tippecanoe is the heaviest step, MUNDI_INGEST_TILES_CONCURRENCY caps it
+        async with ingest_stage("tiles"):
+            try:
+                pmtiles_key = await generate_pmtiles_from_ogr_source(
+                    layer_id,
+                    ogr_source,
+                    feature_count,
+                    user_id,
+                    project_id,
+                    dataset_layer=dataset_layer,
+                )
+                metadata_updates.pmtiles_key = pmtiles_key
+            except Exception as e:
+                print(f"PMTiles generation failed for {ogr_source}: {e}")
+                # Continue without PMTiles - not critical
 
     # Generate MapLibre style for vector layers
     maplibre_style: Optional[List[dict]] = None
@@ -2525,124 +2756,61 @@ async def render_map_internal(
         xmin, ymin, xmax, ymax = map(float, bbox.split(","))
 
     assert style_json is not None
-    # Create a temporary file for the output PNG
-    with tempfile.NamedTemporaryFile(suffix=".png") as temp_output:
-        output_path = temp_output.name
-
-        # Format the style JSON with required parameters
-        input_data = {
-            "width": width,
-            "height": height,
-            "bounds": f"{xmin},{ymin},{xmax},{ymax}",
-            "style": style_json,
-            "ratio": 1,
-        }
 
-        # Get zoom and center for metadata using the zoom script
-        zoom_process = await asyncio.create_subprocess_exec(
-            "node",
-            "src/renderer/zoom.js",
-            stdin=asyncio.subprocess.PIPE,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE,
-        )
-
-        zoom_stdout, zoom_stderr = await zoom_process.communicate(
-            input=json.dumps(
-                {
-                    "bbox": f"{xmin},{ymin},{xmax},{ymax}",
-                    "width": width,
-                    "height": height,
-                }
-            ).encode()
-        )
-        zoom_data = json.loads(zoom_stdout.decode())
-
-        # Run the renderer using subprocess
-        try:
-            with tracer.start_as_current_span("renderer.mbgl") as span:
-                process = await asyncio.create_subprocess_exec(
-                    "xvfb-run",
-                    "-a",
-                    "node",
-                    "src/renderer/render.js",
-                    output_path,
-                    stdin=asyncio.subprocess.PIPE,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
+    # Rendered by a warm worker from the pool, which also reports the viewport
+    try:
+        with tracer.start_as_current_span("renderer.mbgl") as span:
+            span.set_attribute("renderer.queue_depth", map_renderer_pool().queued)
+            try:
+                result = await map_renderer_pool().render(
+                    style=style_json,
+                    width=width,
+                    height=height,
+                    bounds=f"{xmin},{ymin},{xmax},{ymax}",
+                    ratio=1,
                 )
+            except RendererError as e:
+                span.record_exception(e)
+                span.set_status(Status(StatusCode.ERROR, str(e)))
+                raise
+
+            for m in result.messages:
+                sev = str(m.get("severity", "")).upper()
+                text_val = m.get("text")
+                if sev == "WARNING":
+                    print(f"Renderer warning: {text_val}")
+                elif sev == "ERROR":
+                    span.record_exception(RuntimeError(text_val or "renderer error"))
+                    span.set_status(
+                        Status(StatusCode.ERROR, text_val or "renderer error")
+                    )
+    except RendererError as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error rendering map: {e}",
+        )
 
-                stdout, stderr = await process.communicate(
-                    input=json.dumps(input_data).encode()
-                )
+    return (
+        Response(
+            content=result.png,
+            media_type="image/png",
+            headers={
+                "Content-Type": "image/png",
+                "Content-Disposition": f"inline; filename=map_{map_id}.png",
+            },
+        ),
+        {"zoom": result.zoom, "center": result.center},
+    )
 
-                def _iter_json_lines(buf: bytes):
-                    for line in buf.decode(errors="ignore").splitlines():
-                        line = line.strip()
-                        if not line:
-                            continue
-                        try:
-                            obj = json.loads(line)
-                        except Exception:
-                            continue
-                        yield obj
-
-                for m in list(_iter_json_lines(stdout)) + list(
-                    _iter_json_lines(stderr)
-                ):
-                    if isinstance(m, dict):
-                        sev = str(m.get("severity", "")).upper()
-                        text_val = m.get("text")
-                        if sev and sev != "INFO":
-                            if sev == "WARNING":
-                                try:
-                                    print(f"Renderer warning: {text_val}")
-                                except Exception:
-                                    pass
-                            elif sev == "ERROR":
-                                try:
-                                    span.record_exception(
-                                        RuntimeError(text_val or "renderer error")
-                                    )
-                                except Exception:
-                                    pass
-                                try:
-                                    span.set_status(
-                                        Status(
-                                            StatusCode.ERROR,
-                                            text_val or "renderer error",
-                                        )
-                                    )
-                                except Exception:
-                                    pass
-
-                if process.returncode != 0:
-                    raise subprocess.CalledProcessError(
-                        process.returncode or -1,
-                        "xvfb-run",
-                        output=stdout,
-                        stderr=stderr,
-                    )
 
-            temp_output.seek(0)
-            screenshot_data = temp_output.read()
-
-            return (
-                Response(
-                    content=screenshot_data,
-                    media_type="image/png",
-                    headers={
-                        "Content-Type": "image/png",
-                        "Content-Disposition": f"inline; filename=map_{map_id}.png",
-                    },
-                ),
-                zoom_data,
-            )
-        except subprocess.CalledProcessError as e:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Error rendering map: {e.stderr.decode()}",
-            )
+@router.get(
+    "/render/stats",
+    operation_id="get_map_renderer_stats",
+)
+async def get_map_renderer_stats(
+    session: UserContext = Depends(verify_session_required),
+):
+    return map_renderer_pool().stats()
 
 
 @router.delete(
@@ -80,9 +80,11 @@ from src.routes.postgres_routes import (
     render_map_internal,
 )
 
-# Global semaphore to limit concurrent social image renderings
-# This prevents OOM issues when many maps load simultaneously
-SOCIAL_RENDER_SEMAPHORE = asyncio.Semaphore(2)  # Max 2 concurrent renders
+# Renders themselves are bounded by the renderer pool; this only bounds how
+# many decoded social images are held for WEBP encoding at once
+SOCIAL_RENDER_SEMAPHORE = asyncio.Semaphore(
+    int(os.environ.get("MUNDI_SOCIAL_RENDER_CONCURRENCY", 8))
+)
 
 logger = logging.getLogger(__name__)
 tracer = trace.get_tracer(__name__)
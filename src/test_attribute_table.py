@@ -0,0 +1,79 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+from fastapi import HTTPException
+
+from src.routes.attribute_table import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip_keeps_id_type():
+    assert decode_cursor(encode_cursor(42)) == 42
+    assert decode_cursor(encode_cursor("42")) == "42"
+
+    with pytest.raises(HTTPException):
+        decode_cursor("not a cursor")
+    with pytest.raises(HTTPException):
+        decode_cursor(encode_cursor([1, 2]))
+
+
+@pytest.mark.anyio
+async def test_attribute_pages_by_offset_and_cursor_agree(auth_client):
+    map_response = await auth_client.post(
+        "/api/maps/create", json={"title": "Attribute Paging Map"}
+    )
+    assert map_response.status_code == 200
+    map_id = map_response.json()["id"]
+
+    with open("test_fixtures/airports.geojson", "rb") as f:
+        files = {"file": ("airports.geojson", f, "application/json")}
+        upload_response = await auth_client.post(
+            f"/api/maps/{map_id}/layers", files=files, data={"layer_name": "Airports"}
+        )
+    assert upload_response.status_code == 200
+    layer_id = upload_response.json()["id"]
+
+    by_offset = []
+    offset = 0
+    while True:
+        response = await auth_client.get(
+            f"/api/layer/{layer_id}/attributes",
+            params={"offset": offset, "limit": 30},
+        )
+        assert response.status_code == 200
+        page = response.json()
+        assert page["total_count"] == 76
+        by_offset.extend(page["data"])
+        if not page["has_more"]:
+            assert page["next_cursor"] is None
+            break
+        offset += 30
+
+    by_cursor = []
+    params = {"limit": 30}
+    while True:
+        response = await auth_client.get(
+            f"/api/layer/{layer_id}/attributes", params=params
+        )
+        assert response.status_code == 200
+        page = response.json()
+        by_cursor.extend(page["data"])
+        if not page["has_more"]:
+            break
+        params = {"limit": 30, "cursor": page["next_cursor"]}
+
+    assert len(by_offset) == 76
+    assert by_cursor == by_offset
+    assert set(by_offset[0]["attributes"]) == {"ID", "fk_region", "ELEV", "NAME", "USE"}
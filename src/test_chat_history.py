@@ -0,0 +1,81 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+
+import pytest
+
+from src.chat_history import ConversationHistory
+
+
+class FakeConn:
+    def __init__(self, rows):
+        self.rows = rows
+        self.fetches = 0
+
+    async def fetch(self, query, *args):
+        self.fetches += 1
+        return self.rows
+
+    async def fetchval(self, query, *args):
+        return len(self.rows)
+
+
+@pytest.mark.anyio
+async def test_history_loads_once_and_tracks_appends():
+    stored = [
+        json.dumps({"role": "system", "content": "map description"}),
+        json.dumps({"role": "user", "content": "buffer the rivers"}),
+    ]
+    conn = FakeConn([{"message_json": m} for m in stored])
+
+    history = await ConversationHistory.load(conn, 1, "user")
+    assert conn.fetches == 1
+    assert [m["role"] for m in history.openai_messages()] == ["system", "user"]
+
+    history.append(json.dumps({"role": "assistant", "content": None}))
+    messages = history.openai_messages()
+    assert len(history) == 3
+    assert messages[-1] == {"role": "assistant", "content": None}
+
+    # callers get their own list to prepend the system prompt to
+    messages.insert(0, {"role": "system", "content": "prompt"})
+    assert len(history) == 3
+
+
+@pytest.mark.anyio
+async def test_history_reloads_when_another_writer_inserted():
+    stored = [json.dumps({"role": "user", "content": "buffer the rivers"})]
+    conn = FakeConn([{"message_json": m} for m in stored])
+    history = await ConversationHistory.load(conn, 1, "user")
+
+    # rows written by the loop itself are already in memory
+    message = json.dumps({"role": "assistant", "content": "done"})
+    conn.rows.append({"message_json": message})
+    history.append(message)
+    assert not await history.sync(conn)
+    assert conn.fetches == 1
+
+    # a concurrent /send after the chat lock expired
+    conn.rows.append({"message_json": json.dumps({"role": "user", "content": "hi"})})
+    assert await history.sync(conn)
+    assert conn.fetches == 2
+    assert [m["role"] for m in history.openai_messages()] == [
+        "user",
+        "assistant",
+        "user",
+    ]
+    assert history.reloads == 1
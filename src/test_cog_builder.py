@@ -0,0 +1,171 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+import uuid
+
+import pytest
+
+import src.cog_builder as cog_builder
+from src.cog_builder import CogBuildError, CogBuildQueue
+from src.database.models import MapLayer
+
+
+def raster_layer() -> MapLayer:
+    layer_id = "L" + uuid.uuid4().hex[:11]
+    return MapLayer(
+        layer_id=layer_id,
+        owner_uuid=str(uuid.uuid4()),
+        name="raster",
+        type="raster",
+        s3_key=f"uploads/{layer_id}.tif",
+        metadata="{}",
+    )
+
+
+@pytest.mark.anyio
+async def test_cog_build_runs_once_and_records_timings(monkeypatch):
+    builds = []
+
+    async def fake_build(layer, command_timeout):
+        builds.append(layer.layer_id)
+        await asyncio.sleep(0.1)
+        return {
+            "cog_key": f"cog/layer/{layer.layer_id}.cog.tif",
+            "cog_build": {"timings_ms": {"total": 100.0}, "size_bytes": 1234},
+        }
+
+    monkeypatch.setattr(cog_builder, "build_cog", fake_build)
+    queue = CogBuildQueue(max_concurrent_builds=1, command_timeout=10)
+    layer = raster_layer()
+
+    first = queue.enqueue(layer)
+    second = queue.enqueue(layer)
+    assert first["state"] == second["state"] == "queued"
+
+    status = await queue.wait(layer.layer_id, timeout=5)
+    assert builds == [layer.layer_id]
+    assert status["state"] == "done"
+    assert status["cog_key"].endswith(".cog.tif")
+    assert status["size_bytes"] == 1234
+    assert status["timings_ms"]["total"] == 100.0
+
+    # finished builds aren't started again
+    assert queue.enqueue(layer)["state"] == "done"
+    assert builds == [layer.layer_id]
+
+
+@pytest.mark.anyio
+async def test_failed_cog_build_is_reported_and_not_retried_immediately(
+    monkeypatch,
+):
+    attempts = 0
+
+    async def failing_build(layer, command_timeout):
+        nonlocal attempts
+        attempts += 1
+        raise CogBuildError("COG generation failed: bad input")
+
+    monkeypatch.setattr(cog_builder, "build_cog", failing_build)
+    queue = CogBuildQueue(max_concurrent_builds=1, command_timeout=10)
+    layer = raster_layer()
+
+    queue.enqueue(layer)
+    status = await queue.wait(layer.layer_id, timeout=5)
+    assert status["state"] == "failed"
+    assert "bad input" in status["error"]
+
+    assert queue.enqueue(layer)["state"] == "failed"
+    assert attempts == 1
+
+
+@pytest.mark.anyio
+async def test_cog_build_lock_outlives_its_timeout_while_building(monkeypatch):
+    builds = []
+
+    async def slow_build(layer, command_timeout):
+        builds.append(layer.layer_id)
+        await asyncio.sleep(2.5)
+        return {
+            "cog_key": f"cog/layer/{layer.layer_id}.cog.tif",
+            "cog_build": {"timings_ms": {"total": 2500.0}, "size_bytes": 1},
+        }
+
+    monkeypatch.setattr(cog_builder, "build_cog", slow_build)
+    queue = CogBuildQueue(max_concurrent_builds=1, command_timeout=10, lock_timeout=1)
+    layer = raster_layer()
+    lock_key = queue._lock_key(layer.layer_id)
+
+    queue.enqueue(layer)
+    await asyncio.sleep(2)
+    # well past lock_timeout, but still held
+    assert cog_builder.redis.exists(lock_key)
+    other_worker = CogBuildQueue(max_concurrent_builds=1, command_timeout=10)
+    assert other_worker.enqueue(layer)["state"] == "running"
+    assert layer.layer_id not in other_worker._jobs
+
+    status = await queue.wait(layer.layer_id, timeout=5)
+    assert status["state"] == "done"
+    assert builds == [layer.layer_id]
+    assert not cog_builder.redis.exists(lock_key)
+
+
+@pytest.mark.anyio
+async def test_cog_build_lock_is_taken_only_with_a_slot(monkeypatch):
+    release = asyncio.Event()
+
+    async def blocked_build(layer, command_timeout):
+        await release.wait()
+        return {
+            "cog_key": f"cog/layer/{layer.layer_id}.cog.tif",
+            "cog_build": {"timings_ms": {"total": 1.0}, "size_bytes": 1},
+        }
+
+    monkeypatch.setattr(cog_builder, "build_cog", blocked_build)
+    queue = CogBuildQueue(max_concurrent_builds=1, command_timeout=10, lock_timeout=1)
+    first, second = raster_layer(), raster_layer()
+
+    queue.enqueue(first)
+    queue.enqueue(second)
+    await asyncio.sleep(0.1)
+    assert cog_builder.redis.exists(queue._lock_key(first.layer_id))
+    assert not cog_builder.redis.exists(queue._lock_key(second.layer_id))
+    assert queue.status(second.layer_id)["state"] == "queued"
+
+    release.set()
+    assert (await queue.wait(first.layer_id, timeout=5))["state"] == "done"
+    assert (await queue.wait(second.layer_id, timeout=5))["state"] == "done"
+
+
+@pytest.mark.anyio
+async def test_cog_build_stops_when_its_lock_is_lost(monkeypatch):
+    async def slow_build(layer, command_timeout):
+        await asyncio.sleep(5)
+
+    monkeypatch.setattr(cog_builder, "build_cog", slow_build)
+    queue = CogBuildQueue(max_concurrent_builds=1, command_timeout=10, lock_timeout=1)
+    layer = raster_layer()
+
+    queue.enqueue(layer)
+    await asyncio.sleep(0.1)
+    # as if it had expired and another worker had taken it
+    cog_builder.redis.set(queue._lock_key(layer.layer_id), "another-worker", ex=10)
+
+    status = await queue.wait(layer.layer_id, timeout=5)
+    assert status["state"] == "failed"
+    assert "lost the build lock" in status["error"]
+    assert cog_builder.redis.get(queue._lock_key(layer.layer_id)) == "another-worker"
+    cog_builder.redis.delete(queue._lock_key(layer.layer_id))
@@ -0,0 +1,198 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+
+import duckdb
+import pytest
+
+from src.duckdb import DuckDBEngine
+
+
+class CsvEngine(DuckDBEngine):
+    """Reads CSV instead of ST_Read so the test doesn't need the spatial extension."""
+
+    def _source_sql(self, gpkg_path: str) -> str:
+        return f"SELECT * FROM read_csv_auto('{gpkg_path}')"
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    source = tmp_path / "layer.csv"
+    source.write_text("name,value\n" + "".join(f"n{i},{i}\n" for i in range(100)))
+
+    class FakeLayerCache:
+        @asynccontextmanager
+        async def layer_filename(self, layer_id):
+            yield str(source)
+
+    monkeypatch.setattr("src.duckdb.layer_cache", lambda: FakeLayerCache())
+
+    engine = CsvEngine(cache_dir=str(tmp_path / "duckdb"), pool_size=2, extensions=())
+    engine.version = 1
+
+    async def layer_version(layer_id):
+        return engine.version
+
+    engine._layer_version = layer_version
+    yield engine
+    engine.executor.shutdown(wait=True)
+
+
+@pytest.mark.anyio
+async def test_layer_converted_once_and_connections_reused(engine):
+    first = await engine.run_query(
+        "SELECT count(*) FROM Ltest", "Ltest", max_n_rows=5, timeout=10
+    )
+    assert first["rows"] == [[100]]
+    assert first["convert_ms"] > 0
+
+    for _ in range(3):
+        result = await engine.run_query(
+            "SELECT sum(value) FROM Ltest", "Ltest", max_n_rows=5, timeout=10
+        )
+        assert result["rows"] == [[4950]]
+        assert result["convert_ms"] == 0.0
+
+    stats = engine.stats()
+    assert stats["conversions"] == 1
+    assert stats["connections_opened"] <= 2
+
+
+@pytest.mark.anyio
+async def test_new_last_edited_reconverts_and_drops_stale_file(engine):
+    await engine.run_query("SELECT 1 FROM Ltest", "Ltest", max_n_rows=1, timeout=10)
+    engine.version = 2
+    await engine.run_query("SELECT 1 FROM Ltest", "Ltest", max_n_rows=1, timeout=10)
+
+    assert engine.stats()["conversions"] == 2
+    assert os.listdir(engine.cache_dir) == ["Ltest-2.duckdb"]
+
+
+@pytest.mark.anyio
+async def test_user_sql_does_not_leak_into_pooled_connection(engine):
+    await engine.run_query(
+        "CREATE TABLE junk AS SELECT 1", "Ltest", max_n_rows=1, timeout=10
+    )
+    with pytest.raises(duckdb.Error):
+        await engine.run_query("SELECT * FROM junk", "Ltest", max_n_rows=1, timeout=10)
+
+    # a SQL error doesn't cost us the warm connection
+    assert engine.stats()["connections_discarded"] == 0
+    result = await engine.run_query(
+        "SELECT count(*) FROM Ltest", "Ltest", max_n_rows=1, timeout=10
+    )
+    assert result["rows"] == [[100]]
+
+
+@pytest.mark.anyio
+async def test_row_cap_is_pushed_down_with_exact_total(engine):
+    result = await engine.run_query(
+        "SELECT name, value FROM Ltest ORDER BY value -- trailing comment",
+        "Ltest",
+        max_n_rows=3,
+        timeout=10,
+    )
+    assert result["headers"] == ["name", "value"]
+    assert result["rows"] == [["n0", 0], ["n1", 1], ["n2", 2]]
+    assert result["total_rows"] == 100
+
+    small = await engine.run_query(
+        "SELECT * FROM Ltest WHERE value < 2;", "Ltest", max_n_rows=3, timeout=10
+    )
+    assert small["total_rows"] == 2
+
+
+@pytest.mark.anyio
+async def test_timeout_interrupts_query_and_keeps_connection(engine):
+    await engine.run_query("SELECT 1", "Ltest", max_n_rows=1, timeout=10)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await engine.run_query(
+            "SELECT count(*) FROM range(100000000000) a",
+            "Ltest",
+            max_n_rows=1,
+            timeout=0.5,
+        )
+
+    # the interrupted query gives its pool slot back promptly
+    result = await engine.run_query(
+        "SELECT count(*) FROM Ltest", "Ltest", max_n_rows=1, timeout=5
+    )
+    assert result["rows"] == [[100]]
+    stats = engine.stats()
+    assert stats["interrupted"] == 1
+    assert stats["connections_discarded"] == 0
+
+
+@pytest.mark.anyio
+async def test_pooled_connection_only_exposes_queried_layer(engine):
+    await engine.run_query("SELECT 1 FROM La", "La", max_n_rows=1, timeout=10)
+
+    # same warm connection, but La is no longer attached or visible
+    result = await engine.run_query(
+        "SELECT view_name FROM duckdb_views() WHERE NOT internal "
+        "UNION ALL SELECT database_name FROM duckdb_databases() "
+        "WHERE database_name LIKE 'layer_%'",
+        "Lb",
+        max_n_rows=10,
+        timeout=10,
+    )
+    assert sorted(row[0] for row in result["rows"]) == ["Lb", "layer_Lb"]
+    assert engine.stats()["connections_opened"] == 1
+
+
+@pytest.mark.anyio
+async def test_failed_new_connection_is_closed(engine, monkeypatch):
+    def broken_attach(pooled, layer_id, db_path):
+        raise RuntimeError("attach failed")
+
+    monkeypatch.setattr(engine, "_attach", broken_attach)
+    with pytest.raises(RuntimeError):
+        await engine.run_query("SELECT 1", "Ltest", max_n_rows=1, timeout=10)
+
+    stats = engine.stats()
+    assert stats["connections_discarded"] == 1
+    assert stats["idle_connections"] == 0
+
+
+@pytest.mark.anyio
+async def test_timeout_during_attach_skips_query(engine, monkeypatch):
+    await engine.run_query("SELECT 1", "Ltest", max_n_rows=1, timeout=10)
+    attach = engine._attach
+    queries = []
+
+    def slow_attach(pooled, layer_id, db_path):
+        time.sleep(0.5)
+        attach(pooled, layer_id, db_path)
+
+    def fetch_capped(con, sql_query, n):
+        queries.append(sql_query)
+        return [], [], 0
+
+    monkeypatch.setattr(engine, "_attach", slow_attach)
+    monkeypatch.setattr(engine, "_fetch_capped", fetch_capped)
+    with pytest.raises(asyncio.TimeoutError):
+        await engine.run_query("SELECT 1", "Ltest", max_n_rows=1, timeout=0.1)
+
+    # nothing was executing, so nothing counts as interrupted
+    await asyncio.sleep(0.6)
+    assert queries == []
+    stats = engine.stats()
+    assert stats["interrupted"] == 0
+    assert stats["idle_connections"] == 1
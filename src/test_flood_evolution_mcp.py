@@ -0,0 +1,126 @@
+"""
+洪水演进模型测试
+验证向量化圣维南求解器与半隐式格式
+"""
+
+import numpy as np
+import pytest
+
+from src.mcp_servers.flood_evolution_mcp import (
+    FloodEvolutionMCPServer,
+    SaintVenantSolver,
+    solve_tridiagonal,
+)
+
+
+def dam_break(solver: SaintVenantSolver):
+    solver.initialize_river_bed(0.001)
+    h0 = np.where(solver.x < solver.river_length / 2, 10.0, 2.0)
+    return h0, np.zeros(solver.nx), 2.0 + solver.z[-1]
+
+
+def test_semi_implicit_dam_break_is_stable_and_conservative():
+    """溃坝算例: 600秒步长下半隐式格式稳定且质量守恒"""
+    solver = SaintVenantSolver(dx=0.5, dt=600.0)
+    h0, q0, downstream = dam_break(solver)
+    nt = 36
+    run = solver.run(h0, q0, np.zeros(nt), np.full(nt, downstream), nt)
+
+    assert run.completed_steps == nt
+    assert np.all(np.isfinite(run.depths)) and np.all(run.depths >= 0)
+    assert float(run.mass_balance_error) < 1e-10
+    # 溃坝波已传播: 上游水位下降, 下游水位上涨
+    assert run.depths[-1, 0] < 10.0
+    assert run.depths[-1, -20] > 2.0
+
+
+def test_vectorized_equations_match_per_cell_loop():
+    """向量化方程与原逐单元循环结果一致"""
+    solver = SaintVenantSolver(scheme="explicit")
+    solver.initialize_river_bed(0.001)
+    rng = np.random.default_rng(0)
+    h = rng.uniform(1.0, 8.0, solver.nx)
+    q = rng.uniform(0.0, 30.0, solver.nx)
+
+    dh_dt, dq_dt = solver.saint_venant_equations(h, q)
+
+    dx_m = solver.dx_m
+    for i in range(1, solver.nx - 1):
+        assert dh_dt[i] == pytest.approx(-(q[i + 1] - q[i - 1]) / (2 * dx_m))
+        velocity = q[i] / h[i]
+        radius = h[i] / (1 + 2 * h[i] / 50)
+        sf = solver.manning_n**2 * velocity**2 / radius ** (4 / 3)
+        expected = (
+            -((q[i + 1] ** 2 / h[i + 1]) - (q[i - 1] ** 2 / h[i - 1])) / (2 * dx_m)
+            - solver.gravity * h[i] * ((h[i + 1] - h[i - 1]) + (solver.z[i + 1] - solver.z[i - 1])) / (2 * dx_m)
+            - solver.gravity * h[i] * sf
+        )
+        assert dq_dt[i] == pytest.approx(expected)
+
+
+def test_batched_tridiagonal_solve_matches_dense():
+    """批量三对角求解与稠密矩阵结果一致"""
+    rng = np.random.default_rng(1)
+    lower, upper = rng.uniform(-1, 0, (2, 3, 6))
+    diag = 3 + rng.uniform(0, 1, (3, 6))
+    lower[:, 0] = 0
+    upper[:, -1] = 0
+    rhs = rng.normal(size=(3, 6))
+
+    x = solve_tridiagonal(lower, diag, upper, rhs)
+
+    for b in range(3):
+        dense = np.diag(diag[b]) + np.diag(upper[b, :-1], 1) + np.diag(lower[b, 1:], -1)
+        np.testing.assert_allclose(dense @ x[b], rhs[b], atol=1e-12)
+
+
+@pytest.mark.anyio
+async def test_simulate_flood_propagation_default_scheme():
+    """默认半隐式格式完成全部时间步"""
+    result = await FloodEvolutionMCPServer().simulate_flood_propagation(
+        river_length=50.0, simulation_hours=12.0, upstream_flow_rate=2000.0
+    )
+    assert result["status"] == "success"
+    assert result["results"]["completed_steps"] == 72
+    assert result["results"]["mass_balance_error"] < 1e-10
+
+
+@pytest.mark.anyio
+async def test_flood_ensemble_members_match_single_runs():
+    """集合成员与逐个单独模拟结果一致, 概率与百分位数合理"""
+    server = FloodEvolutionMCPServer()
+    hydrographs = [[1000.0, 3000.0, 1500.0], [1000.0, 1000.0, 1000.0], [1000.0, 6000.0, 2000.0]]
+    roughness = [0.03, 0.035, 0.045]
+    ensemble = await server.simulate_flood_ensemble(
+        river_length=20.0,
+        simulation_hours=6.0,
+        upstream_hydrographs=hydrographs,
+        hydrograph_interval_hours=3.0,
+        manning_roughness=roughness,
+        depth_thresholds=[5.0, 12.0],
+    )
+    assert ensemble["status"] == "success"
+    results = ensemble["results"]
+    assert results["max_mass_balance_error"] < 1e-10
+
+    exceedance = np.array(results["exceedance_probability"])
+    assert exceedance.shape == (2, 21)
+    assert np.all((exceedance >= 0) & (exceedance <= 1))
+    assert np.all(exceedance[0] >= exceedance[1])
+    assert np.all(np.diff(np.array(results["peak_depth_percentiles"]), axis=0) >= 0)
+
+    # 恒定入流成员与单独模拟的最大水深一致 (同批成员共用子步数, 允许微小差异)
+    single = await server.simulate_flood_propagation(
+        river_length=20.0, simulation_hours=6.0, upstream_flow_rate=1000.0, manning_roughness=0.035
+    )
+    assert results["member_max_depth"][1] == pytest.approx(
+        np.max(single["results"]["water_levels"]), rel=1e-4
+    )
+
+
+@pytest.mark.anyio
+async def test_flood_ensemble_rejects_mismatched_member_lengths():
+    result = await FloodEvolutionMCPServer().simulate_flood_ensemble(
+        manning_roughness=[0.03, 0.04], breach_peak_flows=[100.0, 200.0, 300.0]
+    )
+    assert result["status"] == "error"
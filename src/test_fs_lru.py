@@ -0,0 +1,164 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import sqlite3
+
+import pytest
+
+from src.fs_lru import FileCache
+
+
+def writer(payload: bytes, calls: list):
+    async def fill(dest):
+        calls.append(dest)
+        await asyncio.sleep(0.01)
+        with open(dest, "wb") as f:
+            f.write(payload)
+
+    return fill
+
+
+@pytest.mark.anyio
+async def test_concurrent_misses_fill_once(tmp_path):
+    cache = FileCache(str(tmp_path), max_size=1024)
+    calls = []
+
+    await asyncio.gather(
+        *[cache.ensure("a.gpkg", writer(b"x" * 10, calls)) for _ in range(8)]
+    )
+
+    assert len(calls) == 1
+    assert cache.get_path("a.gpkg") == os.path.join(tmp_path, "a.gpkg")
+    assert os.listdir(cache.tmp_dir) == []
+
+    await cache.ensure("a.gpkg", writer(b"", calls))
+    stats = cache.stats()
+    assert stats["misses"] == 1 and stats["hits"] == 1
+    assert stats["bytes_filled"] == 10 and stats["bytes_hit"] == 10
+
+
+@pytest.mark.anyio
+async def test_failed_fill_leaves_nothing_behind(tmp_path):
+    cache = FileCache(str(tmp_path), max_size=1024)
+
+    async def broken(dest):
+        with open(dest, "wb") as f:
+            f.write(b"partial")
+        raise RuntimeError("ogr2ogr failed")
+
+    with pytest.raises(RuntimeError):
+        await cache.ensure("a.gpkg", broken)
+    assert not cache.has("a.gpkg")
+    assert os.listdir(cache.tmp_dir) == []
+
+
+@pytest.mark.anyio
+async def test_eviction_skips_keys_pinned_by_any_worker(tmp_path):
+    cache = FileCache(str(tmp_path), max_size=25)
+    # a second FileCache on the same directory stands in for another worker
+    other_worker = FileCache(str(tmp_path), max_size=25)
+    calls = []
+
+    await cache.ensure("old.gpkg", writer(b"o" * 10, calls))
+    await cache.ensure("mine.gpkg", writer(b"m" * 10, calls))
+    assert other_worker.has("old.gpkg")
+
+    async with other_worker.pinned("old.gpkg") as old_path:
+        async with cache.pinned("mine.gpkg") as mine_path:
+            await cache.ensure("new.gpkg", writer(b"n" * 10, calls))
+            # both older entries are pinned, so the cache runs over budget
+            assert os.path.exists(old_path) and os.path.exists(mine_path)
+            assert cache.total == 30
+
+    await cache.ensure("newest.gpkg", writer(b"n" * 10, calls))
+    assert not os.path.exists(old_path)
+    assert not os.path.exists(mine_path)
+    assert cache.total <= 25
+    assert cache.stats()["evictions"] == 2
+
+
+@pytest.mark.anyio
+async def test_pinned_yields_none_for_missing_key(tmp_path):
+    cache = FileCache(str(tmp_path), max_size=1024)
+    async with cache.pinned("missing.gpkg") as path:
+        assert path is None
+    assert cache.stats()["pinned"] == 0
+
+
+@pytest.mark.anyio
+async def test_workers_share_lru_order_and_size_budget(tmp_path):
+    cache = FileCache(str(tmp_path), max_size=25)
+    other_worker = FileCache(str(tmp_path), max_size=25)
+    calls = []
+
+    await cache.ensure("a.gpkg", writer(b"a" * 10, calls))
+    await cache.ensure("b.gpkg", writer(b"b" * 10, calls))
+    # another worker reading a.gpkg makes it the most recently used entry
+    async with other_worker.pinned("a.gpkg") as path:
+        assert path is not None
+        assert other_worker.stats()["pinned"] == 1
+    assert cache.stats()["pinned"] == 0
+
+    await other_worker.ensure("c.gpkg", writer(b"c" * 10, calls))
+
+    assert cache.has("a.gpkg")
+    assert not cache.has("b.gpkg")
+    assert cache.total == other_worker.total == 20
+    assert len(calls) == 3
+
+
+def test_index_adopts_existing_files(tmp_path):
+    (tmp_path / "legacy.gpkg").write_bytes(b"x" * 7)
+    cache = FileCache(str(tmp_path), max_size=1024)
+    assert cache.has("legacy.gpkg")
+    assert cache.total == 7
+
+
+@pytest.mark.anyio
+async def test_busy_index_does_not_block_event_loop(tmp_path):
+    cache = FileCache(str(tmp_path), max_size=1024)
+    await cache.ensure("a.gpkg", writer(b"a" * 10, []))
+
+    # another worker holding a write lock on the shared index
+    other = sqlite3.connect(os.path.join(tmp_path, ".index.sqlite"), timeout=10)
+    other.execute("BEGIN EXCLUSIVE")
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    async def pin():
+        async with cache.pinned("a.gpkg") as path:
+            return path
+
+    ticker = asyncio.ensure_future(tick())
+    # pinning writes to the index, so it waits for the other worker
+    lookup = asyncio.ensure_future(pin())
+    await asyncio.sleep(0.3)
+    assert not lookup.done()
+    assert ticks >= 10
+
+    other.rollback()
+    other.close()
+    assert await lookup == os.path.join(tmp_path, "a.gpkg")
+    ticker.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await ticker
+    assert cache.stats()["pinned"] == 0
@@ -0,0 +1,95 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import pytest
+
+
+@pytest.fixture
+async def airports_layer_id(auth_client):
+    map_response = await auth_client.post(
+        "/api/maps/create", json={"title": "GeoJSON Export Map"}
+    )
+    assert map_response.status_code == 200
+    map_id = map_response.json()["id"]
+
+    with open("test_fixtures/airports.geojson", "rb") as f:
+        files = {"file": ("airports.geojson", f, "application/json")}
+        upload_response = await auth_client.post(
+            f"/api/maps/{map_id}/layers", files=files, data={"layer_name": "Airports"}
+        )
+    assert upload_response.status_code == 200
+    return upload_response.json()["id"]
+
+
+@pytest.mark.anyio
+async def test_geojson_export_streams_full_layer(auth_client, airports_layer_id):
+    response = await auth_client.get(f"/api/layer/{airports_layer_id}.geojson")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/geo+json"
+
+    collection = response.json()
+    assert collection["type"] == "FeatureCollection"
+    assert len(collection["features"]) == 76
+
+
+@pytest.mark.anyio
+async def test_geojson_export_bbox_and_fields(auth_client, airports_layer_id):
+    response = await auth_client.get(
+        f"/api/layer/{airports_layer_id}.geojson",
+        params={"bbox": "-150,60,-140,65", "fields": "NAME,ELEV"},
+    )
+    assert response.status_code == 200
+
+    features = response.json()["features"]
+    assert len(features) == 18
+    for feature in features:
+        assert set(feature["properties"]) == {"NAME", "ELEV"}
+        lon, lat = feature["geometry"]["coordinates"]
+        assert -150 <= lon <= -140 and 60 <= lat <= 65
+
+
+@pytest.mark.anyio
+async def test_geojson_export_rejects_bad_bbox(auth_client, airports_layer_id):
+    response = await auth_client.get(
+        f"/api/layer/{airports_layer_id}.geojson", params={"bbox": "1,2,3"}
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_geojson_export_rejects_unknown_fields(auth_client, airports_layer_id):
+    response = await auth_client.get(
+        f"/api/layer/{airports_layer_id}.geojson", params={"fields": "NAME,NOPE"}
+    )
+    assert response.status_code == 400
+    assert "NOPE" in response.json()["detail"]
+
+
+@pytest.mark.anyio
+async def test_geojsonseq_export_is_one_feature_per_line(
+    auth_client, airports_layer_id
+):
+    response = await auth_client.get(
+        f"/api/layer/{airports_layer_id}.geojsonl", params={"fields": "NAME"}
+    )
+    assert response.status_code == 200
+
+    lines = [line for line in response.text.splitlines() if line.strip()]
+    assert len(lines) == 76
+    for line in lines:
+        feature = json.loads(line)
+        assert feature["type"] == "Feature"
+        assert set(feature["properties"]) == {"NAME"}
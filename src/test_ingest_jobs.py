@@ -0,0 +1,393 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from src import ingest_jobs
+from src.ingest_jobs import (
+    IngestJobContext,
+    IngestJobLost,
+    IngestJobQueue,
+    ingest_stage,
+    is_retryable,
+    stage_concurrency,
+)
+from src.structures import get_async_db_connection
+
+
+@pytest.fixture
+def fresh_stage_limits(monkeypatch):
+    monkeypatch.setattr(ingest_jobs, "_stage_semaphores", {})
+    yield monkeypatch
+
+
+def test_stage_concurrency_from_env(fresh_stage_limits):
+    fresh_stage_limits.setenv("MUNDI_INGEST_TILES_CONCURRENCY", "3")
+    assert stage_concurrency("tiles") == 3
+    assert stage_concurrency("register") is None
+
+
+@pytest.mark.anyio
+async def test_ingest_stage_limits_concurrency_outside_jobs(fresh_stage_limits):
+    fresh_stage_limits.setenv("MUNDI_INGEST_CONVERT_CONCURRENCY", "2")
+    active = 0
+    peak = 0
+
+    async def convert():
+        nonlocal active, peak
+        async with ingest_stage("convert"):
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+
+    await asyncio.gather(*(convert() for _ in range(6)))
+    assert peak == 2
+
+
+def test_client_errors_are_not_retried():
+    assert not is_retryable(HTTPException(status_code=400, detail="bad file"))
+    assert is_retryable(HTTPException(status_code=500, detail="boom"))
+    assert is_retryable(RuntimeError("tippecanoe crashed"))
+
+
+class FakeS3:
+    async def download_file(self, bucket, key, path):
+        with open(path, "wb") as f:
+            f.write(b"s3!")
+
+
+@pytest.mark.anyio
+async def test_spool_dir_must_be_private(tmp_path, monkeypatch):
+    private = IngestJobQueue(1, 1, spool_dir=str(tmp_path / "spool"))
+    path = private.spool_path("J1", ".geojson")
+    assert os.stat(private.spool_dir).st_mode & 0o777 == 0o700
+
+    shared_dir = tmp_path / "shared"
+    shared_dir.mkdir()
+    shared_dir.chmod(0o777)
+    shared = IngestJobQueue(1, 1, spool_dir=str(shared_dir))
+    with pytest.raises(RuntimeError):
+        shared.spool_path("J1", ".geojson")
+
+    async def get_async_s3_client():
+        return FakeS3()
+
+    monkeypatch.setattr(ingest_jobs, "get_async_s3_client", get_async_s3_client)
+    monkeypatch.setattr(ingest_jobs, "get_bucket_name", lambda: "bucket")
+    planted = shared_dir / "J1.geojson"
+    planted.write_bytes(b"bad")
+    outside = tmp_path / "J1.geojson"
+    outside.write_bytes(b"bad")
+    job = {
+        "filename": "points.geojson",
+        "source_s3_key": "ingest/J1.geojson",
+        "size_bytes": 3,
+    }
+
+    # a planted file, or one outside the spool dir, is never used
+    for queue, spool_path in [(shared, str(planted)), (private, str(outside))]:
+        async with queue._source_file({**job, "spool_path": spool_path}) as source:
+            with open(source, "rb") as f:
+                assert f.read() == b"s3!"
+
+    with open(path, "wb") as f:
+        f.write(b"ok!")
+    async with private._source_file({**job, "spool_path": path}) as source:
+        assert source == path
+
+
+@pytest.fixture
+async def ingest_map(auth_client):
+    map_response = await auth_client.post(
+        "/api/maps/create", json={"title": "Ingest Job Map"}
+    )
+    assert map_response.status_code == 200
+    map_id = map_response.json()["id"]
+    async with get_async_db_connection() as conn:
+        row = await conn.fetchrow(
+            "SELECT owner_uuid, project_id FROM user_mundiai_maps WHERE id = $1",
+            map_id,
+        )
+    yield {"map_id": map_id, **dict(row)}
+    async with get_async_db_connection() as conn:
+        await conn.execute("DELETE FROM ingest_jobs WHERE map_id = $1", map_id)
+
+
+@pytest.fixture
+def queue(tmp_path):
+    q = IngestJobQueue(
+        workers=1,
+        max_attempts=2,
+        spool_dir=str(tmp_path / "spool"),
+        stale_after_sec=30,
+        retry_backoff_sec=60,
+    )
+    q.discarded = []
+
+    async def discard_source(job):
+        q.discarded.append(job["id"])
+
+    q._discard_source = discard_source
+    return q
+
+
+async def enqueue(queue, ingest_map, spool_path=None, size_bytes=3) -> dict:
+    async with get_async_db_connection() as conn:
+        return await queue.enqueue(
+            conn,
+            job_id=ingest_jobs.generate_id(prefix="J"),
+            owner_uuid=str(ingest_map["owner_uuid"]),
+            project_id=ingest_map["project_id"],
+            map_id=ingest_map["map_id"],
+            conversation_id=None,
+            filename="points.geojson",
+            layer_name=None,
+            add_layer_to_map=True,
+            source_s3_key="ingest/test/points.geojson",
+            spool_path=spool_path,
+            size_bytes=size_bytes,
+            sha256="0" * 64,
+            receive_seconds=0.1,
+        )
+
+
+async def fetch_job(job_id: str) -> dict:
+    async with get_async_db_connection() as conn:
+        return dict(
+            await conn.fetchrow("SELECT * FROM ingest_jobs WHERE id = $1", job_id)
+        )
+
+
+@pytest.mark.postgres
+@pytest.mark.anyio
+async def test_claim_skips_jobs_locked_by_another_worker(queue, ingest_map):
+    first = await enqueue(queue, ingest_map)
+    second = await enqueue(queue, ingest_map)
+
+    async with get_async_db_connection() as other:
+        async with other.transaction():
+            await other.execute(
+                "SELECT id FROM ingest_jobs WHERE id = $1 FOR UPDATE", first["id"]
+            )
+            claimed = await asyncio.wait_for(queue._claim(), timeout=5)
+            assert claimed["id"] == second["id"]
+
+    claimed = await queue._claim()
+    assert claimed["id"] == first["id"]
+    assert claimed["status"] == "running"
+    assert claimed["attempts"] == 1
+    assert claimed["worker_id"] == queue.worker_id
+    assert await queue._claim() is None
+
+
+@pytest.mark.postgres
+@pytest.mark.anyio
+async def test_failed_job_is_retried_with_backoff_then_fails(queue, ingest_map):
+    job = await enqueue(queue, ingest_map)
+
+    async def process(job):
+        raise RuntimeError("tippecanoe crashed")
+
+    queue._process = process
+
+    await queue._run(await queue._claim())
+    row = await fetch_job(job["id"])
+    assert row["status"] == "queued"
+    assert row["attempts"] == 1
+    assert row["error"] == "tippecanoe crashed"
+    assert row["worker_id"] is None
+    assert (row["run_after"] - row["heartbeat_at"]).total_seconds() >= 59
+    # not due yet
+    assert await queue._claim() is None
+    assert queue.discarded == []
+
+    async with get_async_db_connection() as conn:
+        await conn.execute(
+            "UPDATE ingest_jobs SET run_after = CURRENT_TIMESTAMP WHERE id = $1",
+            job["id"],
+        )
+    await queue._run(await queue._claim())
+    row = await fetch_job(job["id"])
+    assert row["status"] == "failed"
+    assert row["attempts"] == 2
+    assert row["finished_at"] is not None
+    assert queue.discarded == [job["id"]]
+    assert queue.counters["retried"] == 1
+    assert queue.counters["failed"] == 1
+
+
+@pytest.mark.postgres
+@pytest.mark.anyio
+async def test_retries_reuse_the_pinned_layer_id(queue, ingest_map, monkeypatch):
+    from src.routes import postgres_routes
+
+    spool_path = queue.spool_path("pinned", ".geojson")
+    with open(spool_path, "wb") as f:
+        f.write(b"{}\n")
+    job = await enqueue(queue, ingest_map, spool_path=spool_path)
+    assert job["layer_id"].startswith("L")
+
+    layer_ids = []
+
+    async def internal_upload_layer(*, layer_id, **kwargs):
+        layer_ids.append(layer_id)
+        if len(layer_ids) == 1:
+            raise RuntimeError("failed after registering")
+        return SimpleNamespace(id=layer_id)
+
+    monkeypatch.setattr(postgres_routes, "internal_upload_layer", internal_upload_layer)
+
+    await queue._run(await queue._claim())
+    async with get_async_db_connection() as conn:
+        await conn.execute(
+            "UPDATE ingest_jobs SET run_after = CURRENT_TIMESTAMP WHERE id = $1",
+            job["id"],
+        )
+    await queue._run(await queue._claim())
+
+    assert layer_ids == [job["layer_id"], job["layer_id"]]
+    row = await fetch_job(job["id"])
+    assert row["status"] == "succeeded"
+    assert row["layer_id"] == job["layer_id"]
+
+
+@pytest.mark.postgres
+@pytest.mark.anyio
+async def test_cancel_queued_job(queue, ingest_map):
+    job = await enqueue(queue, ingest_map)
+
+    async with get_async_db_connection() as conn:
+        cancelled = await queue.cancel(conn, job["id"])
+    assert cancelled["status"] == "cancelled"
+    assert cancelled["finished_at"] is not None
+    assert queue.discarded == [job["id"]]
+    assert await queue._claim() is None
+
+
+@pytest.mark.postgres
+@pytest.mark.anyio
+async def test_cancel_running_job_from_another_node(queue, ingest_map, tmp_path):
+    job = await enqueue(queue, ingest_map)
+    started = asyncio.Event()
+
+    async def process(job):
+        started.set()
+        await asyncio.Event().wait()
+
+    queue._process = process
+    claimed = await queue._claim()
+    task = asyncio.create_task(queue._run(claimed))
+    queue._running[job["id"]] = task
+    queue._attempts[job["id"]] = claimed["attempts"]
+    await started.wait()
+
+    # the API request landed on a node that isn't running the job
+    api_node = IngestJobQueue(workers=1, max_attempts=2, spool_dir=str(tmp_path))
+    async with get_async_db_connection() as conn:
+        cancelled = await api_node.cancel(conn, job["id"])
+        assert cancelled["status"] == "running"
+        assert cancelled["cancel_requested"]
+
+        await queue._heartbeat(conn)
+    await asyncio.wait_for(task, timeout=5)
+
+    row = await fetch_job(job["id"])
+    assert row["status"] == "cancelled"
+    assert row["worker_id"] is None
+    assert queue.discarded == [job["id"]]
+    assert queue.counters["cancelled"] == 1
+
+
+@pytest.mark.postgres
+@pytest.mark.anyio
+async def test_stale_job_is_requeued_and_old_attempt_is_fenced(queue, ingest_map):
+    job = await enqueue(queue, ingest_map)
+    stale = await queue._claim()
+
+    async with get_async_db_connection() as conn:
+        await conn.execute(
+            """
+            UPDATE ingest_jobs
+            SET heartbeat_at = CURRENT_TIMESTAMP - interval '1 hour'
+            WHERE id = $1
+            """,
+            job["id"],
+        )
+        await queue._heartbeat(conn)
+
+    row = await fetch_job(job["id"])
+    assert row["status"] == "queued"
+    assert row["worker_id"] is None
+    assert row["error"] == "worker stopped responding"
+
+    other = IngestJobQueue(workers=1, max_attempts=2, spool_dir=queue.spool_dir)
+    other.worker_id = "other-node:1"
+    reclaimed = await other._claim()
+    assert reclaimed["id"] == job["id"]
+    assert reclaimed["attempts"] == 2
+
+    # the first worker was only blocked; it must not touch the job again
+    ctx = IngestJobContext(stale)
+    with pytest.raises(IngestJobLost):
+        await ctx.enter_stage("register")
+    await queue._finish(ctx, "succeeded", layer_id=stale["layer_id"])
+    row = await fetch_job(job["id"])
+    assert row["status"] == "running"
+    assert row["worker_id"] == "other-node:1"
+    assert queue.discarded == []
+
+    # and its heartbeat stops the blocked task rather than reviving the row
+    blocked = asyncio.create_task(asyncio.Event().wait())
+    queue._running[job["id"]] = blocked
+    queue._attempts[job["id"]] = stale["attempts"]
+    async with get_async_db_connection() as conn:
+        await queue._heartbeat(conn)
+    with pytest.raises(asyncio.CancelledError):
+        await blocked
+    assert job["id"] in queue._lost
+
+
+@pytest.mark.postgres
+@pytest.mark.anyio
+async def test_spool_files_of_finished_jobs_are_swept(queue, ingest_map):
+    done = await enqueue(queue, ingest_map)
+    waiting = await enqueue(queue, ingest_map)
+    async with get_async_db_connection() as conn:
+        await queue.cancel(conn, done["id"])
+
+    paths = {
+        name: queue.spool_path(name, ".geojson")
+        for name in (done["id"], waiting["id"], "Jorphanold01", "Jreceiving1")
+    }
+    for path in paths.values():
+        with open(path, "wb") as f:
+            f.write(b"{}")
+    old = time.time() - 3600
+    os.utime(paths["Jorphanold01"], (old, old))
+
+    async with get_async_db_connection() as conn:
+        await queue._sweep_spool(conn)
+
+    assert sorted(os.listdir(queue.spool_dir)) == sorted(
+        [f"{waiting['id']}.geojson", "Jreceiving1.geojson"]
+    )
+    assert queue.counters["spool_swept"] == 2
@@ -0,0 +1,84 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+import pytest
+
+from src.structures import get_async_db_connection
+
+N_MAPS = 2_000
+
+
+async def explain(conn, query: str, *args) -> dict:
+    plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+    return json.loads(plan)[0] if isinstance(plan, str) else plan[0]
+
+
+def uses_index(node: dict, index_name: str) -> bool:
+    if node.get("Index Name") == index_name:
+        return True
+    return any(uses_index(child, index_name) for child in node.get("Plans", []))
+
+
+@pytest.mark.postgres
+@pytest.mark.anyio
+async def test_layer_membership_lookup_uses_gin_index():
+    """`layers @>` can use the ix_user_mundiai_maps_layers_gin index, `= ANY(layers)` can't.
+
+    Mirrors the migration on a small temp table so the real table isn't
+    touched. Timings live in benchmark_map_layers_gin.py.
+    """
+    async with get_async_db_connection("test_map_layers_gin") as conn:
+        async with conn.transaction():
+            await conn.execute(
+                """
+                CREATE TEMP TABLE gin_maps (
+                    id varchar(12) PRIMARY KEY,
+                    layers varchar(12)[]
+                ) ON COMMIT DROP
+                """
+            )
+            await conn.execute(
+                f"""
+                INSERT INTO gin_maps (id, layers)
+                SELECT 'M' || lpad(g::text, 11, '0'),
+                       ARRAY(
+                           SELECT 'L' || lpad(((g + k) % {N_MAPS})::text, 11, '0')
+                           FROM generate_series(0, 4) k
+                       )::varchar(12)[]
+                FROM generate_series(0, {N_MAPS - 1}) g
+                """
+            )
+            await conn.execute(
+                "CREATE INDEX gin_maps_layers_gin ON gin_maps USING GIN (layers)"
+            )
+            await conn.execute("ANALYZE gin_maps")
+            # on a table this small the planner may prefer a seq scan anyway;
+            # the question is only whether the index is usable
+            await conn.execute("SET LOCAL enable_seqscan = off")
+
+            any_query = "SELECT id FROM gin_maps WHERE $1 = ANY(layers)"
+            contains_query = (
+                "SELECT id FROM gin_maps WHERE layers @> ARRAY[$1]::varchar[]"
+            )
+            plan = await explain(conn, contains_query, "L00000000123")
+            any_plan = await explain(conn, any_query, "L00000000123")
+
+            assert uses_index(plan["Plan"], "gin_maps_layers_gin")
+            # the old spelling can't use the index, which is why the queries changed
+            assert not uses_index(any_plan["Plan"], "gin_maps_layers_gin")
+            rows = await conn.fetch(contains_query, "L00000000123")
+            assert len(rows) == 5
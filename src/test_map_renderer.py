@@ -0,0 +1,169 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+import os
+import signal
+import sys
+import textwrap
+import time
+
+import anyio
+import pytest
+
+from src.map_renderer import MapRendererPool, RendererError, RendererWorker
+
+# speaks worker.js's line protocol without needing Xvfb or MapLibre
+FAKE_WORKER = textwrap.dedent(
+    """
+    import base64, json, os, sys, time
+    print(json.dumps({"ready": True, "rss": 1}), flush=True)
+    for line in sys.stdin:
+        job = json.loads(line)
+        if job["style"] == "hang":
+            time.sleep(60)
+        if job["style"] == "bad":
+            print(json.dumps({"id": job["id"], "ok": False, "error": "bad style"}), flush=True)
+            continue
+        print(json.dumps({
+            "id": job["id"],
+            "ok": True,
+            "png": base64.b64encode(str(os.getpid()).encode()).decode(),
+            "zoom": 3,
+            "center": [0, 0],
+            "messages": [],
+            "rss": 1,
+        }), flush=True)
+    """
+)
+
+
+@pytest.fixture
+def fake_pool(tmp_path):
+    script = tmp_path / "worker.py"
+    script.write_text(FAKE_WORKER)
+    return MapRendererPool(
+        size=2,
+        max_jobs=3,
+        max_rss_bytes=1024,
+        timeout=2,
+        command=[sys.executable, str(script)],
+    )
+
+
+@pytest.mark.anyio
+async def test_pool_reuses_and_recycles_workers(fake_pool):
+    try:
+        pids = []
+        for _ in range(4):
+            result = await fake_pool.render("{}", 100, 100, bounds="0,0,1,1")
+            assert result.zoom == 3
+            pids.append(result.png)
+
+        # the same warm process serves until max_jobs, then it is replaced
+        assert pids[0] == pids[1] == pids[2]
+        assert pids[3] != pids[0]
+        stats = fake_pool.stats()
+        assert stats["rendered"] == 4
+        assert stats["workers_started"] == 2
+        assert stats["workers_recycled"] == 1
+        assert stats["latency_ms_p50"] is not None
+    finally:
+        await fake_pool.close()
+
+
+@pytest.mark.anyio
+async def test_pool_bounds_concurrency_and_reports_queue(fake_pool):
+    try:
+        results = await asyncio.gather(
+            *(fake_pool.render("{}", 10, 10, bounds="0,0,1,1") for _ in range(5))
+        )
+        assert len(results) == 5
+        assert fake_pool.stats()["workers_started"] <= 3
+        assert fake_pool.stats()["queue_depth"] == 0
+    finally:
+        await fake_pool.close()
+
+
+@pytest.mark.anyio
+async def test_pool_survives_bad_styles_and_timeouts(fake_pool):
+    try:
+        fake_pool.timeout = 0.5
+        with pytest.raises(RendererError, match="bad style"):
+            await fake_pool.render("bad", 10, 10, bounds="0,0,1,1")
+        # a worker that answered with an error is kept
+        assert fake_pool.stats()["idle_workers"] == 1
+
+        with pytest.raises(RendererError, match="timed out"):
+            await fake_pool.render("hang", 10, 10, bounds="0,0,1,1")
+        assert fake_pool.stats()["timed_out"] == 1
+        assert fake_pool.stats()["idle_workers"] == 0
+
+        result = await fake_pool.render("{}", 10, 10, bounds="0,0,1,1")
+        assert result.png
+    finally:
+        await fake_pool.close()
+
+
+# like xvfb-run: the process we start is only a wrapper around the real worker
+FORKING_WORKER = textwrap.dedent(
+    """
+    import json, subprocess, sys, time
+    child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    with open(sys.argv[1], "w") as f:
+        f.write(str(child.pid))
+    print(json.dumps({"ready": True, "rss": 1}), flush=True)
+    time.sleep(60)
+    """
+)
+
+
+def process_gone(pid: int, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # a zombie nobody has reaped yet is gone too
+                if f.read().rsplit(")", 1)[1].split()[0] == "Z":
+                    return True
+        except FileNotFoundError:
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("crashed", [False, True])
+async def test_killing_a_worker_kills_its_children(tmp_path, crashed):
+    script = tmp_path / "wrapper.py"
+    script.write_text(FORKING_WORKER)
+    pid_file = tmp_path / "child.pid"
+
+    worker = await RendererWorker.start(
+        [sys.executable, str(script), str(pid_file)], timeout=5
+    )
+    child_pid = int(pid_file.read_text())
+    assert not process_gone(child_pid, timeout=0)
+
+    if crashed:
+        # the child still holds its stdout, so process.wait() would block
+        os.kill(worker.process.pid, signal.SIGKILL)
+        assert process_gone(worker.process.pid)
+    # the old close() killed only the wrapper and then hung on the child's pipe
+    with anyio.fail_after(10):
+        await worker.close(kill=True)
+
+    assert process_gone(child_pid)
@@ -0,0 +1,99 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import signal
+
+import pytest
+
+from src.ogr_convert import (
+    OgrConversionEngine,
+    OgrConversionError,
+    split_source_args,
+)
+
+AIRPORTS_GEOJSON = os.path.join(
+    os.path.dirname(__file__), "..", "test_fixtures", "airports.geojson"
+)
+
+
+def test_split_source_args_separates_open_options():
+    drivers, open_options, rest = split_source_args(
+        [
+            "-if",
+            "CSV",
+            "-f",
+            "FlatGeobuf",
+            "-oo",
+            "X_POSSIBLE_NAMES=lon",
+            "-skipfailures",
+        ]
+    )
+    assert drivers == ["CSV"]
+    assert open_options == ["X_POSSIBLE_NAMES=lon"]
+    assert rest == ["-f", "FlatGeobuf", "-skipfailures"]
+
+
+@pytest.fixture
+def engine():
+    engine = OgrConversionEngine(max_workers=1)
+    yield engine
+    if engine._executor is not None:
+        engine._executor.shutdown(wait=True)
+
+
+@pytest.mark.anyio
+async def test_convert_geojson_to_gpkg_with_timings(engine, tmp_path):
+    from osgeo import ogr
+
+    dest = str(tmp_path / "airports.gpkg")
+    timings = await engine.convert(
+        AIRPORTS_GEOJSON, dest, ["-f", "GPKG", "-nln", "airports"]
+    )
+
+    assert set(timings) == {"queue_ms", "open_ms", "translate_ms", "total_ms"}
+    ds = ogr.Open(dest)
+    assert ds.GetLayerByName("airports").GetFeatureCount() == 76
+    assert engine.stats()["conversions"] == 1
+
+
+@pytest.mark.anyio
+async def test_convert_reports_gdal_errors(engine, tmp_path):
+    with pytest.raises(OgrConversionError):
+        await engine.convert(
+            str(tmp_path / "missing.geojson"),
+            str(tmp_path / "out.gpkg"),
+            ["-f", "GPKG"],
+        )
+    assert engine.stats()["failed"] == 1
+
+
+@pytest.mark.anyio
+async def test_crashed_worker_pool_is_rebuilt(engine, tmp_path):
+    await engine.convert(AIRPORTS_GEOJSON, str(tmp_path / "a.gpkg"), ["-f", "GPKG"])
+
+    # a segfault or OOM kill in GDAL breaks the whole executor
+    for process in list(engine._executor._processes.values()):
+        os.kill(process.pid, signal.SIGKILL)
+        process.join()
+
+    with pytest.raises(OgrConversionError):
+        await engine.convert(AIRPORTS_GEOJSON, str(tmp_path / "b.gpkg"), ["-f", "GPKG"])
+    assert engine._executor is None
+
+    await engine.convert(AIRPORTS_GEOJSON, str(tmp_path / "c.gpkg"), ["-f", "GPKG"])
+    stats = engine.stats()
+    assert stats["pool_restarts"] == 1
+    assert stats["conversions"] == 2
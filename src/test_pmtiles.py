@@ -0,0 +1,172 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import gzip
+import struct
+
+import pytest
+
+from src.pmtiles import (
+    COMPRESSION_GZIP,
+    DirectoryEntry,
+    PMTilesReader,
+    deserialize_directory,
+    find_entry,
+    parse_header,
+    zxy_to_tile_id,
+)
+
+
+def varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def serialize_directory(entries: list[DirectoryEntry]) -> bytes:
+    buf = varint(len(entries))
+    last = 0
+    for e in entries:
+        buf += varint(e.tile_id - last)
+        last = e.tile_id
+    for e in entries:
+        buf += varint(e.run_length)
+    for e in entries:
+        buf += varint(e.length)
+    for i, e in enumerate(entries):
+        previous = entries[i - 1] if i else None
+        if previous and e.offset == previous.offset + previous.length:
+            buf += varint(0)
+        else:
+            buf += varint(e.offset + 1)
+    return gzip.compress(buf)
+
+
+def build_archive(tiles: dict[tuple[int, int, int], bytes], leaf: bool) -> bytes:
+    """A minimal PMTiles v3 file, optionally with the tiles behind one leaf."""
+    data = b""
+    entries = []
+    for (z, x, y), tile in sorted(tiles.items(), key=lambda t: zxy_to_tile_id(*t[0])):
+        entries.append(DirectoryEntry(zxy_to_tile_id(z, x, y), len(data), len(tile), 1))
+        data += tile
+
+    if leaf:
+        leaf_dir = serialize_directory(entries)
+        root_dir = serialize_directory(
+            [DirectoryEntry(entries[0].tile_id, 0, len(leaf_dir), 0)]
+        )
+    else:
+        leaf_dir = b""
+        root_dir = serialize_directory(entries)
+
+    root_offset = 127
+    leaf_offset = root_offset + len(root_dir)
+    data_offset = leaf_offset + len(leaf_dir)
+    header = struct.pack(
+        "<7sB11Q6B4iB2i",
+        b"PMTiles",
+        3,
+        root_offset,
+        len(root_dir),
+        0,
+        0,
+        leaf_offset,
+        len(leaf_dir),
+        data_offset,
+        len(data),
+        len(tiles),
+        len(tiles),
+        len(tiles),
+        1,
+        COMPRESSION_GZIP,
+        COMPRESSION_GZIP,
+        1,
+        0,
+        14,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+        0,
+    )
+    return header + root_dir + leaf_dir + data
+
+
+class InMemoryReader(PMTilesReader):
+    def __init__(self, objects: dict[str, bytes]):
+        super().__init__(max_directory_bytes=1024 * 1024, header_ttl_sec=60)
+        self.objects = objects
+        self.range_requests = 0
+
+    async def _get_range(self, key, start, length, if_match=None):
+        self.range_requests += 1
+        blob = self.objects[key]
+        return blob[start : start + length], '"v1"', len(blob)
+
+
+def test_tile_ids_follow_hilbert_order():
+    assert zxy_to_tile_id(0, 0, 0) == 0
+    assert [zxy_to_tile_id(1, x, y) for x, y in [(0, 0), (0, 1), (1, 1), (1, 0)]] == [
+        1,
+        2,
+        3,
+        4,
+    ]
+    assert zxy_to_tile_id(2, 0, 0) == 5
+    ids = {zxy_to_tile_id(3, x, y) for x in range(8) for y in range(8)}
+    assert ids == set(range(21, 85))
+
+
+def test_directory_round_trip_and_runs():
+    entries = [
+        DirectoryEntry(0, 0, 10, 1),
+        DirectoryEntry(5, 10, 20, 3),
+        DirectoryEntry(20, 100, 5, 0),
+    ]
+    decoded = deserialize_directory(gzip.decompress(serialize_directory(entries)))
+    assert decoded == entries
+
+    assert find_entry(decoded, 0) == entries[0]
+    assert find_entry(decoded, 7) == entries[1]
+    assert find_entry(decoded, 8) is None
+    # anything past a leaf pointer belongs to that leaf
+    assert find_entry(decoded, 25) == entries[2]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("leaf", [False, True])
+async def test_reader_caches_header_and_directories(leaf):
+    tiles = {(0, 0, 0): b"world", (1, 1, 0): b"northeast", (2, 3, 3): b"corner"}
+    blob = build_archive(tiles, leaf=leaf)
+    assert parse_header(blob).tile_type == 1
+
+    reader = InMemoryReader({"a.pmtiles": blob})
+    for (z, x, y), tile in tiles.items():
+        location = await reader.locate_tile("a.pmtiles", z, x, y)
+        assert blob[location.offset : location.offset + location.length] == tile
+    assert await reader.locate_tile("a.pmtiles", 2, 0, 0) is None
+
+    # one read for header + root, plus one for the leaf if there is one
+    assert reader.range_requests == (2 if leaf else 1)
+    assert reader.stats()["header_fetches"] == 1
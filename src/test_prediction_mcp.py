@@ -0,0 +1,134 @@
+"""
+预测模型测试
+验证模型注册表的命中、持久化、后台重训与指标统计
+"""
+
+import os
+
+import joblib
+import numpy as np
+import pytest
+
+from src.mcp_servers.prediction_mcp import (
+    MachineLearningPredictor,
+    ModelRegistry,
+    PredictionMCPServer,
+    ensure_private_dir,
+    new_observation_count,
+)
+
+
+def _series(n: int) -> np.ndarray:
+    hours = np.arange(n)
+    return 150.0 + 2.0 * np.sin(2 * np.pi * hours / 24) + 0.01 * hours
+
+
+def test_new_observation_count_growing_and_rolling_windows():
+    """支持增长序列与滚动窗口, 数据被修改或新增过多时返回None"""
+    previous = np.arange(10.0)
+    assert new_observation_count(previous, np.arange(13.0), 5) == 3
+    assert new_observation_count(previous, np.arange(2.0, 12.0), 5) == 2
+    assert new_observation_count(previous, np.arange(20.0), 5) is None
+    changed = np.arange(12.0)
+    changed[0] = -1
+    assert new_observation_count(previous, changed, 5) is None
+
+
+def test_registry_hits_persists_and_refits_in_background(tmp_path):
+    """相同数据命中, 跨实例从磁盘命中, 追加观测时返回旧模型并在后台重训"""
+    fitted = []
+
+    def fit(data):
+        fitted.append(len(data))
+        return {"mean": float(np.mean(data))}
+
+    registry = ModelRegistry(str(tmp_path / "models"))
+    key = registry.key("station/1", "water_level", {"kind": "test"})
+    data = _series(100)
+
+    assert registry.get_or_fit(key, data, fit) == {"mean": float(np.mean(data))}
+    assert registry.get_or_fit(key, data, fit) == {"mean": float(np.mean(data))}
+    assert fitted == [100]
+
+    other = ModelRegistry(str(tmp_path / "models"))
+    other.get_or_fit(key, data, fit)
+    assert fitted == [100]
+    assert other.counters["disk_hits"] == 1
+
+    # 滚动窗口新增两个观测: 先返回旧模型, 后台训练完成后命中新模型
+    newer = _series(102)[2:]
+    assert registry.get_or_fit(key, newer, fit) == {"mean": float(np.mean(data))}
+    registry.wait_for_refits(timeout=10)
+    assert fitted == [100, 100]
+    assert registry.get_or_fit(key, newer, fit) == {"mean": float(np.mean(newer))}
+
+    stats = registry.stats()
+    assert stats["misses"] == 1
+    assert stats["stale_hits"] == 1
+    assert stats["memory_hits"] == 2
+    assert stats["background_fits"] == 1
+    assert stats["fits"] == 2
+    assert stats["refits_pending"] == 0
+    assert stats["fit_seconds_total"] >= 0
+
+
+def test_ml_predictor_reuses_registered_model(tmp_path):
+    """同一站点同一数据的重复预测不再重新训练"""
+    registry = ModelRegistry(str(tmp_path / "models"))
+    predictor = MachineLearningPredictor(registry)
+    data = _series(96)
+
+    first = predictor.predict_with_ml(data, 6, station_id="S1", variable="water_level")
+    second = predictor.predict_with_ml(data, 6, station_id="S1", variable="water_level")
+
+    np.testing.assert_allclose(first.predicted_values, second.predicted_values)
+    assert registry.counters["fits"] == 1
+    assert registry.counters["memory_hits"] == 1
+
+    # 不同变量使用不同的键
+    predictor.predict_with_ml(data, 6, station_id="S1", variable="discharge")
+    assert registry.counters["fits"] == 2
+
+
+@pytest.mark.anyio
+async def test_prediction_server_reports_registry_stats(tmp_path):
+    registry = ModelRegistry(str(tmp_path / "models"))
+    server = PredictionMCPServer(registry)
+    levels = _series(96).tolist()
+    discharges = (_series(96) * 30).tolist()
+
+    for _ in range(2):
+        result = await server.predict_hydrological_variables(
+            levels, discharges, prediction_hours=6, method="ensemble", station_id="S1"
+        )
+        assert result["status"] == "success"
+
+    stats = result["prediction_summary"]["model_registry"]
+    # 水位和流量各一个机器学习模型与一组集成权重
+    assert stats["fits"] == 4
+    assert stats["memory_hits"] == 4
+
+
+def test_registry_dir_is_private_and_others_are_not_loaded(tmp_path):
+    """缓存目录以0700创建; 权限过宽的目录中的文件不会被加载"""
+    private = tmp_path / "models"
+    assert ensure_private_dir(str(private))
+    assert private.stat().st_mode & 0o777 == 0o700
+
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    assert not ensure_private_dir(str(shared))
+
+    def fit(data):
+        return {"fitted": True}
+
+    registry = ModelRegistry(str(shared))
+    key = registry.key("S1", "water_level", {"kind": "test"})
+    planted = os.path.join(str(shared), *key[:-1], f"{key[-1]}.joblib")
+    os.makedirs(os.path.dirname(planted))
+    joblib.dump("planted", planted)
+
+    assert registry.get_or_fit(key, _series(10), fit) == {"fitted": True}
+    assert registry.counters["disk_hits"] == 0
+    assert registry.counters["misses"] == 1
@@ -0,0 +1,57 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import pytest
+
+from src.raster_tiles import RasterTileEngine, RasterTileQueueFull
+
+WATERBOARD_TIF = os.path.join(
+    os.path.dirname(__file__), "..", "test_fixtures", "waterboard.tif"
+)
+
+
+@pytest.fixture
+def local_engine():
+    engine = RasterTileEngine(max_workers=2, max_pending=4)
+
+    async def local_asset_url(cog_key: str) -> str:
+        return cog_key
+
+    engine._asset_url = local_asset_url
+    yield engine
+    engine.executor.shutdown(wait=True)
+
+
+@pytest.mark.anyio
+async def test_raster_engine_reuses_readers(local_engine):
+    for _ in range(3):
+        content = await local_engine.render_tile(WATERBOARD_TIF, 656, 1524, 12)
+        assert content.startswith(b"\x89PNG")
+
+    stats = local_engine.stats()
+    assert stats["rendered"] == 3
+    assert stats["pending"] == 0
+    # one open per pool thread at most, the rest reuse the cached reader
+    assert stats["reader_opens"] <= 2
+    assert stats["reader_opens"] + stats["reader_hits"] == 3
+
+
+@pytest.mark.anyio
+async def test_raster_engine_rejects_when_queue_full(local_engine):
+    local_engine.pending = local_engine.max_pending
+    with pytest.raises(RasterTileQueueFull):
+        await local_engine.render_tile(WATERBOARD_TIF, 656, 1524, 12)
+    assert local_engine.stats()["rejected"] == 1
@@ -0,0 +1,264 @@
+"""
+水库模拟模型测试
+验证预编译特征曲线、实测曲线表读取、多库多情景调度与动态规划优化调度
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from pydantic import ValidationError
+
+from src.mcp_servers.integration import ReservoirOptimizationRequest, ReservoirScenarioRequest
+
+from src.mcp_servers.reservoir_simulation_mcp import (
+    CascadeSimulationEngine,
+    CharacteristicCurve,
+    InflowForecast,
+    ReservoirDPScheduler,
+    ReservoirCharacteristics,
+    ReservoirOperationMode,
+    ReservoirSimulationMCPServer,
+    ReservoirSimulationModel,
+    load_survey_curves,
+    sample_inflow_scenarios,
+)
+
+
+def test_characteristic_curve_scalar_and_array_lookup():
+    """标量与数组查询一致, 超出范围取端点值"""
+    curve = CharacteristicCurve([150.0, 145.0, 160.0], [20.0, 10.0, 40.0], "capacity")
+    assert curve(147.5) == pytest.approx(15.0)
+    assert isinstance(curve(147.5), float)
+    np.testing.assert_allclose(curve(np.array([140.0, 155.0, 170.0])), [10.0, 30.0, 40.0])
+    assert curve.inverse(30.0) == pytest.approx(155.0)
+
+    with pytest.raises(ValueError):
+        CharacteristicCurve([1.0, 2.0, 3.0], [3.0, 1.0, 2.0]).inverse(2.0)
+    with pytest.raises(ValueError):
+        CharacteristicCurve([1.0, 1.0], [1.0, 2.0])
+
+
+def test_level_capacity_round_trip():
+    """水位-库容往返转换"""
+    model = ReservoirSimulationMCPServer().reservoir
+    levels = np.linspace(146.0, 174.0, 29)
+    capacities = model.level_to_capacity(levels)
+    np.testing.assert_allclose(model.capacity_to_level(capacities), levels, atol=1e-6)
+    assert model.level_to_capacity(160.0) == pytest.approx(capacities[14])
+
+
+def test_survey_csv_overrides_generated_curves(tmp_path):
+    """实测表中缺失的曲线列仍使用简化曲线"""
+    path = tmp_path / "survey.csv"
+    path.write_text(
+        "water_level,capacity,power_efficiency\n"
+        "145,1.71e10,0.5\n"
+        "160,2.60e10,\n"
+        "175,3.93e10,0.9\n"
+    )
+    curves = load_survey_curves(str(path))
+    assert set(curves) == {"level_capacity_curve", "power_efficiency_curve"}
+    assert curves["power_efficiency_curve"](160.0) == pytest.approx(0.7)
+
+    model = ReservoirSimulationMCPServer(survey_csv=str(path)).reservoir
+    assert model.level_to_capacity(160.0) == pytest.approx(2.60e10)
+    assert model._get_outflow_capacity(175.0) > 0
+
+
+RESERVOIR_SPEC = {
+    "name": "R0",
+    "total_capacity": 5e9,
+    "dead_capacity": 1e9,
+    "flood_capacity": 2e9,
+    "normal_water_level": 175.0,
+    "dead_water_level": 145.0,
+    "flood_limit_water_level": 171.0,
+    "dam_height": 181.0,
+    "crest_elevation": 185.0,
+}
+
+
+@pytest.mark.anyio
+async def test_scenario_reservoirs_use_configured_surveys_or_inline_curves(tmp_path):
+    """请求只能按编号引用已配置的实测表, 或直接给出曲线数据, 不能给出路径"""
+    path = tmp_path / "survey.csv"
+    path.write_text("water_level,capacity\n145,1e9\n175,5e9\n")
+    server = ReservoirSimulationMCPServer(surveys={"R0": str(path)})
+    traces = [[500.0] * 6]
+
+    result = await server.simulate_operation_scenarios(
+        traces, 160.0, reservoirs=[{**RESERVOIR_SPEC, "survey_id": "R0"}]
+    )
+    assert result["status"] == "success"
+
+    inline = {"capacity": {"levels": [145.0, 175.0], "values": [1e9, 5e9]}}
+    inline_result = await server.simulate_operation_scenarios(
+        traces, 160.0, reservoirs=[{**RESERVOIR_SPEC, "curves": inline}]
+    )
+    assert inline_result["scenario_summary"] == result["scenario_summary"]
+
+    for spec in ({"survey_id": "unknown"}, {"survey_csv": str(path)}):
+        rejected = await server.simulate_operation_scenarios(
+            traces, 160.0, reservoirs=[{**RESERVOIR_SPEC, **spec}]
+        )
+        assert rejected["status"] == "error"
+
+    with pytest.raises(ValidationError):
+        ReservoirScenarioRequest(
+            inflow_traces=traces,
+            initial_water_levels=160.0,
+            reservoirs=[{**RESERVOIR_SPEC, "survey_csv": "/etc/passwd"}],
+        )
+
+
+@pytest.mark.anyio
+async def test_scenario_size_is_capped():
+    """情景规模与逐时段数组设有上限, HTTP请求在校验时即被拒绝"""
+    server = ReservoirSimulationMCPServer()
+    server.MAX_SERIES_CELLS = 2 * 12
+    server.MAX_SCENARIO_CELLS = 3 * 12
+    traces = [[5000.0] * 12] * 2
+
+    ok = await server.simulate_operation_scenarios(traces, 160.0, include_series=True)
+    assert ok["status"] == "success"
+
+    too_many_cells = await server.simulate_operation_scenarios(traces * 2, 160.0)
+    series_too_big = await server.simulate_operation_scenarios(
+        traces, 160.0, operation_modes=["normal", "flood_control"], include_series=True
+    )
+    repeated_modes = await server.simulate_operation_scenarios(
+        traces, 160.0, operation_modes=["normal", "normal"]
+    )
+    for result in (too_many_cells, series_too_big, repeated_modes):
+        assert result["status"] == "error"
+    assert "上限" in series_too_big["message"]
+
+    with pytest.raises(ValidationError):
+        ReservoirScenarioRequest(
+            inflow_traces=[[1.0]] * (ReservoirSimulationMCPServer.MAX_SCENARIO_TRACES + 1),
+            initial_water_levels=160.0,
+        )
+
+
+def cascade_reservoir(i: int) -> ReservoirSimulationModel:
+    return ReservoirSimulationModel(ReservoirCharacteristics(
+        name=f"R{i}",
+        total_capacity=5e9,
+        dead_capacity=1e9,
+        flood_capacity=2e9,
+        normal_water_level=175.0 - 10 * i,
+        dead_water_level=145.0 - 10 * i,
+        flood_limit_water_level=171.0 - 10 * i,
+        dam_height=181.0,
+        crest_elevation=185.0 - 10 * i,
+    ))
+
+
+@pytest.mark.parametrize("mode", ["normal", "flood_control", "power_generation", "water_supply"])
+def test_cascade_engine_matches_hourly_loop(mode):
+    """单库单情景时与逐时段调度结果一致"""
+    model = ReservoirSimulationMCPServer().reservoir
+    inflow = 5000 + 1500 * np.random.default_rng(0).standard_normal(48)
+    forecast = InflowForecast(
+        time_series=[datetime(2025, 1, 1) + timedelta(hours=i) for i in range(48)],
+        inflow_rates=inflow.tolist(),
+        confidence_level=0.85,
+    )
+    schedule = model.optimize_reservoir_operation(160.0, forecast, None, ReservoirOperationMode(mode))
+
+    run = CascadeSimulationEngine([model]).run(inflow[None, None, :], 160.0, mode)
+
+    np.testing.assert_allclose(run.water_levels[0, 0], [op["new_level"] for op in schedule])
+    np.testing.assert_allclose(run.outflows[0, 0], [op["outflow"] for op in schedule])
+    np.testing.assert_allclose(run.power_generation[0, 0], [op["power_generation"] for op in schedule])
+
+
+@pytest.mark.parametrize("lag", [0, 2])
+def test_cascade_routes_outflow_downstream(lag):
+    """上游下泄按传播时间汇入下游水库"""
+    engine = CascadeSimulationEngine(
+        [cascade_reservoir(i) for i in range(3)], downstream=[1, 2, None], lag_hours=[lag, lag, 0]
+    )
+    local = np.random.default_rng(1).uniform(200, 800, (5, 3, 24))
+    run = engine.run(local, [160.0, 150.0, 140.0], modes=[["normal"], ["water_supply"], ["normal"],
+                                                           ["flood_control"], ["power_generation"]])
+
+    assert run.water_levels.shape == (5, 3, 24)
+    routed = run.inflows[:, 1:, lag:] - local[:, 1:, lag:]
+    np.testing.assert_allclose(routed, run.outflows[:, :-1, :24 - lag])
+    assert np.all(run.water_levels >= engine.min_water_level[None, :, None] - 1e-9)
+    assert np.all(run.outflows >= engine.min_outflow[None, :, None])
+
+
+def test_dp_schedule_respects_constraints_and_beats_rule_based():
+    """动态规划调度满足约束, 发电量不低于规则调度"""
+    model = ReservoirSimulationMCPServer().reservoir
+    inflow = 5000 + 1000 * np.sin(np.arange(48) / 24 * 2 * np.pi)
+    result = ReservoirDPScheduler(model, max_states=500).solve(inflow, 165.0)
+
+    constraints = model.constraints
+    assert result.penalty == pytest.approx(0.0, abs=1e-6)
+    assert np.all(result.releases >= constraints.min_outflow - 1e-6)
+    assert np.all(result.releases <= constraints.max_outflow + 1e-6)
+    assert result.water_levels[-1] >= 165.0
+    # 水量平衡
+    storages = model.level_to_capacity(result.water_levels)
+    np.testing.assert_allclose(np.diff(storages), (inflow - result.releases) * 3600, rtol=1e-6)
+
+    forecast = InflowForecast(
+        time_series=[datetime(2025, 1, 1) + timedelta(hours=i) for i in range(48)],
+        inflow_rates=inflow.tolist(),
+        confidence_level=0.85,
+    )
+    schedule = model.optimize_reservoir_operation(165.0, forecast, None, ReservoirOperationMode.POWER_GENERATION)
+    assert result.total_power_generation_mwh >= sum(op["power_generation"] for op in schedule)
+
+
+def test_dp_flood_control_keeps_below_flood_limit():
+    model = ReservoirSimulationMCPServer().reservoir
+    inflow = np.full(48, 6000.0)
+    result = ReservoirDPScheduler(model, max_states=500).solve(
+        inflow, 170.5, flood_penalty=ReservoirDPScheduler.FLOOD_CONTROL_PENALTY
+    )
+    assert result.water_levels.max() <= model.characteristics.flood_limit_water_level
+
+
+def test_stochastic_dp_simulates_every_sample():
+    model = ReservoirSimulationMCPServer().reservoir
+    samples = sample_inflow_scenarios(np.full(24, 5000.0), 8, seed=0)
+    result = ReservoirDPScheduler(model, max_states=300).solve_stochastic(samples, 165.0)
+
+    assert result.releases.shape == (8, 24)
+    assert result.water_levels.shape == (8, 25)
+    assert result.expected_objective is not None
+    assert np.all(result.water_levels[:, -1] >= 165.0 - 1e-9)
+
+
+@pytest.mark.anyio
+async def test_dp_size_is_capped():
+    """样本数、状态数与调度时长设有上限, HTTP请求在校验时即被拒绝"""
+    server = ReservoirSimulationMCPServer()
+    cap = ReservoirSimulationMCPServer
+
+    for kwargs in (
+        {"forecast_hours": cap.MAX_DP_HOURS + 1},
+        {"max_states": cap.MAX_DP_STATES + 1},
+        {"stochastic": True, "n_samples": cap.MAX_DP_SAMPLES + 1},
+        {"stochastic": True, "n_samples": 40, "max_states": 1000},
+        {"stochastic": True, "inflow_samples": [[5000.0] * (cap.MAX_DP_HOURS + 1)]},
+    ):
+        result = await server.optimize_operation_dp(165.0, **kwargs)
+        assert result["status"] == "error"
+        assert "上限" in result["message"]
+
+    for kwargs in (
+        {"forecast_hours": cap.MAX_DP_HOURS + 1},
+        {"inflow_forecast": [5000.0] * (cap.MAX_DP_HOURS + 1)},
+        {"n_samples": cap.MAX_DP_SAMPLES + 1},
+        {"max_states": cap.MAX_DP_STATES + 1},
+        {"inflow_samples": [[5000.0] * (cap.MAX_DP_HOURS + 1)]},
+        {"inflow_samples": [[5000.0]] * (cap.MAX_DP_SAMPLES + 1)},
+    ):
+        with pytest.raises(ValidationError):
+            ReservoirOptimizationRequest(current_water_level=165.0, **kwargs)
@@ -0,0 +1,116 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import pytest
+
+from src.tile_cache import (
+    TileCache,
+    etag_matches,
+    mvt_tile_key,
+    postgis_query_hash,
+    raster_tile_key,
+    tile_etag,
+)
+
+
+@pytest.mark.anyio
+async def test_tile_cache_memory_and_disk_tiers(tmp_path):
+    cache = TileCache(
+        "mvt", str(tmp_path / "tiles"), max_memory_bytes=10, max_disk_bytes=1024
+    )
+    key = mvt_tile_key("L1", "abc", 3, 1, 2)
+
+    assert await cache.get(key) is None
+    await cache.set(key, b"tile")
+    assert await cache.get(key) == b"tile"
+    assert cache.counters["memory_hits"] == 1
+
+    # a second worker shares the disk tier but not the memory tier
+    other = TileCache(
+        "mvt", str(tmp_path / "tiles"), max_memory_bytes=10, max_disk_bytes=1024
+    )
+    assert await other.get(key) == b"tile"
+    assert other.counters["disk_hits"] == 1
+
+    # memory tier is bounded by bytes
+    await cache.set(mvt_tile_key("L1", "abc", 3, 1, 3), b"0123456789")
+    assert cache.memory_total <= 10
+
+
+@pytest.mark.anyio
+async def test_tile_cache_invalidate_keeps_current_query(tmp_path):
+    cache = TileCache(
+        "mvt", str(tmp_path / "tiles"), max_memory_bytes=1024, max_disk_bytes=1024
+    )
+    old_key = mvt_tile_key("L1", "old", 0, 0, 0)
+    new_key = mvt_tile_key("L1", "new", 0, 0, 0)
+    await cache.set(old_key, b"old")
+    await cache.set(new_key, b"new")
+
+    await cache.invalidate(("L1",), keep=["new"])
+
+    assert await cache.get(old_key) is None
+    assert await cache.get(new_key) == b"new"
+
+
+@pytest.mark.anyio
+async def test_tile_cache_ignores_disk_tier_others_can_write(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    key = mvt_tile_key("L1", "abc", 0, 0, 0)
+    planted = shared.joinpath("mvt", *key)
+    planted.parent.mkdir(parents=True)
+    planted.write_bytes(b"planted")
+
+    cache = TileCache("mvt", str(shared), max_memory_bytes=1024, max_disk_bytes=1024)
+    assert await cache.get(key) is None
+    await cache.set(key, b"tile")
+    assert planted.read_bytes() == b"planted"
+    assert await cache.get(key) == b"tile"
+
+    private = tmp_path / "tiles"
+    TileCache("mvt", str(private), 1024, 1024)._disk_available()
+    assert private.stat().st_mode & 0o777 == 0o700
+
+
+def test_postgis_query_hash_covers_attribute_columns():
+    base = postgis_query_hash("SELECT * FROM t", ["a", "b"])
+    assert base == postgis_query_hash("SELECT * FROM t", ["a", "b"])
+    assert base != postgis_query_hash("SELECT * FROM t", ["a"])
+    assert base != postgis_query_hash("SELECT * FROM u", ["a", "b"])
+
+
+def test_raster_tile_key_covers_render_parameters():
+    base = raster_tile_key("L1", "cog/a.tif", 4, 2, 3, "spectral_r", (0.0, 10.0))
+    assert base == raster_tile_key(
+        "L1", "cog/a.tif", 4, 2, 3, "spectral_r", (0.0, 10.0)
+    )
+    assert base != raster_tile_key(
+        "L1", "cog/a.tif", 4, 2, 3, "spectral_r", (0.0, 11.0)
+    )
+    assert base != raster_tile_key("L1", "cog/a.tif", 4, 2, 3, None, None)
+    assert base != raster_tile_key(
+        "L1", "cog/b.tif", 4, 2, 3, "spectral_r", (0.0, 10.0)
+    )
+
+
+def test_etag_matches_if_none_match():
+    etag = tile_etag(b"png bytes")
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches(tile_etag(b"other bytes"), etag)
@@ -0,0 +1,112 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+
+import pytest
+
+from src.tool_scheduler import ToolCallScheduler
+
+
+def error_result(e: BaseException) -> dict:
+    return {"status": "error", "error": type(e).__name__}
+
+
+@pytest.mark.anyio
+async def test_scheduler_runs_reads_concurrently_in_order():
+    scheduler = ToolCallScheduler(max_concurrency=2, default_timeout=5)
+    running = 0
+    peak = 0
+
+    def read(i: int, delay: float):
+        async def call():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(delay)
+            running -= 1
+            return {"i": i}
+
+        return call
+
+    results = await scheduler.run(
+        "conv",
+        [(read(0, 0.05), None), (read(1, 0.01), None), (read(2, 0.01), None)],
+        on_error=error_result,
+    )
+
+    assert results == [{"i": 0}, {"i": 1}, {"i": 2}]
+    assert peak == 2
+    # nothing is left behind once the turn is done
+    assert scheduler.stats()["active_conversations"] == 0
+
+
+@pytest.mark.anyio
+async def test_scheduler_serializes_mutations_of_one_map():
+    scheduler = ToolCallScheduler(max_concurrency=4, default_timeout=5)
+    events = []
+
+    def mutate(name: str, delay: float):
+        async def call():
+            events.append(f"{name}:start")
+            await asyncio.sleep(delay)
+            events.append(f"{name}:end")
+            return {"name": name}
+
+        return call
+
+    await scheduler.run(
+        "conv",
+        [
+            (mutate("a", 0.05), "M1"),
+            (mutate("read", 0.01), None),
+            (mutate("b", 0.01), "M1"),
+        ],
+        on_error=error_result,
+    )
+
+    assert events.index("a:end") < events.index("b:start")
+    # the read didn't wait for the mutation ahead of it
+    assert events.index("read:end") < events.index("a:end")
+
+
+@pytest.mark.anyio
+async def test_scheduler_times_out_calls_individually():
+    scheduler = ToolCallScheduler(max_concurrency=4, default_timeout=0.05)
+
+    async def slow():
+        await asyncio.sleep(1)
+        return {"status": "success"}
+
+    async def fast():
+        return {"status": "success"}
+
+    async def broken():
+        raise ValueError("nope")
+
+    results = await scheduler.run(
+        "conv", [(slow, "M1"), (fast, "M1"), (broken, None)], on_error=error_result
+    )
+
+    assert results == [
+        {"status": "error", "error": "TimeoutError"},
+        {"status": "success"},
+        {"status": "error", "error": "ValueError"},
+    ]
+    stats = scheduler.stats()
+    assert stats["timed_out"] == 1
+    assert stats["failed"] == 1
+    assert stats["completed"] == 1
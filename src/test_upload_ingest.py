@@ -0,0 +1,174 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+from io import BytesIO
+
+import pytest
+from fastapi import UploadFile
+
+from src.upload_ingest import (
+    UploadIngestor,
+    UploadSizeLimitRoute,
+    UploadTooLarge,
+    format_matches_extension,
+    sniff_format,
+)
+
+
+class RecordingS3:
+    def __init__(self, fail_part: int | None = None):
+        self.fail_part = fail_part
+        self.objects: dict[str, bytes] = {}
+        self.parts: dict[int, bytes] = {}
+        self.calls: list[str] = []
+
+    async def put_object(self, Bucket, Key, Body):
+        self.calls.append("put_object")
+        self.objects[Key] = Body
+
+    async def create_multipart_upload(self, Bucket, Key):
+        self.calls.append("create_multipart_upload")
+        return {"UploadId": "u1"}
+
+    async def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber == self.fail_part:
+            raise RuntimeError("part failed")
+        self.parts[PartNumber] = Body
+        return {"ETag": f'"{PartNumber}"'}
+
+    async def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.calls.append("complete_multipart_upload")
+        numbers = [p["PartNumber"] for p in MultipartUpload["Parts"]]
+        assert numbers == sorted(numbers)
+        self.objects[Key] = b"".join(self.parts[n] for n in numbers)
+
+    async def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append("abort_multipart_upload")
+
+
+@pytest.mark.anyio
+async def test_ingest_streams_multipart_and_spools(tmp_path):
+    body = b"II*\x00" + bytes(range(256)) * 40
+    s3 = RecordingS3()
+    ingestor = UploadIngestor(part_bytes=1024, max_bytes=1 << 20, max_in_flight=2)
+
+    with open(tmp_path / "spool.tif", "wb") as spool:
+        result = await ingestor.ingest(
+            UploadFile(BytesIO(body), filename="a.tif"), spool, s3, "b", "k.tif"
+        )
+
+    assert (tmp_path / "spool.tif").read_bytes() == body
+    assert s3.objects["k.tif"] == body
+    assert len(s3.parts) == 11
+    assert result.size_bytes == len(body)
+    assert result.sha256 == hashlib.sha256(body).hexdigest()
+    assert result.sniffed_format == "tiff"
+
+
+@pytest.mark.anyio
+async def test_ingest_small_upload_uses_single_put(tmp_path):
+    s3 = RecordingS3()
+    ingestor = UploadIngestor(part_bytes=1024, max_bytes=1024)
+
+    with open(tmp_path / "spool", "wb") as spool:
+        result = await ingestor.ingest(
+            UploadFile(BytesIO(b'{"type": "FeatureCollection"}')), spool, s3, "b", "k"
+        )
+
+    assert s3.calls == ["put_object"]
+    assert result.sniffed_format == "json"
+
+
+@pytest.mark.anyio
+async def test_ingest_aborts_over_limit_and_on_part_failure(tmp_path):
+    ingestor = UploadIngestor(part_bytes=1024, max_bytes=4096)
+
+    s3 = RecordingS3()
+    with open(tmp_path / "spool", "wb") as spool:
+        with pytest.raises(UploadTooLarge):
+            await ingestor.ingest(UploadFile(BytesIO(b"x" * 8192)), spool, s3, "b", "k")
+    assert "abort_multipart_upload" in s3.calls
+    assert "k" not in s3.objects
+
+    s3 = RecordingS3(fail_part=2)
+    with open(tmp_path / "spool", "wb") as spool:
+        with pytest.raises(RuntimeError):
+            await ingestor.ingest(UploadFile(BytesIO(b"x" * 4000)), spool, s3, "b", "k")
+    assert s3.calls[-1] == "abort_multipart_upload"
+
+
+def test_sniff_format_against_extension():
+    assert sniff_format(b"\xef\xbb\xbf  [1, 2]") == "json"
+    assert sniff_format(b"PK\x03\x04rest") == "zip"
+    assert format_matches_extension("zip", ".kmz")
+    assert not format_matches_extension("png", ".tif")
+    assert format_matches_extension(None, ".csv")
+
+
+@pytest.fixture
+def limited_app(monkeypatch):
+    from fastapi import APIRouter, FastAPI, File
+
+    from src.upload_ingest import MULTIPART_OVERHEAD_BYTES, upload_ingestor
+
+    monkeypatch.setattr(upload_ingestor(), "max_bytes", 1024)
+    router = APIRouter(route_class=UploadSizeLimitRoute)
+    received = []
+
+    @router.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        received.append(await file.read())
+        return {"size": len(received[-1])}
+
+    app = FastAPI()
+    app.include_router(router)
+    return app, received, 1024 + MULTIPART_OVERHEAD_BYTES
+
+
+@pytest.mark.anyio
+async def test_size_limit_route_rejects_before_parsing(limited_app):
+    import httpx
+
+    app, received, limit = limited_app
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://test"
+    ) as client:
+        ok = await client.post("/upload", files={"file": ("a.csv", b"x" * 100)})
+        assert ok.status_code == 200
+
+        too_big = await client.post(
+            "/upload", files={"file": ("a.csv", b"x" * (limit + 1))}
+        )
+        assert too_big.status_code == 413
+
+        # no Content-Length: the limit applies to the bytes as they arrive
+        async def chunks():
+            yield (
+                b"--b\r\nContent-Disposition: form-data; "
+                b'name="file"; filename="a.csv"\r\n\r\n'
+            )
+            for _ in range(limit // 65536 + 2):
+                yield b"x" * 65536
+            yield b"\r\n--b--\r\n"
+
+        chunked = await client.post(
+            "/upload",
+            content=chunks(),
+            headers={"content-type": "multipart/form-data; boundary=b"},
+        )
+        assert chunked.status_code == 413
+
+    assert len(received) == 1
@@ -0,0 +1,299 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+from src.utils import ensure_private_dir
+
+logger = logging.getLogger(__name__)
+
+TileKey = Tuple[str, ...]
+
+# tiles on disk are served as they are, so the directory must not be one other
+# users can write to, like /tmp
+DEFAULT_TILE_CACHE_DIR = os.environ.get(
+    "MUNDI_TILE_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "mundi", "tiles"),
+)
+
+
+class TileCache:
+    """Two-tier cache for encoded tiles.
+
+    The first tier is an in-process LRU bounded by bytes. The second tier is a
+    directory shared by every worker on the node, laid out as one file per key
+    part so that a whole layer (or one query version of it) can be dropped with
+    a single rmtree. Values are stored exactly as they should be served, e.g.
+    already gzipped, so the disk tier is only used if cache_dir is private to
+    this user; otherwise the cache runs from memory alone.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        cache_dir: str,
+        max_memory_bytes: int,
+        max_disk_bytes: int,
+        sweep_every_n_writes: int = 256,
+    ):
+        self.name = name
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.sweep_every_n_writes = sweep_every_n_writes
+        self.memory: OrderedDict[TileKey, bytes] = OrderedDict()
+        self.memory_total = 0
+        self._writes_since_sweep = 0
+        self._sweep_lock = threading.Lock()
+        self._disk_ok: Optional[bool] = None
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "invalidations": 0,
+            "disk_evictions": 0,
+        }
+
+    def _path(self, key: TileKey) -> str:
+        return os.path.join(self.cache_dir, self.name, *key)
+
+    def _remember(self, key: TileKey, data: bytes):
+        if len(data) > self.max_memory_bytes:
+            return
+        previous = self.memory.pop(key, None)
+        if previous is not None:
+            self.memory_total -= len(previous)
+        self.memory[key] = data
+        self.memory_total += len(data)
+        while self.memory_total > self.max_memory_bytes and self.memory:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_total -= len(evicted)
+
+    def _disk_available(self) -> bool:
+        # once verified it stays private: nobody else can change a 0700 dir
+        if self._disk_ok is None:
+            try:
+                self._disk_ok = ensure_private_dir(self.cache_dir)
+            except OSError:
+                logger.exception(f"Tile cache directory {self.cache_dir} unusable")
+                self._disk_ok = False
+            else:
+                if not self._disk_ok:
+                    logger.error(
+                        f"Tile cache directory {self.cache_dir} is not owned by "
+                        "this user or is open to others, caching in memory only"
+                    )
+        return self._disk_ok
+
+    def _read_disk(self, key: TileKey) -> Optional[bytes]:
+        if not self._disk_available():
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        try:
+            # mtime doubles as the disk tier's LRU clock
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _write_disk(self, key: TileKey, data: bytes):
+        if not self._disk_available():
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        # readers in other workers see either nothing or the complete tile
+        os.replace(tmp_path, path)
+
+        self._writes_since_sweep += 1
+        if self._writes_since_sweep >= self.sweep_every_n_writes:
+            self._writes_since_sweep = 0
+            self._sweep_disk()
+
+    def _sweep_disk(self):
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            entries = []
+            total = 0
+            for root, _, files in os.walk(os.path.join(self.cache_dir, self.name)):
+                for fn in files:
+                    path = os.path.join(root, fn)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+                    total += st.st_size
+            if total <= self.max_disk_bytes:
+                return
+            # evict down to 90% so we don't sweep again on the very next write
+            target = int(self.max_disk_bytes * 0.9)
+            entries.sort()
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.counters["disk_evictions"] += 1
+        finally:
+            self._sweep_lock.release()
+
+    async def get(self, key: TileKey) -> Optional[bytes]:
+        data = self.memory.get(key)
+        if data is not None:
+            self.memory.move_to_end(key)
+            self.counters["memory_hits"] += 1
+            return data
+
+        data = await asyncio.to_thread(self._read_disk, key)
+        if data is None:
+            self.counters["misses"] += 1
+            return None
+
+        self.counters["disk_hits"] += 1
+        self._remember(key, data)
+        return data
+
+    async def set(self, key: TileKey, data: bytes):
+        self.counters["writes"] += 1
+        self._remember(key, data)
+        await asyncio.to_thread(self._write_disk, key, data)
+
+    async def invalidate(self, prefix: TileKey, keep: Iterable[str] = ()):
+        """Drop every entry under prefix, except the direct children named in keep."""
+        keep = set(keep)
+        self.counters["invalidations"] += 1
+
+        for key in list(self.memory.keys()):
+            if key[: len(prefix)] != prefix:
+                continue
+            if len(key) > len(prefix) and key[len(prefix)] in keep:
+                continue
+            self.memory_total -= len(self.memory.pop(key))
+
+        def _remove():
+            if not self._disk_available():
+                return
+            root = self._path(prefix)
+            if not keep:
+                shutil.rmtree(root, ignore_errors=True)
+                return
+            try:
+                children = os.listdir(root)
+            except FileNotFoundError:
+                return
+            for child in children:
+                if child not in keep:
+                    shutil.rmtree(os.path.join(root, child), ignore_errors=True)
+
+        await asyncio.to_thread(_remove)
+
+    def stats(self) -> dict:
+        hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_ratio": (hits / lookups) if lookups else None,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory_total,
+            "max_memory_bytes": self.max_memory_bytes,
+            "max_disk_bytes": self.max_disk_bytes,
+        }
+
+
+def postgis_query_hash(
+    postgis_query: str | None, attribute_column_list: list[str] | None
+) -> str:
+    """Stable hash of everything in a PostGIS layer definition that shapes its tiles."""
+    h = hashlib.sha256()
+    h.update((postgis_query or "").encode("utf-8"))
+    h.update(b"\x00")
+    h.update("\x1f".join(attribute_column_list or []).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def mvt_tile_key(layer_id: str, query_hash: str, z: int, x: int, y: int) -> TileKey:
+    return (layer_id, query_hash, str(z), str(x), f"{y}.mvt.gz")
+
+
+def raster_tile_key(
+    layer_id: str,
+    cog_key: str,
+    z: int,
+    x: int,
+    y: int,
+    colormap: str | None,
+    rescale: tuple[float, float] | None,
+) -> TileKey:
+    """Key for a rendered PNG; everything that changes the output is in render_hash."""
+    render_hash = hashlib.sha256(
+        repr((cog_key, colormap, rescale)).encode("utf-8")
+    ).hexdigest()[:16]
+    return (layer_id, render_hash, str(z), str(x), f"{y}.png")
+
+
+def tile_etag(data: bytes) -> str:
+    return '"' + hashlib.sha1(data).hexdigest()[:20] + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip() for c in if_none_match.split(",")]
+    # weak comparison, as browsers may send W/ validators back
+    return "*" in candidates or etag in [c.removeprefix("W/") for c in candidates]
+
+
+mvt_cache_singleton = TileCache(
+    name="mvt",
+    cache_dir=DEFAULT_TILE_CACHE_DIR,
+    max_memory_bytes=1024 * 1024 * 64,  # 64 MiB
+    max_disk_bytes=1024 * 1024 * 1024,  # 1 GiB
+)
+
+
+def mvt_tile_cache() -> TileCache:
+    return mvt_cache_singleton
+
+
+raster_cache_singleton = TileCache(
+    name="raster",
+    cache_dir=DEFAULT_TILE_CACHE_DIR,
+    max_memory_bytes=1024 * 1024 * 128,  # 128 MiB
+    max_disk_bytes=1024 * 1024 * 1024 * 2,  # 2 GiB
+)
+
+
+def raster_tile_cache() -> TileCache:
+    return raster_cache_singleton
@@ -0,0 +1,158 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Hashable, Optional, Sequence
+
+ToolResult = dict[str, Any]
+
+
+class ToolCallScheduler:
+    """Runs the tool calls of one assistant turn concurrently.
+
+    Each conversation gets at most max_concurrency calls in flight. Calls that
+    mutate a map take that map's lock, so they run one at a time and in the
+    order the model emitted them, while read-only calls run alongside them.
+    Every call is bounded by its own timeout, and a call that times out or
+    raises becomes an error result instead of failing its siblings.
+    """
+
+    def __init__(self, max_concurrency: int, default_timeout: float):
+        self.max_concurrency = max_concurrency
+        self.default_timeout = default_timeout
+        self._conversation_slots: dict[Hashable, list] = {}
+        self._map_locks: dict[Hashable, list] = {}
+        self.counters = {
+            "started": 0,
+            "completed": 0,
+            "failed": 0,
+            "timed_out": 0,
+        }
+
+    @staticmethod
+    def _acquire(registry: dict, key: Hashable, factory):
+        # registry values are [primitive, number of calls holding a reference]
+        entry = registry.get(key)
+        if entry is None:
+            entry = registry[key] = [factory(), 0]
+        entry[1] += 1
+        return entry[0]
+
+    @staticmethod
+    def _release(registry: dict, key: Hashable):
+        entry = registry[key]
+        entry[1] -= 1
+        # don't keep a semaphore or lock around for every conversation ever seen
+        if entry[1] == 0:
+            del registry[key]
+
+    async def _run_one(
+        self,
+        conversation_id: Hashable,
+        map_id: Optional[Hashable],
+        call: Callable[[], Awaitable[ToolResult]],
+        timeout: float,
+        on_error: Callable[[BaseException], ToolResult],
+    ) -> ToolResult:
+        slots = self._acquire(
+            self._conversation_slots,
+            conversation_id,
+            lambda: asyncio.Semaphore(self.max_concurrency),
+        )
+        lock = (
+            self._acquire(self._map_locks, map_id, asyncio.Lock)
+            if map_id is not None
+            else None
+        )
+        try:
+            # take the map lock first so queued mutations don't hold a slot
+            if lock is not None:
+                await lock.acquire()
+            try:
+                async with slots:
+                    self.counters["started"] += 1
+                    try:
+                        result = await asyncio.wait_for(call(), timeout)
+                    except asyncio.TimeoutError as e:
+                        self.counters["timed_out"] += 1
+                        return on_error(e)
+                    except Exception as e:
+                        self.counters["failed"] += 1
+                        return on_error(e)
+                    self.counters["completed"] += 1
+                    return result
+            finally:
+                if lock is not None:
+                    lock.release()
+        finally:
+            self._release(self._conversation_slots, conversation_id)
+            if map_id is not None:
+                self._release(self._map_locks, map_id)
+
+    def schedule(
+        self,
+        conversation_id: Hashable,
+        calls: Sequence[tuple[Callable[[], Awaitable[ToolResult]], Optional[Hashable]]],
+        on_error: Callable[[BaseException], ToolResult],
+        timeout: Optional[float] = None,
+    ) -> list[asyncio.Task]:
+        """Start every (call, mutated_map_id) pair, returning tasks in input order.
+
+        mutated_map_id is None for read-only calls. Awaiting the tasks in order
+        yields results in the order the calls were given, as soon as each
+        prefix of them is done.
+        """
+        timeout = timeout if timeout is not None else self.default_timeout
+        # tasks start in creation order, so mutations reach the map lock in order
+        return [
+            asyncio.create_task(
+                self._run_one(conversation_id, map_id, call, timeout, on_error)
+            )
+            for call, map_id in calls
+        ]
+
+    async def run(
+        self,
+        conversation_id: Hashable,
+        calls: Sequence[tuple[Callable[[], Awaitable[ToolResult]], Optional[Hashable]]],
+        on_error: Callable[[BaseException], ToolResult],
+        timeout: Optional[float] = None,
+    ) -> list[ToolResult]:
+        tasks = self.schedule(conversation_id, calls, on_error, timeout)
+        try:
+            return list(await asyncio.gather(*tasks))
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "max_concurrency": self.max_concurrency,
+            "default_timeout": self.default_timeout,
+            "active_conversations": len(self._conversation_slots),
+        }
+
+
+tool_call_scheduler_singleton = ToolCallScheduler(
+    max_concurrency=int(os.environ.get("MUNDI_TOOL_CALL_CONCURRENCY", 4)),
+    default_timeout=float(os.environ.get("MUNDI_TOOL_CALL_TIMEOUT_SEC", 300)),
+)
+
+
+def tool_call_scheduler() -> ToolCallScheduler:
+    return tool_call_scheduler_singleton
@@ -0,0 +1,306 @@
+# Copyright (C) 2025 Bunting Labs, Inc.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import hashlib
+import os
+from typing import BinaryIO, NamedTuple, Optional
+
+from fastapi import HTTPException, Request, UploadFile, status
+from fastapi.routing import APIRoute
+
+# S3 rejects multipart parts under 5 MiB, except for the last one
+MIN_PART_BYTES = 5 * 1024 * 1024
+
+# leading bytes kept in memory for format sniffing and CSV header detection
+HEAD_BYTES = 64 * 1024
+
+MAGIC_NUMBERS = [
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"II+\x00", "tiff"),  # BigTIFF
+    (b"MM\x00+", "tiff"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"PK\x03\x04", "zip"),
+    (b"LASF", "las"),
+    (b"SQLite format 3\x00", "sqlite"),
+    (b"fgb\x03", "flatgeobuf"),
+    (b"PMTiles", "pmtiles"),
+]
+
+# extensions whose contents we can check; anything else (e.g. csv) is let through
+EXTENSION_FORMATS = {
+    ".tif": {"tiff"},
+    ".tiff": {"tiff"},
+    ".png": {"png"},
+    ".jpg": {"jpeg"},
+    ".jpeg": {"jpeg"},
+    ".zip": {"zip"},
+    ".kmz": {"zip"},
+    ".las": {"las"},
+    ".laz": {"las"},
+    ".gpkg": {"sqlite"},
+    ".fgb": {"flatgeobuf"},
+    ".geojson": {"json"},
+    ".json": {"json"},
+    ".kml": {"xml"},
+}
+
+
+# room for the multipart boundaries and the small form fields next to the file
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class IngestedUpload(NamedTuple):
+    size_bytes: int
+    sha256: str
+    sniffed_format: Optional[str]
+    head: bytes
+    # None when the upload was only spooled to disk
+    s3_key: Optional[str]
+
+
+def sniff_format(head: bytes) -> Optional[str]:
+    for magic, fmt in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return fmt
+    text = head[:1024].removeprefix(b"\xef\xbb\xbf").lstrip()
+    if text.startswith((b"{", b"[")):
+        return "json"
+    if text.startswith(b"<"):
+        return "xml"
+    return None
+
+
+def format_matches_extension(sniffed_format: Optional[str], file_ext: str) -> bool:
+    expected = EXTENSION_FORMATS.get(file_ext.lower())
+    return expected is None or sniffed_format in expected
+
+
+class _S3PartWriter:
+    """Uploads parts in the background, at most max_in_flight at a time.
+
+    Nothing is created on S3 until the first full part is handed over, so
+    uploads that fit in one part go out as a single put_object.
+    """
+
+    def __init__(self, s3_client, bucket: str, key: str, max_in_flight: int):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.upload_id: Optional[str] = None
+        self.parts: list[asyncio.Task] = []
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    async def _upload_part(self, number: int, body: bytes) -> dict:
+        try:
+            resp = await self.s3.upload_part(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self.upload_id,
+                PartNumber=number,
+                Body=body,
+            )
+            return {"ETag": resp["ETag"], "PartNumber": number}
+        finally:
+            self._slots.release()
+
+    async def add_part(self, body: bytes):
+        if self.upload_id is None:
+            resp = await self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key
+            )
+            self.upload_id = resp["UploadId"]
+        # bounds memory to max_in_flight parts, whatever the upload size
+        await self._slots.acquire()
+        for task in self.parts:
+            if task.done() and not task.cancelled() and task.exception():
+                self._slots.release()
+                raise task.exception()
+        self.parts.append(
+            asyncio.create_task(self._upload_part(len(self.parts) + 1, body))
+        )
+
+    async def finish(self, last: bytes):
+        if self.upload_id is None:
+            await self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=last)
+            return
+        if last:
+            await self.add_part(last)
+        parts = await asyncio.gather(*self.parts)
+        await self.s3.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+
+    async def abort(self):
+        for task in self.parts:
+            task.cancel()
+        await asyncio.gather(*self.parts, return_exceptions=True)
+        if self.upload_id is not None:
+            try:
+                await self.s3.abort_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+                )
+            except Exception as e:
+                print(f"Failed to abort multipart upload of {self.key}: {e}")
+
+
+class UploadSizeLimitRoute(APIRoute):
+    """Enforces the upload limit while the request body is still arriving.
+
+    FastAPI parses File/Form parameters, letting Starlette spool the whole
+    body to disk, before the handler or any dependency runs. This route
+    class rejects a declared Content-Length over the limit before parsing
+    starts, and counts the bytes actually received so a chunked body is cut
+    off with a 413 as soon as it crosses the limit.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def limited_handler(request: Request):
+            limit = upload_ingestor().max_bytes + MULTIPART_OVERHEAD_BYTES
+            content_length = request.headers.get("content-length", "")
+            if content_length.isdigit() and int(content_length) > limit:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"request is {content_length} bytes, max {limit} bytes",
+                )
+
+            received = 0
+
+            async def limited_receive():
+                nonlocal received
+                message = await request.receive()
+                if message["type"] == "http.request":
+                    received += len(message.get("body", b""))
+                    if received > limit:
+                        raise HTTPException(
+                            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"request exceeds the maximum of {limit} bytes",
+                        )
+                return message
+
+            return await handler(Request(request.scope, limited_receive, request._send))
+
+        return limited_handler
+
+
+class UploadIngestor:
+    """Copies a received upload to a local spool file and, optionally, to S3.
+
+    The UploadFile has already been received by Starlette (see
+    UploadSizeLimitRoute for how the size limit is applied before that).
+    It is read in part_bytes chunks; each chunk is hashed and written to the
+    spool file while earlier chunks are still being uploaded as multipart
+    parts, so memory use is bounded by max_in_flight parts rather than by the
+    size of the upload. Uploads over max_bytes are rejected, and any
+    multipart upload is aborted.
+    """
+
+    def __init__(self, part_bytes: int, max_bytes: int, max_in_flight: int = 4):
+        self.part_bytes = part_bytes
+        self.max_bytes = max_bytes
+        self.max_in_flight = max_in_flight
+
+    async def ingest(
+        self,
+        file: UploadFile,
+        spool: BinaryIO,
+        s3_client=None,
+        bucket: Optional[str] = None,
+        s3_key: Optional[str] = None,
+    ) -> IngestedUpload:
+        if file.size is not None and file.size > self.max_bytes:
+            raise UploadTooLarge(
+                f"upload is {file.size} bytes, max {self.max_bytes} bytes"
+            )
+
+        hasher = hashlib.sha256()
+        writer = (
+            _S3PartWriter(s3_client, bucket, s3_key, self.max_in_flight)
+            if s3_key is not None
+            else None
+        )
+        head = b""
+        size = 0
+        pending = bytearray()
+
+        def spool_chunk(chunk: bytes):
+            hasher.update(chunk)
+            spool.write(chunk)
+
+        try:
+            while True:
+                chunk = await file.read(self.part_bytes)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise UploadTooLarge(
+                        f"upload exceeds the maximum of {self.max_bytes} bytes"
+                    )
+                if len(head) < HEAD_BYTES:
+                    head += chunk[: HEAD_BYTES - len(head)]
+
+                await asyncio.to_thread(spool_chunk, chunk)
+                if writer is None:
+                    continue
+                pending += chunk
+                # strictly greater, so the final part is never empty and
+                # single-part uploads can skip multipart entirely
+                while len(pending) > self.part_bytes:
+                    await writer.add_part(bytes(pending[: self.part_bytes]))
+                    del pending[: self.part_bytes]
+
+            await asyncio.to_thread(spool.flush)
+            if writer is not None:
+                await writer.finish(bytes(pending))
+        except BaseException:
+            if writer is not None:
+                await writer.abort()
+            raise
+
+        return IngestedUpload(
+            size_bytes=size,
+            sha256=hasher.hexdigest(),
+            sniffed_format=sniff_format(head),
+            head=head,
+            s3_key=s3_key,
+        )
+
+
+upload_ingestor_singleton = UploadIngestor(
+    part_bytes=max(
+        MIN_PART_BYTES,
+        int(os.environ.get("MUNDI_UPLOAD_PART_BYTES", 16 * 1024 * 1024)),
+    ),
+    max_bytes=int(
+        os.environ.get("MUNDI_MAX_UPLOAD_BYTES", 10 * 1024 * 1024 * 1024)  # 10 GiB
+    ),
+    max_in_flight=int(os.environ.get("MUNDI_UPLOAD_PARTS_IN_FLIGHT", 4)),
+)
+
+
+def upload_ingestor() -> UploadIngestor:
+    return upload_ingestor_singleton
@@ -14,6 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import stat
 import boto3
 import tempfile
 import zipfile
@@ -24,6 +25,7 @@ import secrets
 from functools import lru_cache
 from openai import AsyncOpenAI
 from fastapi import Request
+from src.ogr_convert import ogr_conversion_engine
 
 
 def generate_id(length=12, prefix=""):
@@ -38,6 +40,21 @@ def generate_id(length=12, prefix=""):
     return prefix + result
 
 
+def ensure_private_dir(path: str) -> bool:
+    """Creates path readable and writable by this user only (0700), if missing.
+
+    Returns False if the directory is a symlink, belongs to another user, or is
+    open to group or others; its contents can't be trusted then.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    st = os.lstat(path)
+    return (
+        stat.S_ISDIR(st.st_mode)
+        and st.st_uid == os.geteuid()
+        and not st.st_mode & 0o077
+    )
+
+
 @lru_cache
 def get_s3_client():
     config = boto3.session.Config(
@@ -111,23 +128,9 @@ async def process_zip_with_shapefile(zip_file_path):
 
         layer_name = os.path.splitext(os.path.basename(shp_file))[0]
 
-        ogr_cmd = [
-            "ogr2ogr",
-            "-f",
-            "GPKG",
-            gpkg_file_path,
-            shp_file,
-            "-nln",
-            layer_name,
-        ]
-
-        process = await asyncio.create_subprocess_exec(*ogr_cmd)
-        await process.wait()
-
-        if process.returncode != 0:
-            raise Exception(
-                f"ogr2ogr command failed with exit code {process.returncode}"
-            )
+        await ogr_conversion_engine().convert(
+            shp_file, gpkg_file_path, ["-f", "GPKG", "-nln", layer_name]
+        )
 
         return gpkg_file_path, temp_dir
 
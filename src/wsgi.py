@@ -44,6 +44,8 @@ async def lifespan(app: FastAPI):
     from src.database.migrate import run_migrations
     from src.dependencies.neo4j_connection import init_neo4j, cleanup_neo4j
     from src.core.connection_wrapper import migrate_to_new_pool
+    from src.map_renderer import map_renderer_pool
+    from src.ingest_jobs import ingest_job_queue
     import os
 
     # 初始化连接池 - 根治连接池癌症
@@ -52,9 +54,12 @@ async def lifespan(app: FastAPI):
     # 运行数据库迁移
     await run_migrations()
     await init_neo4j()
+    ingest_job_queue().start()
     yield
     # Cleanup on shutdown
     await cleanup_neo4j()
+    await map_renderer_pool().close()
+    await ingest_job_queue().close()
 
 
 app = FastAPI(